@@ -0,0 +1,3 @@
+"""
+Load generation against the server, `python -m benchmarks.loadgen --help`.
+"""
@@ -0,0 +1,231 @@
+"""
+Load generator in the spirit of redis-benchmark. Clients send pipelines of commands drawn from the
+workload and measure the time from sending a pipeline to each reply; the report is JSON with the
+throughput and latency percentiles, overall and per command, for tracking regressions.
+
+    python -m benchmarks.loadgen [--clients 50] [--requests 100000] [--pipeline 1] [--keyspace 100000]
+                                 [--value-size 3] [--mix set=1,get=1] [--distribution uniform|zipf]
+                                 [--in-process] [--output report.json]
+
+Without --in-process it runs against a server started with `python main.py` (or --workers N). With
+--in-process the same frames go through CommandParser, CommandHandler and the serializer directly,
+which measures the request path without sockets and the event loop.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from array import array
+from typing import Optional
+
+from benchmarks.workload import Workload, parse_mix
+
+PERCENTILES = {'p50': 0.5, 'p99': 0.99, 'p999': 0.999}
+
+
+def reply_end(buffer: bytes | bytearray, start: int) -> int:
+    """the end of the reply starting at `start`, -1 while it is incomplete"""
+    line_end = buffer.find(b"\r\n", start)
+    if line_end == -1:
+        return -1
+    kind = buffer[start]
+    if kind == ord('$'):
+        length = int(buffer[start + 1:line_end])
+        end = line_end + 2 + (length + 2 if length >= 0 else 0)
+        return end if end <= len(buffer) else -1
+    if kind == ord('*'):
+        position = line_end + 2
+        for _ in range(max(int(buffer[start + 1:line_end]), 0)):
+            position = reply_end(buffer, position)
+            if position == -1:
+                return -1
+        return position
+    return line_end + 2
+
+
+class Recorder:
+    """latencies in seconds, per command"""
+
+    def __init__(self):
+        self.latencies: dict[str, array] = {}
+        self.errors = 0
+        self.first_error: Optional[str] = None
+
+    def record(self, name: str, latency: float):
+        samples = self.latencies.get(name, None)
+        if samples is None:
+            samples = self.latencies[name] = array('d')
+        samples.append(latency)
+
+    def error(self, reply: bytes):
+        self.errors += 1
+        if self.first_error is None:
+            self.first_error = reply.decode(errors="replace").strip()
+
+    def report(self, elapsed: float) -> dict:
+        every = array('d')
+        for samples in self.latencies.values():
+            every.extend(samples)
+        return {
+            'requests': len(every),
+            'errors': self.errors,
+            'first_error': self.first_error,
+            'seconds': round(elapsed, 4),
+            'requests_per_second': round(len(every) / elapsed, 1) if elapsed else None,
+            'latency_ms': summary(every),
+            'commands': {name: {'requests': len(samples), 'latency_ms': summary(samples)}
+                         for name, samples in sorted(self.latencies.items())},
+        }
+
+
+def summary(samples: array) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    fields = {name: round(ordered[min(int(share * len(ordered)), len(ordered) - 1)] * 1000, 4)
+              for name, share in PERCENTILES.items()}
+    fields['mean'] = round(sum(ordered) / len(ordered) * 1000, 4)
+    fields['max'] = round(ordered[-1] * 1000, 4)
+    return fields
+
+
+def pipelines(workload: Workload, requests: int, pipeline: int) -> list[list[tuple[str, bytes]]]:
+    """all pipelines are drawn before the clock starts"""
+    commands = workload.draw(requests)
+    return [commands[index:index + pipeline] for index in range(0, requests, pipeline)]
+
+
+async def run_client(host: str, port: int, queue: list, recorder: Recorder):
+    reader, writer = await asyncio.open_connection(host, port)
+    buffer = bytearray()
+    try:
+        while queue:
+            batch = queue.pop()
+            writer.write(b"".join(frame for _, frame in batch))
+            sent = time.perf_counter()
+            position = 0
+            for name, _ in batch:
+                while True:
+                    end = reply_end(buffer, position) if len(buffer) > position else -1
+                    if end != -1:
+                        break
+                    data = await reader.read(1 << 16)
+                    if not data:
+                        raise ConnectionError("server closed the connection")
+                    buffer += data
+                recorder.record(name, time.perf_counter() - sent)
+                if buffer[position] == ord('-'):
+                    recorder.error(bytes(buffer[position:end]))
+                position = end
+            del buffer[:position]
+    finally:
+        writer.close()
+
+
+async def run_network(options, workload: Workload) -> dict:
+    if options.populate:
+        reader, writer = await asyncio.open_connection(options.host, options.port)
+        for frame in workload.populate():
+            writer.write(frame)
+            await reader.readline()
+        writer.close()
+    queue = pipelines(workload, options.requests, options.pipeline)
+    queue.reverse()
+    recorder = Recorder()
+    started = time.perf_counter()
+    await asyncio.gather(*(run_client(options.host, options.port, queue, recorder) for _ in range(options.clients)))
+    return recorder.report(time.perf_counter() - started)
+
+
+def run_in_process(options, workload: Workload) -> dict:
+    from commandhandler.handler import CommandHandler
+    from commandhandler.parser import CommandParser
+    from storage.cache import RedisCache
+
+    handler = CommandHandler(RedisCache("loadgen"))
+    parser = CommandParser()
+    if options.populate:
+        for frame in workload.populate():
+            parser.feed(frame)
+            for command in parser:
+                handler.handle_command(command)
+    recorder = Recorder()
+    batches = pipelines(workload, options.requests, options.pipeline)
+    started = time.perf_counter()
+    for batch in batches:
+        # like a read of the server: one feed, the replies of the batch in one output buffer
+        begin = time.perf_counter()
+        parser.feed(b"".join(frame for _, frame in batch))
+        output = bytearray()
+        for (name, _), command in zip(batch, parser):
+            offset = len(output)
+            handler.handle_command(command, output)
+            recorder.record(name, time.perf_counter() - begin)
+            if output[offset] == ord('-'):
+                recorder.error(bytes(output[offset:]))
+    return recorder.report(time.perf_counter() - started)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def arguments_parser() -> argparse.ArgumentParser:
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument("--host", default="localhost")
+    arguments.add_argument("--port", type=int, default=6379)
+    arguments.add_argument("--clients", type=int, default=50)
+    arguments.add_argument("--requests", type=int, default=100_000)
+    arguments.add_argument("--pipeline", type=int, default=1)
+    arguments.add_argument("--keyspace", type=int, default=100_000)
+    arguments.add_argument("--value-size", type=int, default=3)
+    arguments.add_argument("--mix", type=parse_mix, default="set=1,get=1",
+                           help="weighted commands out of set, get, incr, lpush, lrange")
+    arguments.add_argument("--distribution", choices=("uniform", "zipf"), default="uniform")
+    arguments.add_argument("--zipf-skew", type=float, default=0.99)
+    arguments.add_argument("--no-populate", dest="populate", action="store_false",
+                           help="don't create the string keys and counters before the run")
+    arguments.add_argument("--in-process", action="store_true", help="parser, handler and serializer without sockets")
+    arguments.add_argument("--seed", type=int, default=1)
+    arguments.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return arguments
+
+
+def main(argv: Optional[list[str]] = None) -> dict:
+    options = arguments_parser().parse_args(argv)
+    workload = Workload(options.mix, options.keyspace, options.value_size, options.distribution,
+                        options.zipf_skew, options.seed)
+    if options.in_process:
+        results = run_in_process(options, workload)
+    else:
+        results = asyncio.run(run_network(options, workload))
+    report = {
+        'mode': 'in-process' if options.in_process else 'network',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'config': {name: getattr(options, name) for name in (
+            'clients', 'requests', 'pipeline', 'keyspace', 'value_size', 'mix', 'distribution', 'zipf_skew',
+            'populate', 'seed')},
+        **results,
+    }
+    if options.in_process:
+        del report['config']['clients']
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main()['errors'] == 0 else 1)
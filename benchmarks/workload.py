@@ -0,0 +1,83 @@
+"""
+What the load generator sends: a command mix over a keyspace with uniform or Zipf distributed keys,
+encoded as the RESP frames a client writes.
+"""
+import random
+from itertools import accumulate
+
+COMMANDS = ('set', 'get', 'incr', 'lpush', 'lrange')
+# every command type works on its own keys, so GET never hits a list and INCR never a text value
+PREFIXES = {'set': b"key:", 'get': b"key:", 'incr': b"counter:", 'lpush': b"list:", 'lrange': b"list:"}
+# the lists are capped by LRANGE reading only their head
+LRANGE_LENGTH = b"9"
+
+
+def parse_mix(raw: str) -> dict[str, int]:
+    """'set=1,get=9' -> {'set': 1, 'get': 9}"""
+    mix = {}
+    for part in raw.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip().lower()
+        if name not in COMMANDS:
+            raise ValueError(f"unknown command {name!r}, expected one of {', '.join(COMMANDS)}")
+        mix[name] = int(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("the mix needs a command with a positive weight")
+    return mix
+
+
+def encode(*arguments: bytes) -> bytes:
+    return b"*%d\r\n" % len(arguments) + b"".join(b"$%d\r\n%s\r\n" % (len(argument), argument)
+                                                   for argument in arguments)
+
+
+class Workload:
+    """draws commands, the same seed gives the same sequence of commands"""
+
+    def __init__(self, mix: dict[str, int], keyspace: int, value_size: int, distribution: str = 'uniform',
+                 zipf_skew: float = 0.99, seed: int = 1):
+        self.random = random.Random(seed)
+        self.names = [name for name, weight in mix.items() if weight]
+        self.weights = list(accumulate(mix[name] for name in self.names))
+        self.keyspace = keyspace
+        self.value = b"x" * value_size
+        self.key_weights = None
+        if distribution == 'zipf':
+            # rank r is drawn with probability ~ 1 / r^skew, the ranks are spread over the key numbers
+            self.key_weights = list(accumulate(1 / rank ** zipf_skew for rank in range(1, keyspace + 1)))
+            self.key_numbers = list(range(keyspace))
+            self.random.shuffle(self.key_numbers)
+        elif distribution != 'uniform':
+            raise ValueError(f"unknown distribution {distribution!r}")
+
+    def draw(self, count: int) -> list[tuple[str, bytes]]:
+        """`count` commands as (command name, encoded frame)"""
+        names = self.random.choices(self.names, cum_weights=self.weights, k=count)
+        if self.key_weights is None:
+            keys = [self.random.randrange(self.keyspace) for _ in range(count)]
+        else:
+            numbers = self.key_numbers
+            keys = [numbers[rank] for rank in
+                    self.random.choices(range(self.keyspace), cum_weights=self.key_weights, k=count)]
+        return [(name, self.frame(name, key)) for name, key in zip(names, keys)]
+
+    def frame(self, name: str, key: int) -> bytes:
+        key = PREFIXES[name] + b"%d" % key
+        if name == 'set':
+            return encode(b"SET", key, self.value)
+        if name == 'get':
+            return encode(b"GET", key)
+        if name == 'incr':
+            return encode(b"INCR", key)
+        if name == 'lpush':
+            return encode(b"LPUSH", key, self.value)
+        return encode(b"LRANGE", key, b"0", LRANGE_LENGTH)
+
+    def populate(self, batch: int = 1000) -> list[bytes]:
+        """frames creating every string key and counter, so GET and INCR find their keys"""
+        frames = []
+        for start in range(0, self.keyspace, batch):
+            numbers = range(start, min(start + batch, self.keyspace))
+            for prefix, value in ((b"key:", self.value), (b"counter:", b"0")):
+                frames.append(encode(b"MSET", *(part for number in numbers for part in (prefix + b"%d" % number, value))))
+        return frames
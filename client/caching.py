@@ -0,0 +1,170 @@
+"""
+A reference client with a local cache, kept valid by the invalidation pushes of CLIENT TRACKING.
+
+The connection speaks RESP3 (HELLO 3) and turns tracking on, so the server pushes every key the
+client read once that key changes, expires or is evicted. GET answers from the local dict when it
+can and asks the server otherwise; before every lookup the pushes which arrived meanwhile are read
+without blocking, a value is dropped at most one round trip after it changed on the server. The
+local cache keeps the `max_entries` most recently used values.
+
+    client = CachingClient("localhost", 6379)
+    client.get("user:1")          # from the server, tracked from now on
+    client.get("user:1")          # from the local cache
+    client.execute("SET", "user:1", "x")
+
+With `prefixes` the connection uses BCAST: the server tracks nothing per client and pushes every
+change of a key with one of the prefixes, for keys read by many clients.
+"""
+import select
+import socket
+from collections import OrderedDict
+from typing import Optional
+
+
+class ReplyError(Exception):
+    pass
+
+
+class Push(list):
+    """an out of band message of the server, RESP3 '>'"""
+
+
+class Incomplete(Exception):
+    pass
+
+
+def encode(arguments) -> bytes:
+    out = bytearray(b"*%d\r\n" % len(arguments))
+    for argument in arguments:
+        if type(argument) is str:
+            argument = argument.encode()
+        elif type(argument) is int:
+            argument = b"%d" % argument
+        out += b"$%d\r\n%s\r\n" % (len(argument), argument)
+    return bytes(out)
+
+
+def parse(buffer: bytearray, start: int):
+    """:return: the reply starting at `start` and where it ends, raises Incomplete while it isn't all there"""
+    line_end = buffer.find(b"\r\n", start)
+    if line_end == -1:
+        raise Incomplete
+    kind, line, position = buffer[start], bytes(buffer[start + 1:line_end]), line_end + 2
+    if kind == ord('$'):
+        length = int(line)
+        if length < 0:
+            return None, position
+        if position + length + 2 > len(buffer):
+            raise Incomplete
+        return bytes(buffer[position:position + length]), position + length + 2
+    if kind in b"*>~%":
+        length = int(line)
+        if length < 0:
+            return None, position
+        elements = []
+        for _ in range(2 * length if kind == ord('%') else length):
+            element, position = parse(buffer, position)
+            elements.append(element)
+        if kind == ord('%'):
+            return dict(zip(elements[::2], elements[1::2])), position
+        return (Push(elements) if kind == ord('>') else elements), position
+    if kind == ord('+'):
+        return line.decode(), position
+    if kind == ord('-'):
+        return ReplyError(line.decode()), position
+    if kind == ord(':'):
+        return int(line), position
+    if kind == ord('_'):
+        return None, position
+    if kind == ord(','):
+        return float(line), position
+    if kind == ord('#'):
+        return line == b"t", position
+    raise ValueError(f"unexpected reply type {chr(kind)!r}")
+
+
+class CachingClient:
+
+    def __init__(self, host: str, port: int, max_entries: int = 10000, prefixes: Optional[list[str]] = None):
+        self.connection = socket.create_connection((host, port))
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray()
+        self.local: OrderedDict[bytes, bytes] = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = self.misses = self.invalidations = 0
+        self.execute("HELLO", "3")
+        options = ["BCAST", *(part for prefix in prefixes for part in ("PREFIX", prefix))] if prefixes else []
+        self.execute("CLIENT", "TRACKING", "on", *options)
+
+    def get(self, key) -> Optional[bytes]:
+        key = key.encode() if type(key) is str else key
+        self.poll()
+        local = self.local
+        if key in local:
+            self.hits += 1
+            local.move_to_end(key)
+            return local[key]
+        self.misses += 1
+        value = self.execute("GET", key)
+        # a push read with the reply may have dropped a value which is not stored yet, the reply is newer
+        local[key] = value
+        if len(local) > self.max_entries:
+            local.popitem(last=False)
+        return value
+
+    def execute(self, *arguments):
+        """sends a command and returns its reply, the pushes which come before the reply are handled on the way"""
+        self.connection.sendall(encode(arguments))
+        while True:
+            reply = self._read(blocking=True)
+            if type(reply) is Push:
+                self._push(reply)
+                continue
+            if isinstance(reply, ReplyError):
+                raise reply
+            return reply
+
+    def poll(self):
+        """handles the pushes which arrived, without waiting for any"""
+        while select.select((self.connection,), (), (), 0)[0] or self.buffer:
+            reply = self._read(blocking=False)
+            if reply is None:
+                return
+            self._push(reply)
+
+    def close(self):
+        self.connection.close()
+        self.local.clear()
+
+    def _read(self, blocking: bool):
+        """the next reply, None if there is no complete one and `blocking` is False"""
+        while True:
+            if self.buffer:
+                try:
+                    reply, end = parse(self.buffer, 0)
+                except Incomplete:
+                    pass
+                else:
+                    del self.buffer[:end]
+                    return reply
+            if not blocking and not select.select((self.connection,), (), (), 0)[0]:
+                return None
+            data = self.connection.recv(1 << 16)
+            if not data:
+                # without the connection nothing tells which values are still valid
+                self.local.clear()
+                raise ConnectionError("the server closed the connection")
+            self.buffer += data
+
+    def _push(self, push: Push):
+        if type(push) is not Push or len(push) != 2 or push[0] != b"invalidate":
+            return
+        keys = push[1]
+        if keys is None:
+            self.local.clear()
+            return
+        local = self.local
+        for key in keys:
+            if key in local:
+                del local[key]
+                self.invalidations += 1
@@ -0,0 +1,157 @@
+"""
+Blocking list pops: BLPOP, BRPOP and BLMOVE.
+
+A client whose keys are all empty becomes a `Waiter` in a FIFO queue per key of its keyspace
+(`RedisCache.blocked`, a dict used as an ordered set like the subscriber sets of pub/sub, so a
+waiter leaves the queues of all its keys in O(1)). A push to a key with waiters marks it ready,
+and once the write command is done and propagated, `serve` hands the new elements to the waiters
+in the order they blocked, like redis serves its blocked clients after every command. Nothing
+polls: a timeout is one `call_later` per waiter, and a waiter leaves its queues when it is served,
+when it times out and when its connection closes.
+
+The connection of a blocked client reads on meanwhile (see `main.py`), which is how it notices a
+client that goes away. The commands it sends while it is blocked run after the blocking one.
+"""
+import asyncio
+import math
+from typing import Optional
+
+from commandhandler.utils import ErrorReply, RespFrame, NULL_ARRAY
+from storage.cache import RedisCache, WRONGTYPE
+
+# the reply of a command which blocked, nothing is written until the waiter gets its real reply
+BLOCKED = RespFrame(b"")
+
+
+def parse_timeout(raw) -> float | str:
+    """the timeout of a blocking command in seconds, 0 blocks forever, or the error"""
+    try:
+        timeout = float(raw)
+    except ValueError:
+        return ErrorReply("-ERR timeout is not a float or out of range")
+    if not math.isfinite(timeout):
+        return ErrorReply("-ERR timeout is not a float or out of range")
+    if timeout < 0:
+        return ErrorReply("-ERR timeout is negative")
+    return timeout
+
+
+def parse_side(raw) -> Optional[bool]:
+    """LEFT or RIGHT of LMOVE and BLMOVE, True for the head, None for anything else"""
+    side = raw.lower()
+    if side == 'left':
+        return True
+    if side == 'right':
+        return False
+    return None
+
+
+class Waiter:
+    """a client blocked on the keys of a keyspace, `future` gets its reply"""
+    __slots__ = ('cache', 'keys', 'from_head', 'destination', 'to_head', 'future', 'timer')
+
+    def __init__(self, cache: RedisCache, keys, from_head: bool, destination=None, to_head: bool = False):
+        self.cache = cache
+        self.keys = keys
+        self.from_head = from_head
+        # set for BLMOVE, the element goes there instead of into the reply
+        self.destination = destination
+        self.to_head = to_head
+        self.future: Optional[asyncio.Future] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def pop(self, key):
+        """
+        takes the element for this waiter from key
+        :return: the reply, and the command to propagate, None for both if key has nothing
+        """
+        cache = self.cache
+        if self.destination is None:
+            value = cache.pop(key, None, self.from_head)
+            if value is None or value is WRONGTYPE:
+                return value, None
+            return [key, value], ['lpop' if self.from_head else 'rpop', key]
+        value = cache.move(key, self.destination, self.from_head, self.to_head)
+        if value is None or value is WRONGTYPE:
+            return value, None
+        return value, ['lmove', key, self.destination, _side(self.from_head), _side(self.to_head)]
+
+    def timeout_reply(self):
+        return None if self.destination is not None else NULL_ARRAY
+
+
+def _side(head: bool) -> str:
+    return 'left' if head else 'right'
+
+
+class Blocking:
+
+    def __init__(self):
+        self.blocked_clients = 0
+
+    def block(self, waiter: Waiter, timeout: float) -> Waiter:
+        """queues the waiter on all its keys, it gets the timeout reply after `timeout` seconds unless 0"""
+        loop = asyncio.get_running_loop()
+        waiter.future = loop.create_future()
+        blocked = waiter.cache.blocked
+        for key in waiter.keys:
+            blocked.setdefault(key, {})[waiter] = None
+        if timeout:
+            waiter.timer = loop.call_later(timeout, self._expire, waiter)
+        self.blocked_clients += 1
+        return waiter
+
+    def serve(self, cache: RedisCache):
+        """
+        hands the elements pushed by the last command to the waiters of their keys, oldest first.
+        Called once the command is propagated, so a served pop follows the push in the stream. A
+        served BLMOVE pushes to its destination, whose waiters are served in the next round.
+        """
+        ready = cache.ready_keys
+        while ready:
+            keys = list(ready)
+            ready.clear()
+            for key in keys:
+                queue = cache.blocked.get(key, None)
+                while queue:
+                    waiter = next(iter(queue))
+                    reply, propagated = waiter.pop(key)
+                    if reply is None:
+                        # the list is empty again
+                        break
+                    self._unblock(waiter)
+                    waiter.future.set_result(reply)
+                    if propagated is not None:
+                        cache.dirty += 1
+                        if cache.aof is not None or RedisCache.replication_feed is not None:
+                            cache.propagate(propagated)
+                        if RedisCache.invalidation_feed is not None:
+                            # the clients caching the list, and the destination of a BLMOVE
+                            for changed in propagated[1:3 if waiter.destination is not None else 2]:
+                                RedisCache.invalidation_feed(cache.name, changed)
+
+    def cancel(self, waiter: Waiter):
+        """the connection of the waiter closed"""
+        if not waiter.future.done():
+            self._unblock(waiter)
+            waiter.future.cancel()
+
+    def _expire(self, waiter: Waiter):
+        waiter.timer = None
+        if not waiter.future.done():
+            self._unblock(waiter)
+            waiter.future.set_result(waiter.timeout_reply())
+
+    def _unblock(self, waiter: Waiter):
+        blocked = waiter.cache.blocked
+        for key in waiter.keys:
+            queue = blocked.get(key, None)
+            if queue is not None and queue.pop(waiter, 0) is None and not queue:
+                del blocked[key]
+        if waiter.timer is not None:
+            waiter.timer.cancel()
+            waiter.timer = None
+        self.blocked_clients -= 1
+
+
+blocking = Blocking()
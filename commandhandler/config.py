@@ -0,0 +1,76 @@
+from fnmatch import fnmatchcase
+from typing import Callable, Any
+
+
+class ConfigParameter:
+    """
+    a runtime tunable, `parse` turns the CONFIG SET argument into the stored value (and raises
+    ValueError for invalid input), `on_change` lets the owning module react to a new value
+    """
+
+    def __init__(self, name: str, default: str, parse: Callable[[str], Any] = str,
+                 on_change: Callable[[Any], None] | None = None, render: Callable[[Any], str] = str):
+        self.name = name
+        self.parse = parse
+        self.on_change = on_change
+        self.render = render
+        self.value = parse(default)
+
+
+class ServerConfig:
+    """
+    Registry of the parameters reachable through CONFIG GET/SET. Every module registers the
+    parameters it owns when it is imported and reads the value from the returned parameter.
+    """
+    _parameters: dict[str, ConfigParameter] = {}
+
+    @classmethod
+    def register(cls, name: str, default: str, parse: Callable[[str], Any] = str,
+                 on_change: Callable[[Any], None] | None = None,
+                 render: Callable[[Any], str] = str) -> ConfigParameter:
+        parameter = ConfigParameter(name, default, parse, on_change, render)
+        cls._parameters[name] = parameter
+        if on_change:
+            on_change(parameter.value)
+        return parameter
+
+    @classmethod
+    def get(cls, name: str):
+        return cls._parameters[name].value
+
+    @classmethod
+    def set(cls, name: str, raw: str):
+        """
+        :raises KeyError: for an unknown parameter
+        :raises ValueError: if the value is rejected by the parameter
+        """
+        parameter = cls._parameters[name.lower()]
+        parameter.value = parameter.parse(raw)
+        if parameter.on_change:
+            parameter.on_change(parameter.value)
+
+    @classmethod
+    def matching(cls, pattern: str) -> list[tuple[str, str]]:
+        pattern = pattern.lower()
+        return [(name, parameter.render(parameter.value))
+                for name, parameter in cls._parameters.items() if fnmatchcase(name, pattern)]
+
+
+def parse_choice(*choices: str) -> Callable[[str], str]:
+    def parse(raw: str) -> str:
+        value = raw.lower()
+        if value not in choices:
+            raise ValueError(f"argument must be one of {', '.join(choices)}")
+        return value
+
+    return parse
+
+
+def parse_number(minimum: float, maximum: float, kind: type = int) -> Callable[[str], Any]:
+    def parse(raw: str):
+        value = kind(raw)
+        if not minimum <= value <= maximum:
+            raise ValueError(f"argument must be between {minimum} and {maximum}")
+        return value
+
+    return parse
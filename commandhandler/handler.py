@@ -1,108 +1,1068 @@
-from typing import Callable
+from time import perf_counter_ns
+from inspect import signature, Parameter
+from itertools import chain, islice
+from typing import Callable, Optional
 
-from commandhandler.serializer import SerializerFactory, Serializer
-from commandhandler.utils import SIMPLE_STRING
-from storage.cache import RedisCache
+from commandhandler import info
+from commandhandler.blocking import BLOCKED, Waiter, blocking, parse_side, parse_timeout
+from commandhandler.config import ServerConfig
+from commandhandler.pubsub import Subscriber, pubsub, encode_array
+from commandhandler.replication import ReplicaLink, replication, READONLY_REPLY
+from commandhandler.serializer import write_reply
+from commandhandler.stats import stats
+from commandhandler.trace import tracer, logger
+from commandhandler.tracking import (TrackingClient, tracking, client_ids, encode_hello, overlapping_prefixes,
+                                     TRACKED_READS)
+from commandhandler.utils import (OK_RESP, PONG_RESP, EMPTY_ARRAY, NULL_ARRAY, SYNTAX_ERROR, RespFrame, ArrayStream,
+                                  ErrorReply, StatusReply, is_error, bulk_integer, to_text, wrong_arguments)
+from storage.cache import RedisCache, CacheHolder, WRONGTYPE
+from storage.eviction import maxmemory, usage, OOM_REPLY
+from storage.integers import NOT_AN_INTEGER, NOT_A_FLOAT, format_float, parse_integer
+from storage.loading import LOADING_REPLY
+from storage.zsettype import parse_score, parse_score_bound
+
+
+NO_SUBSCRIPTIONS = ErrorReply("-ERR this connection can't subscribe")
+NO_TRACKING = ErrorReply("-ERR this connection can't track keys")
+
+
+def _pairs(key, value, pairs: tuple) -> list[tuple]:
+    """the key value pairs of MSET and MSETNX, the field value pairs of HSET"""
+    return [(key, value), *zip(pairs[::2], pairs[1::2])]
+
+
+def _scan_arguments(cursor: str, options: tuple) -> tuple[int, int, str | None] | str:
+    """the cursor, COUNT and MATCH of a SCAN family command, or the error"""
+    try:
+        cursor = int(cursor)
+    except ValueError:
+        return ErrorReply("-ERR invalid cursor")
+    if cursor < 0:
+        return ErrorReply("-ERR invalid cursor")
+    count, pattern = 10, None
+    if len(options) % 2:
+        return SYNTAX_ERROR
+    for option, value in zip(options[::2], options[1::2]):
+        match option.lower():
+            case 'count':
+                try:
+                    count = int(value)
+                except ValueError:
+                    return NOT_AN_INTEGER
+                if count < 1:
+                    return SYNTAX_ERROR
+            case 'match':
+                pattern = value
+            case _:
+                return SYNTAX_ERROR
+    return cursor, count, pattern
+
+
+def _score_reply(score):
+    """ZSCORE, ZINCRBY and ZADD INCR, the formatted score as a bulk string"""
+    return None if score is None else format_float(score)
+
+
+def _zset_reply(from_store, with_scores: bool):
+    """the members of a range, with their scores, streamed into the output"""
+    if isinstance(from_store, str):
+        return from_store
+    length, pairs = from_store
+    if with_scores:
+        return ArrayStream(2 * length, chain.from_iterable((member, format_float(score)) for score, member in pairs))
+    return ArrayStream(length, (member for _, member in pairs))
+
+
+def _limit(options: list[str]) -> tuple[int, int] | str | None:
+    """the LIMIT offset count of a range command, removed from the options"""
+    if 'limit' not in options:
+        return None
+    index = options.index('limit')
+    if index + 2 >= len(options):
+        return SYNTAX_ERROR
+    try:
+        limit = int(options[index + 1]), int(options[index + 2])
+    except ValueError:
+        return NOT_AN_INTEGER
+    del options[index:index + 3]
+    return limit
+
+
+def _bit_range(options: tuple) -> tuple | str:
+    """the start, end and unit (True for BIT) of BITCOUNT and BITPOS, as far as they are given"""
+    try:
+        bounds = tuple(map(int, options[:2]))
+    except ValueError:
+        return NOT_AN_INTEGER
+    if len(options) < 3:
+        return bounds
+    unit = options[2].lower()
+    if unit not in ('byte', 'bit'):
+        return SYNTAX_ERROR
+    return (*bounds, unit == 'bit')
+
+
+def arity(handler: Callable) -> tuple[int, Optional[int]]:
+    """the least and the most arguments a handler takes after the connection, None for any number"""
+    parameters = list(signature(handler).parameters.values())[1:]
+    positional = [parameter for parameter in parameters if parameter.kind is Parameter.POSITIONAL_OR_KEYWORD]
+    required = sum(parameter.default is Parameter.empty for parameter in positional)
+    variadic = any(parameter.kind is Parameter.VAR_POSITIONAL for parameter in parameters)
+    return required, None if variadic else len(positional)
 
 
 class CommandHandler:
 
     def __init__(self, redis_cache: RedisCache):
-        default_handlers: dict[str, Callable] = {
-            'set': self.handle_set,
-            'exists': self.handle_exists,
-            'del': self.handle_del,
-            'incr': self.handle_incr,
-            'decr': self.handle_decr,
-            'lpush': self.handle_lpush,
-            'rpush': self.handle_rpush,
-            'lrange': self.handle_lrange,
-            'get': self.handle_get,
-            'save': self.handle_save,
-            'command': self.handle_command,
-            'ping': self.handle_ping,
-            'echo': self.handle_echo,
-            'config': self.handle_config,
-        }
-        self.command_mappings = default_handlers
-        self.serializor_factory = SerializerFactory()
-        self.serializer: Serializer = Serializer()
         self.redis_cache = redis_cache
+        # set by QUIT, the connection is closed once the reply is written
+        self.close_requested = False
+        # the transport of the connection, published messages are written to it directly
+        self.transport = None
+        # created by the first (P)SUBSCRIBE, with subscriptions only the pub/sub commands are allowed
+        self.subscriber: Optional[Subscriber] = None
+        # a replica connecting, from its REPLCONF on, the connection carries the stream once PSYNC is answered
+        self.replica: Optional[ReplicaLink] = None
+        # set by connections which can wait for the reply of a blocking command, the others get its
+        # timeout reply right away, like redis inside MULTI
+        self.can_block = False
+        # the blocking command the connection waits for, until its reply is written
+        self.waiter: Optional[Waiter] = None
+        self.id = next(client_ids)
+        self.name: Optional[str] = None
+        # 3 after HELLO 3, the connection then understands push messages
+        self.protocol = 2
+        # set by connections whose reads and writes all run here, with workers a key can belong to another one
+        self.can_track = True
+        # created by CLIENT TRACKING on, the connection gets invalidation pushes for the keys it caches
+        self.tracker: Optional[TrackingClient] = None
+
+    def handle_command(self, commands: list[str], output: bytearray | None = None):
+        """
+        executes the command and encodes its reply into `output`, the output buffer of the
+        connection. Without an output buffer the encoded reply is returned.
+        """
+        # a single check on the hot path, the keyspace is only unavailable while it is loaded from disk
+        reply = self.execute(commands) if self.redis_cache.loading is None else self._execute_while_loading(commands)
+        if output is None:
+            output = bytearray()
+            write_reply(reply, output)
+            return bytes(output)
+        write_reply(reply, output)
+        return output
 
-    def handle_command(self, commands: list[str]):
+    def reply(self, commands: list[str]):
+        """the result of the command, not encoded yet, or the error while the keyspace is loading"""
+        return self.execute(commands) if self.redis_cache.loading is None else self._execute_while_loading(commands)
+
+    def execute(self, commands: list[str]):
+        """executes the command and returns its result, not encoded yet"""
+        command, *params = commands
+        command = command.lower()
+        if tracer.enabled:
+            tracer.trace("command %s", commands)
+        handler = self.command_mappings.get(command, None)
+        if not handler:
+            return self.command_not_found(command)
+        if self.read_only and command in self.write_commands:
+            return READONLY_REPLY
+        if self.subscriber is not None and command not in self.subscribed_commands and self.subscriber.subscriptions():
+            return ErrorReply(f"-ERR Can't execute '{command}': only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING / QUIT "
+                              f"are allowed in this context")
+        if maxmemory.value and usage.used > maxmemory.value and command in self.write_commands:
+            # writes which only free memory go through even if nothing can be evicted
+            if not CacheHolder.free_memory(self.redis_cache) and command in self.denyoom_commands:
+                stats.reject(command)
+                return OOM_REPLY
+        return self._run(command, handler, params, commands)
+
+    def apply(self, commands: list[str]):
+        """
+        executes a command which was accepted once already, replayed from the append only file or
+        streamed from the primary. It skips the read only, subscriber and maxmemory checks, which
+        would drop it and leave the keyspace behind the one which wrote it.
+        """
         command, *params = commands
         command = command.lower()
-        print(f"commands in handle_command {commands}")
-        return self.command_mappings.get(command, lambda: self.command_not_found(command))(*params)
+        handler = self.command_mappings.get(command, None)
+        if not handler:
+            return self.command_not_found(command)
+        return self._run(command, handler, params, commands)
+
+    def _run(self, command: str, handler, params: list[str], commands: list[str]):
+        started = perf_counter_ns()
+        least, most = self.command_arity[command]
+        if len(params) < least or (most is not None and len(params) > most):
+            reply = wrong_arguments(command)
+        else:
+            try:
+                reply = handler(self, *params)
+            except Exception:
+                # a bug of the command, the connection stays open and the error is logged with its traceback
+                logger.exception("%s failed", command)
+                reply = ErrorReply(f"-ERR internal error executing '{command}'")
+        failed = is_error(reply)
+        stats.record(command, perf_counter_ns() - started, commands, failed, self.redis_cache.name)
+        if failed:
+            return reply
+        # a blocking pop which blocked, or found nothing where it can't block, changed nothing
+        if command in self.write_commands and (reply is not None or command in self.null_reply_writes) \
+                and reply is not BLOCKED and reply is not NULL_ARRAY:
+            cache = self.redis_cache
+            # counted for the `save` rules
+            cache.dirty += 1
+            # the replay of the append only file while loading is already logged
+            if cache.loading is None and (cache.aof is not None or RedisCache.replication_feed is not None):
+                cache.propagate(self._propagated(commands, reply))
+            if RedisCache.invalidation_feed is not None:
+                tracking.invalidate_command(cache.name, commands, self.tracker)
+            if cache.ready_keys:
+                blocking.serve(cache)
+        elif self.tracker is not None and command in TRACKED_READS and not self.tracker.bcast:
+            # the keys a client caches, it hears about them once they change
+            tracking.remember(self.tracker, self.redis_cache.name, commands[TRACKED_READS[command]])
+        return reply
+
+    def _execute_while_loading(self, commands: list[str]):
+        progress = self.redis_cache.loading
+        if commands[0].lower() in self.loading_commands:
+            return self.execute(commands)
+        if progress.error is not None:
+            return ErrorReply(f"-ERR Loading {progress.file_name} failed, the keyspace is unavailable: "
+                              f"{progress.error}")
+        return LOADING_REPLY
+
+    def _propagated(self, commands: list[str], reply=None) -> list[str]:
+        """
+        the form of an executed write command which gives the same result when it is replayed
+        later, relative ttls become absolute deadlines
+        """
+        command, key, *params = commands
+        command = command.lower()
+        if command == 'blpop' or command == 'brpop':
+            # the pop which happened, the replay must neither block nor pick another key
+            return ['lpop' if command == 'blpop' else 'rpop', reply[0]]
+        if command == 'blmove':
+            return ['lmove', key, *params[:3]]
+        if command in ('expire', 'pexpire', 'expireat') or (command == 'set' and len(params) > 1):
+            deadline = self.redis_cache.expires.get(key)
+            if command == 'set':
+                return ['set', key, params[0]] if deadline is None else ['set', key, params[0], 'pxat', str(deadline)]
+            # a deadline in the past deleted the key
+            return ['del', key] if deadline is None else ['pexpireat', key, str(deadline)]
+        if command == 'incrbyfloat':
+            # adding a float again can round differently, the result is replayed instead
+            return ['set', key, str(self.redis_cache.get_string(key)), 'keepttl']
+        return commands
 
-    def handle_config(self, *commands):
-        print(f"commands {commands}")
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(list))
-        return self.serializer.serialize(f"{SIMPLE_STRING}OK")
+    def handle_config(self, subcommand, *params):
+        match subcommand.lower():
+            case 'get':
+                if not params:
+                    return wrong_arguments('config|get')
+                reply = []
+                for pattern in params:
+                    for name, value in ServerConfig.matching(pattern):
+                        reply += (name, value)
+                return reply
+            case 'set':
+                if not params or len(params) % 2:
+                    return wrong_arguments('config|set')
+                for name, value in zip(params[::2], params[1::2]):
+                    try:
+                        ServerConfig.set(name, value)
+                    except KeyError:
+                        return ErrorReply(f"-ERR Unknown option or number of arguments for CONFIG SET - '{name}'")
+                    except ValueError as error:
+                        return ErrorReply(f"-ERR Invalid argument '{value}' for CONFIG SET '{name}' - {error}")
+                return OK_RESP
+            case 'resetstat':
+                stats.reset()
+                return OK_RESP
+            case _:
+                return ErrorReply(f"-ERR unknown subcommand '{subcommand}'. Try CONFIG GET, CONFIG SET, "
+                                  f"CONFIG RESETSTAT.")
 
     def command_not_found(self, input):
-        return f"-ERR Command not found! {input}"
+        return ErrorReply(f"-ERR Command not found! {input}")
+
+    def handle_exists(self, key, *keys):
+        return self.redis_cache.is_key_existing((key, *keys))
+
+    def handle_del(self, key, *keys):
+        return self.redis_cache.delete_by_keys((key, *keys))
+
+    def handle_scan(self, cursor, *options):
+        options = list(options)
+        kind = None
+        lowered = [option.lower() for option in options[::2]]
+        if 'type' in lowered:
+            index = 2 * lowered.index('type')
+            if index + 1 >= len(options):
+                return SYNTAX_ERROR
+            kind = options[index + 1].lower()
+            del options[index:index + 2]
+        arguments = _scan_arguments(cursor, options)
+        if isinstance(arguments, str):
+            return arguments
+        cursor, count, pattern = arguments
+        cursor, keys = self.redis_cache.scan(cursor, count, pattern, kind)
+        return [str(cursor), keys]
+
+    def handle_keys(self, pattern):
+        return self.redis_cache.keys(pattern)
+
+    def handle_type(self, key):
+        return StatusReply(f"+{self.redis_cache.type_of(key)}")
+
+    def handle_dbsize(self):
+        return self.redis_cache.size()
+
+    def handle_randomkey(self):
+        return self.redis_cache.random_key()
+
+    def handle_mget(self, key, *keys):
+        values = self.redis_cache.get_many((key, *keys))
+        for index, value in enumerate(values):
+            if type(value) is int:
+                values[index] = bulk_integer(value)
+        return values
 
-    def handle_exists(self, *value):
-        from_store = self.redis_cache.is_key_existing(value)
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(type(from_store)))
-        return self.serializer.serialize(from_store)
+    def handle_mset(self, key, value, *pairs):
+        if len(pairs) % 2:
+            return wrong_arguments('mset')
+        return OK_RESP if self.redis_cache.set_many(_pairs(key, value, pairs)) else None
 
-    def handle_del(self, *value):
-        from_store = self.redis_cache.delete_by_keys(value)
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(type(from_store)))
-        return self.serializer.serialize(from_store)
+    def handle_msetnx(self, key, value, *pairs):
+        if len(pairs) % 2:
+            return wrong_arguments('msetnx')
+        return int(self.redis_cache.set_many_if_missing(_pairs(key, value, pairs)))
 
     def handle_incr(self, value):
-        from_store = self.redis_cache.increment(value)
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(type(from_store)))
-        return self.serializer.serialize(from_store)
+        return self.redis_cache.increment(value)
 
     def handle_decr(self, value):
-        from_store = self.redis_cache.decrement(value)
+        return self.redis_cache.decrement(value)
 
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(type(from_store)))
-        return self.serializer.serialize(from_store)
+    def handle_incrby(self, key, increment):
+        delta = parse_integer(increment)
+        return NOT_AN_INTEGER if delta is None else self.redis_cache.increment_by(key, delta)
 
-    def handle_lpush(self, *value):
-        from_store = self.redis_cache.append_to_head(value)
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(type(from_store)))
-        return self.serializer.serialize(from_store)
+    def handle_decrby(self, key, decrement):
+        delta = parse_integer(decrement)
+        return NOT_AN_INTEGER if delta is None else self.redis_cache.increment_by(key, -delta)
 
-    def handle_rpush(self, *value):
+    def handle_incrbyfloat(self, key, increment):
+        return self.redis_cache.increment_by_float(key, increment)
 
-        from_store = self.redis_cache.append_to_tail(value)
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(type(from_store)))
-        return self.serializer.serialize(from_store)
+    def handle_getset(self, key, value):
+        old = self.redis_cache.get_set(key, value)
+        return bulk_integer(old) if type(old) is int else old
 
-    def handle_lrange(self, *value):
-        from_store = self.redis_cache.lrange(value)
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(type(from_store)))
-        return self.serializer.serialize(from_store)
+    def handle_getdel(self, key):
+        value = self.redis_cache.get_delete(key)
+        return bulk_integer(value) if type(value) is int else value
+
+    def handle_append(self, key, value):
+        return self.redis_cache.append(key, value)
+
+    def handle_getrange(self, key, start, end):
+        return self.redis_cache.get_range(key, start, end)
+
+    def handle_setrange(self, key, offset, value):
+        return self.redis_cache.set_range(key, offset, value)
+
+    def handle_strlen(self, key):
+        return self.redis_cache.string_length(key)
+
+    def handle_setbit(self, key, offset, bit):
+        return self.redis_cache.set_bit(key, offset, bit)
+
+    def handle_getbit(self, key, offset):
+        return self.redis_cache.get_bit(key, offset)
+
+    def handle_bitcount(self, key, *options):
+        if len(options) == 1 or len(options) > 3:
+            return SYNTAX_ERROR
+        if not options:
+            return self.redis_cache.bit_count(key)
+        bit_range = _bit_range(options)
+        if isinstance(bit_range, str):
+            return bit_range
+        return self.redis_cache.bit_count(key, *bit_range)
+
+    def handle_bitpos(self, key, bit, *options):
+        if bit not in ('0', '1'):
+            return ErrorReply("-ERR The bit argument must be 1 or 0.")
+        if len(options) > 3:
+            return SYNTAX_ERROR
+        bit_range = _bit_range(options)
+        if isinstance(bit_range, str):
+            return bit_range
+        return self.redis_cache.bit_position(key, int(bit), *bit_range)
+
+    def handle_bitop(self, operation, destination, key, *keys):
+        operation = operation.lower()
+        if operation not in ('and', 'or', 'xor', 'not'):
+            return SYNTAX_ERROR
+        if operation == 'not' and keys:
+            return ErrorReply("-ERR BITOP NOT must be called with a single source key.")
+        return self.redis_cache.bit_operation(operation, destination, (key, *keys))
+
+    def handle_pfadd(self, key, *elements):
+        return self.redis_cache.pf_add(key, elements)
+
+    def handle_pfcount(self, key, *keys):
+        return self.redis_cache.pf_count((key, *keys))
+
+    def handle_pfmerge(self, destination, *sources):
+        reply = self.redis_cache.pf_merge(destination, sources)
+        return OK_RESP if reply is True else reply
+
+    def handle_hset(self, key, field, value, *pairs):
+        if len(pairs) % 2:
+            return wrong_arguments('hset')
+        return self.redis_cache.hash_set(key, _pairs(field, value, pairs))
+
+    def handle_hget(self, key, field):
+        return self.redis_cache.hash_get(key, field)
+
+    def handle_hmget(self, key, field, *fields):
+        return self.redis_cache.hash_get_many(key, (field, *fields))
+
+    def handle_hgetall(self, key):
+        return self.redis_cache.hash_get_all(key)
+
+    def handle_hdel(self, key, field, *fields):
+        return self.redis_cache.hash_delete(key, (field, *fields))
+
+    def handle_hlen(self, key):
+        return self.redis_cache.hash_length(key)
+
+    def handle_hexists(self, key, field):
+        return self.redis_cache.hash_exists(key, field)
+
+    def handle_hincrby(self, key, field, increment):
+        delta = parse_integer(increment)
+        return NOT_AN_INTEGER if delta is None else self.redis_cache.hash_increment_by(key, field, delta)
+
+    def handle_hscan(self, key, cursor, *options):
+        arguments = _scan_arguments(cursor, options)
+        if isinstance(arguments, str):
+            return arguments
+        cursor, count, pattern = arguments
+        from_store = self.redis_cache.hash_scan(key, cursor, count, pattern)
+        if isinstance(from_store, str):
+            return from_store
+        cursor, entries = from_store
+        return [str(cursor), entries]
+
+    def handle_zadd(self, key, first, second, *rest):
+        arguments = [first, second, *rest]
+        flags = set()
+        while arguments and arguments[0].lower() in ('nx', 'xx', 'gt', 'lt', 'ch', 'incr'):
+            flags.add(arguments.pop(0).lower())
+        if not arguments or len(arguments) % 2:
+            return SYNTAX_ERROR
+        if 'nx' in flags and 'xx' in flags:
+            return ErrorReply("-ERR XX and NX options at the same time are not compatible")
+        if ('gt' in flags or 'lt' in flags) and ('nx' in flags or ('gt' in flags and 'lt' in flags)):
+            return ErrorReply("-ERR GT, LT, and/or NX options at the same time are not compatible")
+        if 'incr' in flags and len(arguments) > 2:
+            return ErrorReply("-ERR INCR option supports a single increment-element pair")
+        scores = list(map(parse_score, arguments[::2]))
+        if None in scores:
+            return NOT_A_FLOAT
+        condition = 'nx' if 'nx' in flags else 'xx' if 'xx' in flags else None
+        compare = 'gt' if 'gt' in flags else 'lt' if 'lt' in flags else None
+        from_store = self.redis_cache.zset_add(key, list(zip(scores, arguments[1::2])), condition, compare,
+                                               'ch' in flags, 'incr' in flags)
+        if 'incr' in flags and not isinstance(from_store, str):
+            return _score_reply(from_store)
+        return from_store
+
+    def handle_zincrby(self, key, increment, member):
+        delta = parse_score(increment)
+        if delta is None:
+            return NOT_A_FLOAT
+        from_store = self.redis_cache.zset_add(key, [(delta, member)], increment=True)
+        return from_store if isinstance(from_store, str) else _score_reply(from_store)
+
+    def handle_zrem(self, key, member, *members):
+        return self.redis_cache.zset_remove(key, (member, *members))
+
+    def handle_zscore(self, key, member):
+        from_store = self.redis_cache.zset_score(key, member)
+        return from_store if isinstance(from_store, str) else _score_reply(from_store)
+
+    def handle_zcard(self, key):
+        return self.redis_cache.zset_length(key)
+
+    def handle_zrank(self, key, member):
+        return self.redis_cache.zset_rank(key, member)
+
+    def handle_zrevrank(self, key, member):
+        return self.redis_cache.zset_rank(key, member, reverse=True)
+
+    def handle_zrange(self, key, start, stop, *options):
+        options = [option.lower() for option in options]
+        limit = _limit(options)
+        if isinstance(limit, str):
+            return limit
+        flags = set(options)
+        if len(flags) != len(options) or not flags <= {'byscore', 'rev', 'withscores'}:
+            return SYNTAX_ERROR
+        reverse = 'rev' in flags
+        if 'byscore' not in flags:
+            if limit is not None:
+                return ErrorReply("-ERR syntax error, LIMIT is only supported in combination with either BYSCORE "
+                                  "or BYLEX")
+            return self._zrange_by_rank(key, start, stop, reverse, 'withscores' in flags)
+        # with REV the range is given from max to min
+        low, high = (stop, start) if reverse else (start, stop)
+        return self._zrange_by_score(key, low, high, reverse, limit, 'withscores' in flags)
+
+    def handle_zrevrange(self, key, start, stop, *options):
+        if options and [option.lower() for option in options] != ['withscores']:
+            return SYNTAX_ERROR
+        return self._zrange_by_rank(key, start, stop, True, bool(options))
+
+    def handle_zrangebyscore(self, key, low, high, *options):
+        options = [option.lower() for option in options]
+        limit = _limit(options)
+        if isinstance(limit, str):
+            return limit
+        if options and options != ['withscores']:
+            return SYNTAX_ERROR
+        return self._zrange_by_score(key, low, high, False, limit, bool(options))
+
+    def _zrange_by_rank(self, key, start, stop, reverse: bool, with_scores: bool):
+        try:
+            start, stop = int(start), int(stop)
+        except ValueError:
+            return NOT_AN_INTEGER
+        return _zset_reply(self.redis_cache.zset_range_by_rank(key, start, stop, reverse), with_scores)
+
+    def _zrange_by_score(self, key, low, high, reverse: bool, limit, with_scores: bool):
+        low, high = parse_score_bound(low), parse_score_bound(high)
+        if low is None or high is None:
+            return ErrorReply("-ERR min or max is not a float")
+        offset, count = limit or (0, -1)
+        return _zset_reply(self.redis_cache.zset_range_by_score(key, low, high, reverse, offset, count), with_scores)
+
+    def handle_zcount(self, key, low, high):
+        low, high = parse_score_bound(low), parse_score_bound(high)
+        if low is None or high is None:
+            return ErrorReply("-ERR min or max is not a float")
+        return self.redis_cache.zset_count(key, low, high)
+
+    def _zpop(self, key, count, lowest: bool):
+        if count is not None:
+            count = parse_integer(count)
+            if count is None or count < 0:
+                return ErrorReply("-ERR value is out of range, must be positive")
+        from_store = self.redis_cache.zset_pop(key, 1 if count is None else count, lowest)
+        if isinstance(from_store, str):
+            return from_store
+        return [part for score, member in from_store for part in (member, format_float(score))]
+
+    def handle_zpopmin(self, key, count=None):
+        return self._zpop(key, count, lowest=True)
+
+    def handle_zpopmax(self, key, count=None):
+        return self._zpop(key, count, lowest=False)
+
+    def handle_lpush(self, key, *values):
+        if not values:
+            return wrong_arguments('lpush')
+        return self.redis_cache.append_to_head((key, *values))
+
+    def handle_rpush(self, key, *values):
+        if not values:
+            return wrong_arguments('rpush')
+        return self.redis_cache.append_to_tail((key, *values))
+
+    def handle_lrange(self, key, start, end):
+        return self.redis_cache.lrange((key, start, end))
+
+    def handle_lpop(self, key, count=None):
+        return self.redis_cache.pop(key, count, from_head=True)
+
+    def handle_rpop(self, key, count=None):
+        return self.redis_cache.pop(key, count, from_head=False)
+
+    def handle_blpop(self, key, *keys_and_timeout):
+        return self._blocking_pop((key, *keys_and_timeout), from_head=True)
+
+    def handle_brpop(self, key, *keys_and_timeout):
+        return self._blocking_pop((key, *keys_and_timeout), from_head=False)
+
+    def _blocking_pop(self, keys_and_timeout: tuple, from_head: bool):
+        """BLPOP/BRPOP key [key ...] timeout, [key, element] of the first key with elements"""
+        if len(keys_and_timeout) < 2:
+            return wrong_arguments('blpop' if from_head else 'brpop')
+        *keys, timeout = keys_and_timeout
+        timeout = parse_timeout(timeout)
+        if isinstance(timeout, str):
+            return timeout
+        cache = self.redis_cache
+        for key in keys:
+            value = cache.pop(key, None, from_head)
+            if value is WRONGTYPE:
+                return value
+            if value is not None:
+                return [key, value]
+        return self._block(Waiter(cache, keys, from_head), timeout)
+
+    def handle_lmove(self, source, destination, wherefrom, whereto):
+        from_head, to_head = parse_side(wherefrom), parse_side(whereto)
+        if from_head is None or to_head is None:
+            return SYNTAX_ERROR
+        return self.redis_cache.move(source, destination, from_head, to_head)
+
+    def handle_blmove(self, source, destination, wherefrom, whereto, timeout):
+        from_head, to_head = parse_side(wherefrom), parse_side(whereto)
+        if from_head is None or to_head is None:
+            return SYNTAX_ERROR
+        timeout = parse_timeout(timeout)
+        if isinstance(timeout, str):
+            return timeout
+        value = self.redis_cache.move(source, destination, from_head, to_head)
+        if value is not None:
+            return value
+        return self._block(Waiter(self.redis_cache, (source,), from_head, destination, to_head), timeout)
+
+    def _block(self, waiter: Waiter, timeout: float):
+        """queues the waiter, the connection writes its reply once it is served or timed out"""
+        if not self.can_block:
+            return waiter.timeout_reply()
+        self.waiter = blocking.block(waiter, timeout)
+        return BLOCKED
+
+    def handle_llen(self, key):
+        return self.redis_cache.list_length(key)
+
+    def handle_lindex(self, key, index):
+        return self.redis_cache.list_index(key, index)
+
+    def handle_lset(self, key, index, value):
+        from_store = self.redis_cache.list_set(key, index, value)
+        return OK_RESP if from_store is True else from_store
+
+    def handle_ltrim(self, key, start, stop):
+        from_store = self.redis_cache.list_trim(key, start, stop)
+        return OK_RESP if from_store is True else from_store
+
+    def handle_lrem(self, key, count, value):
+        return self.redis_cache.list_remove(key, count, value)
 
     def handle_get(self, value):
-        from_store = self.redis_cache.get_by_key(value)
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(type(from_store)))
-        return self.serializer.serialize(from_store)
-
-    def handle_set(self, *data):
-        key, *value = data
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(str))
-        self.redis_cache.set_key_value(key, value)
-        return self.serializer.serialize(f"{SIMPLE_STRING}OK")
+        value = self.redis_cache.get_string(value)
+        # integer encoded values become strings only here, on their way to the client
+        return bulk_integer(value) if type(value) is int else value
+
+    def handle_set(self, key, value, *options):
+        from_store = self.redis_cache.set_key_value(key, (value, *options))
+        if from_store is True:
+            return OK_RESP
+        if from_store is False:
+            return None
+        return from_store
+
+    def _handle_expire(self, unit, key, ttl, *flags):
+        return self.redis_cache.expire(key, unit, ttl, *flags)
+
+    def handle_expire(self, key, seconds, *flags):
+        return self._handle_expire('ex', key, seconds, *flags)
+
+    def handle_pexpire(self, key, milliseconds, *flags):
+        return self._handle_expire('px', key, milliseconds, *flags)
+
+    def handle_expireat(self, key, timestamp, *flags):
+        return self._handle_expire('exat', key, timestamp, *flags)
+
+    def handle_pexpireat(self, key, timestamp, *flags):
+        return self._handle_expire('pxat', key, timestamp, *flags)
+
+    def handle_ttl(self, key):
+        return self.redis_cache.ttl(key, 's')
+
+    def handle_pttl(self, key):
+        return self.redis_cache.ttl(key, 'ms')
+
+    def handle_persist(self, key):
+        return self.redis_cache.persist(key)
+
     def handle_save(self, _=None):
         try:
-            self.redis_cache.save()
-            self.serializer.set_strategy(self.serializor_factory.create_serializor(str))
-            return self.serializer.serialize(f"{SIMPLE_STRING}OK")
-        except Exception:
-            return self.serializer.serialize("-ERR save to FileSystem failed")
+            from_store = self.redis_cache.save()
+        except OSError:
+            return ErrorReply("-ERR save to FileSystem failed")
+        return OK_RESP if from_store is True else from_store
 
-    def handle_ping(self, _=None):
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(str))
-        return self.serializer.serialize(f"{SIMPLE_STRING}PONG")
+    def handle_bgsave(self, *_):
+        try:
+            from_store = self.redis_cache.background_save()
+        except OSError:
+            return ErrorReply("-ERR Background save failed to start")
+        return StatusReply("+Background saving started") if from_store is True else from_store
+
+    def handle_bgrewriteaof(self):
+        try:
+            from_store = self.redis_cache.rewrite_append_only_file()
+        except OSError:
+            return ErrorReply("-ERR Background append only file rewriting failed to start")
+        return StatusReply("+Background append only file rewriting started") if from_store is True else from_store
+
+    def handle_lastsave(self):
+        return self.redis_cache.lastsave
+
+    def handle_ping(self, message=None):
+        if self.subscriber is not None and self.subscriber.subscriptions():
+            # a subscribed connection reads messages, a pong looks like one
+            pubsub.flush_before_reply(self.subscriber)
+            return RespFrame(encode_array(('pong', message or '')))
+        return PONG_RESP
+
+    def _subscriber(self) -> Optional[Subscriber]:
+        if self.subscriber is None and self.transport is not None:
+            self.subscriber = Subscriber(self.transport)
+        return self.subscriber
+
+    def handle_subscribe(self, channel, *channels):
+        subscriber = self._subscriber()
+        return NO_SUBSCRIPTIONS if subscriber is None else pubsub.subscribe(subscriber, (channel, *channels))
+
+    def handle_unsubscribe(self, *channels):
+        subscriber = self._subscriber()
+        return NO_SUBSCRIPTIONS if subscriber is None else pubsub.unsubscribe(subscriber, channels)
+
+    def handle_psubscribe(self, pattern, *patterns):
+        subscriber = self._subscriber()
+        return NO_SUBSCRIPTIONS if subscriber is None else pubsub.psubscribe(subscriber, (pattern, *patterns))
+
+    def handle_punsubscribe(self, *patterns):
+        subscriber = self._subscriber()
+        return NO_SUBSCRIPTIONS if subscriber is None else pubsub.punsubscribe(subscriber, patterns)
+
+    def handle_publish(self, channel, message):
+        return pubsub.publish(channel, message)
+
+    def handle_pubsub(self, subcommand, *params):
+        match subcommand.lower():
+            case 'channels':
+                if len(params) > 1:
+                    return wrong_arguments('pubsub|channels')
+                return pubsub.channel_names(*params)
+            case 'numsub':
+                return pubsub.subscriber_counts(params)
+            case 'numpat':
+                return pubsub.pattern_count()
+            case _:
+                return ErrorReply(f"-ERR unknown subcommand '{subcommand}'. Try PUBSUB CHANNELS, PUBSUB NUMSUB, "
+                                  f"PUBSUB NUMPAT.")
+
+    def handle_hello(self, *params):
+        """HELLO [protover [SETNAME name]], switches the protocol and describes the connection"""
+        protocol = self.protocol
+        if params:
+            protover, *options = params
+            try:
+                protocol = int(protover)
+            except ValueError:
+                return ErrorReply("-ERR Protocol version is not an integer or out of range")
+            if protocol not in (2, 3):
+                return ErrorReply("-NOPROTO unsupported protocol version")
+            if protocol == 2 and self.tracker is not None:
+                return ErrorReply("-ERR a connection with CLIENT TRACKING on can't switch back to RESP2")
+            if options:
+                if len(options) != 2 or options[0].lower() != 'setname':
+                    return ErrorReply(f"-ERR Syntax error in HELLO option '{options[0]}'")
+                self.name = options[1]
+        self.protocol = protocol
+        return encode_hello({
+            'server': 'redis',
+            'version': '7.0.0',
+            'proto': protocol,
+            'id': self.id,
+            'mode': 'standalone',
+            'role': 'master' if replication.primary is None else 'replica',
+            'modules': [],
+        }, protocol)
+
+    def handle_client(self, subcommand, *params):
+        match subcommand.lower():
+            case 'tracking':
+                if not params:
+                    return wrong_arguments('client|tracking')
+                return self._client_tracking(*params)
+            case 'id':
+                return self.id
+            case 'setname':
+                if len(params) != 1:
+                    return wrong_arguments('client|setname')
+                self.name = params[0]
+                return OK_RESP
+            case 'getname':
+                return None if self.name is None else to_text(self.name)
+            case _:
+                return ErrorReply(f"-ERR unknown subcommand '{subcommand}'. Try CLIENT TRACKING, CLIENT ID, "
+                                  f"CLIENT SETNAME, CLIENT GETNAME.")
+
+    def _client_tracking(self, switch, *options):
+        """CLIENT TRACKING on|off [BCAST] [PREFIX prefix ...] [NOLOOP]"""
+        switch = switch.lower()
+        if switch not in ('on', 'off'):
+            return SYNTAX_ERROR
+        bcast = noloop = False
+        prefixes = []
+        index = 0
+        while index < len(options):
+            option = options[index].lower()
+            if option == 'bcast':
+                bcast = True
+            elif option == 'noloop':
+                noloop = True
+            elif option == 'prefix' and index + 1 < len(options):
+                index += 1
+                prefixes.append(to_text(options[index]))
+            else:
+                return SYNTAX_ERROR
+            index += 1
+        if switch == 'off':
+            if self.tracker is not None:
+                tracking.disable(self.tracker)
+                self.tracker = None
+            return OK_RESP
+        if prefixes and not bcast:
+            return ErrorReply("-ERR PREFIX option requires BCAST mode to be enabled")
+        if self.protocol != 3:
+            return ErrorReply("-ERR CLIENT TRACKING needs RESP3 for the invalidation pushes, switch with HELLO 3 first")
+        if not self.can_track or self.transport is None:
+            return NO_TRACKING
+        error = overlapping_prefixes(tuple(prefixes))
+        if error is not None:
+            return error
+        if self.tracker is not None:
+            if bcast != self.tracker.bcast:
+                return ErrorReply("-ERR You can't switch BCAST mode on/off before disabling tracking for this "
+                                  "client, and then re-enabling it with a different mode.")
+            if not bcast:
+                # the keys it read stay tracked
+                self.tracker.noloop = noloop
+                return OK_RESP
+            tracking.disable(self.tracker)
+        self.tracker = tracking.enable(self.id, self.transport, self.redis_cache.name, bcast, tuple(prefixes), noloop)
+        return OK_RESP
+
+    def close(self):
+        """the connection is gone, its subscriptions, tracking and a blocking command it waits for go with it"""
+        if self.tracker is not None:
+            tracking.disable(self.tracker)
+            self.tracker = None
+        if self.subscriber is not None:
+            pubsub.drop(self.subscriber)
+            self.subscriber = None
+        if self.waiter is not None:
+            blocking.cancel(self.waiter)
+            self.waiter = None
+
+    def handle_replicaof(self, host, port):
+        if host.lower() == 'no' and port.lower() == 'one':
+            return replication.promote()
+        try:
+            port = int(port)
+        except ValueError:
+            return ErrorReply("-ERR Invalid master port")
+        if not 0 < port < 65536:
+            return ErrorReply("-ERR Invalid master port")
+        return replication.replicate(host, port)
+
+    def handle_replconf(self, option, *params):
+        if option.lower() == 'listening-port':
+            if len(params) != 1 or not params[0].isdigit():
+                return SYNTAX_ERROR
+            if self.replica is None:
+                self.replica = ReplicaLink(self.redis_cache.name)
+            self.replica.port = int(params[0])
+        # capabilities and acks before PSYNC are accepted and ignored
+        return OK_RESP
+
+    def handle_psync(self, replid, offset):
+        if self.replica is None:
+            self.replica = ReplicaLink(self.redis_cache.name)
+        reply = replication.accept(self.replica, replid, offset)
+        if self.replica.accepted:
+            # the connection carries the replication stream from now on, the server hands it over
+            self.close_requested = True
+        return reply
+
+    def handle_command_docs(self, *_):
+        # redis-cli asks for the command docs on connect, an empty reply makes it fall back to defaults
+        return EMPTY_ARRAY
+
+    def handle_quit(self, *_):
+        self.close_requested = True
+        return OK_RESP
+
+    def handle_info(self, *sections):
+        return info.render(self.redis_cache, list(sections))
 
     def handle_echo(self, value):
-        print(f"echo value {value}")
-        self.serializer.set_strategy(self.serializor_factory.create_serializor(type(value)))
-        return self.serializer.serialize(value)
+        return value
+
+    def handle_slowlog(self, subcommand, *params):
+        match subcommand.lower():
+            case 'get':
+                if len(params) > 1:
+                    return wrong_arguments('slowlog|get')
+                try:
+                    # the 10 latest entries by default, -1 for all of them
+                    limit = int(params[0]) if params else 10
+                except ValueError:
+                    return NOT_AN_INTEGER
+                if limit < -1:
+                    return ErrorReply("-ERR count should be greater than or equal to -1")
+                entries = stats.slowlog if limit == -1 else islice(stats.slowlog, limit)
+                return [entry.reply() for entry in entries]
+            case 'len':
+                return len(stats.slowlog)
+            case 'reset':
+                stats.slowlog.clear()
+                return OK_RESP
+            case _:
+                return ErrorReply(f"-ERR unknown subcommand '{subcommand}'. Try SLOWLOG GET, SLOWLOG LEN, "
+                                  f"SLOWLOG RESET.")
+
+    # set on a replica, its keyspaces only change by the stream of its primary
+    read_only = False
+
+    # commands which can change the keyspace
+    write_commands = frozenset((
+        'set', 'mset', 'msetnx', 'del', 'incr', 'decr', 'incrby', 'decrby', 'incrbyfloat', 'getset', 'getdel',
+        'append', 'setrange', 'lpush', 'rpush', 'lpop', 'rpop', 'blpop', 'brpop', 'lmove', 'blmove', 'lset', 'ltrim',
+        'lrem', 'hset', 'hdel', 'hincrby', 'zadd', 'zincrby', 'zrem', 'zpopmin', 'zpopmax', 'expire', 'pexpire',
+        'expireat', 'pexpireat', 'persist', 'setbit', 'bitop', 'pfadd', 'pfmerge',
+    ))
+
+    # write commands whose reply is None although they changed the keyspace (GETSET of a missing key)
+    null_reply_writes = frozenset(('getset',))
+
+    # write commands which can grow the memory, rejected once nothing can be evicted anymore
+    denyoom_commands = frozenset(('set', 'mset', 'msetnx', 'incr', 'decr', 'incrby', 'decrby', 'incrbyfloat',
+                                  'getset', 'append', 'setrange', 'lpush', 'rpush', 'lmove', 'blmove', 'lset',
+                                  'hset', 'hincrby', 'zadd', 'zincrby', 'setbit', 'bitop', 'pfadd', 'pfmerge'))
+
+    # commands served while the keyspace is still loading
+    loading_commands = frozenset(('info', 'ping', 'quit', 'config', 'command', 'slowlog', 'subscribe', 'unsubscribe',
+                                  'psubscribe', 'punsubscribe', 'publish', 'pubsub', 'replicaof', 'slaveof',
+                                  'replconf', 'psync', 'hello', 'client'))
+
+    # the commands a connection with subscriptions may send
+    subscribed_commands = frozenset(('subscribe', 'unsubscribe', 'psubscribe', 'punsubscribe', 'ping', 'quit'))
+
+    # built once when the module is imported, shared by all connections
+    command_mappings: dict[str, Callable] = {
+        'set': handle_set,
+        'mget': handle_mget,
+        'mset': handle_mset,
+        'msetnx': handle_msetnx,
+        'exists': handle_exists,
+        'del': handle_del,
+        'scan': handle_scan,
+        'keys': handle_keys,
+        'type': handle_type,
+        'dbsize': handle_dbsize,
+        'randomkey': handle_randomkey,
+        'incr': handle_incr,
+        'decr': handle_decr,
+        'incrby': handle_incrby,
+        'decrby': handle_decrby,
+        'incrbyfloat': handle_incrbyfloat,
+        'getset': handle_getset,
+        'getdel': handle_getdel,
+        'append': handle_append,
+        'getrange': handle_getrange,
+        'substr': handle_getrange,
+        'setrange': handle_setrange,
+        'strlen': handle_strlen,
+        'setbit': handle_setbit,
+        'getbit': handle_getbit,
+        'bitcount': handle_bitcount,
+        'bitpos': handle_bitpos,
+        'bitop': handle_bitop,
+        'pfadd': handle_pfadd,
+        'pfcount': handle_pfcount,
+        'pfmerge': handle_pfmerge,
+        'lpush': handle_lpush,
+        'rpush': handle_rpush,
+        'lrange': handle_lrange,
+        'lpop': handle_lpop,
+        'rpop': handle_rpop,
+        'blpop': handle_blpop,
+        'brpop': handle_brpop,
+        'lmove': handle_lmove,
+        'blmove': handle_blmove,
+        'llen': handle_llen,
+        'lindex': handle_lindex,
+        'lset': handle_lset,
+        'ltrim': handle_ltrim,
+        'lrem': handle_lrem,
+        'hset': handle_hset,
+        'hget': handle_hget,
+        'hmget': handle_hmget,
+        'hgetall': handle_hgetall,
+        'hdel': handle_hdel,
+        'hlen': handle_hlen,
+        'hexists': handle_hexists,
+        'hincrby': handle_hincrby,
+        'hscan': handle_hscan,
+        'zadd': handle_zadd,
+        'zincrby': handle_zincrby,
+        'zrem': handle_zrem,
+        'zscore': handle_zscore,
+        'zcard': handle_zcard,
+        'zrank': handle_zrank,
+        'zrevrank': handle_zrevrank,
+        'zrange': handle_zrange,
+        'zrevrange': handle_zrevrange,
+        'zrangebyscore': handle_zrangebyscore,
+        'zcount': handle_zcount,
+        'zpopmin': handle_zpopmin,
+        'zpopmax': handle_zpopmax,
+        'get': handle_get,
+        'save': handle_save,
+        'bgsave': handle_bgsave,
+        'lastsave': handle_lastsave,
+        'bgrewriteaof': handle_bgrewriteaof,
+        'command': handle_command_docs,
+        'ping': handle_ping,
+        'echo': handle_echo,
+        'info': handle_info,
+        'slowlog': handle_slowlog,
+        'subscribe': handle_subscribe,
+        'unsubscribe': handle_unsubscribe,
+        'psubscribe': handle_psubscribe,
+        'punsubscribe': handle_punsubscribe,
+        'publish': handle_publish,
+        'pubsub': handle_pubsub,
+        'replicaof': handle_replicaof,
+        'slaveof': handle_replicaof,
+        'replconf': handle_replconf,
+        'psync': handle_psync,
+        'config': handle_config,
+        'hello': handle_hello,
+        'client': handle_client,
+        'quit': handle_quit,
+        'expire': handle_expire,
+        'pexpire': handle_pexpire,
+        'expireat': handle_expireat,
+        'pexpireat': handle_pexpireat,
+        'ttl': handle_ttl,
+        'pttl': handle_pttl,
+        'persist': handle_persist,
+    }
+
+    # the least and the most arguments of every command, checked before it runs
+    command_arity: dict[str, tuple[int, Optional[int]]] = {name: arity(handler)
+                                                           for name, handler in command_mappings.items()}
@@ -0,0 +1,175 @@
+"""
+INFO sections, every section renders the fields of the keyspace the client works on. New sections
+are added to SECTIONS, INFO without arguments renders all of them in this order.
+"""
+import os
+import time
+from typing import Callable
+
+from commandhandler.blocking import blocking
+from commandhandler.pubsub import pubsub
+from commandhandler.replication import replication, backlog_size
+from commandhandler.stats import stats, LATENCY_PERCENTILES
+from commandhandler.tracking import tracking
+from storage.cache import RedisCache
+from storage.eviction import usage, maxmemory, maxmemory_policy
+
+STARTED = time.time()
+
+
+def server_section(cache: RedisCache) -> dict:
+    return {
+        'process_id': os.getpid(),
+        'uptime_in_seconds': int(time.time() - STARTED),
+    }
+
+
+def clients_section(cache: RedisCache) -> dict:
+    return {'connected_clients': stats.connected_clients, 'blocked_clients': blocking.blocked_clients,
+            'tracking_clients': len(tracking.clients)}
+
+
+def memory_section(cache: RedisCache) -> dict:
+    return {
+        'used_memory': usage.used,
+        'used_memory_keyspace': cache.table.used,
+        'maxmemory': maxmemory.value,
+        'maxmemory_policy': maxmemory_policy.value,
+        'evicted_keys': usage.evicted_keys,
+    }
+
+
+def persistence_section(cache: RedisCache) -> dict:
+    progress = cache.loading
+    fields = {'loading': int(progress is not None and progress.error is None)}
+    if progress is not None:
+        fields.update(
+            loading_start_time=int(progress.started),
+            loading_total_bytes=progress.total_bytes,
+            loading_loaded_bytes=progress.loaded_bytes,
+            loading_loaded_perc=f"{progress.percentage:.2f}",
+            loading_eta_seconds=round(progress.eta_seconds),
+            loading_keys_loaded=progress.keys,
+        )
+    last_load = cache.last_load
+    if last_load is not None:
+        fields.update(
+            last_load_file=last_load.file_name,
+            last_load_keys_loaded=last_load.keys,
+            last_load_duration_ms=round(last_load.duration * 1000),
+            last_load_longest_step_ms=round(last_load.longest_step * 1000, 3),
+            last_load_status='ok' if last_load.error is None else 'err',
+        )
+    fields.update(
+        rdb_changes_since_last_save=cache.dirty,
+        rdb_bgsave_in_progress=int(cache.bgsave is not None),
+        rdb_last_save_time=cache.lastsave,
+        aof_enabled=int(cache.aof is not None),
+        aof_rewrite_in_progress=int(cache.aof is not None and cache.aof.rewrite is not None),
+    )
+    return fields
+
+
+def stats_section(cache: RedisCache) -> dict:
+    return {
+        'total_connections_received': stats.total_connections,
+        'total_commands_processed': stats.total_commands,
+        'total_error_replies': stats.total_error_replies,
+        'rejected_calls': sum(entry.rejected_calls for entry in stats.commands.values()),
+        'evicted_keys': usage.evicted_keys,
+        'pubsub_channels': len(pubsub.channels),
+        'pubsub_patterns': len(pubsub.patterns),
+        'client_output_buffer_limit_disconnections': pubsub.dropped_subscribers,
+        'slowlog_len': len(stats.slowlog),
+        'tracking_total_keys': tracking.tracked_keys,
+        'tracking_total_prefixes': tracking.prefix_count(),
+    }
+
+
+def replication_section(cache: RedisCache) -> dict:
+    fields: dict = {'role': 'master' if replication.primary is None else 'slave'}
+    if replication.primary is not None:
+        last_io = replication.last_io
+        fields.update(
+            master_host=replication.primary[0],
+            master_port=replication.primary[1],
+            master_link_status='up' if replication.link_up else 'down',
+            master_last_io_seconds_ago=int(time.time() - last_io) if last_io else -1,
+            master_sync_in_progress=int(replication.sync_in_progress),
+            slave_repl_offset=replication.offset,
+            slave_read_only=1,
+        )
+    fields['connected_slaves'] = len(replication.replicas)
+    now = time.monotonic()
+    for index, link in enumerate(replication.replicas):
+        fields[f"slave{index}"] = (f"ip={link.address},port={link.port},state={link.state},"
+                                   f"offset={link.acked_offset},lag={int(now - link.last_ack)}")
+    backlog = replication.backlog
+    fields.update(
+        master_replid=replication.replid,
+        master_replid2=replication.replid2,
+        master_repl_offset=replication.offset,
+        second_repl_offset=replication.second_offset,
+        repl_backlog_active=int(backlog is not None),
+        repl_backlog_size=backlog_size.value,
+        repl_backlog_first_byte_offset=backlog.offset - backlog.length if backlog is not None else 0,
+        repl_backlog_histlen=backlog.length if backlog is not None else 0,
+    )
+    return fields
+
+
+def commandstats_section(cache: RedisCache) -> dict:
+    return {
+        f"cmdstat_{name}": f"calls={entry.calls},usec={entry.nanoseconds // 1000},"
+                           f"usec_per_call={entry.nanoseconds / 1000 / entry.calls if entry.calls else 0:.2f},"
+                           f"rejected_calls={entry.rejected_calls},failed_calls={entry.failed_calls}"
+        for name, entry in sorted(stats.commands.items())
+    }
+
+
+def latencystats_section(cache: RedisCache) -> dict:
+    return {
+        f"latency_percentiles_usec_{name}": ",".join(
+            f"{label}={entry.histogram.percentile(share) / 1000:.3f}" for label, share in LATENCY_PERCENTILES)
+        for name, entry in sorted(stats.commands.items()) if entry.histogram is not None and entry.histogram.total
+    }
+
+
+def keyspace_section(cache: RedisCache) -> dict:
+    if not cache.data:
+        return {}
+    return {'db0': f"keys={len(cache.data)},expires={len(cache.expires)}"}
+
+
+SECTIONS: dict[str, Callable[[RedisCache], dict]] = {
+    'server': server_section,
+    'clients': clients_section,
+    'memory': memory_section,
+    'persistence': persistence_section,
+    'stats': stats_section,
+    'replication': replication_section,
+    'commandstats': commandstats_section,
+    'latencystats': latencystats_section,
+    'keyspace': keyspace_section,
+}
+# one line per command, only rendered when asked for (or with 'all')
+NOT_DEFAULT = ('commandstats', 'latencystats')
+
+
+def render(cache: RedisCache, sections: list[str]) -> str:
+    """:return: the INFO text of the requested sections, 'default' (or none) skips the per command ones"""
+    names = [section.lower() for section in sections]
+    if set(names) & {'all', 'everything'}:
+        names = list(SECTIONS)
+    elif not names or 'default' in names:
+        names = [name for name in SECTIONS if name not in NOT_DEFAULT]
+    lines = []
+    for name in names:
+        section = SECTIONS.get(name, None)
+        if section is None:
+            continue
+        if lines:
+            lines.append("")
+        lines.append(f"# {name.capitalize()}")
+        lines += (f"{field}:{value}" for field, value in section(cache).items())
+    return "\r\n".join(lines) + "\r\n" if lines else ""
@@ -1,11 +1,26 @@
-from typing import Callable
+from typing import Callable, Iterator
 
-from commandhandler.utils import split_by_CRLF
+from commandhandler.utils import split_by_CRLF, UNICODE_ERRORS, MAX_DECODED_LENGTH
+
+ARRAY_BYTE = ord('*')
+STRING_BYTE = ord('$')
+CRLF_BYTES = b"\r\n"
+
+# same limits redis applies to a single request, anything larger is treated as garbage
+MAX_BULK_LENGTH = 512 * 1024 * 1024
+MAX_MULTIBULK_LENGTH = 1024 * 1024
+MAX_INLINE_LENGTH = 64 * 1024
+
+
+class ProtocolError(Exception):
+    def __init__(self, message="Protocol error"):
+        self.message = message
+        super().__init__(self.message)
 
 
 class CommandParser:
 
-    def __init__(self):
+    def __init__(self, encoding: str | None = "utf-8"):
         default_handlers: dict[str, Callable] = {
             '+': self.handle_simple_string,
             '-': self.handle_error,
@@ -14,6 +29,16 @@ class CommandParser:
             '*': self.handle_array,
             }
         self.command_mappings = default_handlers
+        # state of the streaming parser, survives between `feed` calls
+        self.encoding = encoding
+        self._buffer = bytearray()
+        self._pos = 0
+        self._items: list | None = None
+        self._remaining = 0
+        self._bulk_length = -1
+        # stream offsets of the first buffered byte and of the frame being parsed
+        self._offset = 0
+        self._frame_start = 0
 
     def parse_command(self, command: str):
         return self.command_mappings.get(command[0], lambda: self.command_not_found)(command[1:])
@@ -53,3 +78,120 @@ class CommandParser:
 
         return items
 
+    # streaming parser
+
+    def feed(self, data: bytes):
+        """
+        appends a chunk read from the socket, complete commands are handed out by `parse`
+        :param data: raw bytes as received
+        """
+        self._buffer += data
+
+    def pending(self) -> int:
+        """number of buffered bytes which are not yet consumed"""
+        return len(self._buffer) - self._pos
+
+    def consumed(self) -> int:
+        """number of bytes fed so far which belong to commands already handed out"""
+        return self._frame_start
+
+    def __iter__(self):
+        return self.parse()
+
+    def parse(self) -> Iterator[list]:
+        """
+        yields every complete command currently buffered as a list of arguments.
+        An incomplete frame is kept together with the progress made so far (parsed items,
+        announced bulk length), so the next call resumes where this one stopped instead of
+        scanning the frame again. Large bulk payloads are copied exactly once, straight from the
+        read buffer into the resulting argument.
+        """
+        buffer = self._buffer
+        pos, items, remaining, bulk_length = self._pos, self._items, self._remaining, self._bulk_length
+        frame_start = self._frame_start - self._offset
+        try:
+            while True:
+                if items is None:
+                    frame_start = pos
+                    if pos >= len(buffer):
+                        return
+                    if buffer[pos] != ARRAY_BYTE:
+                        end = buffer.find(b"\n", pos)
+                        if end < 0:
+                            if len(buffer) - pos > MAX_INLINE_LENGTH:
+                                raise ProtocolError("Protocol error: too big inline request")
+                            return
+                        line, pos = buffer[pos:end], end + 1
+                        arguments = line.split()
+                        if arguments:
+                            yield [self._decode(argument) for argument in arguments]
+                        continue
+                    end = buffer.find(CRLF_BYTES, pos)
+                    if end < 0:
+                        return
+                    remaining = self._to_length(buffer, pos + 1, end, MAX_MULTIBULK_LENGTH, "multibulk")
+                    pos = end + 2
+                    if remaining <= 0:
+                        continue
+                    items = []
+                while remaining:
+                    if bulk_length < 0:
+                        end = buffer.find(CRLF_BYTES, pos)
+                        if end < 0:
+                            return
+                        if buffer[pos] != STRING_BYTE:
+                            raise ProtocolError(f"Protocol error: expected '$', got '{chr(buffer[pos])}'")
+                        bulk_length = self._to_length(buffer, pos + 1, end, MAX_BULK_LENGTH, "bulk")
+                        if bulk_length < 0:
+                            raise ProtocolError("Protocol error: invalid bulk length")
+                        pos = end + 2
+                    end = pos + bulk_length
+                    if len(buffer) < end + 2:
+                        return
+                    if buffer[end] != 13 or buffer[end + 1] != 10:
+                        raise ProtocolError("Protocol error: bulk is not terminated by CRLF")
+                    # payloads up to this size are sliced and decoded, copying a few bytes twice is
+                    # cheaper than a memoryview. Larger ones are values, copied once and kept as bytes
+                    if bulk_length <= MAX_DECODED_LENGTH:
+                        items.append(self._decode(buffer[pos:end]))
+                    else:
+                        items.append(self._extract(buffer, pos, end))
+                    pos = end + 2
+                    bulk_length = -1
+                    remaining -= 1
+                command, items = items, None
+                yield command
+        finally:
+            self._items, self._remaining, self._bulk_length = items, remaining, bulk_length
+            self._frame_start = self._offset + (pos if items is None else frame_start)
+            if pos >= len(buffer):
+                self._offset += len(buffer)
+                buffer.clear()
+                pos = 0
+            elif pos > len(buffer) // 2:
+                # compact only once the consumed prefix dominates, keeps big frames from being moved per read
+                self._offset += pos
+                del buffer[:pos]
+                pos = 0
+            self._pos = pos
+
+    @staticmethod
+    def _extract(buffer: bytearray, start: int, end: int) -> bytes:
+        with memoryview(buffer) as view, view[start:end] as payload:
+            return bytes(payload)
+
+    def _decode(self, value: bytearray):
+        if self.encoding is None or len(value) > MAX_DECODED_LENGTH:
+            return bytes(value)
+        return value.decode(self.encoding, UNICODE_ERRORS)
+
+    @staticmethod
+    def _to_length(buffer: bytearray, start: int, end: int, limit: int, kind: str) -> int:
+        digits = buffer[start:end]
+        # int() also takes a sign, whitespace and underscores, redis only digits or the null length
+        if not digits.isdigit() and digits != b"-1":
+            raise ProtocolError(f"Protocol error: invalid {kind} length")
+        length = int(digits)
+        if length > limit:
+            raise ProtocolError(f"Protocol error: invalid {kind} length")
+        return length
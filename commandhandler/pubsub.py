@@ -0,0 +1,301 @@
+"""
+Publish/subscribe, server wide like in redis: channels are not part of a keyspace.
+
+PUBLISH encodes the message once and queues the same bytes object for every subscriber. The
+queues are written once per iteration of the event loop, like redis writes the client buffers
+before it sleeps, so a pipeline of PUBLISH commands costs one `transport.write` per subscriber
+and not one per message and subscriber. Messages bypass the reply batches of the subscribers,
+the ones queued before a reply to a subscriber are written before that reply.
+
+Pattern subscriptions are indexed by their literal prefix, the part before the first glob
+character. PUBLISH looks up the prefixes of the channel name, one dict lookup per distinct prefix
+length, and only matches the patterns found there instead of every pattern of the server.
+
+A subscriber that doesn't read fills its transport buffer. Like `client-output-buffer-limit
+pubsub` in redis, it is disconnected once the buffer is above the hard limit, or above the soft
+limit for longer than the soft seconds.
+"""
+import asyncio
+import time
+from typing import Callable, Optional
+
+from commandhandler.config import ServerConfig
+from commandhandler.trace import logger
+from commandhandler.utils import RespFrame, CRLF_BYTES, to_bytes, to_text
+from storage.eviction import parse_memory
+from storage.glob import compile_glob, filter_glob
+
+GLOB_CHARACTERS = '*?[\\'
+
+
+def parse_output_buffer_limit(raw: str) -> tuple[int, int, int]:
+    """'pubsub <hard> <soft> <soft seconds>', the sizes in bytes or with a unit like '32mb'"""
+    parts = raw.lower().split()
+    if len(parts) != 4 or parts[0] != 'pubsub':
+        raise ValueError("expected 'pubsub <hard limit> <soft limit> <soft seconds>'")
+    hard, soft = parse_memory(parts[1]), parse_memory(parts[2])
+    seconds = int(parts[3])
+    if seconds < 0:
+        raise ValueError("the soft seconds must not be negative")
+    return hard, soft, seconds
+
+
+def render_output_buffer_limit(limit: tuple[int, int, int]) -> str:
+    return "pubsub %d %d %d" % limit
+
+
+output_buffer_limit = ServerConfig.register('client-output-buffer-limit', 'pubsub 32mb 8mb 60',
+                                            parse_output_buffer_limit, render=render_output_buffer_limit)
+
+
+def encode_array(parts: tuple) -> bytes:
+    """an array of bulk strings, encoded in one go"""
+    out = bytearray(b"*%d\r\n" % len(parts))
+    for part in parts:
+        encoded = to_bytes(part)
+        out += b"$%d\r\n" % len(encoded)
+        out += encoded
+        out += CRLF_BYTES
+    return bytes(out)
+
+
+def literal_prefix(pattern: str) -> str:
+    for index, character in enumerate(pattern):
+        if character in GLOB_CHARACTERS:
+            return pattern[:index]
+    return pattern
+
+
+class Subscriber:
+    """the pub/sub side of a connection, `transport` is where the messages go"""
+    __slots__ = ('transport', 'channels', 'patterns', 'pending', 'soft_limit_since', 'dropped')
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.channels: dict[str, None] = {}
+        self.patterns: dict[str, None] = {}
+        # the frames published since the last flush, shared with the other subscribers
+        self.pending: list[bytes] = []
+        # when the output buffer went above the soft limit, None while it is below
+        self.soft_limit_since: Optional[float] = None
+        self.dropped = False
+
+    def subscriptions(self) -> int:
+        return len(self.channels) + len(self.patterns)
+
+    def flush(self, now: float) -> bool:
+        """writes the pending messages, :return: False if the subscriber is over its output buffer limit"""
+        pending, transport = self.pending, self.transport
+        transport.write(pending[0] if len(pending) == 1 else b"".join(pending))
+        pending.clear()
+        hard, soft, seconds = output_buffer_limit.value
+        buffered = transport.get_write_buffer_size()
+        if hard and buffered > hard:
+            return False
+        if soft and buffered > soft:
+            if self.soft_limit_since is None:
+                self.soft_limit_since = now
+            elif now - self.soft_limit_since > seconds:
+                return False
+        else:
+            self.soft_limit_since = None
+        return True
+
+
+class PatternSubscription:
+    __slots__ = ('match', 'subscribers')
+
+    def __init__(self, pattern: str):
+        self.match: Callable[[str], bool] = compile_glob(pattern)
+        self.subscribers: dict[Subscriber, None] = {}
+
+
+class PubSub:
+
+    def __init__(self):
+        self.channels: dict[str, dict[Subscriber, None]] = {}
+        self.patterns: dict[str, PatternSubscription] = {}
+        # literal prefix -> the patterns starting with it, and the distinct prefix lengths in use
+        self.prefixes: dict[str, dict[str, None]] = {}
+        self.prefix_lengths: list[int] = []
+        # subscribers with pending messages, flushed once per iteration of the event loop
+        self.unflushed: dict[Subscriber, None] = {}
+        self.flush_scheduled = False
+        self.dropped_subscribers = 0
+
+    # subscriptions, every call returns the confirmations of its channels or patterns
+
+    def subscribe(self, subscriber: Subscriber, channels) -> RespFrame:
+        self.flush_before_reply(subscriber)
+        out = bytearray()
+        for channel in channels:
+            if channel not in subscriber.channels:
+                subscriber.channels[channel] = None
+                self.channels.setdefault(channel, {})[subscriber] = None
+            out += _confirmation('subscribe', channel, subscriber.subscriptions())
+        return RespFrame(out)
+
+    def unsubscribe(self, subscriber: Subscriber, channels) -> RespFrame:
+        self.flush_before_reply(subscriber)
+        out = bytearray()
+        for channel in channels or list(subscriber.channels):
+            if subscriber.channels.pop(channel, 0) is None:
+                subscribers = self.channels[channel]
+                del subscribers[subscriber]
+                if not subscribers:
+                    del self.channels[channel]
+            out += _confirmation('unsubscribe', channel, subscriber.subscriptions())
+        if not out:
+            out += _confirmation('unsubscribe', None, subscriber.subscriptions())
+        return RespFrame(out)
+
+    def psubscribe(self, subscriber: Subscriber, patterns) -> RespFrame:
+        self.flush_before_reply(subscriber)
+        out = bytearray()
+        for pattern in map(to_text, patterns):
+            if pattern not in subscriber.patterns:
+                subscriber.patterns[pattern] = None
+                entry = self.patterns.get(pattern, None)
+                if entry is None:
+                    entry = self.patterns[pattern] = PatternSubscription(pattern)
+                    self.prefixes.setdefault(literal_prefix(pattern), {})[pattern] = None
+                    self._index_lengths()
+                entry.subscribers[subscriber] = None
+            out += _confirmation('psubscribe', pattern, subscriber.subscriptions())
+        return RespFrame(out)
+
+    def punsubscribe(self, subscriber: Subscriber, patterns) -> RespFrame:
+        self.flush_before_reply(subscriber)
+        out = bytearray()
+        for pattern in map(to_text, patterns) if patterns else list(subscriber.patterns):
+            if subscriber.patterns.pop(pattern, 0) is None:
+                entry = self.patterns[pattern]
+                del entry.subscribers[subscriber]
+                if not entry.subscribers:
+                    del self.patterns[pattern]
+                    prefix = literal_prefix(pattern)
+                    bucket = self.prefixes[prefix]
+                    del bucket[pattern]
+                    if not bucket:
+                        del self.prefixes[prefix]
+                        self._index_lengths()
+            out += _confirmation('punsubscribe', pattern, subscriber.subscriptions())
+        if not out:
+            out += _confirmation('punsubscribe', None, subscriber.subscriptions())
+        return RespFrame(out)
+
+    def drop(self, subscriber: Subscriber):
+        """removes all subscriptions of a closed connection, its unsent messages are dropped"""
+        if self.unflushed.pop(subscriber, 0) is None:
+            subscriber.pending.clear()
+        if subscriber.channels:
+            self.unsubscribe(subscriber, ())
+        if subscriber.patterns:
+            self.punsubscribe(subscriber, ())
+
+    def _index_lengths(self):
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.prefixes})
+
+    # messages
+
+    def publish(self, channel: str, message: str) -> int:
+        """:return: the number of subscribers which got the message, once per matching subscription"""
+        receivers = 0
+        unflushed = self.unflushed
+        subscribers = self.channels.get(channel, None)
+        if subscribers:
+            frame = encode_array(('message', channel, message))
+            for subscriber in subscribers:
+                if not subscriber.pending:
+                    unflushed[subscriber] = None
+                subscriber.pending.append(frame)
+            receivers += len(subscribers)
+        if self.prefix_lengths:
+            for pattern, entry in self._matching_patterns(to_text(channel)):
+                frame = encode_array(('pmessage', pattern, channel, message))
+                for subscriber in entry.subscribers:
+                    if not subscriber.pending:
+                        unflushed[subscriber] = None
+                    subscriber.pending.append(frame)
+                receivers += len(entry.subscribers)
+        if unflushed and not self.flush_scheduled:
+            self._schedule_flush()
+        return receivers
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # outside of the server the messages go out right away
+            self.flush()
+            return
+        self.flush_scheduled = True
+        loop.call_soon(self.flush)
+
+    def flush(self):
+        """writes the messages of this loop iteration, a pipeline of PUBLISH costs one write per subscriber"""
+        self.flush_scheduled = False
+        now = time.monotonic()
+        slow = [subscriber for subscriber in self.unflushed if not subscriber.flush(now)]
+        self.unflushed.clear()
+        for subscriber in slow:
+            self._disconnect(subscriber)
+
+    def flush_before_reply(self, subscriber: Subscriber):
+        """the messages published before a reply to the subscriber reach it before that reply"""
+        if subscriber.pending:
+            del self.unflushed[subscriber]
+            if not subscriber.flush(time.monotonic()):
+                self._disconnect(subscriber)
+
+    def _matching_patterns(self, channel: str) -> list[tuple[str, PatternSubscription]]:
+        found = []
+        prefixes, patterns = self.prefixes, self.patterns
+        for length in self.prefix_lengths:
+            if length > len(channel):
+                break
+            bucket = prefixes.get(channel[:length], None)
+            if bucket is not None:
+                for pattern in bucket:
+                    entry = patterns[pattern]
+                    if entry.match(channel):
+                        found.append((pattern, entry))
+        return found
+
+    def _disconnect(self, subscriber: Subscriber):
+        if subscriber.dropped:
+            return
+        logger.warning("closing subscriber, output buffer above the limit of %s",
+                       render_output_buffer_limit(output_buffer_limit.value))
+        subscriber.dropped = True
+        self.dropped_subscribers += 1
+        self.drop(subscriber)
+        # the unsent messages are thrown away, closing would try to send them first
+        subscriber.transport.abort()
+
+    # introspection, PUBSUB
+
+    def channel_names(self, pattern: Optional[str] = None) -> list[str]:
+        if pattern is None:
+            return list(self.channels)
+        return filter_glob(pattern, self.channels)
+
+    def subscriber_counts(self, channels) -> list:
+        counts = []
+        for channel in channels:
+            counts += (channel, len(self.channels.get(channel, ())))
+        return counts
+
+    def pattern_count(self) -> int:
+        return len(self.patterns)
+
+
+def _confirmation(kind: str, name: Optional[str], count: int) -> bytes:
+    """the reply for one channel or pattern, with the number of subscriptions the client has left"""
+    if name is None:
+        return b"*3\r\n$%d\r\n%s\r\n$-1\r\n:%d\r\n" % (len(kind), kind.encode(), count)
+    encoded = to_bytes(name)
+    return b"*3\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n:%d\r\n" % (len(kind), kind.encode(), len(encoded), encoded, count)
+
+
+pubsub = PubSub()
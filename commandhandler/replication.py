@@ -0,0 +1,495 @@
+"""
+Primary -> replica replication, `REPLICAOF host port`.
+
+The replication stream is the RESP encoding of the write commands in the form the append only
+file logs them (`RedisCache.propagate`), with `ATTACH <keyspace>` in front of a command for
+another keyspace than the one before, the way redis puts SELECT into it. Its byte offset
+identifies a point in the history of the primary, together with a random replication id.
+
+A replica connects with `PSYNC <replid> <offset>`. If the primary still holds the stream from that
+offset in its backlog, a ring buffer of the last `repl-backlog-size` bytes, it answers +CONTINUE
+and sends the missing part (partial resync). Otherwise it answers +FULLRESYNC, forks a snapshot of
+every keyspace at the current offset and streams the files, the replica loads them like its own
+snapshots and then applies the stream from that offset on. Writes made meanwhile are buffered.
+
+Like PUBLISH, the stream is written once per iteration of the event loop, a pipeline of writes
+costs one write per replica. Replicas acknowledge their offset every second (REPLCONF ACK), INFO
+replication reports how far behind they are. A replica only accepts writes from its primary.
+"""
+import asyncio
+import os
+import secrets
+import time
+from typing import Optional
+
+from commandhandler.config import ServerConfig
+from commandhandler.parser import CommandParser
+from commandhandler.trace import logger
+from commandhandler.utils import OK_RESP, ErrorReply, RespFrame, StatusReply, is_error
+from storage.aof import encode_command
+from storage.background import BackgroundJob
+from storage.cache import CacheHolder, RedisCache, rdb_compression
+from storage.eviction import parse_memory
+from storage.expiry import now_ms
+from storage.integers import NOT_AN_INTEGER
+from storage.loading import LOADING_REPLY
+from storage.snapshot import write_snapshot
+
+READONLY_REPLY = ErrorReply("-READONLY You can't write against a read only replica.")
+# a replica retries a failed sync after this long
+RECONNECT_SECONDS = 1.0
+ACK_SECONDS = 1.0
+# the primary pings its replicas through the stream, a replica which hears nothing for
+# REPL_TIMEOUT_SECONDS considers the link broken and reconnects
+PING_SECONDS = 10.0
+REPL_TIMEOUT_SECONDS = 60.0
+SNAPSHOT_POLL_SECONDS = 0.01
+SNAPSHOT_CHUNK = 256 * 1024
+READ_SIZE = 64 * 1024
+# a replica whose unsent stream grows past this is disconnected, it resyncs when it reconnects
+REPLICA_OUTPUT_LIMIT = 256 * 1024 * 1024
+MIN_BACKLOG_SIZE = 16 * 1024
+
+HANDSHAKE, WAIT_BGSAVE, SEND_BULK, ONLINE = 'handshake', 'wait_bgsave', 'send_bulk', 'online'
+
+
+class ReplicationError(Exception):
+    pass
+
+
+def new_replid() -> str:
+    return secrets.token_hex(20)
+
+
+def parse_backlog_size(raw: str) -> int:
+    size = parse_memory(raw)
+    if size < MIN_BACKLOG_SIZE:
+        raise ValueError(f"the backlog needs at least {MIN_BACKLOG_SIZE} bytes")
+    return size
+
+
+class Backlog:
+    """the last `size` bytes of the replication stream in a ring buffer, stream offset o is at o % size"""
+
+    def __init__(self, size: int, offset: int):
+        self.buffer = bytearray(size)
+        # the offset after the last byte fed
+        self.offset = offset
+        self.length = 0
+
+    def feed(self, data: bytes):
+        size = len(self.buffer)
+        end = self.offset + len(data)
+        chunk = memoryview(data)[-size:]
+        start = (end - len(chunk)) % size
+        first = min(len(chunk), size - start)
+        self.buffer[start:start + first] = chunk[:first]
+        if first < len(chunk):
+            self.buffer[:len(chunk) - first] = chunk[first:]
+        self.offset = end
+        self.length = min(self.length + len(data), size)
+
+    def read_from(self, offset: int) -> Optional[bytes]:
+        """the stream from `offset` on, None if that part isn't in the backlog anymore"""
+        if not self.offset - self.length <= offset <= self.offset:
+            return None
+        count = self.offset - offset
+        size = len(self.buffer)
+        start = offset % size
+        first = min(count, size - start)
+        return bytes(self.buffer[start:start + first]) + bytes(self.buffer[:count - first])
+
+    def resized(self, size: int) -> 'Backlog':
+        backlog = Backlog(size, self.offset - min(self.length, size))
+        backlog.feed(self.read_from(backlog.offset))
+        return backlog
+
+
+class ReplicaLink:
+    """a replica connected to this server, from its REPLCONF on"""
+
+    def __init__(self, address: str):
+        self.address = address
+        self.port = 0
+        self.state = HANDSHAKE
+        self.writer: Optional[asyncio.StreamWriter] = None
+        # the stream produced while the snapshot is made and sent
+        self.buffered: list[bytes] = []
+        self.buffered_bytes = 0
+        # (keyspace, file name, job writing it) of a full sync
+        self.snapshots: list[tuple[str, str, BackgroundJob]] = []
+        self.acked_offset = 0
+        self.last_ack = time.monotonic()
+
+    @property
+    def accepted(self) -> bool:
+        """PSYNC was answered, the connection now carries the stream"""
+        return self.state != HANDSHAKE
+
+    def send(self, data: bytes) -> bool:
+        """:return: False if the replica is too far behind and must be dropped"""
+        if self.state != ONLINE:
+            self.buffered.append(data)
+            self.buffered_bytes += len(data)
+            return self.buffered_bytes <= REPLICA_OUTPUT_LIMIT
+        self.writer.write(data)
+        return self.writer.transport.get_write_buffer_size() <= REPLICA_OUTPUT_LIMIT
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.transport.abort()
+        for _, file_name, job in self.snapshots:
+            job.wait()
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        self.snapshots = []
+
+
+class Replication:
+    """the replication role and state of this server, both as a primary and as a replica"""
+
+    def __init__(self):
+        self.replid = new_replid()
+        # the id of the previous primary after a promotion, valid up to `second_offset`
+        self.replid2 = '0' * 40
+        self.second_offset = -1
+        # as a primary the length of the stream so far, as a replica the part of it applied
+        self.offset = 0
+        self.backlog: Optional[Backlog] = None
+        self.replicas: list[ReplicaLink] = []
+        self.pending = bytearray()
+        self.flush_scheduled = False
+        self.last_ping = time.monotonic()
+        # the keyspace the stream selected last, sent or received
+        self.stream_keyspace: Optional[str] = None
+        # false in the worker processes of `--workers`
+        self.supported = True
+        self.listening_port = 6379
+        # the replica side
+        self.primary: Optional[tuple[str, int]] = None
+        self.task: Optional[asyncio.Task] = None
+        self.synced = False
+        self.link_up = False
+        self.sync_in_progress = False
+        self.last_io = 0.0
+
+    # the primary side
+
+    def feed(self, keyspace: Optional[str], arguments):
+        out = self.pending
+        if keyspace is not None and keyspace != self.stream_keyspace:
+            encode_command(('attach', keyspace), out)
+            self.stream_keyspace = keyspace
+        encode_command(arguments, out)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            try:
+                asyncio.get_running_loop().call_soon(self.flush)
+            except RuntimeError:
+                self.flush()
+
+    def flush(self):
+        """appends the writes of this loop iteration to the backlog and sends them to the replicas"""
+        self.flush_scheduled = False
+        if not self.pending:
+            return
+        data = bytes(self.pending)
+        self.pending.clear()
+        self.backlog.feed(data)
+        self.offset = self.backlog.offset
+        for link in self.replicas:
+            if not link.send(data):
+                logger.warning("replica %s:%d is too far behind, disconnecting it", link.address, link.port)
+                link.close()
+
+    def _start_backlog(self):
+        if self.backlog is None:
+            self.backlog = Backlog(backlog_size.value, self.offset)
+            RedisCache.replication_feed = self.feed
+
+    def accept(self, link: ReplicaLink, replid: str, offset: str):
+        """PSYNC of a replica, :return: +CONTINUE or +FULLRESYNC, or the error"""
+        if not self.supported:
+            return ErrorReply("-ERR replication is not supported with --workers")
+        if self.primary is not None:
+            return ErrorReply("-ERR this server is a replica itself, chained replication is not supported")
+        try:
+            offset = int(offset)
+        except ValueError:
+            return NOT_AN_INTEGER
+        self._start_backlog()
+        self.flush()
+        if replid == self.replid or (replid == self.replid2 and offset <= self.second_offset):
+            missing = self.backlog.read_from(offset)
+            if missing is not None:
+                link.buffered, link.buffered_bytes = [missing], len(missing)
+                link.state = SEND_BULK
+                self.replicas.append(link)
+                logger.info("partial resync of replica %s:%d from offset %d", link.address, link.port, offset)
+                return RespFrame(b"+CONTINUE %s\r\n" % self.replid.encode())
+        # keyspaces stored on disk are part of the data set too, their clients just didn't come back yet
+        for name in CacheHolder.stored_keyspaces():
+            CacheHolder.acquire_cache(name, background=True)
+        caches = CacheHolder.keyspaces()
+        if any(cache.loading is not None for cache in caches):
+            return LOADING_REPLY
+        compress = rdb_compression.value == 'yes'
+        for cache in caches:
+            file_name = f"{cache.snapshot_file}.sync-{id(link)}"
+            job = BackgroundJob(lambda items, deadlines, file_name=file_name:
+                                write_snapshot(file_name, items, deadlines, now_ms(), compress),
+                                cache.data, cache.expires.deadlines)
+            link.snapshots.append((cache.name, file_name, job))
+        link.state = WAIT_BGSAVE
+        self.replicas.append(link)
+        # the replica doesn't know which keyspace the stream selected before
+        self.stream_keyspace = None
+        logger.info("full resync of replica %s:%d at offset %d", link.address, link.port, self.offset)
+        return RespFrame(b"+FULLRESYNC %s %d\r\n" % (self.replid.encode(), self.offset))
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, parser: CommandParser,
+                    link: ReplicaLink):
+        """the connection of a replica after PSYNC: the snapshot if needed, then the stream and its acks"""
+        link.writer = writer
+        try:
+            if link.snapshots:
+                try:
+                    await self._send_snapshots(link)
+                except ReplicationError as error:
+                    logger.warning("full resync of replica %s:%d failed: %s", link.address, link.port, error)
+                    return
+            for data in link.buffered:
+                writer.write(data)
+            link.buffered, link.buffered_bytes = [], 0
+            link.state = ONLINE
+            while True:
+                for command in parser:
+                    if len(command) == 3 and command[0].lower() == 'replconf' and command[1].lower() == 'ack':
+                        link.acked_offset = int(command[2])
+                        link.last_ack = time.monotonic()
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    return
+                parser.feed(data)
+        finally:
+            if link in self.replicas:
+                self.replicas.remove(link)
+            link.close()
+
+    async def _send_snapshots(self, link: ReplicaLink):
+        """streams the snapshot files, one bulk string per keyspace after its name"""
+        while any(job.poll() is None for _, _, job in link.snapshots):
+            await asyncio.sleep(SNAPSHOT_POLL_SECONDS)
+        if not all(job.poll() for _, _, job in link.snapshots):
+            raise ReplicationError("writing the snapshot for a replica failed")
+        link.state = SEND_BULK
+        writer = link.writer
+        writer.write(b"*%d\r\n" % len(link.snapshots))
+        for name, file_name, _ in link.snapshots:
+            encoded = name.encode()
+            writer.write(b"$%d\r\n%s\r\n$%d\r\n" % (len(encoded), encoded, os.path.getsize(file_name)))
+            with open(file_name, 'rb') as file:
+                while chunk := file.read(SNAPSHOT_CHUNK):
+                    writer.write(chunk)
+                    await writer.drain()
+            writer.write(b"\r\n")
+            os.remove(file_name)
+        link.snapshots = []
+
+    def cron(self):
+        now = time.monotonic()
+        if self.replicas and now - self.last_ping >= PING_SECONDS:
+            self.last_ping = now
+            self.feed(None, ('ping',))
+
+    # the replica side
+
+    def replicate(self, host: str, port: int):
+        """REPLICAOF host port"""
+        if not self.supported:
+            return ErrorReply("-ERR replication is not supported with --workers")
+        if self.primary == (host, port):
+            return StatusReply("+OK Already connected to specified master")
+        self._stop()
+        if self.primary is None:
+            # replicas of this server would follow a history which doesn't continue here
+            for link in self.replicas:
+                link.close()
+            self.replicas.clear()
+            RedisCache.replication_feed = None
+            self.backlog = None
+            self.synced = False
+        self.primary = (host, port)
+        self._set_read_only(True)
+        self.task = asyncio.get_running_loop().create_task(self._replicate(host, port))
+        return OK_RESP
+
+    def promote(self):
+        """REPLICAOF NO ONE, the data stays and replicas of the old primary can continue from here"""
+        if self.primary is None:
+            return OK_RESP
+        self._stop()
+        self.primary = None
+        self._set_read_only(False)
+        if self.synced:
+            self.replid2, self.second_offset = self.replid, self.offset
+        self.replid = new_replid()
+        self.stream_keyspace = None
+        # the writes from now on are what the other replicas of the old primary will be missing
+        self._start_backlog()
+        return OK_RESP
+
+    @staticmethod
+    def _set_read_only(read_only: bool):
+        # the handler module imports this one
+        from commandhandler.handler import CommandHandler
+        CommandHandler.read_only = read_only
+
+    def _stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.link_up = self.sync_in_progress = False
+
+    async def _replicate(self, host: str, port: int):
+        while True:
+            try:
+                await self._sync(host, port)
+            except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError,
+                    ReplicationError) as error:
+                logger.warning("replication from %s:%d interrupted: %s", host, port, error or type(error).__name__)
+            self.link_up = self.sync_in_progress = False
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _sync(self, host: str, port: int):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            out = bytearray()
+            encode_command(('replconf', 'listening-port', str(self.listening_port)), out)
+            encode_command(('psync', self.replid, str(self.offset)) if self.synced else ('psync', '?', '-1'), out)
+            writer.write(out)
+            if (await reader.readline()).rstrip() != b"+OK":
+                raise ReplicationError("REPLCONF was refused")
+            reply = (await reader.readline()).decode().split()
+            if reply[:1] == ['+FULLRESYNC'] and len(reply) == 3:
+                self.synced = False
+                self.sync_in_progress = True
+                await self._load_snapshots(reader)
+                self.replid, self.offset, self.synced = reply[1], int(reply[2]), True
+                self.stream_keyspace = None
+                self.sync_in_progress = False
+            elif reply[:1] == ['+CONTINUE']:
+                # a promoted primary continues the history under a new id
+                if len(reply) > 1:
+                    self.replid = reply[1]
+            else:
+                raise ReplicationError(f"unexpected reply to PSYNC: {' '.join(reply)}")
+            logger.info("replicating from %s:%d at offset %d", host, port, self.offset)
+            self.link_up = True
+            self.last_io = time.time()
+            acknowledge = asyncio.get_running_loop().create_task(self._acknowledge(writer))
+            try:
+                await self._apply_stream(reader)
+            finally:
+                acknowledge.cancel()
+        finally:
+            writer.close()
+
+    async def _load_snapshots(self, reader: asyncio.StreamReader):
+        """
+        receives the snapshot of every keyspace of the primary into the snapshot file of the
+        keyspace and loads it, the keyspaces the primary doesn't have are dropped with their files
+        """
+        header = await reader.readline()
+        if header[:1] != b'*':
+            raise ReplicationError("expected the snapshots of the primary")
+        names = []
+        for _ in range(int(header[1:])):
+            name = (await _read_bulk(reader)).decode()
+            size_line = await reader.readline()
+            if size_line[:1] != b'$':
+                raise ReplicationError("expected the snapshot of a keyspace")
+            remaining = int(size_line[1:])
+            file_name = f"{RedisCache.FILE_STORE}{name}.rdb"
+            with open(f"{file_name}.sync", 'wb') as file:
+                while remaining:
+                    chunk = await reader.read(min(remaining, SNAPSHOT_CHUNK))
+                    if not chunk:
+                        raise EOFError("the primary closed the connection during the sync")
+                    file.write(chunk)
+                    remaining -= len(chunk)
+            await reader.readexactly(2)
+            os.replace(f"{file_name}.sync", file_name)
+            names.append(name)
+        for name in {cache.name for cache in CacheHolder.keyspaces()} | set(CacheHolder.stored_keyspaces()):
+            if name in names:
+                continue
+            cache = CacheHolder.get_client_cache(name)
+            if cache is not None:
+                cache.reset()
+            for extension in ('aof', 'rdb', 'json'):
+                stale = f"{RedisCache.FILE_STORE}{name}.{extension}"
+                if os.path.exists(stale):
+                    os.remove(stale)
+        caches = []
+        for name in names:
+            # the log of the keyspace would take priority over the snapshot, it is rewritten after the load
+            stale = f"{RedisCache.FILE_STORE}{name}.aof"
+            if os.path.exists(stale):
+                os.remove(stale)
+            caches.append(CacheHolder.reload(name))
+        await asyncio.gather(*(cache.loading.task for cache in caches if cache.loading is not None))
+        failed = [cache.name for cache in caches if cache.loading is not None]
+        if failed:
+            raise ReplicationError(f"loading the snapshot of {', '.join(failed)} failed")
+
+    async def _apply_stream(self, reader: asyncio.StreamReader):
+        # the handler module imports this one
+        from commandhandler.handler import CommandHandler
+        parser = CommandParser()
+        start = self.offset
+        handler = None
+        while True:
+            data = await asyncio.wait_for(reader.read(READ_SIZE), REPL_TIMEOUT_SECONDS)
+            if not data:
+                raise EOFError("the primary closed the connection")
+            self.last_io = time.time()
+            parser.feed(data)
+            for command in parser:
+                name = command[0].lower()
+                if name == 'attach':
+                    self.stream_keyspace = command[1]
+                    handler = None
+                elif name != 'ping':
+                    if handler is None:
+                        handler = CommandHandler(CacheHolder().acquire_cache(self.stream_keyspace))
+                    # the writes of the primary, neither read only nor limited by the maxmemory of the replica
+                    reply = handler.apply(command)
+                    if is_error(reply):
+                        logger.warning("applying %s from the primary failed: %s", name, reply[1:])
+            self.offset = start + parser.consumed()
+
+    async def _acknowledge(self, writer: asyncio.StreamWriter):
+        while True:
+            out = bytearray()
+            encode_command(('replconf', 'ack', str(self.offset)), out)
+            writer.write(out)
+            await asyncio.sleep(ACK_SECONDS)
+
+
+async def _read_bulk(reader: asyncio.StreamReader) -> bytes:
+    line = await reader.readline()
+    if line[:1] != b'$':
+        raise ReplicationError("expected a bulk string")
+    return (await reader.readexactly(int(line[1:]) + 2))[:-2]
+
+
+replication = Replication()
+
+
+def _resize_backlog(size: int):
+    if replication.backlog is not None:
+        replication.backlog = replication.backlog.resized(size)
+
+
+backlog_size = ServerConfig.register('repl-backlog-size', '1mb', parse_backlog_size, on_change=_resize_backlog)
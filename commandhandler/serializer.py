@@ -1,42 +1,101 @@
 from abc import abstractmethod
-from collections import defaultdict
-from typing import Callable
+from collections import deque
 
-from commandhandler.utils import NULL_RESP
+from commandhandler.utils import (NULL_BULK, CRLF_BYTES, SHARED_INTEGERS, INTEGER_REPLIES, BULK_HEADERS,
+                                  ARRAY_HEADERS, UNICODE_ERRORS, RespFrame, ArrayStream, ErrorReply, StatusReply)
 
 
 class SerializationStrategy:
+    """
+    strategies are stateless and shared, `write` appends the encoded value to an output buffer,
+    so a whole pipelined batch of replies ends up in one bytearray without intermediate strings
+    """
+
     @abstractmethod
-    def serialize(self, value):
+    def write(self, value, out: bytearray):
         pass
 
-    def concat_crlf(self, value):
-        return f"{value}\r\n"
+    def serialize(self, value) -> bytes:
+        out = bytearray()
+        self.write(value, out)
+        return bytes(out)
+
+
+class FrameSerializer(SerializationStrategy):
+    def write(self, value, out):
+        out += value
+
+
+class LineSerializer(SerializationStrategy):
+    """error and status lines, which carry their marker"""
+    def write(self, value, out):
+        out += value.encode("utf-8", UNICODE_ERRORS)
+        out += CRLF_BYTES
 
 
 class StringSerializer(SerializationStrategy):
-    def serialize(self, value):
-        if value.startswith('+') or (not value.isdigit() and value.startswith('-')):
-            return self.concat_crlf(value)
-        return f"{self.concat_crlf(f'${len(value)}')}{self.concat_crlf(value)}"
+    """values, always a bulk string, whatever they start with"""
+    def write(self, value, out):
+        encoded = value.encode("utf-8", UNICODE_ERRORS)
+        length = len(encoded)
+        out += BULK_HEADERS[length] if length < SHARED_INTEGERS else b"$%d\r\n" % length
+        out += encoded
+        out += CRLF_BYTES
+
+
+class BytesSerializer(SerializationStrategy):
+    """binary values (bytes, bytearray, memoryview), always a bulk string, copied once into the output"""
+    def write(self, value, out):
+        length = len(value)
+        out += BULK_HEADERS[length] if length < SHARED_INTEGERS else b"$%d\r\n" % length
+        out += value
+        out += CRLF_BYTES
 
 
 class NumberSerializer(SerializationStrategy):
-    def serialize(self, value):
-        return self.concat_crlf(f":{value}")
+    def write(self, value, out):
+        if 0 <= value < SHARED_INTEGERS:
+            out += INTEGER_REPLIES[value]
+        else:
+            out += b":%d\r\n" % value
 
 
 class NoneSerializer(SerializationStrategy):
-    def serialize(self, value):
-        return NULL_RESP
+    def write(self, value, out):
+        out += NULL_BULK
 
 
 class ArraySerializer(SerializationStrategy):
-    def serialize(self, value):
-        print(f"array serializer {value}")
-        serialized_values = [SerializerFactory.create_serializor(type(val)).serialize(val)
-                             for val in value]
-        return self.concat_crlf(f"*{len(serialized_values)}") + ''.join(serialized_values)
+    def write(self, value, out):
+        length = len(value)
+        out += ARRAY_HEADERS[length] if length < SHARED_INTEGERS else b"*%d\r\n" % length
+        strategies = SerializerFactory.strategy_types
+        for val in value:
+            # strings take the bulk fast path inline
+            if type(val) is str:
+                encoded = val.encode("utf-8", UNICODE_ERRORS)
+                length = len(encoded)
+                out += BULK_HEADERS[length] if length < SHARED_INTEGERS else b"$%d\r\n" % length
+                out += encoded
+                out += CRLF_BYTES
+            elif val is None:
+                # MGET replies have one for every missing key
+                out += NULL_BULK
+            else:
+                strategies[type(val)].write(val, out)
+
+
+class StreamSerializer(SerializationStrategy):
+    def write(self, value, out):
+        length = value.length
+        out += ARRAY_HEADERS[length] if length < SHARED_INTEGERS else b"*%d\r\n" % length
+        # the elements are strings (members, formatted scores), every one is a bulk string
+        for val in value.elements:
+            encoded = val.encode("utf-8", UNICODE_ERRORS) if type(val) is str else val
+            length = len(encoded)
+            out += BULK_HEADERS[length] if length < SHARED_INTEGERS else b"$%d\r\n" % length
+            out += encoded
+            out += CRLF_BYTES
 
 
 class Serializer:
@@ -52,24 +111,36 @@ class Serializer:
         raise ValueError("strategy for serialisation not set")
 
 
-SerializerInputType = str | list | int | None
+SerializerInputType = str | bytes | bytearray | memoryview | list | int | None
 
 
 class SerializerFactory:
-    strategy_types: dict[object, SerializationStrategy | Callable] = defaultdict(
-        lambda val: ValueError(f"Unsupported type: {type(val)}"), {
-            type(None): NoneSerializer,
-            str: StringSerializer,
-            int: NumberSerializer,
-            list: ArraySerializer
-        })
+    # one shared instance per type, looking up a strategy allocates nothing
+    strategy_types: dict[type, SerializationStrategy] = {
+        type(None): NoneSerializer(),
+        str: StringSerializer(),
+        ErrorReply: LineSerializer(),
+        StatusReply: LineSerializer(),
+        int: NumberSerializer(),
+        bool: NumberSerializer(),
+        list: ArraySerializer(),
+        tuple: ArraySerializer(),
+        deque: ArraySerializer(),
+        RespFrame: FrameSerializer(),
+        bytes: BytesSerializer(),
+        bytearray: BytesSerializer(),
+        memoryview: BytesSerializer(),
+        ArrayStream: StreamSerializer(),
+    }
 
     @staticmethod
-    def create_serializor(value: SerializerInputType) -> SerializationStrategy:
-        print(f"value {value}")
-        strategy: SerializationStrategy | Callable = SerializerFactory.strategy_types.get(value)
-        print(f"strategy {strategy}")
-        if issubclass(strategy, SerializationStrategy):
-            return strategy()
-        else:
-            raise strategy()
+    def create_serializor(value: type) -> SerializationStrategy:
+        strategy = SerializerFactory.strategy_types.get(value, None)
+        if strategy is None:
+            raise ValueError(f"Unsupported type: {value}")
+        return strategy
+
+
+def write_reply(value: SerializerInputType, out: bytearray):
+    """encodes a handler result into the output buffer of the connection"""
+    SerializerFactory.strategy_types[type(value)].write(value, out)
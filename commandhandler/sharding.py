@@ -0,0 +1,282 @@
+"""
+Sharding of the keyspaces over worker processes, `python main.py --workers N`.
+
+All workers accept clients on the same port (SO_REUSEPORT) and every worker owns a range of the
+16384 hash slots. Like in redis cluster the slot of a key is the CRC16 of the key, or of its
+{hash tag}. Commands for keys of another worker are forwarded to it over a unix socket: the
+forwarded commands of one read of the client go out in one write per worker and their replies
+are read back in order. Commands on different keys commute and every key has one owner, so the
+local commands run right away while the forwarded ones are in flight and the order per key stays
+the order of the client.
+"""
+import asyncio
+from binascii import crc_hqx
+from typing import Callable, Optional
+
+from commandhandler.serializer import write_reply
+from commandhandler.trace import logger
+from commandhandler.utils import OK_RESP, UNICODE_ERRORS, ErrorReply, StatusReply, is_error, to_bytes
+from storage.aof import encode_command
+
+HASH_SLOTS = 16384
+# a worker which just started may not listen yet
+CONNECT_ATTEMPTS = 40
+CONNECT_RETRY_SECONDS = 0.05
+
+CROSSSLOT_REPLY = ErrorReply("-CROSSSLOT Keys in request don't hash to the same worker")
+
+# commands without a key, they run on the worker the client is connected to. The keyspace
+# commands among them (SCAN, KEYS, DBSIZE, RANDOMKEY) see the keys of that worker only, like a
+# redis cluster node
+KEYLESS_COMMANDS = frozenset(('ping', 'echo', 'info', 'quit', 'command', 'lastsave', 'config', 'slowlog',
+                              'scan', 'keys', 'dbsize', 'randomkey', 'subscribe', 'unsubscribe', 'psubscribe',
+                              'punsubscribe', 'pubsub', 'replicaof', 'slaveof', 'replconf', 'psync', 'hello',
+                              'client'))
+# commands run by every worker (and CONFIG SET), the reply is the local one unless a peer failed.
+# PUBLISH reaches the subscribers connected to any worker and counts all of them
+BROADCAST_COMMANDS = frozenset(('save', 'bgsave', 'bgrewriteaof', 'publish'))
+# commands whose keys may belong to several workers, MSET and MSETNX take key value pairs
+MULTI_KEY_COMMANDS = {'mget': 1, 'del': 1, 'exists': 1, 'mset': 2, 'msetnx': 2}
+# commands with several keys which must all belong to one worker, and where the keys are
+SAME_WORKER_COMMANDS = {'blpop': slice(1, -1), 'brpop': slice(1, -1), 'lmove': slice(1, 3), 'blmove': slice(1, 3),
+                        'pfcount': slice(1, None), 'pfmerge': slice(1, None), 'bitop': slice(2, None)}
+
+
+def key_slot(key: str) -> int:
+    """CRC16 (XMODEM, as redis cluster) of the key or of the non empty part between its first { and }"""
+    key = to_bytes(key)
+    start = key.find(b'{')
+    if start != -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return crc_hqx(key, 0) & (HASH_SLOTS - 1)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """reads one reply of a worker, decoded into what the handler of that worker returned"""
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("worker closed the connection")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        # values stay bytes, the serializer writes them back as bulk strings
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b':':
+        return int(rest)
+    if kind == b'*':
+        length = int(rest)
+        return None if length < 0 else [await read_reply(reader) for _ in range(length)]
+    # status and error lines keep their marker, the way handlers return them
+    if kind == b'-':
+        return ErrorReply(line[:-2].decode("utf-8", UNICODE_ERRORS))
+    if kind == b'+':
+        return StatusReply(line[:-2].decode("utf-8", UNICODE_ERRORS))
+    raise ValueError(f"unexpected reply type {kind!r}")
+
+
+class PeerLink:
+    """a connection to another worker working on one keyspace, shared by the clients of that keyspace"""
+
+    def __init__(self, worker: int, path: str, keyspace: str):
+        self.worker = worker
+        self.path = path
+        self.keyspace = keyspace
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        # one request at a time, replies are matched to the commands by their order
+        self.lock = asyncio.Lock()
+
+    async def _connect(self):
+        for attempt in range(CONNECT_ATTEMPTS):
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if attempt == CONNECT_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(CONNECT_RETRY_SECONDS)
+        out = bytearray()
+        encode_command(('attach', self.keyspace), out)
+        self.writer.write(out)
+        reply = await read_reply(self.reader)
+        if reply != '+OK':
+            raise ConnectionError(reply)
+
+    async def request(self, commands: list[list[str]]) -> list:
+        """sends the commands in one write and returns their replies"""
+        async with self.lock:
+            try:
+                if self.writer is None:
+                    await self._connect()
+                out = bytearray()
+                for command in commands:
+                    encode_command(command, out)
+                self.writer.write(out)
+                await self.writer.drain()
+                return [await read_reply(self.reader) for _ in commands]
+            except (OSError, ValueError, asyncio.IncompleteReadError) as error:
+                logger.warning("worker %d unavailable: %s", self.worker, error)
+                self.close()
+                return [ErrorReply(f"-ERR worker {self.worker} unavailable")] * len(commands)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Router:
+    """knows which worker owns a key and keeps the links to the other workers"""
+
+    def __init__(self, index: int, socket_paths: list[str]):
+        self.index = index
+        self.socket_paths = socket_paths
+        self.workers = len(socket_paths)
+        self.peers = [worker for worker in range(self.workers) if worker != index]
+        self.links: dict[tuple[int, str], PeerLink] = {}
+
+    def owner(self, key: str) -> int:
+        return key_slot(key) * self.workers // HASH_SLOTS
+
+    def link(self, worker: int, keyspace: str) -> PeerLink:
+        link = self.links.get((worker, keyspace), None)
+        if link is None:
+            link = self.links[(worker, keyspace)] = PeerLink(worker, self.socket_paths[worker], keyspace)
+        return link
+
+    def batch(self, handler) -> 'Batch':
+        return Batch(self, handler)
+
+    def close(self):
+        for link in self.links.values():
+            link.close()
+
+
+class Batch:
+    """
+    the replies to one read of a client. Local commands are encoded into the output right away,
+    a forwarded command leaves a gap which is filled once the workers answered
+    """
+
+    def __init__(self, router: Router, handler):
+        self.router = router
+        self.handler = handler
+        self.output = bytearray()
+        # (offset in the output, function computing the reply from the replies of the workers)
+        self.gaps: list[tuple[int, Callable]] = []
+        self.queues: dict[int, list[list[str]]] = {}
+
+    def add(self, command: list[str]):
+        name = command[0].lower()
+        if name in BROADCAST_COMMANDS or (name == 'config' and command[1:2] and command[1].lower() == 'set'):
+            local = _snapshot(self.handler.reply(command))
+            forwarded = [self._forward(worker, command) for worker in self.router.peers]
+            self._gap(lambda replies: next(
+                (replies[worker][position] for worker, position in forwarded
+                 if is_error(replies[worker][position])),
+                local + sum(replies[worker][position] for worker, position in forwarded)
+                if name == 'publish' else local))
+        elif name in KEYLESS_COMMANDS or len(command) < 2:
+            self.handler.handle_command(command, self.output)
+        elif name in MULTI_KEY_COMMANDS:
+            self._add_multi_key(name, command, MULTI_KEY_COMMANDS[name])
+        elif name in SAME_WORKER_COMMANDS:
+            owners = {self.router.owner(key) for key in command[SAME_WORKER_COMMANDS[name]]}
+            if len(owners) > 1:
+                write_reply(CROSSSLOT_REPLY, self.output)
+            else:
+                self._route(owners.pop() if owners else self.router.index, command)
+        else:
+            self._route(self.router.owner(command[1]), command)
+
+    def _route(self, worker: int, command: list[str]):
+        if worker == self.router.index:
+            self.handler.handle_command(command, self.output)
+        else:
+            worker, position = self._forward(worker, command)
+            self._gap(lambda replies: replies[worker][position])
+
+    def _add_multi_key(self, name: str, command: list[str], step: int):
+        arguments = command[1:]
+        owners: dict[int, list[int]] = {}
+        for position in range(0, len(arguments), step):
+            owners.setdefault(self.router.owner(arguments[position]), []).append(position)
+        if len(owners) == 1 or len(arguments) % step:
+            # wrong calls are answered by the local handler
+            self._route(next(iter(owners)) if len(owners) == 1 else self.router.index, command)
+            return
+        if name == 'msetnx':
+            # all or nothing can't be promised across workers
+            write_reply(CROSSSLOT_REPLY, self.output)
+            return
+        parts = []
+        for worker, positions in owners.items():
+            part = [command[0], *(argument for position in positions for argument in arguments[position:position + step])]
+            if worker == self.router.index:
+                parts.append((None, _snapshot(self.handler.reply(part)), positions))
+            else:
+                parts.append((self._forward(worker, part), None, positions))
+        self._gap(lambda replies: _merge(name, parts, replies, len(arguments)))
+
+    def _forward(self, worker: int, command: list[str]) -> tuple[int, int]:
+        queue = self.queues.setdefault(worker, [])
+        queue.append(command)
+        return worker, len(queue) - 1
+
+    def _gap(self, reply: Callable):
+        self.gaps.append((len(self.output), reply))
+
+    def __len__(self):
+        return len(self.output)
+
+    async def finish(self) -> bytearray:
+        """waits for the workers and returns all replies in the order of the commands"""
+        if not self.gaps:
+            return self.output
+        workers = list(self.queues)
+        keyspace = self.handler.redis_cache.name
+        results = await asyncio.gather(*(self.router.link(worker, keyspace).request(self.queues[worker])
+                                         for worker in workers))
+        replies = dict(zip(workers, results))
+        output = bytearray()
+        start = 0
+        for offset, reply in self.gaps:
+            output += self.output[start:offset]
+            write_reply(reply(replies), output)
+            start = offset
+        output += self.output[start:]
+        return output
+
+
+def _snapshot(reply):
+    """
+    a local reply kept until the workers answered. Values are handed out without a copy, a later
+    command of the batch could change them in place (APPEND, SETBIT) before the reply is written
+    """
+    if type(reply) is bytearray:
+        return bytes(reply)
+    if type(reply) is list:
+        return [bytes(value) if type(value) is bytearray else value for value in reply]
+    return reply
+
+
+def _merge(name: str, parts: list[tuple], replies: dict, count: int):
+    """the reply of a multi key command from the replies of the workers owning its keys"""
+    values = [local if target is None else replies[target[0]][target[1]] for target, local, _ in parts]
+    for value in values:
+        if is_error(value):
+            return value
+    if name == 'mget':
+        merged = [None] * count
+        for value, (_, _, positions) in zip(values, parts):
+            for position, element in zip(positions, value):
+                merged[position] = element
+        return merged
+    if name == 'mset':
+        return OK_RESP
+    # DEL and EXISTS count
+    return sum(values)
@@ -0,0 +1,181 @@
+"""
+Command statistics: calls, time and an HDR style latency histogram per command, and the slow log.
+
+The histogram is log-linear, every power of two is split into 16 sub-buckets, so a recorded
+duration is off by at most 1/16 (6%) at any magnitude while a histogram stays a fixed array of
+976 counters. Recording a call costs two clock reads, a dict lookup and a few integer additions.
+"""
+import time
+from collections import deque
+from itertools import count
+from typing import Optional
+
+from commandhandler.config import ServerConfig, parse_choice, parse_number
+from commandhandler.utils import to_text
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# durations below two sub-bucket ranges get a bucket each, every power of two above gets 16
+BUCKETS = (65 - SUB_BUCKET_BITS) * SUB_BUCKETS
+# what INFO latencystats reports, as in redis
+LATENCY_PERCENTILES = (('p50', 50.0), ('p99', 99.0), ('p99.9', 99.9))
+# arguments of a slow log entry beyond these are summarized, like redis does
+SLOWLOG_ENTRY_MAX_ARGC = 32
+SLOWLOG_ENTRY_MAX_STRING = 128
+
+
+def bucket_of(value: int) -> int:
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_range(bucket: int) -> tuple[int, int]:
+    """the smallest value of the bucket and the smallest one of the next"""
+    if bucket < 2 * SUB_BUCKETS:
+        return bucket, bucket + 1
+    shift = bucket // SUB_BUCKETS - 1
+    mantissa = bucket % SUB_BUCKETS + SUB_BUCKETS
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+class Histogram:
+    def __init__(self):
+        # a list, incrementing a list item is more than twice as fast as one of an array('Q')
+        self.counts = [0] * BUCKETS
+
+    def record(self, value: int):
+        self.counts[bucket_of(value)] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, share: float) -> int:
+        """the middle of the bucket holding the percentile, 0 without values"""
+        total = self.total
+        if not total:
+            return 0
+        rank = max(round(share / 100 * total), 1)
+        seen = 0
+        for bucket, amount in enumerate(self.counts):
+            seen += amount
+            if seen >= rank:
+                low, high = bucket_range(bucket)
+                return (low + high - 1) // 2
+        return 0
+
+
+class CommandStats:
+    __slots__ = ('calls', 'nanoseconds', 'failed_calls', 'rejected_calls', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.nanoseconds = 0
+        self.failed_calls = 0
+        self.rejected_calls = 0
+        self.histogram: Optional[Histogram] = None
+
+
+class SlowLogEntry:
+    __slots__ = ('id', 'timestamp', 'microseconds', 'arguments', 'client')
+
+    def __init__(self, entry_id: int, microseconds: int, arguments: list[str], client: str):
+        self.id = entry_id
+        self.timestamp = int(time.time())
+        self.microseconds = microseconds
+        self.arguments = arguments
+        self.client = client
+
+    def reply(self) -> list:
+        """the SLOWLOG GET form: id, timestamp, duration, arguments, client address, client name"""
+        return [self.id, self.timestamp, self.microseconds, self.arguments, self.client, ""]
+
+
+def _slowlog_arguments(arguments: list[str]) -> list[str]:
+    shown = arguments[:SLOWLOG_ENTRY_MAX_ARGC]
+    if len(arguments) > SLOWLOG_ENTRY_MAX_ARGC:
+        shown[-1] = f"... ({len(arguments) - SLOWLOG_ENTRY_MAX_ARGC + 1} more arguments)"
+    return [argument if len(argument) <= SLOWLOG_ENTRY_MAX_STRING else
+            f"{to_text(argument[:SLOWLOG_ENTRY_MAX_STRING])}... ({len(argument) - SLOWLOG_ENTRY_MAX_STRING} more bytes)"
+            for argument in shown]
+
+
+class Stats:
+    """the counters of the whole server, shared by all connections"""
+
+    def __init__(self):
+        self.commands: dict[str, CommandStats] = {}
+        self.slowlog: deque[SlowLogEntry] = deque(maxlen=128)
+        self._slowlog_ids = count()
+        # -1 logs nothing, 0 every command, set from slowlog-log-slower-than (microseconds)
+        self.slower_than_ns = 10_000_000
+        self.tracking = True
+        self.total_commands = 0
+        self.total_error_replies = 0
+        self.connected_clients = 0
+        self.total_connections = 0
+
+    def _entry(self, name: str) -> CommandStats:
+        entry = self.commands.get(name, None)
+        if entry is None:
+            entry = self.commands[name] = CommandStats()
+            if self.tracking:
+                entry.histogram = Histogram()
+        return entry
+
+    def record(self, name: str, nanoseconds: int, arguments: list[str], failed: bool, client: str):
+        entry = self.commands.get(name, None) or self._entry(name)
+        entry.calls += 1
+        entry.nanoseconds += nanoseconds
+        self.total_commands += 1
+        if failed:
+            entry.failed_calls += 1
+            self.total_error_replies += 1
+        if self.tracking:
+            # bucket_of inlined with the constants spelled out (SUB_BUCKET_BITS 4), this runs for every command
+            counts = (entry.histogram or self._histogram(entry)).counts
+            shift = nanoseconds.bit_length() - 5
+            if shift > 0:
+                counts[(shift << 4) + (nanoseconds >> shift)] += 1
+            else:
+                counts[nanoseconds] += 1
+        if 0 <= self.slower_than_ns <= nanoseconds:
+            self.slowlog.appendleft(SlowLogEntry(next(self._slowlog_ids), nanoseconds // 1000,
+                                                 _slowlog_arguments(arguments), client))
+
+    def reject(self, name: str):
+        """a call refused before it ran, e.g. by maxmemory"""
+        self._entry(name).rejected_calls += 1
+        self.total_commands += 1
+        self.total_error_replies += 1
+
+    @staticmethod
+    def _histogram(entry: CommandStats) -> Histogram:
+        # latency-tracking was switched on after the command was first seen
+        entry.histogram = Histogram()
+        return entry.histogram
+
+    def reset(self):
+        """CONFIG RESETSTAT"""
+        self.commands.clear()
+        self.total_commands = 0
+        self.total_error_replies = 0
+        self.total_connections = 0
+
+    def set_slowlog_max_len(self, length: int):
+        self.slowlog = deque(self.slowlog, maxlen=length)
+
+
+stats = Stats()
+
+
+def _set_slower_than(microseconds: int):
+    stats.slower_than_ns = microseconds * 1000 if microseconds >= 0 else -1
+
+
+ServerConfig.register('slowlog-log-slower-than', '10000', parse_number(-1, 2 ** 40), on_change=_set_slower_than)
+ServerConfig.register('slowlog-max-len', '128', parse_number(0, 2 ** 31), on_change=stats.set_slowlog_max_len)
+ServerConfig.register('latency-tracking', 'yes', parse_choice('yes', 'no'),
+                      on_change=lambda value: setattr(stats, 'tracking', value == 'yes'))
@@ -0,0 +1,64 @@
+import logging
+
+from commandhandler.config import ServerConfig, parse_choice, parse_number
+
+VERBOSE = 15
+logging.addLevelName(VERBOSE, "VERBOSE")
+# redis log levels, 'nothing' silences the server completely
+LOG_LEVELS: dict[str, int] = {
+    'debug': logging.DEBUG,
+    'verbose': VERBOSE,
+    'notice': logging.INFO,
+    'warning': logging.WARNING,
+    'nothing': logging.CRITICAL + 1,
+}
+# payloads in traces are cut after this many characters, a huge LRANGE reply must not end up in the log
+TRACE_PAYLOAD_LIMIT = 128
+
+logger = logging.getLogger("own_redis")
+
+
+def abbreviate(value) -> str:
+    text = repr(value)
+    if len(text) <= TRACE_PAYLOAD_LIMIT:
+        return text
+    return f"{text[:TRACE_PAYLOAD_LIMIT]}... ({len(text)} chars)"
+
+
+class Tracer:
+    """
+    Per request tracing at debug level. Call sites check the plain `enabled` attribute first,
+
+        if tracer.enabled:
+            tracer.trace("command %s", commands)
+
+    so with tracing off the hot path pays one attribute lookup and nothing gets formatted.
+    With tracing on only every n-th request is logged according to `log-sample-rate`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._every = 1
+        self._counter = 0
+
+    def configure(self, sample_rate: float):
+        self._every = max(round(1 / sample_rate), 1) if sample_rate > 0 else 0
+        self.enabled = bool(self._every) and logger.isEnabledFor(logging.DEBUG)
+
+    def trace(self, message: str, *args):
+        self._counter += 1
+        if self._counter % self._every == 0:
+            logger.debug(message, *(abbreviate(arg) for arg in args))
+
+
+tracer = Tracer()
+
+
+def _set_log_level(level: str):
+    logger.setLevel(LOG_LEVELS[level])
+    tracer.configure(ServerConfig.get('log-sample-rate'))
+
+
+ServerConfig.register('log-sample-rate', '1', parse_number(0, 1, float),
+                      on_change=lambda rate: tracer.configure(rate))
+ServerConfig.register('loglevel', 'notice', parse_choice(*LOG_LEVELS), on_change=_set_log_level)
@@ -0,0 +1,306 @@
+"""
+Server assisted client side caching, CLIENT TRACKING like in redis 6.
+
+A connection which switched to RESP3 with HELLO 3 and turned tracking on gets an `invalidate`
+push once a key it may have cached changes, so it can keep values locally and skip the round trip
+for repeated reads. In the default mode the server remembers the keys the connection read, in a
+table per keyspace from key to the ids of the clients which read it. A change pushes the key to
+those clients and forgets it, a client which reads the key again is tracked again. With BCAST
+nothing is remembered, the connection gets the pushes for every changed key starting with one of
+its prefixes, indexed by prefix length like the pattern subscriptions of pub/sub.
+
+Changes are noticed in two places: the handler after every write command, for the keys of the
+command, and `RedisCache.invalidation_feed` for the keys the storage removes on its own, expired
+and evicted keys and a keyspace which is emptied, whose push carries a null instead of the keys.
+
+The table holds `tracking-table-max-keys` keys at most. Beyond that the oldest tracked keys are
+invalidated, their clients drop them and the server forgets them. The table keeps client ids and
+not connections, the ids of a connection which turned tracking off or closed are skipped and go
+away with their keys. Pushes are queued per client and written once per iteration of the event
+loop, like the messages of pub/sub.
+"""
+import asyncio
+from collections import deque
+from itertools import count
+from typing import Optional
+
+from commandhandler.config import ServerConfig, parse_number
+from commandhandler.utils import ErrorReply, RespFrame, CRLF_BYTES, to_bytes, to_text
+from storage.cache import RedisCache
+
+# the ids of the connections, for HELLO, CLIENT ID and the tracking table
+client_ids = count(1)
+
+INVALIDATE = b">2\r\n$10\r\ninvalidate\r\n"
+# the push for a keyspace which was emptied, every key of it is invalid
+INVALIDATE_ALL = INVALIDATE + b"_\r\n"
+
+table_max_keys = ServerConfig.register('tracking-table-max-keys', '1000000', parse_number(0, 2 ** 40))
+
+# the arguments which name the keys of a command, by default the first one
+FIRST_KEY = slice(1, 2)
+ALL_KEYS = slice(1, None)
+
+# the reads which track their keys in the default mode
+TRACKED_READS = {
+    **dict.fromkeys(('get', 'strlen', 'getrange', 'substr', 'lrange', 'llen', 'lindex', 'hget', 'hmget', 'hgetall',
+                     'hlen', 'hexists', 'hscan', 'zscore', 'zcard', 'zrank', 'zrevrank', 'zrange', 'zrevrange',
+                     'zrangebyscore', 'zcount', 'type', 'ttl', 'pttl', 'getbit', 'bitcount', 'bitpos'), FIRST_KEY),
+    'mget': ALL_KEYS,
+    'exists': ALL_KEYS,
+    'pfcount': ALL_KEYS,
+}
+
+# the keys of the write commands which don't change just their first argument
+WRITE_KEYS = {
+    'mset': slice(1, None, 2),
+    'msetnx': slice(1, None, 2),
+    'del': ALL_KEYS,
+    'blpop': slice(1, -1),
+    'brpop': slice(1, -1),
+    'lmove': slice(1, 3),
+    'blmove': slice(1, 3),
+    'bitop': slice(2, 3),
+}
+
+
+def overlapping_prefixes(prefixes: tuple) -> Optional[str]:
+    """like redis, a client can't have prefixes of which one starts the other, a key would be sent twice"""
+    for index, prefix in enumerate(prefixes):
+        for other in prefixes[index + 1:]:
+            if prefix.startswith(other) or other.startswith(prefix):
+                return ErrorReply(f"-ERR Prefix '{prefix}' overlaps with an existing prefix '{other}'. "
+                                  f"Prefixes for a single client must not overlap.")
+    return None
+
+
+def encode_invalidation(keys) -> bytes:
+    out = bytearray(INVALIDATE)
+    out += b"*%d\r\n" % len(keys)
+    for key in keys:
+        encoded = to_bytes(key)
+        out += b"$%d\r\n" % len(encoded)
+        out += encoded
+        out += CRLF_BYTES
+    return bytes(out)
+
+
+def encode_hello(fields: dict, protocol: int) -> RespFrame:
+    """the reply of HELLO, a map in RESP3 and a flat array of names and values in RESP2"""
+    out = bytearray(b"%%%d\r\n" % len(fields) if protocol == 3 else b"*%d\r\n" % (2 * len(fields)))
+    for name, value in fields.items():
+        out += b"$%d\r\n%s\r\n" % (len(name), name.encode())
+        if type(value) is int:
+            out += b":%d\r\n" % value
+        elif type(value) is list:
+            out += b"*%d\r\n" % len(value)
+        else:
+            out += b"$%d\r\n%s\r\n" % (len(value), value.encode())
+    return RespFrame(out)
+
+
+class TrackingClient:
+    """the tracking side of a connection, `transport` is where its pushes go"""
+    __slots__ = ('id', 'transport', 'keyspace', 'bcast', 'prefixes', 'noloop', 'pending', 'invalidate_all')
+
+    def __init__(self, client_id: int, transport, keyspace: str, bcast: bool, prefixes: tuple, noloop: bool):
+        self.id = client_id
+        self.transport = transport
+        self.keyspace = keyspace
+        self.bcast = bcast
+        self.prefixes = prefixes
+        self.noloop = noloop
+        # the keys invalidated since the last flush
+        self.pending: dict = {}
+        self.invalidate_all = False
+
+    def flush(self):
+        transport = self.transport
+        if self.invalidate_all:
+            transport.write(INVALIDATE_ALL)
+            self.invalidate_all = False
+        if self.pending:
+            transport.write(encode_invalidation(self.pending))
+            self.pending.clear()
+
+
+class Tracking:
+
+    def __init__(self):
+        self.clients: dict[int, TrackingClient] = {}
+        # keyspace name -> key -> the ids of the clients which read it since it last changed
+        self.tables: dict[str, dict] = {}
+        self.tracked_keys = 0
+        # (keyspace name, key) in the order the keys got tracked, for evicting the oldest ones. A key
+        # which was invalidated stays behind until it comes up, see _evict
+        self.order: deque = deque()
+        # keyspace name -> prefix -> the BCAST clients with it, and the distinct prefix lengths in use
+        self.prefixes: dict[str, dict[str, dict[TrackingClient, None]]] = {}
+        self.prefix_lengths: dict[str, list[int]] = {}
+        # clients with pending pushes, flushed once per iteration of the event loop
+        self.unflushed: dict[TrackingClient, None] = {}
+        self.flush_scheduled = False
+
+    # CLIENT TRACKING on and off
+
+    def enable(self, client_id: int, transport, keyspace: str, bcast: bool, prefixes: tuple,
+               noloop: bool) -> TrackingClient:
+        client = TrackingClient(client_id, transport, keyspace, bcast, prefixes or ('',), noloop)
+        self.clients[client.id] = client
+        if bcast:
+            index = self.prefixes.setdefault(keyspace, {})
+            for prefix in client.prefixes:
+                index.setdefault(prefix, {})[client] = None
+            self._index_lengths(keyspace)
+        # from the first client on the storage reports the keys it removes on its own
+        RedisCache.invalidation_feed = self.invalidate
+        return client
+
+    def disable(self, client: TrackingClient):
+        """tracking off or the connection closed, its pending pushes are dropped"""
+        if self.clients.pop(client.id, None) is None:
+            return
+        self.unflushed.pop(client, None)
+        if client.bcast:
+            index = self.prefixes[client.keyspace]
+            for prefix in client.prefixes:
+                clients = index[prefix]
+                del clients[client]
+                if not clients:
+                    del index[prefix]
+            if not index:
+                del self.prefixes[client.keyspace]
+            self._index_lengths(client.keyspace)
+        if not self.clients:
+            # nobody is left to notify, the ids in the table all belong to gone clients
+            self.tables.clear()
+            self.order.clear()
+            self.tracked_keys = 0
+            RedisCache.invalidation_feed = None
+
+    def _index_lengths(self, keyspace: str):
+        index = self.prefixes.get(keyspace, None)
+        if index:
+            self.prefix_lengths[keyspace] = sorted({len(prefix) for prefix in index})
+        else:
+            self.prefix_lengths.pop(keyspace, None)
+
+    # reads
+
+    def remember(self, client: TrackingClient, keyspace: str, keys):
+        """the keys a client in the default mode read, it hears about their next change"""
+        table = self.tables.get(keyspace, None)
+        if table is None:
+            table = self.tables[keyspace] = {}
+        client_id = client.id
+        for key in keys:
+            readers = table.get(key, None)
+            if readers is None:
+                table[key] = {client_id}
+                self.order.append((keyspace, key))
+                self.tracked_keys += 1
+            else:
+                readers.add(client_id)
+        maximum = table_max_keys.value
+        if maximum and self.tracked_keys > maximum:
+            self._evict(maximum)
+
+    def _evict(self, maximum: int):
+        """invalidates the oldest tracked keys until the table is back at its limit"""
+        order, tables = self.order, self.tables
+        while self.tracked_keys > maximum and order:
+            keyspace, key = order.popleft()
+            table = tables.get(keyspace, None)
+            if table is not None and key in table:
+                self._notify(key, table.pop(key), None)
+                self.tracked_keys -= 1
+        # the invalidated keys left behind are dropped once they outnumber the tracked ones
+        if len(order) > 2 * self.tracked_keys + 1024:
+            self.order = deque((keyspace, key) for keyspace, table in tables.items() for key in table)
+
+    # changes
+
+    def invalidate_command(self, keyspace: str, commands: list, origin: Optional[TrackingClient]):
+        """after a write command, `origin` is the tracking of the connection which sent it"""
+        for key in commands[WRITE_KEYS.get(commands[0].lower(), FIRST_KEY)]:
+            self.invalidate(keyspace, key, origin)
+
+    def invalidate(self, keyspace: str, key, origin: Optional[TrackingClient] = None):
+        """
+        the key changed or is gone, its readers and the BCAST clients of a matching prefix get a
+        push. A key of None means the whole keyspace was emptied
+        """
+        if key is None:
+            self._invalidate_all(keyspace)
+            return
+        table = self.tables.get(keyspace, None)
+        if table:
+            readers = table.pop(key, None)
+            if readers is not None:
+                self.tracked_keys -= 1
+                self._notify(key, readers, origin)
+        lengths = self.prefix_lengths.get(keyspace, None)
+        if lengths:
+            index = self.prefixes[keyspace]
+            text = to_text(key)
+            unflushed = self.unflushed
+            for length in lengths:
+                if length > len(text):
+                    break
+                clients = index.get(text[:length], None)
+                if clients is not None:
+                    for client in clients:
+                        if client is not origin or not client.noloop:
+                            client.pending[key] = None
+                            unflushed[client] = None
+        if self.unflushed and not self.flush_scheduled:
+            self._schedule_flush()
+
+    def _notify(self, key, readers: set, origin: Optional[TrackingClient]):
+        clients, unflushed = self.clients, self.unflushed
+        for client_id in readers:
+            client = clients.get(client_id, None)
+            # the connection closed or turned tracking off
+            if client is None or (client is origin and client.noloop):
+                continue
+            client.pending[key] = None
+            unflushed[client] = None
+        if unflushed and not self.flush_scheduled:
+            self._schedule_flush()
+
+    def _invalidate_all(self, keyspace: str):
+        table = self.tables.pop(keyspace, None)
+        if table:
+            self.tracked_keys -= len(table)
+        for client in self.clients.values():
+            if client.keyspace == keyspace:
+                client.pending.clear()
+                client.invalidate_all = True
+                self.unflushed[client] = None
+        if self.unflushed and not self.flush_scheduled:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # outside of the server the pushes go out right away
+            self.flush()
+            return
+        self.flush_scheduled = True
+        loop.call_soon(self.flush)
+
+    def flush(self):
+        """writes the pushes of this loop iteration, one write per client"""
+        self.flush_scheduled = False
+        for client in self.unflushed:
+            client.flush()
+        self.unflushed.clear()
+
+    # introspection, INFO
+
+    def prefix_count(self) -> int:
+        return sum(len(index) for index in self.prefixes.values())
+
+
+tracking = Tracking()
@@ -9,6 +9,98 @@ ARRAY = '*'
 DICT = '%'
 
 
+class RespFrame(bytes):
+    """an already encoded reply, the serializer writes it to the output as it is"""
+    __slots__ = ()
+
+
+class ErrorReply(str):
+    """an error line ('-ERR ...'), the marker included. Every other str a handler returns is data, a bulk string"""
+    __slots__ = ()
+
+
+class StatusReply(str):
+    """a status line ('+string'), the marker included"""
+    __slots__ = ()
+
+
+class ArrayStream:
+    """
+    an array reply whose elements are produced while it is encoded, so a range of a big value goes
+    into the output buffer without an intermediate list. `length` must be the exact element count
+    """
+    __slots__ = ('length', 'elements')
+
+    def __init__(self, length: int, elements):
+        self.length = length
+        self.elements = elements
+
+
+CRLF_BYTES = b"\r\n"
+SYNTAX_ERROR = ErrorReply("-ERR syntax error")
+NULL_BULK = RespFrame(b"$-1\r\n")
+OK_RESP = RespFrame(b"+OK\r\n")
+PONG_RESP = RespFrame(b"+PONG\r\n")
+EMPTY_ARRAY = RespFrame(b"*0\r\n")
+NULL_ARRAY = RespFrame(b"*-1\r\n")
+
+# integer replies and length headers below this are encoded once at import time
+SHARED_INTEGERS = 10000
+INTEGER_REPLIES = tuple(RespFrame(b":%d\r\n" % number) for number in range(SHARED_INTEGERS))
+BULK_HEADERS = tuple(b"$%d\r\n" % number for number in range(SHARED_INTEGERS))
+ARRAY_HEADERS = tuple(b"*%d\r\n" % number for number in range(SHARED_INTEGERS))
+# integer encoded string values read back as bulk strings
+INTEGER_BULKS = tuple(RespFrame(b"$%d\r\n%d\r\n" % (len(b"%d" % number), number)) for number in range(SHARED_INTEGERS))
+
+
+def bulk_integer(value: int):
+    """an integer encoded value as a string reply, not as an integer one"""
+    return INTEGER_BULKS[value] if 0 <= value < SHARED_INTEGERS else str(value)
+
+
+# arguments are decoded without loss, bytes which aren't utf-8 become lone surrogates and are encoded back
+UNICODE_ERRORS = "surrogateescape"
+# a bulk argument longer than this is taken for a value: it is handed out as bytes and never decoded
+MAX_DECODED_LENGTH = 4 * 1024
+
+
+def decode_argument(raw) -> str | bytes:
+    """an argument in the form the parser hands it out, for data read back from files"""
+    if len(raw) > MAX_DECODED_LENGTH:
+        return bytes(raw)
+    return str(raw, "utf-8", UNICODE_ERRORS)
+
+
+def to_bytes(value) -> bytes | bytearray:
+    """the bytes of a string value in any of its forms, bytes and bytearrays as they are"""
+    kind = type(value)
+    if kind is str:
+        return value.encode("utf-8", UNICODE_ERRORS)
+    if kind is int:
+        return b"%d" % value
+    return value
+
+
+def to_text(value) -> str:
+    """the str of a string value, for the places which need one (glob patterns, sorted set members)"""
+    kind = type(value)
+    if kind is str:
+        return value
+    if kind is int:
+        return str(value)
+    return str(value, "utf-8", UNICODE_ERRORS)
+
+
+def is_error(reply) -> bool:
+    """handlers return errors as an `ErrorReply`, a str which starts with '-' is just a value"""
+    return type(reply) is ErrorReply
+
+
+def wrong_arguments(command: str) -> ErrorReply:
+    """the reply to a command called with too few or too many arguments"""
+    return ErrorReply(f"-ERR wrong number of arguments for '{command}' command")
+
+
 def split_by_CRLF(value: str):
     word, rest = value.split(CRLF, 1)
     return word, rest
@@ -1,51 +1,298 @@
+import argparse
 import asyncio
+import logging
+import os
+import signal
 import socket
+import tempfile
 from asyncio import StreamReader, StreamWriter
+from typing import Optional
+
 from commandhandler.handler import CommandHandler
-from commandhandler.parser import CommandParser
-from storage.cache import CacheHolder
+from commandhandler.serializer import write_reply
+from commandhandler.parser import CommandParser, ProtocolError
+from commandhandler.replication import replication
+from commandhandler.sharding import Router
+from commandhandler.stats import stats
+from commandhandler.trace import logger, tracer, VERBOSE
+from storage.cache import CacheHolder, RedisCache
 
 HOST: str = "localhost"
 PORT: int = 6379
+READ_BUFFER_SIZE: int = 64 * 1024
+# replies of a pipelined batch are flushed early once they grow past the soft limit, the drain
+# then stops us from reading (and answering) more until the client consumed what it asked for
+OUTPUT_BUFFER_SOFT_LIMIT: int = 1024 * 1024
+# a client which still has more than the hard limit of unsent replies is disconnected, 0 disables it
+OUTPUT_BUFFER_HARD_LIMIT: int = 256 * 1024 * 1024
+# how many times per second the server cron runs its housekeeping (active expire, ...)
+HZ: int = 10
+# set in the worker processes of `--workers N`, routes the commands to the worker owning the key
+ROUTER: Optional[Router] = None
+# `--replicaof host port`, the primary to replicate from once the server runs
+REPLICAOF: Optional[tuple[str, int]] = None
 
 
 class BreakExceptionMarker(Exception): pass
 
 
-async def _handle_client(reader, writer, cache_holder, ip, ):
-    parser = CommandParser()
-    cache = cache_holder.acquire_cache(ip)
-    data = await reader.read(1024)
-    print(f"incoming data {data}")
-    encoded = data.decode("utf-8")
-    if not encoded:
+async def _flush(writer: StreamWriter, output: bytearray):
+    writer.write(output)
+    if OUTPUT_BUFFER_HARD_LIMIT and writer.transport.get_write_buffer_size() > OUTPUT_BUFFER_HARD_LIMIT:
+        logger.warning("closing client, output buffer exceeds %d bytes", OUTPUT_BUFFER_HARD_LIMIT)
         raise BreakExceptionMarker
-    parsed_resp = parser.parse_command(encoded)
-    handler = CommandHandler(cache)
-    handled_resp = handler.handle_command(parsed_resp)
-    print(f"{handled_resp=}")
-    writer.write(handled_resp.encode())
     await writer.drain()
-    writer.close()
+
+
+async def _unblocked(reader: StreamReader, parser: CommandParser, handler: CommandHandler):
+    """
+    waits for the reply of the blocking command the client sent. The connection reads on meanwhile,
+    that is how a client which goes away is noticed, what it sends is parsed once the reply is out
+    """
+    future = handler.waiter.future
+    while not future.done():
+        read = asyncio.ensure_future(reader.read(READ_BUFFER_SIZE))
+        await asyncio.wait((read, future), return_when=asyncio.FIRST_COMPLETED)
+        if not read.done():
+            read.cancel()
+            # the reader allows one read at a time, the next one starts once this one is gone
+            await asyncio.wait((read,))
+            break
+        data = read.result()
+        if not data:
+            raise BreakExceptionMarker
+        parser.feed(data)
+    handler.waiter = None
+    return future.result()
+
+
+def _commit(handler: CommandHandler):
+    # the append only file gets the writes of a batch before any of its replies goes out
+    aof = handler.redis_cache.aof
+    if aof is not None:
+        aof.flush()
+
+
+async def _handle_client(reader, writer, parser: CommandParser, handler: CommandHandler,
+                         router: Optional[Router] = None):
+    """
+    reads once from the client and answers every complete command of that read,
+    all replies of the batch are collected and written with a single write/drain
+    """
+    data = await reader.read(READ_BUFFER_SIZE)
+    if tracer.enabled:
+        tracer.trace("incoming data %s", data)
+    if not data:
+        raise BreakExceptionMarker
+    parser.feed(data)
+    if router is not None:
+        await _handle_sharded(writer, parser, handler, router)
+        return
+    output = bytearray()
+    for command in parser:
+        # replies are encoded straight into the output buffer of the batch
+        handler.handle_command(command, output)
+        if handler.close_requested:
+            break
+        if handler.waiter is not None:
+            # a blocking command found nothing, the replies so far go out and the rest of the pipeline waits
+            _commit(handler)
+            if output:
+                await _flush(writer, output)
+                output = bytearray()
+            write_reply(await _unblocked(reader, parser, handler), output)
+        if len(output) >= OUTPUT_BUFFER_SOFT_LIMIT:
+            _commit(handler)
+            await _flush(writer, output)
+            output = bytearray()
+    _commit(handler)
+    if output:
+        await _flush(writer, output)
+    if handler.close_requested:
+        if handler.replica is not None and handler.replica.accepted:
+            # PSYNC was answered, the connection now belongs to the replication until the replica leaves
+            await replication.serve(reader, writer, parser, handler.replica)
+        raise BreakExceptionMarker
+
+
+async def _handle_sharded(writer, parser: CommandParser, handler: CommandHandler, router: Router):
+    """the same for a worker, commands for keys of other workers are forwarded to them"""
+    batch = router.batch(handler)
+    for command in parser:
+        batch.add(command)
+        if handler.close_requested:
+            break
+        if len(batch) >= OUTPUT_BUFFER_SOFT_LIMIT:
+            output = await batch.finish()
+            _commit(handler)
+            await _flush(writer, output)
+            batch = router.batch(handler)
+    output = await batch.finish()
+    _commit(handler)
+    if output:
+        await _flush(writer, output)
+    if handler.close_requested:
+        raise BreakExceptionMarker
 
 
 async def handle_client(reader: StreamReader, writer: StreamWriter):
     ip, host = writer.get_extra_info('peername')
-    print(f"Client connected from {ip}")
-    cache_holder = CacheHolder()
+    logger.log(VERBOSE, "Client connected from %s", ip)
+    # parser and handler live as long as the connection, the parser keeps partial frames between reads
+    parser = CommandParser()
+    # a keyspace stored on disk is loaded in the background, meanwhile its commands get a LOADING error
+    handler = CommandHandler(CacheHolder().acquire_cache(ip, background=True))
+    handler.transport = writer.transport
+    # with workers a blocked command would hold up the link to the worker owning its key
+    handler.can_block = ROUTER is None
+    # and reads of keys owned by another worker run there, where the connection can't be tracked
+    handler.can_track = ROUTER is None
+    stats.connected_clients += 1
+    stats.total_connections += 1
     try:
         while True:
-            await _handle_client(reader, writer, cache_holder, ip)
+            await _handle_client(reader, writer, parser, handler, ROUTER)
     except BreakExceptionMarker:
         pass
+    except ProtocolError as error:
+        writer.write(f"-ERR {error.message}\r\n".encode())
+    except ConnectionError:
+        pass
+    finally:
+        stats.connected_clients -= 1
+        handler.close()
+        writer.close()
+
+
+async def handle_peer(reader: StreamReader, writer: StreamWriter):
+    """
+    a connection of another worker forwarding the commands for keys of this worker. It starts
+    with ATTACH <keyspace>, the other worker waits for the reply before it sends commands
+    """
+    parser = CommandParser()
+    handler = None
+    try:
+        while handler is None:
+            data = await reader.read(READ_BUFFER_SIZE)
+            if not data:
+                raise BreakExceptionMarker
+            parser.feed(data)
+            for command in parser:
+                if len(command) != 2 or command[0].lower() != 'attach':
+                    writer.write(b"-ERR expected ATTACH <keyspace>\r\n")
+                    raise BreakExceptionMarker
+                handler = CommandHandler(CacheHolder().acquire_cache(command[1], background=True))
+                writer.write(b"+OK\r\n")
+        while True:
+            await _handle_client(reader, writer, parser, handler)
+    except (BreakExceptionMarker, ConnectionError):
+        pass
+    except asyncio.CancelledError:
+        # the links between the workers stay open until the workers shut down
+        pass
+    except ProtocolError as error:
+        writer.write(f"-ERR {error.message}\r\n".encode())
+    finally:
+        writer.close()
+
+
+async def server_cron(cache_holder: CacheHolder):
+    while True:
+        await asyncio.sleep(1 / HZ)
+        cache_holder.cron()
+        replication.cron()
 
 
 async def main():
     server = await asyncio.start_server(handle_client,
                                         host=HOST, port=PORT,
                                         family=socket.AF_INET)
-    await server.serve_forever()
+    cron = asyncio.create_task(server_cron(CacheHolder()))
+    replication.listening_port = PORT
+    if REPLICAOF is not None:
+        replication.replicate(*REPLICAOF)
+    try:
+        await server.serve_forever()
+    finally:
+        cron.cancel()
+        CacheHolder.shutdown()
+
+
+async def worker_main(index: int, socket_paths: list[str]):
+    """one of the `--workers` processes, the port is shared, the unix socket is its own"""
+    global ROUTER
+    ROUTER = Router(index, socket_paths)
+    # the workers have no common replication stream
+    replication.supported = False
+    # every worker stores its own part of the keyspaces
+    RedisCache.FILE_STORE = f"{RedisCache.FILE_STORE}worker{index}of{len(socket_paths)}_"
+    server = await asyncio.start_server(handle_client, host=HOST, port=PORT, family=socket.AF_INET,
+                                        reuse_port=True)
+    peers = await asyncio.start_unix_server(handle_peer, path=socket_paths[index])
+    cron = asyncio.create_task(server_cron(CacheHolder()))
+    try:
+        await asyncio.gather(server.serve_forever(), peers.serve_forever())
+    finally:
+        cron.cancel()
+        ROUTER.close()
+        CacheHolder.shutdown()
+
+
+def run_workers(workers: int):
+    """forks the workers and waits for them, a signal to the parent stops all of them"""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise SystemExit("--workers needs SO_REUSEPORT, which this platform doesn't have")
+    directory = tempfile.mkdtemp(prefix="owncache-")
+    socket_paths = [os.path.join(directory, f"worker{index}.sock") for index in range(workers)]
+    children = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                asyncio.run(worker_main(index, socket_paths))
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                logger.exception("worker %d failed", index)
+                code = 1
+            finally:
+                os._exit(code)
+        children.append(pid)
+    logger.info("started %d workers on port %d", workers, PORT)
+
+    def stop(signum, _):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for child in children:
+        os.waitpid(child, 0)
+    for path in socket_paths:
+        if os.path.exists(path):
+            os.unlink(path)
+    os.rmdir(directory)
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+    arguments = argparse.ArgumentParser(description="Redis like cache server")
+    arguments.add_argument("--port", type=int, default=PORT)
+    arguments.add_argument("--workers", type=int, default=1,
+                           help="processes sharing the port, each owns a hash slot range of the keyspaces")
+    arguments.add_argument("--replicaof", nargs=2, metavar=("HOST", "PORT"),
+                           help="start as a read only replica of the server at host port")
+    options = arguments.parse_args()
+    PORT = options.port
+    if options.replicaof:
+        if options.workers > 1:
+            arguments.error("--replicaof doesn't work with --workers")
+        REPLICAOF = options.replicaof[0], int(options.replicaof[1])
+    if options.workers > 1:
+        run_workers(options.workers)
+    else:
+        asyncio.run(main())
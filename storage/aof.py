@@ -0,0 +1,180 @@
+"""
+Append only file: every command which changed the keyspace, in RESP, in the order it was executed.
+
+Commands are collected in `buffer` while a batch is handled and written once before the replies of
+the batch go out, so a pipeline costs one write. How often the written data is synced is the
+`appendfsync` policy: `always` syncs every batch before replying (group commit, one fsync no
+matter how many commands the batch had), `everysec` syncs at most once a second from a thread,
+`no` leaves it to the operating system.
+"""
+import os
+import threading
+import time
+from itertools import islice
+from typing import Iterable, Optional
+
+from commandhandler.config import ServerConfig, parse_choice
+from commandhandler.trace import logger
+from commandhandler.utils import BULK_HEADERS, ARRAY_HEADERS, SHARED_INTEGERS, CRLF_BYTES, UNICODE_ERRORS
+from storage.background import BackgroundJob
+from storage.hashtype import RedisHash
+from storage.integers import format_float
+from storage.listtype import RedisList
+from storage.zsettype import SortedSet
+
+# elements per RPUSH of a rewritten list (fields per HSET of a hash), keeps single commands of huge lists reasonably sized
+REWRITE_ITEMS_PER_COMMAND = 64
+REWRITE_WRITE_CHUNK = 1024 * 1024
+
+append_fsync = ServerConfig.register('appendfsync', 'everysec', parse_choice('always', 'everysec', 'no'))
+
+
+def encode_command(arguments: Iterable[str | bytes], out: bytearray):
+    """appends the RESP array of bulk strings a client would send for the command"""
+    arguments = list(arguments)
+    count = len(arguments)
+    out += ARRAY_HEADERS[count] if count < SHARED_INTEGERS else b"*%d\r\n" % count
+    for argument in arguments:
+        # binary values are written as they are
+        encoded = argument.encode("utf-8", UNICODE_ERRORS) if type(argument) is str else argument
+        length = len(encoded)
+        out += BULK_HEADERS[length] if length < SHARED_INTEGERS else b"$%d\r\n" % length
+        out += encoded
+        out += CRLF_BYTES
+
+
+def write_rewrite(file_name: str, items: Iterable[tuple[str, object]], deadlines: dict[str, int], now: int):
+    """writes the shortest command sequence recreating the keyspace, synced but not renamed yet"""
+    out = bytearray()
+    with open(file_name, 'wb') as file:
+        for key, value in items:
+            deadline = deadlines.get(key, None) if deadlines else None
+            if deadline is not None and deadline <= now:
+                continue
+            if isinstance(value, RedisList):
+                elements = iter(value)
+                while chunk := list(islice(elements, REWRITE_ITEMS_PER_COMMAND)):
+                    encode_command(('RPUSH', key, *chunk), out)
+            elif isinstance(value, RedisHash):
+                items = value.items()
+                while chunk := list(islice(items, REWRITE_ITEMS_PER_COMMAND)):
+                    encode_command(('HSET', key, *(part for item in chunk for part in item)), out)
+            elif isinstance(value, SortedSet):
+                pairs = value.pairs()
+                while chunk := list(islice(pairs, REWRITE_ITEMS_PER_COMMAND)):
+                    encode_command(('ZADD', key, *(part for score, member in chunk
+                                                   for part in (format_float(score), member))), out)
+            else:
+                encode_command(('SET', key, str(value) if type(value) is int else value), out)
+            if deadline is not None:
+                encode_command(('PEXPIREAT', key, str(deadline)), out)
+            if len(out) >= REWRITE_WRITE_CHUNK:
+                file.write(out)
+                out.clear()
+        file.write(out)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+class AppendOnlyFile:
+    """
+    With `wait_rewrite` the file is not touched until a first rewrite replaced it, used when the log
+    is switched on for a keyspace it doesn't describe yet. The commands of that period only go
+    into the rewrite buffer.
+    """
+
+    def __init__(self, file_name: str, wait_rewrite: bool = False):
+        self.file_name = file_name
+        self.buffer = bytearray()
+        self._file = None if wait_rewrite else open(file_name, 'ab')
+        self._unsynced = False
+        self._last_fsync = time.monotonic()
+        self._fsync_thread: Optional[threading.Thread] = None
+        self.rewrite: Optional[BackgroundJob] = None
+        # commands executed while a rewrite runs, appended to the rewritten file once it is done
+        self._rewrite_buffer: Optional[bytearray] = None
+        self._rewrite_file = f"{file_name}.rewrite-tmp"
+
+    def append(self, arguments: Iterable[str]):
+        start = len(self.buffer)
+        encode_command(arguments, self.buffer)
+        if self._rewrite_buffer is not None:
+            self._rewrite_buffer += memoryview(self.buffer)[start:]
+
+    def flush(self):
+        """writes the buffered commands, with `appendfsync always` they are on disk when this returns"""
+        if not self.buffer:
+            return
+        if self._file is None:
+            self.buffer.clear()
+            return
+        self._file.write(self.buffer)
+        self._file.flush()
+        self.buffer.clear()
+        if append_fsync.value == 'always':
+            os.fsync(self._file.fileno())
+        else:
+            self._unsynced = True
+
+    def cron(self):
+        self.flush()
+        if (append_fsync.value == 'everysec' and self._unsynced and time.monotonic() - self._last_fsync >= 1
+                and not (self._fsync_thread and self._fsync_thread.is_alive())):
+            # a sync still running from the last second postpones this one instead of blocking the loop
+            self._unsynced = False
+            self._last_fsync = time.monotonic()
+            self._fsync_thread = threading.Thread(target=os.fsync, args=(self._file.fileno(),),
+                                                  name="aof-fsync", daemon=True)
+            self._fsync_thread.start()
+        if self.rewrite is not None:
+            self.poll_rewrite()
+
+    @property
+    def waiting_rewrite(self) -> bool:
+        return self._file is None
+
+    def start_rewrite(self, data: dict, deadlines: dict[str, int], now: int):
+        self._rewrite_buffer = bytearray()
+        self.rewrite = BackgroundJob(
+            lambda items, volatile: write_rewrite(self._rewrite_file, items, volatile, now), data, deadlines)
+
+    def poll_rewrite(self) -> Optional[bool]:
+        """
+        once the rewrite finished, the commands executed meanwhile are appended to the new file
+        which then replaces the old one
+        :return: None while no rewrite finished, afterwards whether it succeeded
+        """
+        succeeded = self.rewrite.poll()
+        if succeeded is None:
+            return None
+        if succeeded:
+            self.flush()
+            with open(self._rewrite_file, 'ab') as file:
+                file.write(self._rewrite_buffer)
+                file.flush()
+                os.fsync(file.fileno())
+            self._join_fsync()
+            if self._file is not None:
+                self._file.close()
+            os.replace(self._rewrite_file, self.file_name)
+            self._file = open(self.file_name, 'ab')
+            logger.info("Background append only file rewriting of %s terminated with success", self.file_name)
+        else:
+            if os.path.exists(self._rewrite_file):
+                os.remove(self._rewrite_file)
+            logger.warning("Background append only file rewriting of %s failed", self.file_name)
+        self.rewrite = None
+        self._rewrite_buffer = None
+        return succeeded
+
+    def close(self):
+        self.flush()
+        self._join_fsync()
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def _join_fsync(self):
+        if self._fsync_thread is not None:
+            self._fsync_thread.join()
+            self._fsync_thread = None
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from typing import Optional, Callable, Iterable
+
+from commandhandler.trace import logger
+from storage.hashtype import RedisHash
+from storage.listtype import RedisList
+from storage.zsettype import SortedSet
+
+# the work gets the entries of the keyspace and the deadlines of its volatile keys
+Work = Callable[[Iterable[tuple[str, object]], dict[str, int]], None]
+
+
+class BackgroundJob:
+    """
+    Runs `work` over a point in time view of a keyspace without blocking the event loop (BGSAVE,
+    BGREWRITEAOF). Where the platform can fork, a child process gets a copy on write view of the
+    keyspace for free, the parent only polls for its exit status from the cron. Elsewhere the
+    keyspace is copied (lists are mutable, strings are shared) and a thread works on the copy.
+    """
+
+    def __init__(self, work: Work, data: dict, deadlines: dict[str, int]):
+        self.started = time.time()
+        self._pid: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._succeeded: Optional[bool] = None
+        if hasattr(os, 'fork'):
+            self._fork(work, data, deadlines)
+        else:
+            self._start_thread(work, data, deadlines)
+
+    def _fork(self, work: Work, data: dict, deadlines: dict[str, int]):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                work(data.items(), deadlines)
+                status = 0
+            except BaseException:
+                # os._exit skips printing the traceback, the cause would be lost
+                logger.exception("background save failed")
+            finally:
+                # never return into the copy of the server, skip atexit handlers and buffers
+                os._exit(status)
+        self._pid = pid
+
+    def _start_thread(self, work: Work, data: dict, deadlines: dict[str, int]):
+        # the mutable values are copied, the thread must not see changes made meanwhile
+        items = [(key, RedisList(value) if isinstance(value, RedisList) else
+                  value.copy() if isinstance(value, (RedisHash, SortedSet)) else
+                  bytes(value) if type(value) is bytearray else value)
+                 for key, value in data.items()]
+        deadlines = dict(deadlines)
+
+        def run():
+            try:
+                work(items, deadlines)
+                self._succeeded = True
+            except Exception:
+                logger.exception("background save failed")
+                self._succeeded = False
+
+        self._thread = threading.Thread(target=run, name="background-job", daemon=True)
+        self._thread.start()
+
+    def poll(self) -> Optional[bool]:
+        """:return: None while the job is running, afterwards whether it succeeded"""
+        if self._pid is not None:
+            pid, status = os.waitpid(self._pid, os.WNOHANG)
+            if pid == 0:
+                return None
+            self._pid = None
+            self._succeeded = os.waitstatus_to_exitcode(status) == 0
+        elif self._thread is not None and self._thread.is_alive():
+            return None
+        return self._succeeded
+
+    def wait(self) -> bool:
+        """blocks until the job finished"""
+        if self._pid is not None:
+            _, status = os.waitpid(self._pid, 0)
+            self._pid = None
+            self._succeeded = os.waitstatus_to_exitcode(status) == 0
+        elif self._thread is not None:
+            self._thread.join()
+        return bool(self._succeeded)
@@ -0,0 +1,113 @@
+"""
+Bit operations on string values: SETBIT, GETBIT, BITCOUNT, BITPOS and BITOP. Bit 0 is the most
+significant bit of the first byte, like in redis.
+
+Nothing loops over the bits or bytes in Python. A range is turned into one big int
+(`int.from_bytes`), BITCOUNT is its `int.bit_count()` and BITOP combines the ints of the sources
+with one `&`, `|` or `^`. BITPOS takes the `bit_length()` of such an int (of its inverse when looking
+for a 0), in chunks so it stops soon after a bit near the start of a long value.
+"""
+from typing import Optional
+
+from commandhandler.utils import ErrorReply
+
+# SETBIT and GETBIT address at most 512MB, like redis
+MAX_BIT_OFFSET = 2 ** 32 - 1
+BIT_OFFSET_ERROR = ErrorReply("-ERR bit offset is not an integer or out of range")
+BIT_ERROR = ErrorReply("-ERR bit is not an integer or out of range")
+# the bits BITPOS looks at in one go
+POSITION_CHUNK_BITS = 8 * 65536
+
+
+def parse_offset(raw) -> Optional[int]:
+    try:
+        offset = int(raw)
+    except ValueError:
+        return None
+    return offset if 0 <= offset <= MAX_BIT_OFFSET else None
+
+
+def parse_bit(raw) -> Optional[int]:
+    return {'0': 0, '1': 1}.get(raw, None)
+
+
+def get_bit(data, offset: int) -> int:
+    position = offset >> 3
+    if position >= len(data):
+        return 0
+    return (data[position] >> (7 - (offset & 7))) & 1
+
+
+def set_bit(data: bytearray, offset: int, bit: int) -> int:
+    """sets the bit, growing the value with zero bytes up to it, :return: the bit it had before"""
+    position = offset >> 3
+    if position >= len(data):
+        data += bytes(position + 1 - len(data))
+    mask = 0x80 >> (offset & 7)
+    old = data[position] & mask
+    if bit:
+        data[position] |= mask
+    else:
+        data[position] &= ~mask & 0xff
+    return 1 if old else 0
+
+
+def bit_range(length: int, start: int, end: int, in_bits: bool) -> Optional[tuple[int, int]]:
+    """
+    the first and the last bit of a BITCOUNT or BITPOS range of a value of `length` bytes, start
+    and end count from the end when negative, None for an empty range
+    """
+    total = length * 8 if in_bits else length
+    if start < 0:
+        start = max(total + start, 0)
+    if end < 0:
+        end = max(total + end, 0)
+    end = min(end, total - 1)
+    if start > end:
+        return None
+    return (start, end) if in_bits else (start * 8, end * 8 + 7)
+
+
+def _bits(data, first: int, last: int) -> int:
+    """the bits from first to last (both included) as an int, the first one the most significant"""
+    number = int.from_bytes(memoryview(data)[first >> 3:(last >> 3) + 1], 'big')
+    # the bits in front of first in its byte, and behind last in its byte
+    number &= (1 << (((last >> 3) - (first >> 3) + 1) * 8 - (first & 7))) - 1
+    return number >> (7 - (last & 7))
+
+
+def count_bits(data, first: int, last: int) -> int:
+    return _bits(data, first, last).bit_count()
+
+
+def bit_position(data, bit: int, first: int, last: int) -> int:
+    """the first bit set to `bit` from first to last, -1 if there is none"""
+    for start in range(first, last + 1, POSITION_CHUNK_BITS):
+        end = min(start + POSITION_CHUNK_BITS - 1, last)
+        number = _bits(data, start, end)
+        if not bit:
+            number ^= (1 << (end - start + 1)) - 1
+        if number:
+            # the most significant bit of the chunk is its first one
+            return end + 1 - number.bit_length()
+    return -1
+
+
+def bit_operation(operation: str, sources: list) -> bytes:
+    """BITOP of the sources, the shorter ones are padded with zero bytes to the longest"""
+    length = max(map(len, sources))
+    if operation == 'not':
+        (source,) = sources
+        return (int.from_bytes(source, 'big') ^ ((1 << (8 * length)) - 1)).to_bytes(length, 'big')
+    numbers = [int.from_bytes(source, 'big') << (8 * (length - len(source))) for source in sources]
+    result = numbers[0]
+    if operation == 'and':
+        for number in numbers[1:]:
+            result &= number
+    elif operation == 'or':
+        for number in numbers[1:]:
+            result |= number
+    else:
+        for number in numbers[1:]:
+            result ^= number
+    return result.to_bytes(length, 'big')
@@ -1,9 +1,60 @@
 import asyncio
 import json
+import math
 import os
 import time
-from asyncio import Task, AbstractEventLoop
-from typing import Optional
+from asyncio import AbstractEventLoop
+from typing import Optional, Iterator, Callable, Iterable
+
+from commandhandler.config import ServerConfig, parse_choice
+from commandhandler.parser import MAX_BULK_LENGTH
+from commandhandler.trace import logger
+from commandhandler.utils import SYNTAX_ERROR, ErrorReply, is_error, to_bytes
+from storage.aof import AppendOnlyFile
+from storage.background import BackgroundJob
+from storage.eviction import (KeyTable, KEY_OVERHEAD, ELEMENT_OVERHEAD, value_size, element_size,
+                              evictor)
+from storage.expiry import ExpiryEngine, now_ms, ACTIVE_EXPIRE_CYCLE_BUDGET_MS
+from storage.integers import (LLONG_MIN, LLONG_MAX, NOT_AN_INTEGER, NOT_A_FLOAT, OVERFLOW, encode_string,
+                              format_float, parse_float, parse_integer, shared)
+from storage.glob import filter_glob
+from storage.hashtype import RedisHash
+from storage import bitmap, hyperloglog
+from storage.listtype import RedisList, normalize_range
+from storage.zsettype import SortedSet
+from storage.loading import LoadProgress, load_in_background
+from storage.snapshot import write_snapshot, iter_snapshot
+
+WRONGTYPE = ErrorReply("-WRONGTYPE Operation against a key holding the wrong kind of value")
+# bytes of the append only file replayed per loading step
+LOAD_CHUNK_SIZE = 256 * 1024
+BGSAVE_IN_PROGRESS = ErrorReply("-ERR Background save already in progress")
+# what TYPE replies and SCAN TYPE filters on, integer encoded strings are strings
+TYPE_NAMES = {str: 'string', int: 'string', bytes: 'string', bytearray: 'string', RedisList: 'list',
+              RedisHash: 'hash', SortedSet: 'zset'}
+# the forms of a string value: text, an int, bytes for a value too large to decode, a bytearray once it
+# was changed in place by APPEND or SETRANGE
+STRING_TYPES = frozenset((str, int, bytes, bytearray))
+TOO_LARGE = ErrorReply("-ERR string exceeds maximum allowed size (proto-max-bulk-len)")
+# RANDOMKEY draws at most this many expired keys before it gives up, like redis
+RANDOMKEY_ATTEMPTS = 100
+
+
+def parse_save_rules(raw: str) -> list[tuple[int, int]]:
+    """'900 1 300 10' snapshots after 900s if one key changed or after 300s if ten keys changed"""
+    numbers = [int(number) for number in raw.split()]
+    if len(numbers) % 2 or any(number < 1 for number in numbers):
+        raise ValueError("expected pairs of positive <seconds> <changes>")
+    return list(zip(numbers[::2], numbers[1::2]))
+
+
+def render_save_rules(rules: list[tuple[int, int]]) -> str:
+    return " ".join(f"{seconds} {changes}" for seconds, changes in rules)
+
+
+# automatic snapshots are off unless configured
+save_rules = ServerConfig.register('save', '', parse_save_rules, render=render_save_rules)
+rdb_compression = ServerConfig.register('rdbcompression', 'yes', parse_choice('yes', 'no'))
 
 
 def singleton(cls):
@@ -23,6 +74,13 @@ class CacheKeyMissingException(Exception):
         super().__init__(self.message)
 
 
+def string_length(value) -> int:
+    """the length of a string value in bytes, whatever form it has"""
+    if type(value) is str and value.isascii():
+        return len(value)
+    return len(to_bytes(value))
+
+
 # @singleton
 class RedisCache:
     """
@@ -31,16 +89,36 @@ class RedisCache:
     # instead of a decorator we can declare the singleton definition in the dunder functions
     name: str
     data: dict = {}
-    _expire_times: dict = {}
     FILE_STORE = "file_store_"
+    # set once replicas can attach, gets the keyspace name and every write as it is replayed
+    replication_feed: Optional[Callable[[str, Iterable[str]], None]] = None
+    # set while clients track keys (commandhandler/tracking.py), gets the keyspace name and a key
+    # which expired or was evicted, or None once the keyspace was emptied
+    invalidation_feed: Optional[Callable[[str, Optional[str]], None]] = None
 
     def __init__(self, cache_name):
         if not cache_name:
             raise CacheKeyMissingException()
         self.name = cache_name  # Storing the name in the instance
         self.data = {}  # Using a dictionary to store key-value pairs
-        self.tasks: dict[str, Task[_T]] = {}
+        self.expires = ExpiryEngine()  # absolute deadlines of the keys with a ttl
+        self.table = KeyTable()  # sizes and access metadata of the keys, for maxmemory
         self.file_name = f"{self.FILE_STORE}{self.name}.json"  # file name to store, we distinguish each client
+        self.snapshot_file = f"{self.FILE_STORE}{self.name}.rdb"
+        self.dirty = 0  # changes since the last successful save
+        self.lastsave = int(time.time())
+        self.bgsave: Optional[BackgroundJob] = None
+        self.aof_file = f"{self.FILE_STORE}{self.name}.aof"
+        self.aof: Optional[AppendOnlyFile] = None
+        self._aof_loaded = False
+        # set while the keyspace is loaded from disk, and kept if that failed
+        self.loading: Optional[LoadProgress] = None
+        self.last_load: Optional[LoadProgress] = None
+        self._dirty_at_bgsave = 0
+        # key -> the clients blocked on it in the order they came (commandhandler/blocking.py), and
+        # the keys with waiters which got elements, served once the current command is done
+        self.blocked: dict[str, dict] = {}
+        self.ready_keys: dict[str, None] = {}
 
     def get_name(self):
         return self.name
@@ -48,100 +126,443 @@ class RedisCache:
     def __eq__(self, other: 'RedisCache'):
         return self.name == other.name
 
+    def _lookup(self, key):
+        """
+        every read and write goes through here, a key whose deadline passed is removed
+        lazily before anyone gets to see it
+        """
+        if self.expires.deadlines and self.expires.is_expired(key):
+            self.delete_by_key(key)
+            if RedisCache.invalidation_feed is not None:
+                RedisCache.invalidation_feed(self.name, key)
+            return None
+        value = self.data.get(key, None)
+        if value is not None and KeyTable.tracking:
+            self.table.touch(key)
+        return value
+
+    def _store(self, key, value):
+        self.data[key] = value
+        self.table.store(key, KEY_OVERHEAD + len(key) + value_size(value))
+
+    def _plain_reads(self) -> bool:
+        """no deadline to check and no access to record, a read is a plain dict lookup"""
+        return not self.expires.deadlines and not KeyTable.tracking
+
     def is_key_existing(self, keys):
-        counter = 0
-        for key in keys:
-            counter = counter + 1 if self.data.get(key, None) else counter
-        return counter
+        """counts the existing keys, a key named twice counts twice"""
+        if self._plain_reads():
+            return sum(map(self.data.__contains__, keys))
+        lookup = self._lookup
+        return sum(lookup(key) is not None for key in keys)
 
     def get_by_key(self, key):
-        return self.data.get(key, None)
+        return self._lookup(key)
 
     def delete_by_key(self, key):
         deleted = False
         if key in self.data:
             del self.data[key]
+            self.table.remove(key)
             deleted = True
-        if key in self._expire_times:
-            del self._expire_times[key]
-        if key in self.tasks:
-            self.tasks[key].cancel()
-            del self.tasks[key]
+        self.expires.remove(key)
         return deleted
 
+    def evict_key(self, key):
+        """deletes a key to free memory, the append only file and the replicas get the delete as well"""
+        self.delete_by_key(key)
+        self.propagate(('del', key))
+        if RedisCache.invalidation_feed is not None:
+            RedisCache.invalidation_feed(self.name, key)
+
+    def propagate(self, arguments: Iterable[str]):
+        """a write goes to the append only file and to the replication stream"""
+        if self.aof is not None:
+            self.aof.append(arguments)
+        if RedisCache.replication_feed is not None:
+            RedisCache.replication_feed(self.name, arguments)
+
+    def reset(self):
+        """empties the keyspace, a replica does this before it loads the data of its primary"""
+        if self.bgsave is not None:
+            # a save finishing later would replace the snapshot the keyspace is loaded from
+            self.bgsave.wait()
+            self.bgsave = None
+        self.close_append_only_file()
+        self.data.clear()
+        self.expires.clear()
+        self.table.clear()
+        self.dirty = 0
+        if RedisCache.invalidation_feed is not None:
+            RedisCache.invalidation_feed(self.name, None)
+
     def delete_by_keys(self, keys):
-        counter = 0
-        for key in keys:
-            counter = counter + 1 if self.delete_by_key(key) else counter
-        return counter
+        return sum(map(self.delete_by_key, keys))
+
+    def get_many(self, keys) -> list:
+        """MGET, missing keys and keys which don't hold a string are None, integer encoded values stay ints"""
+        if self._plain_reads():
+            values = list(map(self.data.get, keys))
+        else:
+            values = list(map(self._lookup, keys))
+        for index, value in enumerate(values):
+            if value is not None and type(value) not in STRING_TYPES:
+                values[index] = None
+        return values
+
+    def set_many(self, pairs) -> bool:
+        """MSET, the values replace whatever the keys held and their ttls are gone"""
+        data, table, expires = self.data, self.table, self.expires
+        for key, value in pairs:
+            value = data[key] = encode_string(value)
+            table.store(key, KEY_OVERHEAD + len(key) + value_size(value))
+            if expires.deadlines:
+                expires.remove(key)
+        return True
+
+    def set_many_if_missing(self, pairs) -> bool:
+        """MSETNX, sets all the keys or none if any of them exists"""
+        keys = [key for key, _ in pairs]
+        if self.is_key_existing(keys):
+            return False
+        return self.set_many(pairs)
 
     def __str__(self):
         return f"{self.name} : {self.data}"
 
-    def set_key_value(self, key, value):
-        print(f"scheduled tasks {self.tasks.keys()}")
-        value_to_set = value[0]
-        if len(value) == 1:
-            self.data[key] = value_to_set
+    def _live_keys(self, keys: list[str]) -> list[str]:
+        """drops the keys whose deadline passed, they are left to the active expiry"""
+        if not self.expires.deadlines:
+            return keys
+        now, is_expired = now_ms(), self.expires.is_expired
+        return [key for key in keys if not is_expired(key, now)]
+
+    def scan(self, cursor: int, count: int, pattern: Optional[str] = None,
+             kind: Optional[str] = None) -> tuple[int, list[str]]:
+        """
+        SCAN, the next cursor and the keys of `count` slots of the key table, walked from the last
+        slot down. The cursor is the number of slots still ahead, 0 starts and ends a scan. A
+        delete moves the last key into the hole, that key was either visited already or lands
+        ahead of the cursor, so a key which exists during the whole scan is returned at least
+        once; keys added meanwhile are appended behind the cursor and may be missed.
+        """
+        keys = self.table.keys
+        position = len(keys) if cursor == 0 else min(cursor, len(keys))
+        start = max(position - count, 0)
+        found = self._live_keys(keys[start:position])
+        if pattern is not None:
+            found = filter_glob(pattern, found)
+        if kind is not None:
+            data = self.data
+            found = [key for key in found if TYPE_NAMES[type(data[key])] == kind]
+        return start, found
+
+    def keys(self, pattern: str) -> list[str]:
+        """KEYS, all the matching keys in one go"""
+        found = self._live_keys(self.table.keys)
+        return filter_glob(pattern, found)
+
+    def type_of(self, key) -> str:
+        value = self._lookup(key)
+        return 'none' if value is None else TYPE_NAMES[type(value)]
+
+    def size(self) -> int:
+        """DBSIZE, keys whose deadline passed count until they are removed"""
+        return len(self.data)
+
+    def random_key(self) -> Optional[str]:
+        table = self.table
+        for _ in range(RANDOMKEY_ATTEMPTS):
+            if not table.keys:
+                return None
+            key = table.keys[table.random_slot()]
+            if self._lookup(key) is not None:
+                return key
+        return None
+
+    def set_key_value(self, key, value) -> bool | str:
+        """
+        SET key value [NX | XX] [EX seconds | PX milliseconds | EXAT unix-time-seconds |
+        PXAT unix-time-milliseconds | KEEPTTL]
+        :return: True if the value was stored, False if NX/XX prevented it, an error otherwise
+        """
+        value_to_set, *options = value
+        deadline = None
+        condition = None
+        keep_ttl = False
+        index = 0
+        while index < len(options):
+            option = options[index].lower()
+            if option in ('nx', 'xx') and not condition:
+                condition = option
+            elif option == 'keepttl' and deadline is None:
+                keep_ttl = True
+            elif option in ('ex', 'px', 'exat', 'pxat') and deadline is None and not keep_ttl:
+                if index + 1 >= len(options):
+                    return SYNTAX_ERROR
+                index += 1
+                deadline = self.to_deadline(option, options[index])
+                if isinstance(deadline, str):
+                    return deadline
+                if option in ('ex', 'px') and int(options[index]) <= 0:
+                    return ErrorReply("-ERR invalid expire time in 'set' command")
+            else:
+                return SYNTAX_ERROR
+            index += 1
+
+        exists = self._lookup(key) is not None
+        if (condition == 'nx' and exists) or (condition == 'xx' and not exists):
+            return False
+        self._store(key, encode_string(value_to_set))
+        if deadline is not None:
+            self.set_deadline(key, deadline)
+        elif not keep_ttl:
+            self.expires.remove(key)
+        return True
+
+    @staticmethod
+    def to_deadline(unit: str, ttl) -> int | str:
+        """
+        converts a relative or absolute ttl of the given unit (ex, px, exat, pxat) into
+        an absolute deadline in unix milliseconds
+        """
+        try:
+            ttl = int(ttl)
+        except ValueError:
+            return NOT_AN_INTEGER
+        match unit:
+            case 'ex':
+                return now_ms() + ttl * 1000
+            case 'px':
+                return now_ms() + ttl
+            case 'exat':
+                return ttl * 1000
+            case _:
+                return ttl
+
+    def set_deadline(self, key, deadline: int):
+        # a deadline in the past (EXAT/PXAT) behaves like an immediate delete
+        if deadline <= now_ms():
+            self.delete_by_key(key)
         else:
-            value_to_set, *rest = value
-            print(f"{rest}")
-            expire_type, ttl = rest
-
-            if self.is_expiration_in_past(expire_type.lower(), ttl):
-                return f"-ERR ${expire_type} is in the past"
-            match expire_type.lower():
-                case 'ex':
-                    schedule_value = int(ttl)
-                case 'px':
-                    # takes ms need to convert
-                    schedule_value = int(ttl) / 1000
-                case 'exat':
-                    schedule_value = int(ttl) - time.time()
-                case 'pxat':
-                    schedule_value = (int(ttl) / 1000) - time.time()
-                case _:
-                    return f"-ERR ${expire_type} is unknown"
-            self._expire_times[key] = schedule_value
-            # we will create for each expiration its own task
-            self.data[key] = value_to_set
-            self.tasks[key] = asyncio.create_task(self.schedule_cleanup(key, schedule_value), name=f"cleanup{key}")
-
-        return value_to_set
-
-    # schedule a task for each key with ttl
-    async def schedule_cleanup(self, key, ttl):
-        print(f"tasks {self.name} {self.tasks.keys()}")
-        print(f"called schedule cleanup")
-        await asyncio.sleep(ttl)
-        print(f"schedule is done {self.name} {key}")
-        self.delete_by_key(key)
+            self.expires.set(key, deadline)
 
-    async def schedule_global_cleanup(self, seconds):
+    def expire(self, key, unit: str, ttl, *flags) -> int | str:
         """
-        alternative approach; instead of scheduling multiple tasks, we can have just have one single
-        coroutine running which checks every <seconds> if ANY of the data has expired, can sace resources
-        but can have data, which is not cleaned up yet, a third approach will be, to delete on demand,
-        when ever the data is accessed, check if the ttl is hit and delete. So if there are not many chache hits,
-        we are just using up memory.
-        :return:
+        EXPIRE/PEXPIRE/EXPIREAT/PEXPIREAT key ttl [NX | XX | GT | LT]
+        :return: 1 if the timeout was set, 0 if the key is missing or a flag prevented it
         """
-        while True:
-            await asyncio.sleep(seconds)
+        # a deadline in the past is accepted and deletes the key
+        deadline = self.to_deadline(unit, ttl)
+        if isinstance(deadline, str):
+            return deadline
+        flags = {flag.lower() for flag in flags}
+        if not flags <= {'nx', 'xx', 'gt', 'lt'} or len(flags) > 1:
+            return ErrorReply("-ERR NX and XX, GT or LT options at the same time are not compatible")
+        if self._lookup(key) is None:
+            return 0
+        current = self.expires.get(key)
+        if 'nx' in flags and current is not None:
+            return 0
+        if 'xx' in flags and current is None:
+            return 0
+        # a key without ttl counts as an infinite ttl for GT/LT
+        if 'gt' in flags and (current is None or deadline <= current):
+            return 0
+        if 'lt' in flags and current is not None and deadline >= current:
+            return 0
+        self.set_deadline(key, deadline)
+        return 1
 
-            now = time.time()
-            # we can add some grace period here, imagine the list is very large, we could fail to
-            # clean up in worst case, but would be picked in next round
-            expired_keys = [key for key, expire_time in self._expire_times.items() if expire_time < now]
-            tasks = []
-            for key in expired_keys:
-                tasks.append(self.delete_by_key(key))
+    def ttl(self, key, unit: str = 'ms') -> int:
+        """
+        :return: the remaining time to live in ms or seconds, -2 for a missing key, -1 without ttl
+        """
+        if self._lookup(key) is None:
+            return -2
+        deadline = self.expires.get(key)
+        if deadline is None:
+            return -1
+        remaining = max(deadline - now_ms(), 0)
+        return remaining if unit == 'ms' else (remaining + 500) // 1000
+
+    def persist(self, key) -> int:
+        if self._lookup(key) is None:
+            return 0
+        return 1 if self.expires.remove(key) else 0
+
+    def active_expire_cycle(self, stop_at: float) -> int:
+        """
+        removes keys whose deadline passed without anyone reading them, bounded by `stop_at`
+        (a `time.perf_counter` value) so a burst of expiring keys can't stall the event loop
+        :return: number of expired keys
+        """
+        expired = 0
+        data, feed = self.data, RedisCache.invalidation_feed
+        for key in self.expires.pop_expired(now_ms(), stop_at):
+            if data.pop(key, None) is not None:
+                self.table.remove(key)
+            if feed is not None:
+                feed(self.name, key)
+            expired += 1
+        return expired
 
-            await asyncio.gather(*tasks)
+    def save(self) -> bool | str:
+        """writes the snapshot synchronously, every client waits until it is on disk"""
+        if self.bgsave is not None:
+            return BGSAVE_IN_PROGRESS
+        write_snapshot(self.snapshot_file, self.data.items(), self.expires.deadlines, now_ms(),
+                       rdb_compression.value == 'yes')
+        self.dirty = 0
+        self.lastsave = int(time.time())
+        return True
+
+    def background_save(self) -> bool | str:
+        if self.bgsave is not None:
+            return BGSAVE_IN_PROGRESS
+        file_name, compress = self.snapshot_file, rdb_compression.value == 'yes'
+        self.bgsave = BackgroundJob(
+            lambda items, deadlines: write_snapshot(file_name, items, deadlines, now_ms(), compress),
+            self.data, self.expires.deadlines)
+        self._dirty_at_bgsave = self.dirty
+        return True
+
+    def poll_background_save(self) -> Optional[bool]:
+        """:return: None while no save finished, afterwards whether the finished one succeeded"""
+        if self.bgsave is None:
+            return None
+        succeeded = self.bgsave.poll()
+        if succeeded is None:
+            return None
+        if succeeded:
+            # changes made while the child was writing are still unsaved
+            self.dirty -= self._dirty_at_bgsave
+            self.lastsave = int(self.bgsave.started)
+            logger.info("Background saving of %s terminated with success", self.name)
+        else:
+            logger.warning("Background saving of %s failed", self.name)
+        self.bgsave = None
+        return succeeded
+
+    def open_append_only_file(self):
+        """
+        starts logging the writes. Unless the keyspace was just replayed from it, the existing file
+        doesn't describe the keyspace, it is replaced by a rewrite before anything is appended
+        """
+        if self.aof is not None:
+            return
+        self.aof = AppendOnlyFile(self.aof_file, wait_rewrite=not self._aof_loaded)
+        if self.aof.waiting_rewrite:
+            self.aof.start_rewrite(self.data, self.expires.deadlines, now_ms())
 
-    def save(self):
-        with open(self.file_name, 'w') as file:
-            json.dump(self.data, file)
+    def close_append_only_file(self):
+        if self.aof is not None:
+            self.aof.close()
+            self.aof = None
+            self._aof_loaded = False
+
+    def rewrite_append_only_file(self) -> bool | str:
+        if self.aof is None:
+            return ErrorReply("-ERR Append only file is disabled, enable it with CONFIG SET appendonly yes")
+        if self.aof.rewrite is not None:
+            return ErrorReply("-ERR Background append only file rewriting already in progress")
+        self.aof.start_rewrite(self.data, self.expires.deadlines, now_ms())
+        return True
+
+    def _replay_steps(self) -> Iterator[int]:
+        """
+        replays the logged commands a chunk at a time. A command cut off by a crash while it was
+        written is dropped and the file is truncated to the last complete one, so new commands
+        don't end up behind garbage. The commands are applied past the maxmemory limit, they were
+        accepted once and the keyspace they rebuild fitted then.
+        """
+        # the handler module imports this one
+        from commandhandler.handler import CommandHandler
+        from commandhandler.parser import CommandParser
+        handler = CommandHandler(self)
+        parser = CommandParser()
+        size = 0
+        with open(self.aof_file, 'rb') as file:
+            while chunk := file.read(LOAD_CHUNK_SIZE):
+                size += len(chunk)
+                parser.feed(chunk)
+                for command in parser:
+                    reply = handler.apply(command)
+                    if is_error(reply):
+                        logger.warning("Replaying %s from %s failed: %s", command[0], self.aof_file, reply[1:])
+                yield size
+        if parser.consumed() < size:
+            logger.warning("%s ends with an incomplete command, truncating %d bytes",
+                           self.aof_file, size - parser.consumed())
+            os.truncate(self.aof_file, parser.consumed())
+        self.dirty = 0
+        self._aof_loaded = True
+
+    def save_due(self, rules: list[tuple[int, int]], now: float) -> bool:
+        return any(self.dirty >= changes and now - self.lastsave >= seconds for seconds, changes in rules)
+
+    def _snapshot_steps(self) -> Iterator[int]:
+        block: dict = {}
+        deadlines: dict[str, int] = {}
+        for loaded in iter_snapshot(self.snapshot_file, block, deadlines):
+            if deadlines:
+                now = now_ms()
+                for key, deadline in deadlines.items():
+                    if deadline <= now:
+                        del block[key]
+                    else:
+                        self.expires.set(key, deadline)
+                deadlines.clear()
+            self._store_loaded(block)
+            block.clear()
+            yield loaded
+
+    def _store_loaded(self, values: dict):
+        """adds keys read from disk, which the keyspace doesn't hold yet"""
+        self.data.update(values)
+        self.table.store_many(list(values),
+                              [KEY_OVERHEAD + len(key) + value_size(value) for key, value in values.items()])
+
+    def _json_steps(self) -> Iterator[int]:
+        # caches saved before the binary snapshot format
+        data_from_store = self.read_from_fs(self.file_name)
+        self._store_loaded({key: RedisList(value) if isinstance(value, list) else value
+                            for key, value in data_from_store.items()})
+        yield os.path.getsize(self.file_name)
+
+    def begin_loading(self) -> Iterator[int]:
+        """
+        starts loading the stored keyspace, the append only file takes priority as it is at least
+        as recent as the snapshot. Until the returned steps are exhausted `loading` reports the
+        progress and clients get LOADING_REPLY. A damaged file leaves the keyspace unavailable,
+        serving it empty would overwrite the file on the next save.
+        :return: generator doing one piece of the work per step (a snapshot block, a chunk of the log)
+        """
+        if append_only.value == 'yes' and os.path.isfile(self.aof_file):
+            file_name, steps = self.aof_file, self._replay_steps()
+        elif os.path.isfile(self.snapshot_file):
+            file_name, steps = self.snapshot_file, self._snapshot_steps()
+        else:
+            file_name, steps = self.file_name, self._json_steps()
+        self.loading = LoadProgress(file_name, os.path.getsize(file_name))
+        return self._loading_steps(steps)
+
+    def _loading_steps(self, steps: Iterator[int]) -> Iterator[int]:
+        progress = self.loading
+        try:
+            for loaded in steps:
+                progress.loaded_bytes = loaded
+                progress.keys = len(self.data)
+                yield loaded
+        except Exception as error:
+            progress.error = str(error)
+            raise
+        finally:
+            progress.finish()
+            self.last_load = progress
+        self.loading = None
+        if append_only.value == 'yes':
+            self.open_append_only_file()
 
     @staticmethod
     def read_from_fs(file_name):
@@ -151,72 +572,713 @@ class RedisCache:
         except IOError:
             return {}
 
+    def get_string(self, key):
+        """the string value, an int if it is integer encoded"""
+        value = self._lookup(key)
+        if value is not None and type(value) not in STRING_TYPES:
+            return WRONGTYPE
+        return value
+
+    def _get_list(self, key, create: bool = False) -> RedisList | str | None:
+        """
+        :return: the list stored at key, a new empty one if `create` is set and the key is missing,
+        WRONGTYPE if the key holds something else
+        """
+        value = self._lookup(key)
+        if value is None:
+            if not create:
+                return None
+            value = RedisList()
+            self._store(key, value)
+        elif not isinstance(value, RedisList):
+            return WRONGTYPE
+        return value
+
+    def _drop_if_empty(self, key, values: RedisList):
+        # like redis, a list which lost its last element stops existing
+        if not values:
+            self.delete_by_key(key)
+
     def lrange(self, values):
         if len(values) < 3:
-            return "-ERR wrong number of arguments for command\r\n";
+            return ErrorReply("-ERR wrong number of arguments for command")
         key, start, end = values
-        data = self.data.get(key, [])
         try:
-            return data[int(start):int(end) + 1]
-        except IndexError:
-            return []
+            start, end = int(start), int(end)
+        except ValueError:
+            return NOT_AN_INTEGER
+        existing = self._get_list(key)
+        if existing is None or isinstance(existing, str):
+            return existing if existing else []
+        return existing.range(start, end)
 
     def append_to_tail(self, values):
         key, *tail = values
         # as rpush inserts in order
-        existing_data: list | None = self.data.get(key, None)
-        if not existing_data:
-            self.data[key] = list(tail)
-        else:
-            self.data[key].extend(list(values))
-        return len(self.data.get(key))
+        existing = self._get_list(key, create=True)
+        if isinstance(existing, str):
+            return existing
+        existing.extend(tail)
+        self.table.resize(key, element_size(tail))
+        if key in self.blocked:
+            self.ready_keys[key] = None
+        return len(existing)
 
     def append_to_head(self, values):
         key, *tail = values
-        # as lpush inserts in reversed
-        reversed_tail = tail[::-1]
-        existing_data: list | None = self.data.get(key, None)
-        if not existing_data:
-            self.data[key] = list(reversed_tail)
+        # LPUSH a b c inserts one element after the other at the head, the list reads c b a
+        existing = self._get_list(key, create=True)
+        if isinstance(existing, str):
+            return existing
+        existing.extendleft(tail)
+        self.table.resize(key, element_size(tail))
+        if key in self.blocked:
+            self.ready_keys[key] = None
+        return len(existing)
+
+    def pop(self, key, count=None, from_head: bool = True):
+        """
+        LPOP/RPOP key [count]
+        :return: the element, a list of elements if a count was given, None for a missing key
+        """
+        if count is not None:
+            try:
+                count = int(count)
+            except ValueError:
+                count = -1
+            if count < 0:
+                return ErrorReply("-ERR value is out of range, must be positive")
+        existing = self._get_list(key)
+        if existing is None or isinstance(existing, str):
+            return existing
+        if count is None:
+            value = existing.popleft() if from_head else existing.pop()
+            self.table.resize(key, -ELEMENT_OVERHEAD - len(value))
+        else:
+            value = existing.pop_many(count, from_head)
+            self.table.resize(key, -element_size(value))
+        self._drop_if_empty(key, existing)
+        return value
+
+    def move(self, source, destination, from_head: bool, to_head: bool):
+        """
+        LMOVE, pops an element from one end of source and pushes it to one end of destination
+        :return: the element, None if source is missing, WRONGTYPE if either key is no list
+        """
+        existing = self._get_list(source)
+        if existing is None or isinstance(existing, str):
+            return existing
+        if source != destination and isinstance(self._get_list(destination), str):
+            return WRONGTYPE
+        value = existing.popleft() if from_head else existing.pop()
+        self.table.resize(source, -ELEMENT_OVERHEAD - len(value))
+        self._drop_if_empty(source, existing)
+        if to_head:
+            self.append_to_head((destination, value))
         else:
-            self.data[key].extend(list(reversed_tail))
-        return len(self.data.get(key))
+            self.append_to_tail((destination, value))
+        return value
 
-    def decrement(self, key) -> str | int:
-        target = self.data.get(key, None)
+    def list_length(self, key) -> int | str:
+        existing = self._get_list(key)
+        if existing is None or isinstance(existing, str):
+            return existing or 0
+        return len(existing)
+
+    def list_index(self, key, index):
         try:
-            incremented_value = int(target) - 1
-            self.data[key] = str(incremented_value)
-            return incremented_value
+            index = int(index)
         except ValueError:
-            return "-value is not an integer or out of range"
+            return NOT_AN_INTEGER
+        existing = self._get_list(key)
+        if existing is None or isinstance(existing, str):
+            return existing
+        index = existing.normalize_index(index)
+        return None if index is None else existing[index]
 
-    def increment(self, key) -> str | int:
-        print(f"{key=}")
-        target = self.data.get(key, None)
+    def list_set(self, key, index, value) -> bool | str:
         try:
-            incremented_value = int(target) + 1
-            self.data[key] = str(incremented_value)
-            return incremented_value
+            index = int(index)
         except ValueError:
-            return "-value is not an integer or out of range"
+            return NOT_AN_INTEGER
+        existing = self._get_list(key)
+        if existing is None:
+            return ErrorReply("-ERR no such key")
+        if isinstance(existing, str):
+            return existing
+        index = existing.normalize_index(index)
+        if index is None:
+            return ErrorReply("-ERR index out of range")
+        self.table.resize(key, len(value) - len(existing[index]))
+        existing[index] = value
+        return True
 
-    def is_expiration_in_past(self, expire_type, ttl):
-        if expire_type == "exat":
-            return time.time() > ttl
-        if expire_type == "pxat":
-            return time.time() > ttl * 1000
+    def list_trim(self, key, start, end) -> bool | str:
+        try:
+            start, end = int(start), int(end)
+        except ValueError:
+            return NOT_AN_INTEGER
+        existing = self._get_list(key)
+        if isinstance(existing, str):
+            return existing
+        if existing is not None:
+            self.table.resize(key, -element_size(existing.trim(start, end)))
+            self._drop_if_empty(key, existing)
+        return True
+
+    def list_remove(self, key, count, value) -> int | str:
+        try:
+            count = int(count)
+        except ValueError:
+            return NOT_AN_INTEGER
+        existing = self._get_list(key)
+        if existing is None or isinstance(existing, str):
+            return existing or 0
+        removed = existing.remove_occurrences(count, value)
+        self.table.resize(key, -removed * (ELEMENT_OVERHEAD + len(value)))
+        self._drop_if_empty(key, existing)
+        return removed
+
+    def _get_hash(self, key, create: bool = False) -> RedisHash | str | None:
+        """like `_get_list`, for hashes"""
+        value = self._lookup(key)
+        if value is None:
+            if not create:
+                return None
+            value = RedisHash()
+            self._store(key, value)
+        elif type(value) is not RedisHash:
+            return WRONGTYPE
+        return value
+
+    def hash_set(self, key, pairs) -> int | str:
+        """HSET, the number of fields which were new"""
+        existing = self._get_hash(key, create=True)
+        if isinstance(existing, str):
+            return existing
+        before = existing.nbytes
+        added = sum(existing.set(field, value) for field, value in pairs)
+        self.table.resize(key, existing.nbytes - before)
+        return added
+
+    def hash_get(self, key, field):
+        existing = self._get_hash(key)
+        if existing is None or isinstance(existing, str):
+            return existing
+        return existing.get(field)
+
+    def hash_get_many(self, key, fields) -> list | str:
+        existing = self._get_hash(key)
+        if existing is None:
+            return [None] * len(fields)
+        if isinstance(existing, str):
+            return existing
+        return list(map(existing.get, fields))
+
+    def hash_get_all(self, key) -> list | str:
+        existing = self._get_hash(key)
+        if existing is None or isinstance(existing, str):
+            return existing or []
+        return existing.flat()
+
+    def hash_delete(self, key, fields) -> int | str:
+        existing = self._get_hash(key)
+        if existing is None or isinstance(existing, str):
+            return existing or 0
+        before = existing.nbytes
+        removed = sum(map(existing.delete, fields))
+        if not existing:
+            self.delete_by_key(key)
+        else:
+            self.table.resize(key, existing.nbytes - before)
+        return removed
+
+    def hash_length(self, key) -> int | str:
+        existing = self._get_hash(key)
+        if existing is None or isinstance(existing, str):
+            return existing or 0
+        return len(existing)
+
+    def hash_exists(self, key, field) -> int | str:
+        existing = self._get_hash(key)
+        if existing is None or isinstance(existing, str):
+            return existing or 0
+        return int(field in existing)
+
+    def hash_increment_by(self, key, field, delta: int) -> int | str:
+        """HINCRBY, a missing field counts as 0"""
+        existing = self._get_hash(key, create=True)
+        if isinstance(existing, str):
+            return existing
+        value = existing.get(field)
+        number = 0 if value is None else parse_integer(value)
+        if number is None:
+            return ErrorReply("-ERR hash value is not an integer")
+        result = number + delta
+        if not LLONG_MIN <= result <= LLONG_MAX:
+            return OVERFLOW
+        before = existing.nbytes
+        existing.set(field, str(result))
+        self.table.resize(key, existing.nbytes - before)
+        return result
+
+    def hash_scan(self, key, cursor: int, count: int, pattern: Optional[str] = None) -> tuple[int, list] | str:
+        """HSCAN, the next cursor and the matching fields and values of this step"""
+        existing = self._get_hash(key)
+        if existing is None or isinstance(existing, str):
+            return existing or (0, [])
+        cursor, items = existing.scan(cursor, count)
+        if pattern is not None:
+            fields = set(filter_glob(pattern, (field for field, _ in items)))
+            items = [item for item in items if item[0] in fields]
+        return cursor, [part for item in items for part in item]
+
+    def _get_zset(self, key, create: bool = False) -> SortedSet | str | None:
+        """like `_get_list`, for sorted sets"""
+        value = self._lookup(key)
+        if value is None:
+            if not create:
+                return None
+            value = SortedSet()
+            self._store(key, value)
+        elif type(value) is not SortedSet:
+            return WRONGTYPE
+        return value
+
+    def _zset_changed(self, key, existing: SortedSet, before: int):
+        if not existing:
+            self.delete_by_key(key)
+        else:
+            self.table.resize(key, existing.nbytes - before)
+
+    def zset_add(self, key, pairs, condition: Optional[str] = None, compare: Optional[str] = None,
+                 changed: bool = False, increment: bool = False):
+        """
+        ZADD with its NX/XX (`condition`), GT/LT (`compare`), CH and INCR options
+        :return: the number of added (with CH: added or updated) members, with INCR the new score
+        or None if the options prevented the update
+        """
+        existing = self._get_zset(key)
+        if isinstance(existing, str):
+            return existing
+        if existing is None:
+            if condition == 'xx':
+                return None if increment else 0
+            existing = SortedSet()
+            self._store(key, existing)
+        before = existing.nbytes
+        added = updated = 0
+        result = None
+        for score, member in pairs:
+            old = existing.score(member)
+            if old is None:
+                if condition == 'xx':
+                    continue
+                existing.add(member, score)
+                added += 1
+                result = score
+                continue
+            if condition == 'nx':
+                continue
+            new = old + score if increment else score
+            if new != new:
+                self._zset_changed(key, existing, before)
+                return ErrorReply("-ERR resulting score is not a number (NaN)")
+            if (compare == 'gt' and new <= old) or (compare == 'lt' and new >= old):
+                continue
+            result = new
+            if new != old:
+                existing.add(member, new)
+                updated += 1
+        self._zset_changed(key, existing, before)
+        if increment:
+            return result
+        return added + updated if changed else added
+
+    def zset_remove(self, key, members) -> int | str:
+        existing = self._get_zset(key)
+        if existing is None or isinstance(existing, str):
+            return existing or 0
+        before = existing.nbytes
+        removed = sum(map(existing.remove, members))
+        self._zset_changed(key, existing, before)
+        return removed
+
+    def zset_score(self, key, member):
+        existing = self._get_zset(key)
+        if existing is None or isinstance(existing, str):
+            return existing
+        return existing.score(member)
+
+    def zset_length(self, key) -> int | str:
+        existing = self._get_zset(key)
+        if existing is None or isinstance(existing, str):
+            return existing or 0
+        return len(existing)
+
+    def zset_rank(self, key, member, reverse: bool = False):
+        existing = self._get_zset(key)
+        if existing is None or isinstance(existing, str):
+            return existing
+        return existing.rank(member, reverse)
+
+    def zset_range_by_rank(self, key, start: int, stop: int, reverse: bool = False):
+        """
+        ZRANGE and ZREVRANGE by inclusive (possibly negative) ranks
+        :return: the number of pairs and an iterator producing them, WRONGTYPE
+        """
+        existing = self._get_zset(key)
+        if existing is None or isinstance(existing, str):
+            return existing or (0, iter(()))
+        bounds = normalize_range(start, stop, len(existing))
+        if bounds is None:
+            return 0, iter(())
+        start, stop = bounds
+        return stop + 1 - start, existing.range_by_rank(start, stop + 1, reverse)
+
+    def zset_range_by_score(self, key, low: tuple[float, bool], high: tuple[float, bool], reverse: bool = False,
+                            offset: int = 0, limit: int = -1):
+        """
+        ZRANGEBYSCORE and ZRANGE BYSCORE, `low` and `high` are (score, excluded) bounds, with `reverse`
+        the pairs come from the highest score down. LIMIT skips `offset` pairs and returns at most
+        `limit` (all if negative).
+        :return: the number of pairs and an iterator producing them, WRONGTYPE
+        """
+        existing = self._get_zset(key)
+        if existing is None or isinstance(existing, str):
+            return existing or (0, iter(()))
+        first = existing.rank_of_score(low[0], after=low[1])
+        end = existing.rank_of_score(high[0], after=not high[1])
+        if offset < 0 or first >= end:
+            return 0, iter(())
+        if reverse:
+            # ranks counted from the highest score
+            first, end = len(existing) - end, len(existing) - first
+        start = first + offset
+        stop = end if limit < 0 else min(end, start + limit)
+        if start >= stop:
+            return 0, iter(())
+        return stop - start, existing.range_by_rank(start, stop, reverse)
+
+    def zset_count(self, key, low: tuple[float, bool], high: tuple[float, bool]) -> int | str:
+        existing = self._get_zset(key)
+        if existing is None or isinstance(existing, str):
+            return existing or 0
+        return max(existing.rank_of_score(high[0], after=not high[1]) - existing.rank_of_score(low[0], after=low[1]), 0)
+
+    def zset_pop(self, key, count: int, lowest: bool = True) -> list | str:
+        """ZPOPMIN / ZPOPMAX, the removed (score, member) pairs"""
+        existing = self._get_zset(key)
+        if existing is None or isinstance(existing, str):
+            return existing or []
+        before = existing.nbytes
+        removed = existing.pop(count, lowest)
+        self._zset_changed(key, existing, before)
+        return removed
+
+    def increment_by(self, key, delta: int) -> int | str:
+        """INCR, DECR, INCRBY and DECRBY, a missing key counts as 0 and a ttl stays"""
+        value = self._lookup(key)
+        kind = type(value)
+        if kind is not int:
+            if value is None:
+                value = 0
+            elif kind is str or kind is bytes or kind is bytearray:
+                value = parse_integer(value)
+                if value is None:
+                    return NOT_AN_INTEGER
+            else:
+                return WRONGTYPE
+        result = value + delta
+        if not LLONG_MIN <= result <= LLONG_MAX:
+            return OVERFLOW
+        result = shared(result)
+        if kind is int:
+            # an int replaces an int, the size the table accounts for stays the same
+            self.data[key] = result
+        else:
+            self._store(key, result)
+        return result
+
+    def increment(self, key) -> int | str:
+        return self.increment_by(key, 1)
+
+    def decrement(self, key) -> int | str:
+        return self.increment_by(key, -1)
+
+    def increment_by_float(self, key, delta: str) -> str:
+        """INCRBYFLOAT, the result is stored in its string form (an int if it is integral) and returned"""
+        increment = parse_float(delta)
+        if increment is None:
+            return NOT_A_FLOAT
+        value = self._lookup(key)
+        if value is None:
+            value = 0
+        elif type(value) is not int and type(value) in STRING_TYPES:
+            value = parse_float(value)
+            if value is None:
+                return NOT_A_FLOAT
+        elif type(value) is not int:
+            return WRONGTYPE
+        result = value + increment
+        if math.isnan(result) or math.isinf(result):
+            return ErrorReply("-ERR increment would produce NaN or Infinity")
+        formatted = format_float(result)
+        self._store(key, encode_string(formatted))
+        return formatted
+
+    def get_set(self, key, value):
+        """GETSET, the old value (None if there was none), the ttl is gone like after SET"""
+        old = self.get_string(key)
+        if old is WRONGTYPE:
+            return old
+        self._store(key, encode_string(value))
+        self.expires.remove(key)
+        return old
+
+    def get_delete(self, key):
+        """GETDEL, the value of a string key which is deleted"""
+        value = self.get_string(key)
+        if value is not None and value is not WRONGTYPE:
+            self.delete_by_key(key)
+        return value
+
+    def _mutable_string(self, key, value) -> bytearray:
+        """the value as a bytearray, stored in its place, APPEND and SETRANGE change it in place from then on"""
+        if type(value) is not bytearray:
+            value = bytearray(to_bytes(value))
+            self.data[key] = value
+        return value
+
+    def append(self, key, value) -> int | str:
+        """APPEND, the length of the value after appending, a missing key is created like by SET"""
+        current = self._lookup(key)
+        if current is None:
+            self._store(key, encode_string(value) if type(value) is str else value)
+            return string_length(value)
+        if type(current) not in STRING_TYPES:
+            return WRONGTYPE
+        data = to_bytes(value)
+        if string_length(current) + len(data) > MAX_BULK_LENGTH:
+            return TOO_LARGE
+        current = self._mutable_string(key, current)
+        current += data
+        self.table.store(key, KEY_OVERHEAD + len(key) + value_size(current))
+        return len(current)
+
+    def get_range(self, key, start, end):
+        """GETRANGE, the bytes from start to end (both included), a view of a binary value"""
+        try:
+            start, end = int(start), int(end)
+        except ValueError:
+            return NOT_AN_INTEGER
+        value = self.get_string(key)
+        if value is None:
+            return b""
+        if value is WRONGTYPE:
+            return value
+        if type(value) is str and value.isascii():
+            # text is short, the parser decodes nothing longer than MAX_DECODED_LENGTH
+            data = value
+        else:
+            data = memoryview(to_bytes(value))
+        length = len(data)
+        if start < 0:
+            start = max(length + start, 0)
+        if end < 0:
+            end = length + end
+        end = min(end, length - 1)
+        if start > end or not length:
+            return b""
+        return data[start:end + 1].encode() if type(data) is str else data[start:end + 1]
+
+    def set_range(self, key, offset, value) -> int | str:
+        """SETRANGE, overwrites the value from offset on, padding it with zero bytes up to there"""
+        try:
+            offset = int(offset)
+        except ValueError:
+            return NOT_AN_INTEGER
+        if offset < 0:
+            return ErrorReply("-ERR offset is out of range")
+        data = to_bytes(value)
+        if data and offset + len(data) > MAX_BULK_LENGTH:
+            return TOO_LARGE
+        current = self._lookup(key)
+        if current is None:
+            if not data:
+                return 0
+            current = bytearray()
+            self._store(key, current)
+        elif type(current) not in STRING_TYPES:
+            return WRONGTYPE
+        elif not data:
+            return string_length(current)
+        else:
+            current = self._mutable_string(key, current)
+        if len(current) < offset:
+            current += bytes(offset - len(current))
+        current[offset:offset + len(data)] = data
+        self.table.store(key, KEY_OVERHEAD + len(key) + value_size(current))
+        return len(current)
+
+    def string_length(self, key) -> int | str:
+        """STRLEN, in bytes, 0 for a missing key"""
+        value = self.get_string(key)
+        if value is None or value is WRONGTYPE:
+            return value or 0
+        return string_length(value)
+
+    def _hyperloglog(self, key):
+        """the HyperLogLog at key in the form it is stored, None if the key is missing, or the error"""
+        value = self._lookup(key)
+        if value is None:
+            return None
+        if type(value) not in STRING_TYPES:
+            return WRONGTYPE
+        if not hyperloglog.is_valid(to_bytes(value)):
+            return hyperloglog.INVALID_HLL
+        return value
+
+    def pf_add(self, key, elements) -> int | str:
+        """PFADD, 1 if a register changed or the key was created, a value can change its encoding"""
+        value = self._hyperloglog(key)
+        if is_error(value):
+            return value
+        created = value is None
+        data = hyperloglog.new() if created else self._mutable_string(key, value)
+        result = hyperloglog.add(data, elements)
+        if is_error(result):
+            return result
+        if result is None and not created:
+            return 0
+        self._store(key, data if result is None else result)
+        return 1
+
+    def pf_count(self, keys) -> int | str:
+        """PFCOUNT, the estimate for the union of the keys, missing keys are empty"""
+        if len(keys) == 1:
+            value = self._hyperloglog(keys[0])
+            if value is None:
+                return 0
+            if is_error(value):
+                return value
+            # the estimate is cached in the header, in place
+            data = self._mutable_string(keys[0], value)
+            if data is not value:
+                self.table.store(keys[0], KEY_OVERHEAD + len(keys[0]) + value_size(data))
+            return hyperloglog.count(data)
+        all_registers = self._hyperloglog_registers(keys)
+        if is_error(all_registers):
+            return all_registers
+        merged = hyperloglog.merge(all_registers)
+        return hyperloglog.count(merged)
+
+    def pf_merge(self, destination, sources) -> bool | str:
+        """PFMERGE, the destination becomes the union of itself and the sources"""
+        all_registers = self._hyperloglog_registers((destination, *sources))
+        if is_error(all_registers):
+            return all_registers
+        self._store(destination, hyperloglog.merge(all_registers))
+        return True
+
+    def _hyperloglog_registers(self, keys) -> list[bytes] | str:
+        all_registers = []
+        for key in keys:
+            value = self._hyperloglog(key)
+            if value is None:
+                continue
+            if is_error(value):
+                return value
+            registers = hyperloglog.registers_of(to_bytes(value))
+            if registers is None:
+                return hyperloglog.CORRUPTED
+            all_registers.append(registers)
+        return all_registers
+
+    def set_bit(self, key, offset, bit) -> int | str:
+        """SETBIT, the bit it had before, the value grows with zero bytes up to the offset"""
+        offset = bitmap.parse_offset(offset)
+        if offset is None:
+            return bitmap.BIT_OFFSET_ERROR
+        bit = bitmap.parse_bit(bit)
+        if bit is None:
+            return bitmap.BIT_ERROR
+        current = self._lookup(key)
+        if current is None:
+            current = bytearray()
+        elif type(current) not in STRING_TYPES:
+            return WRONGTYPE
+        else:
+            current = self._mutable_string(key, current)
+        old = bitmap.set_bit(current, offset, bit)
+        self._store(key, current)
+        return old
+
+    def get_bit(self, key, offset) -> int | str:
+        offset = bitmap.parse_offset(offset)
+        if offset is None:
+            return bitmap.BIT_OFFSET_ERROR
+        value = self.get_string(key)
+        if value is None or value is WRONGTYPE:
+            return value or 0
+        return bitmap.get_bit(to_bytes(value), offset)
+
+    def bit_count(self, key, start=None, end=None, in_bits: bool = False) -> int | str:
+        """BITCOUNT, the bits set in the whole value or from start to end, in bytes or bits"""
+        value = self.get_string(key)
+        if value is None or value is WRONGTYPE:
+            return value or 0
+        data = to_bytes(value)
+        bits = (0, len(data) * 8 - 1) if start is None else bitmap.bit_range(len(data), start, end, in_bits)
+        if bits is None or not data:
+            return 0
+        return bitmap.count_bits(data, *bits)
+
+    def bit_position(self, key, bit: int, start=None, end=None, in_bits: bool = False) -> int | str:
+        """BITPOS, the first bit set to `bit`, -1 if there is none"""
+        value = self.get_string(key)
+        if value is WRONGTYPE:
+            return value
+        data = b"" if value is None else to_bytes(value)
+        if not data:
+            # a missing key is all zeros
+            return -1 if bit else 0
+        bits = bitmap.bit_range(len(data), 0 if start is None else start, -1 if end is None else end, in_bits)
+        if bits is None:
+            return -1
+        position = bitmap.bit_position(data, bit, *bits)
+        if position == -1 and not bit and end is None:
+            # without an end the value counts as padded with zeros
+            return bits[1] + 1
+        return position
+
+    def bit_operation(self, operation: str, destination, keys) -> int | str:
+        """BITOP, the length of the result, which replaces the destination; an empty result deletes it"""
+        sources = []
+        for key in keys:
+            value = self.get_string(key)
+            if value is WRONGTYPE:
+                return value
+            sources.append(b"" if value is None else to_bytes(value))
+        result = bitmap.bit_operation(operation, sources)
+        if not result:
+            self.delete_by_key(destination)
+            return 0
+        self._store(destination, bytearray(result))
+        self.expires.remove(destination)
+        return len(result)
 
 
 class CacheHolder:
     _instance: 'CacheHolder' = None
-    _client_caches: list[RedisCache] = []
+    _client_caches: dict[str, RedisCache] = {}
     _loop: AbstractEventLoop = None
+    _cron_cursor: int = 0
 
     def __new__(cls):
         if not cls._instance:
             cls._instance = super().__new__(cls)
-            cls._instance._client_caches: list[RedisCache] = []
+            cls._instance._client_caches: dict[str, RedisCache] = {}
         return cls._instance
 
     @classmethod
@@ -226,41 +1288,138 @@ class CacheHolder:
         :param name:
         :return:
         """
-        return next(
-            (cache for cache in cls._instance._client_caches if cache.get_name() == name),
-            None
-        )
+        return cls._instance._client_caches.get(name, None)
 
     @classmethod
-    def get_client_fs(cls, name) -> Optional[RedisCache]:
-        data_from_store = RedisCache.read_from_fs(f"{RedisCache.FILE_STORE}{name}.json")
-        cache = cls._add_cache(name)
-        cache.data = data_from_store
+    def get_client_fs(cls, name, background: bool = False) -> Optional[RedisCache]:
+        """
+        loads the keyspace from the file system, with `background` the load runs as a task of the
+        event loop a time budget at a time and the cache is returned right away, still loading
+        """
+        return cls._load(cls._add_cache(name), background)
+
+    @classmethod
+    def _load(cls, cache: RedisCache, background: bool) -> RedisCache:
+        steps = cache.begin_loading()
+        if background:
+            cache.loading.task = asyncio.get_running_loop().create_task(load_in_background(steps, cache.loading))
+        else:
+            for _ in steps:
+                pass
         return cache
 
+    @classmethod
+    def reload(cls, name: str) -> RedisCache:
+        """replaces the keyspace by the one stored on disk, the clients keep working on the same cache"""
+        cache = cls.get_client_cache(name) or cls._add_cache(name)
+        cache.reset()
+        return cls._load(cache, background=True)
+
+    @classmethod
+    def keyspaces(cls) -> list[RedisCache]:
+        return list(cls._instance._client_caches.values()) if cls._instance else []
+
+    @classmethod
+    def stored_keyspaces(cls) -> list[str]:
+        """the names of the keyspaces with files in the working directory, loaded or not"""
+        prefix, names = RedisCache.FILE_STORE, set()
+        for file_name in os.listdir('.'):
+            if file_name.startswith(prefix):
+                for extension in ('.aof', '.rdb', '.json'):
+                    if file_name.endswith(extension):
+                        names.add(file_name[len(prefix):-len(extension)])
+        return sorted(names)
+
     @classmethod
     def _add_cache(cls, name: str):
         new_cache = RedisCache(name)
-        cls._instance._client_caches.append(new_cache)
+        cls._instance._client_caches[name] = new_cache
         return new_cache
 
     @classmethod
     def is_existing(cls, name: str):
-        cache = next(
-            (cache for cache in cls._instance._client_caches if cache.get_name() == name),
-            None
-        )
-        return bool(cache)
+        return name in cls._instance._client_caches
 
     @classmethod
     def is_in_fs_existing(cls, name: str):
-        file_path = f"{RedisCache.FILE_STORE}{name}.json"
-        return os.path.isfile(file_path)
+        return any(os.path.isfile(f"{RedisCache.FILE_STORE}{name}.{extension}")
+                   for extension in ('aof', 'rdb', 'json'))
 
     @classmethod
-    def acquire_cache(cls, name) -> RedisCache:
-        if cls.is_existing(name):
-            return cls.get_client_cache(name)
+    def acquire_cache(cls, name, background: bool = False) -> RedisCache:
+        cache = cls.get_client_cache(name)
+        if cache is not None:
+            return cache
         if cls.is_in_fs_existing(name):
-            return cls.get_client_fs(name)
-        return cls._add_cache(name)
+            # opens the append only file once it is loaded
+            return cls.get_client_fs(name, background)
+        cache = cls._add_cache(name)
+        if append_only.value == 'yes':
+            cache.open_append_only_file()
+        return cache
+
+    @classmethod
+    def cron(cls):
+        """
+        periodic housekeeping, called by the server cron. The expire budget is shared by all
+        keyspaces, each tick starts with the next one so a huge keyspace can't starve the others
+        """
+        caches = list(cls._instance._client_caches.values())
+        if not caches:
+            return
+        cls._persistence_cron(caches)
+        stop_at = time.perf_counter() + ACTIVE_EXPIRE_CYCLE_BUDGET_MS / 1000
+        cls._cron_cursor = (cls._cron_cursor + 1) % len(caches)
+        for index in range(len(caches)):
+            caches[(cls._cron_cursor + index) % len(caches)].active_expire_cycle(stop_at)
+            if time.perf_counter() >= stop_at:
+                break
+
+    @classmethod
+    def _persistence_cron(cls, caches: list[RedisCache]):
+        """reaps finished background saves and starts new ones according to the `save` rules"""
+        now = time.time()
+        for cache in caches:
+            if cache.aof is not None:
+                cache.aof.cron()
+                if cache.aof.waiting_rewrite and cache.aof.rewrite is None:
+                    # the first rewrite failed, the log can't start without one
+                    cache.aof.start_rewrite(cache.data, cache.expires.deadlines, now_ms())
+            if cache.bgsave is not None:
+                cache.poll_background_save()
+            elif save_rules.value and cache.save_due(save_rules.value, now):
+                logger.info("%d changes in %s, saving", cache.dirty, cache.name)
+                cache.background_save()
+
+    @classmethod
+    def set_append_only(cls, enabled: bool):
+        if cls._instance is None:
+            return
+        for cache in cls._instance._client_caches.values():
+            if cache.loading is not None:
+                # opened or not once loading finished
+                continue
+            if enabled:
+                cache.open_append_only_file()
+            else:
+                cache.close_append_only_file()
+
+    @classmethod
+    def shutdown(cls):
+        """syncs what is still buffered, whatever the fsync policy"""
+        if cls._instance is None:
+            return
+        for cache in cls._instance._client_caches.values():
+            cache.close_append_only_file()
+
+    @classmethod
+    def free_memory(cls, current: RedisCache) -> bool:
+        """evicts keys of all keyspaces until the memory is below maxmemory"""
+        caches = list(cls._instance._client_caches.values()) if cls._instance else []
+        if current not in caches:
+            caches.append(current)
+        return evictor.evict(caches)
+
+
+append_only = ServerConfig.register('appendonly', 'no', parse_choice('yes', 'no'),
+                                    on_change=lambda value: CacheHolder.set_append_only(value == 'yes'))
@@ -0,0 +1,287 @@
+"""
+Memory accounting and the maxmemory eviction policies.
+
+Every keyspace keeps a KeyTable: one slot per key in parallel arrays holding the key, its
+estimated size and its packed access metadata, so the metadata costs two machine words per key
+instead of Python objects. The slot array also allows drawing random keys in O(1), which is what
+eviction needs: like redis it doesn't keep a global LRU/LFU order but samples a few keys per round
+and evicts the best candidate of a small pool carried over between rounds.
+"""
+import random
+import sys
+from array import array
+from collections import deque
+from itertools import count, islice
+from typing import Callable
+
+from commandhandler.config import ServerConfig, parse_choice, parse_number
+from commandhandler.utils import ErrorReply
+from storage.hashtype import RedisHash
+from storage.zsettype import SortedSet
+
+# estimated bytes per key beyond the key itself: dict entries of the keyspace and of the slot
+# index, the key object, the slot arrays
+KEY_OVERHEAD = 160
+STRING_OVERHEAD = sys.getsizeof("")
+LIST_OVERHEAD = sys.getsizeof(deque())
+# integer encoded values, whatever their magnitude
+INT_SIZE = sys.getsizeof(2 ** 62)
+# the element object and its pointer in the deque
+ELEMENT_OVERHEAD = STRING_OVERHEAD + 8
+
+# access metadata: the logical clock of the last access above the 8 bit LFU counter
+COUNTER_BITS = 8
+COUNTER_MASK = (1 << COUNTER_BITS) - 1
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+# accesses (to any key) after which an untouched LFU counter loses one
+LFU_DECAY_TICKS = 1 << 16
+EVICTION_POOL_SIZE = 16
+
+OOM_REPLY = ErrorReply("-OOM command not allowed when used memory > 'maxmemory'.")
+
+# a global logical clock, every access takes the next tick, so LRU order is exact within the samples
+_clock = count(1)
+
+POLICIES = ('noeviction', 'allkeys-lru', 'volatile-lru', 'allkeys-lfu', 'volatile-lfu',
+            'allkeys-random', 'volatile-random', 'volatile-ttl')
+TRACKING_NONE, TRACKING_LRU, TRACKING_LFU = 0, 1, 2
+
+
+def value_size(value) -> int:
+    kind = type(value)
+    if kind is str or kind is bytes or kind is bytearray:
+        return STRING_OVERHEAD + len(value)
+    if kind is int:
+        return INT_SIZE
+    if kind is RedisHash or kind is SortedSet:
+        return value.nbytes
+    return LIST_OVERHEAD + len(value) * ELEMENT_OVERHEAD + sum(map(len, value))
+
+
+def element_size(elements) -> int:
+    """size of list elements, for the size changes of a list"""
+    return len(elements) * ELEMENT_OVERHEAD + sum(map(len, elements))
+
+
+def parse_memory(raw: str) -> int:
+    """'0', '1048576', '100mb', '1gb', ..."""
+    units = {'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3, 'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3, 'b': 1}
+    value = raw.strip().lower()
+    for unit, factor in units.items():
+        if value.endswith(unit):
+            return parse_number(0, 2 ** 63, int)(value[:-len(unit)]) * factor
+    return parse_number(0, 2 ** 63, int)(value)
+
+
+class MemoryUsage:
+    """the estimated bytes of all keyspaces together, maxmemory is a limit for the whole server"""
+
+    def __init__(self):
+        self.used = 0
+        self.evicted_keys = 0
+
+
+usage = MemoryUsage()
+
+
+class KeyTable:
+    # what accesses record, set from the eviction policy, nothing without maxmemory
+    tracking = TRACKING_NONE
+
+    def __init__(self):
+        self.slot_of: dict[str, int] = {}
+        self.keys: list[str] = []
+        self.sizes = array('Q')
+        self.access = array('Q')
+        self.used = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def store(self, key: str, size: int):
+        """records a new key or the new size of an existing one"""
+        slot = self.slot_of.get(key, None)
+        if slot is None:
+            self.slot_of[key] = len(self.keys)
+            self.keys.append(key)
+            self.sizes.append(size)
+            self.access.append(next(_clock) << COUNTER_BITS | LFU_INIT_VAL)
+            self.used += size
+            usage.used += size
+            return
+        delta = size - self.sizes[slot]
+        self.sizes[slot] = size
+        self.used += delta
+        usage.used += delta
+
+    def store_many(self, keys: list[str], sizes: list[int]):
+        """records keys known to be new, used when a keyspace is loaded"""
+        first = len(self.keys)
+        self.slot_of.update(zip(keys, range(first, first + len(keys))))
+        self.keys += keys
+        self.sizes.extend(sizes)
+        self.access.extend([next(_clock) << COUNTER_BITS | LFU_INIT_VAL] * len(keys))
+        total = sum(sizes)
+        self.used += total
+        usage.used += total
+
+    def resize(self, key: str, delta: int):
+        slot = self.slot_of.get(key, None)
+        if slot is not None:
+            self.sizes[slot] += delta
+            self.used += delta
+            usage.used += delta
+
+    def remove(self, key: str):
+        """the last slot moves into the hole, keeping the arrays dense"""
+        slot = self.slot_of.pop(key, None)
+        if slot is None:
+            return
+        size = self.sizes[slot]
+        self.used -= size
+        usage.used -= size
+        last = len(self.keys) - 1
+        if slot != last:
+            moved = self.keys[last]
+            self.keys[slot] = moved
+            self.sizes[slot] = self.sizes[last]
+            self.access[slot] = self.access[last]
+            self.slot_of[moved] = slot
+        self.keys.pop()
+        self.sizes.pop()
+        self.access.pop()
+
+    def clear(self):
+        usage.used -= self.used
+        self.__init__()
+
+    def touch(self, key: str):
+        slot = self.slot_of.get(key, None)
+        if slot is None:
+            return
+        tick = next(_clock)
+        if KeyTable.tracking == TRACKING_LFU:
+            meta = self.access[slot]
+            counter = decayed_counter(meta, tick)
+            # logarithmic counter, the more hits a key has the less likely the next one counts
+            if counter < COUNTER_MASK and random.random() * ((counter - LFU_INIT_VAL) * LFU_LOG_FACTOR + 1) < 1:
+                counter += 1
+            self.access[slot] = tick << COUNTER_BITS | counter
+        else:
+            self.access[slot] = tick << COUNTER_BITS | (self.access[slot] & COUNTER_MASK)
+
+    def random_slot(self) -> int:
+        return int(random.random() * len(self.keys))
+
+
+def decayed_counter(meta: int, tick: int) -> int:
+    counter = meta & COUNTER_MASK
+    periods = (tick - (meta >> COUNTER_BITS)) // LFU_DECAY_TICKS
+    return max(counter - periods, 0) if periods else counter
+
+
+def _sample(cache, volatile: bool, samples: int) -> list[str]:
+    table = cache.table
+    if not volatile:
+        return [table.keys[table.random_slot()] for _ in range(samples)]
+    deadlines = cache.expires.deadlines
+    if not deadlines:
+        return []
+    keys = []
+    # draw from all keys and keep the volatile ones, with few volatile keys fall back to the first ones
+    for _ in range(samples * 10):
+        key = table.keys[table.random_slot()]
+        if key in deadlines:
+            keys.append(key)
+            if len(keys) == samples:
+                return keys
+    return keys or list(islice(deadlines, samples))
+
+
+def _score(policy: str) -> Callable:
+    """higher scores are evicted first, they stay comparable with the ones pooled in earlier rounds"""
+    tick = next(_clock)
+    if policy.endswith('-lru'):
+        return lambda cache, key: -(cache.table.access[cache.table.slot_of[key]] >> COUNTER_BITS)
+    if policy.endswith('-lfu'):
+        return lambda cache, key: COUNTER_MASK - decayed_counter(cache.table.access[cache.table.slot_of[key]], tick)
+    return lambda cache, key: -cache.expires.deadlines[key]
+
+
+class Evictor:
+    """
+    frees memory until the used memory is below maxmemory. The pool keeps the best candidates
+    seen so far (with their score) across rounds and calls, so the approximation improves with
+    every sample instead of depending on a single draw of `maxmemory-samples` keys.
+    """
+
+    def __init__(self):
+        # (score, id of the cache, cache, key)
+        self.pool: list[tuple] = []
+
+    def evict(self, caches: list) -> bool:
+        """:return: False if nothing more can be evicted while the memory is still above the limit"""
+        policy = maxmemory_policy.value
+        volatile = policy.startswith('volatile')
+        while usage.used > maxmemory.value:
+            if policy == 'noeviction':
+                return False
+            candidates = [cache for cache in caches
+                          if cache.loading is None and (cache.expires.deadlines if volatile else cache.table.keys)]
+            if not candidates:
+                return False
+            if policy.endswith('-random'):
+                cache = random.choice(candidates)
+                keys = _sample(cache, volatile, 1)
+                victim = (cache, keys[0]) if keys else None
+            else:
+                victim = self._best_candidate(candidates, policy, volatile)
+            if victim is None:
+                return False
+            victim[0].evict_key(victim[1])
+            usage.evicted_keys += 1
+        return True
+
+    def _best_candidate(self, caches: list, policy: str, volatile: bool):
+        score = _score(policy)
+        samples = maxmemory_samples.value
+        pool = self.pool
+        for cache in caches:
+            for key in _sample(cache, volatile, samples):
+                pool.append((score(cache, key), id(cache), cache, key))
+        pool.sort(key=lambda entry: entry[0], reverse=True)
+        # duplicates and candidates which are gone by now are dropped on the way
+        seen = set()
+        while pool:
+            _, _, cache, key = pool.pop(0)
+            if (id(cache), key) in seen or key not in cache.data or (volatile and key not in cache.expires.deadlines):
+                continue
+            seen.add((id(cache), key))
+            del pool[EVICTION_POOL_SIZE:]
+            return cache, key
+        return None
+
+    def reset(self):
+        self.pool.clear()
+
+
+evictor = Evictor()
+
+
+def _set_policy(policy: str):
+    if not maxmemory.value:
+        KeyTable.tracking = TRACKING_NONE
+    elif policy.endswith('-lfu'):
+        KeyTable.tracking = TRACKING_LFU
+    else:
+        KeyTable.tracking = TRACKING_LRU
+    evictor.reset()
+
+
+maxmemory_samples = ServerConfig.register('maxmemory-samples', '5', parse_number(1, 64))
+maxmemory = ServerConfig.register('maxmemory', '0', parse_memory)
+maxmemory_policy = ServerConfig.register('maxmemory-policy', 'noeviction', parse_choice(*POLICIES))
+# both decide what accesses record, hooked up once both exist
+maxmemory.on_change = lambda _: _set_policy(maxmemory_policy.value)
+maxmemory_policy.on_change = _set_policy
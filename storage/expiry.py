@@ -0,0 +1,104 @@
+import heapq
+import time
+from typing import Optional
+
+# share of every cron tick the active expire cycle may spend, redis uses 25% of 100ms as well
+ACTIVE_EXPIRE_CYCLE_BUDGET_MS = 25
+# how many keys are expired between two looks at the clock
+ACTIVE_EXPIRE_CYCLE_CHECK_INTERVAL = 64
+# width of a timing wheel slot, a key is actively expired at most this late (reads expire it right away)
+WHEEL_RESOLUTION_MS = 10
+# stale wheel entries (overwritten or removed deadlines) are dropped once they outnumber the live ones
+COMPACTION_MIN_ENTRIES = 1024
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+class ExpiryEngine:
+    """
+    Absolute deadlines (unix time in ms) of the volatile keys of one keyspace.
+
+    `deadlines` is the source of truth. For the active expire cycle the keys are additionally
+    kept in a sparse timing wheel: one slot per WHEEL_RESOLUTION_MS holding the keys due in it,
+    plus a heap of the occupied slot numbers. Setting a deadline is an append, expiring a key
+    a pop, no matter how many keys are volatile. Changing or removing a deadline leaves the old
+    entry behind, it is skipped once its slot is due because it no longer matches `deadlines`.
+    """
+
+    def __init__(self):
+        self.deadlines: dict[str, int] = {}
+        self._slots: dict[int, list] = {}
+        self._slot_heap: list[int] = []
+        self._entries = 0
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def get(self, key) -> Optional[int]:
+        return self.deadlines.get(key, None)
+
+    def set(self, key, deadline: int):
+        self.deadlines[key] = deadline
+        slot_number = deadline // WHEEL_RESOLUTION_MS
+        slot = self._slots.get(slot_number, None)
+        if slot is None:
+            slot = self._slots[slot_number] = []
+            heapq.heappush(self._slot_heap, slot_number)
+        slot.append(key)
+        self._entries += 1
+        if self._entries > COMPACTION_MIN_ENTRIES and self._entries > 2 * len(self.deadlines):
+            self._compact()
+
+    def remove(self, key) -> bool:
+        return self.deadlines.pop(key, None) is not None
+
+    def clear(self):
+        self.deadlines.clear()
+        self._slots.clear()
+        self._slot_heap.clear()
+        self._entries = 0
+
+    def is_expired(self, key, now: Optional[int] = None) -> bool:
+        deadline = self.deadlines.get(key, None)
+        if deadline is None:
+            return False
+        return deadline <= (now if now is not None else now_ms())
+
+    def pop_expired(self, now: int, stop_at: float):
+        """
+        yields the keys whose deadline passed, most overdue first, and removes their deadline.
+        Only slots which lie completely in the past are visited. Stops once `stop_at`
+        (a `time.perf_counter` value) is reached, the rest is picked up by the next cycle
+        or lazily on access.
+        """
+        slot_heap, slots, deadlines = self._slot_heap, self._slots, self.deadlines
+        current_slot = now // WHEEL_RESOLUTION_MS
+        checked = 0
+        while slot_heap and slot_heap[0] < current_slot:
+            slot = slots[slot_heap[0]]
+            while slot:
+                key = slot.pop()
+                self._entries -= 1
+                deadline = deadlines.get(key, None)
+                if deadline is None or deadline > now:
+                    # stale entry, the key got persisted, deleted or a new deadline
+                    continue
+                del deadlines[key]
+                yield key
+                checked += 1
+                if checked % ACTIVE_EXPIRE_CYCLE_CHECK_INTERVAL == 0 and time.perf_counter() >= stop_at:
+                    return
+            del slots[heapq.heappop(slot_heap)]
+
+    def _compact(self):
+        self._slots.clear()
+        self._slot_heap.clear()
+        self._entries = 0
+        deadlines, self.deadlines = self.deadlines, {}
+        for key, deadline in deadlines.items():
+            self.set(key, deadline)
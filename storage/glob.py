@@ -0,0 +1,83 @@
+"""
+Glob patterns as redis matches them (KEYS, SCAN and HSCAN MATCH): `*`, `?`, `[abc]`, `[^abc]`,
+`[a-z]` and `\\x` for a literal x. A pattern is translated into a regular expression once and
+cached, matching a key is then a single call into the regex engine.
+"""
+import re
+from functools import lru_cache
+from typing import Callable, Iterable
+
+from commandhandler.utils import to_text
+
+
+def _translate(pattern: str) -> str:
+    parts = []
+    index, length = 0, len(pattern)
+    while index < length:
+        char = pattern[index]
+        index += 1
+        if char == '*':
+            # consecutive stars are one
+            if not parts or parts[-1] != '.*':
+                parts.append('.*')
+        elif char == '?':
+            parts.append('.')
+        elif char == '\\' and index < length:
+            parts.append(re.escape(pattern[index]))
+            index += 1
+        elif char == '[':
+            end = index
+            if end < length and pattern[end] == '^':
+                end += 1
+            # a ']' right after the opening bracket is part of the set
+            if end < length and pattern[end] == ']':
+                end += 1
+            while end < length and pattern[end] != ']':
+                end += 2 if pattern[end] == '\\' else 1
+            if end >= length:
+                # no closing bracket, redis matches the rest of the set up to the end of the pattern
+                end = length
+            body = pattern[index:end]
+            index = end + 1
+            negate = body.startswith('^')
+            if negate:
+                body = body[1:]
+            items = []
+            position = 0
+            while position < len(body):
+                if body[position] == '\\' and position + 1 < len(body):
+                    items.append(re.escape(body[position + 1]))
+                    position += 2
+                elif position + 2 < len(body) and body[position + 1] == '-':
+                    low, high = sorted((body[position], body[position + 2]))
+                    items.append(f"{re.escape(low)}-{re.escape(high)}")
+                    position += 3
+                else:
+                    items.append(re.escape(body[position]))
+                    position += 1
+            if not items:
+                # an empty set matches nothing, negated it matches any character
+                parts.append('.' if negate else '(?!)')
+            else:
+                parts.append(f"[{'^' if negate else ''}{''.join(items)}]")
+        else:
+            parts.append(re.escape(char))
+    return ''.join(parts)
+
+
+@lru_cache(maxsize=256)
+def compile_glob(pattern: str) -> Callable[[str], object]:
+    """the match function of the pattern, truthy for matching strings"""
+    if pattern == '*':
+        return lambda _: True
+    return re.compile(_translate(pattern), re.DOTALL).fullmatch
+
+
+def filter_glob(pattern, names: Iterable) -> list:
+    """the names matching the pattern, the ones the parser kept as bytes are matched as text"""
+    match = compile_glob(to_text(pattern))
+    names = list(names)
+    try:
+        return list(filter(match, names))
+    except TypeError:
+        return [name for name in names if match(to_text(name))]
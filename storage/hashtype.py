@@ -0,0 +1,169 @@
+"""
+Hash value type with the two encodings of redis.
+
+A small hash is a flat list [field, value, field, value, ...], the role the listpack plays in
+redis: one list object instead of a dict with its hash table, so an object of a few fields costs
+little more than its strings. The field names of compact hashes are interned, objects stored as
+hashes mostly share a handful of field names, and those are then kept once instead of once per
+object. Lookups scan the fields, which is cheap while there are at most
+`hash-max-listpack-entries` of them. A hash that grows past that or gets a field or value longer
+than `hash-max-listpack-value` becomes a dict, and stays one.
+"""
+import sys
+from sys import intern
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from commandhandler.config import ServerConfig, parse_number
+
+max_listpack_entries = ServerConfig.register('hash-max-listpack-entries', '128', parse_number(0, 2 ** 31))
+max_listpack_value = ServerConfig.register('hash-max-listpack-value', '64', parse_number(0, 2 ** 31))
+
+_STRING_OVERHEAD = sys.getsizeof("")
+# the hash object and its list or dict
+COMPACT_OVERHEAD = 48 + sys.getsizeof([])
+TABLE_OVERHEAD = 48 + sys.getsizeof({})
+# per field: the value object (the interned field name is shared) and the two pointers in the list,
+# or the field and value objects and their dict entry (hash, key and value pointers) with its share
+# of the index
+COMPACT_ENTRY_OVERHEAD = _STRING_OVERHEAD + 16
+TABLE_ENTRY_OVERHEAD = 2 * _STRING_OVERHEAD + 40
+
+
+def _find(entries: list, field: str) -> int:
+    """the index of the field in a flat list, -1 if it is missing. Values equal to it are skipped"""
+    start = 0
+    try:
+        while True:
+            index = entries.index(field, start)
+            if not index & 1:
+                return index
+            start = index + 1
+    except ValueError:
+        return -1
+
+
+class RedisHash:
+    __slots__ = ('entries', 'table', 'nbytes')
+
+    def __init__(self, pairs: Iterable[tuple[str, str]] = ()):
+        self.entries: Optional[list[str]] = []
+        self.table: Optional[dict[str, str]] = None
+        # the estimated size, kept up to date by every change for the memory accounting
+        self.nbytes = COMPACT_OVERHEAD
+        for field, value in pairs:
+            self.set(field, value)
+
+    @classmethod
+    def from_flat(cls, entries: list[str]) -> 'RedisHash':
+        """a hash of distinct fields from field, value, field, value, ..., as a snapshot stores it"""
+        value = cls.__new__(cls)
+        limit = max_listpack_value.value
+        entries[::2] = map(intern, entries[::2])
+        value.entries, value.table = entries, None
+        value.nbytes = COMPACT_OVERHEAD + (len(entries) >> 1) * COMPACT_ENTRY_OVERHEAD + sum(map(len, entries))
+        if len(entries) > 2 * max_listpack_entries.value or max(map(len, entries), default=0) > limit:
+            value._convert()
+        return value
+
+    @property
+    def is_compact(self) -> bool:
+        return self.table is None
+
+    def __len__(self) -> int:
+        return len(self.table) if self.entries is None else len(self.entries) >> 1
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.table if self.entries is None else _find(self.entries, field) != -1
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RedisHash) and dict(self.items()) == dict(other.items())
+
+    def __repr__(self) -> str:
+        return f"RedisHash({dict(self.items())!r})"
+
+    def get(self, field: str) -> Optional[str]:
+        entries = self.entries
+        if entries is None:
+            return self.table.get(field, None)
+        index = _find(entries, field)
+        return None if index == -1 else entries[index + 1]
+
+    def set(self, field: str, value: str) -> bool:
+        """:return: whether the field is new"""
+        entries = self.entries
+        if entries is not None:
+            index = _find(entries, field)
+            if index != -1:
+                self.nbytes += len(value) - len(entries[index + 1])
+                entries[index + 1] = value
+                if len(value) > max_listpack_value.value:
+                    self._convert()
+                return False
+            entries += (intern(field), value)
+            self.nbytes += COMPACT_ENTRY_OVERHEAD + len(field) + len(value)
+            if len(entries) > 2 * max_listpack_entries.value or len(field) > max_listpack_value.value \
+                    or len(value) > max_listpack_value.value:
+                self._convert()
+            return True
+        table = self.table
+        old = table.get(field, None)
+        table[field] = value
+        if old is None:
+            self.nbytes += TABLE_ENTRY_OVERHEAD + len(field) + len(value)
+            return True
+        self.nbytes += len(value) - len(old)
+        return False
+
+    def delete(self, field: str) -> bool:
+        entries = self.entries
+        if entries is None:
+            value = self.table.pop(field, None)
+            if value is None:
+                return False
+            self.nbytes -= TABLE_ENTRY_OVERHEAD + len(field) + len(value)
+            return True
+        index = _find(entries, field)
+        if index == -1:
+            return False
+        self.nbytes -= COMPACT_ENTRY_OVERHEAD + len(field) + len(entries[index + 1])
+        del entries[index:index + 2]
+        return True
+
+    def _convert(self):
+        entries = self.entries
+        self.table = dict(zip(islice(entries, 0, None, 2), islice(entries, 1, None, 2)))
+        self.entries = None
+        self.nbytes += TABLE_OVERHEAD - COMPACT_OVERHEAD + \
+            len(self.table) * (TABLE_ENTRY_OVERHEAD - COMPACT_ENTRY_OVERHEAD)
+
+    def items(self) -> Iterator[tuple[str, str]]:
+        if self.entries is None:
+            return iter(self.table.items())
+        entries = self.entries
+        return zip(islice(entries, 0, None, 2), islice(entries, 1, None, 2))
+
+    def flat(self) -> list[str]:
+        """field, value, field, value, ... as HGETALL replies"""
+        if self.entries is None:
+            return [part for item in self.table.items() for part in item]
+        return self.entries.copy()
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[tuple[str, str]]]:
+        """
+        HSCAN, the cursor is the position in insertion order. A compact hash is returned whole,
+        like redis does for listpacks. Fields added during a scan come last, so they are returned
+        at the end; deleting fields before the cursor moves the later ones down, which can skip them.
+        """
+        if self.entries is not None:
+            return 0, list(self.items())
+        chunk = list(islice(self.table.items(), cursor, cursor + count))
+        cursor += len(chunk)
+        return (0 if cursor >= len(self.table) else cursor), chunk
+
+    def copy(self) -> 'RedisHash':
+        clone = RedisHash.__new__(RedisHash)
+        clone.entries = None if self.entries is None else self.entries.copy()
+        clone.table = None if self.table is None else self.table.copy()
+        clone.nbytes = self.nbytes
+        return clone
@@ -0,0 +1,71 @@
+"""
+Integer encoding of string values. A value written in the canonical decimal form of a 64 bit signed
+integer, the form redis accepts as a number (no '+', no leading zeros, no spaces), is kept as an
+int: INCR and friends do the arithmetic without parsing and formatting a string every time, and the
+reply is formatted only when a client reads the value as a string.
+"""
+from typing import Optional
+
+from commandhandler.utils import SHARED_INTEGERS, ErrorReply, to_text
+
+LLONG_MIN = -2 ** 63
+LLONG_MAX = 2 ** 63 - 1
+# like the shared integers of redis, all keys holding a value below SHARED_INTEGERS share one object
+_SHARED = tuple(range(SHARED_INTEGERS))
+
+NOT_AN_INTEGER = ErrorReply("-ERR value is not an integer or out of range")
+NOT_A_FLOAT = ErrorReply("-ERR value is not a valid float")
+OVERFLOW = ErrorReply("-ERR increment or decrement would overflow")
+
+
+def shared(number: int) -> int:
+    return _SHARED[number] if 0 <= number < SHARED_INTEGERS else number
+
+
+def parse_integer(value: str | bytes | bytearray) -> Optional[int]:
+    """the number of a canonical integer string, None for anything else"""
+    length = len(value)
+    if not 0 < length <= 20 or not value.isascii():
+        return None
+    if type(value) is not str:
+        # a value changed by APPEND or SETRANGE
+        value = value.decode()
+    digits = value[1:] if value[0] == '-' else value
+    if not digits.isdigit() or (digits[0] == '0' and length > 1):
+        return None
+    number = int(value)
+    if not LLONG_MIN <= number <= LLONG_MAX:
+        return None
+    return _SHARED[number] if 0 <= number < SHARED_INTEGERS else number
+
+
+def parse_float(value: str | bytes | bytearray) -> Optional[float]:
+    """the number of a float string as strtod reads it, 'inf' included, None for anything else and NaN"""
+    if type(value) is not str:
+        value = to_text(value)
+    if '_' in value or value != value.strip():
+        # python's float() takes these, strtod doesn't
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return None if number != number else number
+
+
+def encode_string(value: str) -> str | int:
+    """the int a string value is stored as if it is an integer, the string itself otherwise"""
+    # most values don't start like a number, one character rules them out
+    first = value[:1]
+    if first.isdigit() or first == '-':
+        number = parse_integer(value)
+        if number is not None:
+            return number
+    return value
+
+
+def format_float(number: float) -> str:
+    """the shortest form reading back as the same double, integral values without a fraction like redis"""
+    if number.is_integer() and abs(number) < 1e17:
+        return str(int(number))
+    return repr(number)
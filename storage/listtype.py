@@ -0,0 +1,84 @@
+from collections import deque
+from itertools import islice
+from typing import Optional
+
+
+def normalize_range(start: int, end: int, length: int) -> Optional[tuple[int, int]]:
+    """
+    resolves redis style inclusive indices (negative ones count from the tail)
+    :return: the clamped (start, end) pair or None if the range is empty
+    """
+    if start < 0:
+        start += length
+    if end < 0:
+        end += length
+    start = max(start, 0)
+    if start > end or start >= length:
+        return None
+    return start, min(end, length - 1)
+
+
+class RedisList(deque):
+    """
+    list value type, a deque gives O(1) push and pop at both ends. Index based access walks
+    from whichever end is closer, so LRANGE/LINDEX near the tail cost as little as near the head.
+    """
+
+    def range(self, start: int, end: int) -> list:
+        bounds = normalize_range(start, end, len(self))
+        if bounds is None:
+            return []
+        start, end = bounds
+        length = len(self)
+        if start <= length - 1 - end:
+            return list(islice(self, start, end + 1))
+        values = list(islice(reversed(self), length - 1 - end, length - start))
+        values.reverse()
+        return values
+
+    def normalize_index(self, index: int) -> Optional[int]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            return None
+        return index
+
+    def pop_many(self, count: int, from_head: bool) -> list:
+        pop = self.popleft if from_head else self.pop
+        return [pop() for _ in range(min(count, len(self)))]
+
+    def trim(self, start: int, end: int) -> list:
+        """
+        keeps only the inclusive range, costs O(removed elements)
+        :return: the removed elements
+        """
+        bounds = normalize_range(start, end, len(self))
+        if bounds is None:
+            removed = list(self)
+            self.clear()
+            return removed
+        start, end = bounds
+        removed = [self.pop() for _ in range(len(self) - 1 - end)]
+        removed += (self.popleft() for _ in range(start))
+        return removed
+
+    def remove_occurrences(self, count: int, value) -> int:
+        """
+        LREM semantics: count > 0 removes the first `count` matches from the head,
+        count < 0 from the tail, 0 removes all of them
+        :return: number of removed elements
+        """
+        limit = abs(count) or len(self)
+        ordered = reversed(self) if count < 0 else iter(self)
+        kept, removed = [], 0
+        for element in ordered:
+            if removed < limit and element == value:
+                removed += 1
+            else:
+                kept.append(element)
+        if removed:
+            if count < 0:
+                kept.reverse()
+            self.clear()
+            self.extend(kept)
+        return removed
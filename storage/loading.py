@@ -0,0 +1,65 @@
+import asyncio
+import time
+from typing import Iterator, Optional
+
+from commandhandler.trace import logger
+from commandhandler.utils import ErrorReply
+
+# longest stretch the event loop spends loading before it serves other clients again
+LOAD_STEP_BUDGET_MS = 10
+LOADING_REPLY = ErrorReply("-LOADING Redis is loading the dataset in memory")
+
+
+class LoadProgress:
+    """how far loading a keyspace from disk got, reported by INFO persistence"""
+
+    def __init__(self, file_name: str, total_bytes: int):
+        self.file_name = file_name
+        self.total_bytes = total_bytes
+        self.loaded_bytes = 0
+        self.keys = 0
+        self.started = time.time()
+        self._started_counter = time.perf_counter()
+        self.duration: Optional[float] = None
+        # longest time a single step held the event loop
+        self.longest_step = 0.0
+        self.error: Optional[str] = None
+        # the task loading in the background, referenced so it isn't garbage collected
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def percentage(self) -> float:
+        return 100 * self.loaded_bytes / self.total_bytes if self.total_bytes else 100.0
+
+    @property
+    def eta_seconds(self) -> float:
+        elapsed = time.perf_counter() - self._started_counter
+        if not self.loaded_bytes:
+            return 0.0
+        return elapsed * (self.total_bytes - self.loaded_bytes) / self.loaded_bytes
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started_counter
+
+
+async def load_in_background(steps: Iterator[int], progress: LoadProgress):
+    """
+    runs the loading steps of a keyspace on the event loop, a time budget at a time. In between,
+    other clients are served and the commands for the keyspace get LOADING_REPLY.
+    """
+    try:
+        while True:
+            started = time.perf_counter()
+            stop_at = started + LOAD_STEP_BUDGET_MS / 1000
+            finished = True
+            for _ in steps:
+                if time.perf_counter() >= stop_at:
+                    finished = False
+                    break
+            progress.longest_step = max(progress.longest_step, time.perf_counter() - started)
+            if finished:
+                return
+            await asyncio.sleep(0)
+    except Exception as error:
+        # the steps recorded the error, the keyspace stays unavailable
+        logger.error("Loading %s failed: %s", progress.file_name, error)
@@ -0,0 +1,434 @@
+"""
+Snapshot file layout (all integers little endian):
+
+    header   MAGIC, version (u8)
+    blocks   type (u8), count (varint), flags (u8), payload length (varint), payload
+    trailer  OPCODE_EOF, crc32 (u32) of everything before it
+
+Entries are grouped into blocks so encoding and decoding work on whole columns at once
+(joined blobs, length arrays) instead of one small write or read per key:
+
+    TYPE_STRING  key lengths (u32 * count), value lengths (u32 * count),
+                 [deadlines (u64 * count)], keys blob, values blob
+    TYPE_LIST    one list per block, count is the number of elements:
+                 key length (u32), [deadline (u64)], element lengths (u32 * count), key, elements blob
+    TYPE_INTEGER integer encoded strings (version 2): key lengths (u32 * count), values (i64 * count),
+                 [deadlines (u64 * count)], keys blob
+    TYPE_HASH    one hash per block (version 3), count is the number of fields: key length (u32),
+                 [deadline (u64)], field and value lengths (u32 * 2 * count), key, fields and values blob
+    TYPE_ZSET    one sorted set per block (version 4), count is the number of members, in score order:
+                 key length (u32), [deadline (u64)], member lengths (u32 * count), scores (f64 * count),
+                 key, members blob
+
+FLAG_COMPRESSED marks a zlib compressed payload, FLAG_DEADLINES a block of volatile keys.
+"""
+import gc
+import os
+import sys
+import zlib
+from array import array
+from itertools import accumulate, pairwise, islice
+from typing import Iterable, BinaryIO, Iterator
+
+from commandhandler.utils import MAX_DECODED_LENGTH, UNICODE_ERRORS, decode_argument, to_bytes, to_text
+from storage.hashtype import RedisHash
+from storage.integers import shared
+from storage.listtype import RedisList
+from storage.zsettype import SortedSet
+
+MAGIC = b"OWNRDB"
+VERSION = 4
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_INTEGER = 2
+TYPE_HASH = 3
+TYPE_ZSET = 4
+OPCODE_EOF = 0xFF
+FLAG_COMPRESSED = 1
+FLAG_DEADLINES = 2
+# entries per string block, big enough to amortize the per block work
+BLOCK_ENTRIES = 4096
+# payloads shorter than this are never compressed, zlib can't win anything on them
+COMPRESSION_MIN_LENGTH = 256
+_SWAP_BYTES = sys.byteorder != 'little'
+# the values written into string blocks, bytearrays are the strings changed by APPEND or SETRANGE
+STRING_BLOCK_TYPES = frozenset((str, bytes, bytearray))
+
+
+class SnapshotError(Exception):
+    def __init__(self, message="Snapshot is corrupt"):
+        self.message = message
+        super().__init__(self.message)
+
+
+def encode_varint(number: int) -> bytes:
+    encoded = bytearray()
+    while number >= 128:
+        encoded.append((number & 0x7F) | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return bytes(encoded)
+
+
+def _read_varint(data, pos: int) -> tuple[int, int]:
+    number, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 128:
+            return number, pos
+        shift += 7
+
+
+def _to_bytes(values: array) -> bytes:
+    if _SWAP_BYTES:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _to_array(typecode: str, data) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if _SWAP_BYTES:
+        values.byteswap()
+    return values
+
+
+def pack_strings(strings: list[str | bytes]) -> tuple[bytes, bytes]:
+    """:return: the utf-8 byte lengths (u32 array) and the joined bytes of the strings"""
+    try:
+        text = "".join(strings)
+    except TypeError:
+        # binary values among them
+        encoded = list(map(to_bytes, strings))
+        return _to_bytes(array('I', map(len, encoded))), b"".join(encoded)
+    blob = text.encode("utf-8", UNICODE_ERRORS)
+    if len(blob) == len(text):
+        # pure ascii, character and byte lengths are the same
+        return _to_bytes(array('I', map(len, strings))), blob
+    encoded = [string.encode("utf-8", UNICODE_ERRORS) for string in strings]
+    return _to_bytes(array('I', map(len, encoded))), b"".join(encoded)
+
+
+def unpack_strings(lengths: array, blob) -> list[str | bytes]:
+    """the strings in the form the parser hands them out, the ones above MAX_DECODED_LENGTH as bytes"""
+    offsets = accumulate(lengths, initial=0)
+    blob = bytes(blob)
+    if lengths and max(lengths) > MAX_DECODED_LENGTH:
+        return [decode_argument(blob[start:end]) for start, end in pairwise(offsets)]
+    text = blob.decode("utf-8", UNICODE_ERRORS)
+    if len(text) == len(blob):
+        # one character per byte, ascii or bytes escaped as surrogates
+        return [text[start:end] for start, end in pairwise(offsets)]
+    return [blob[start:end].decode("utf-8", UNICODE_ERRORS) for start, end in pairwise(offsets)]
+
+
+class SnapshotWriter:
+    """collects entries into blocks and streams them into a binary file, keeping the running checksum"""
+
+    def __init__(self, file: BinaryIO, compress: bool = True):
+        self._file = file
+        self.compress = compress
+        self._crc = 0
+        self._keys: list[str] = []
+        self._values: list[str] = []
+        self._volatile_keys: list[str] = []
+        self._volatile_values: list[str] = []
+        self._deadlines = array('Q')
+        self._int_keys: list[str] = []
+        self._int_values = array('q')
+        self._volatile_int_keys: list[str] = []
+        self._volatile_int_values = array('q')
+        self._int_deadlines = array('Q')
+        self._write(MAGIC + bytes((VERSION,)))
+
+    def write_entry(self, key: str, value, deadline: int | None = None):
+        if type(value) in STRING_BLOCK_TYPES:
+            if deadline is None:
+                self._keys.append(key)
+                self._values.append(value)
+                if len(self._keys) >= BLOCK_ENTRIES:
+                    self._write_strings(self._keys, self._values, None)
+            else:
+                self._volatile_keys.append(key)
+                self._volatile_values.append(value)
+                self._deadlines.append(deadline)
+                if len(self._volatile_keys) >= BLOCK_ENTRIES:
+                    self._write_strings(self._volatile_keys, self._volatile_values, self._deadlines)
+        elif type(value) is int:
+            if deadline is None:
+                self._int_keys.append(key)
+                self._int_values.append(value)
+                if len(self._int_keys) >= BLOCK_ENTRIES:
+                    self._write_integers(self._int_keys, self._int_values, None)
+            else:
+                self._volatile_int_keys.append(key)
+                self._volatile_int_values.append(value)
+                self._int_deadlines.append(deadline)
+                if len(self._volatile_int_keys) >= BLOCK_ENTRIES:
+                    self._write_integers(self._volatile_int_keys, self._volatile_int_values, self._int_deadlines)
+        elif isinstance(value, RedisList):
+            self._write_list(key, value, deadline)
+        elif type(value) is RedisHash:
+            self._write_hash(key, value, deadline)
+        elif type(value) is SortedSet:
+            self._write_zset(key, value, deadline)
+        else:
+            raise SnapshotError(f"can't store values of type {type(value).__name__}")
+
+    def write_entries(self, items: Iterable[tuple[str, object]], deadlines: dict[str, int], now: int):
+        """
+        writes all entries, skipping the ones whose deadline passed. Entries are taken a block at a
+        time and a block of plain strings (or of counters) without ttls, the common case, is written
+        without looking at its entries one by one.
+        """
+        items = iter(items)
+        while chunk := list(islice(items, BLOCK_ENTRIES)):
+            keys, values = zip(*chunk)
+            if not deadlines or deadlines.keys().isdisjoint(keys):
+                types = set(map(type, values))
+                if types <= STRING_BLOCK_TYPES:
+                    self._write_strings(list(keys), list(values), None)
+                    continue
+                if types == {int}:
+                    self._write_integers(list(keys), array('q', values), None)
+                    continue
+            for key, value in chunk:
+                deadline = deadlines.get(key, None) if deadlines else None
+                if deadline is not None and deadline <= now:
+                    continue
+                self.write_entry(key, value, deadline)
+
+    def finish(self):
+        if self._keys:
+            self._write_strings(self._keys, self._values, None)
+        if self._volatile_keys:
+            self._write_strings(self._volatile_keys, self._volatile_values, self._deadlines)
+        if self._int_keys:
+            self._write_integers(self._int_keys, self._int_values, None)
+        if self._volatile_int_keys:
+            self._write_integers(self._volatile_int_keys, self._volatile_int_values, self._int_deadlines)
+        self._write(bytes((OPCODE_EOF,)))
+        self._file.write(self._crc.to_bytes(4, 'little'))
+
+    def _write_strings(self, keys: list[str], values: list[str], deadlines: array | None):
+        key_lengths, key_blob = pack_strings(keys)
+        value_lengths, value_blob = pack_strings(values)
+        parts = [key_lengths, value_lengths]
+        if deadlines is not None:
+            parts.append(_to_bytes(deadlines))
+        parts += (key_blob, value_blob)
+        self._write_block(TYPE_STRING, len(keys), b"".join(parts), deadlines is not None)
+        keys.clear()
+        values.clear()
+        if deadlines is not None:
+            del deadlines[:]
+
+    def _write_integers(self, keys: list[str], values: array, deadlines: array | None):
+        key_lengths, key_blob = pack_strings(keys)
+        parts = [key_lengths, _to_bytes(values)]
+        if deadlines is not None:
+            parts.append(_to_bytes(deadlines))
+        parts.append(key_blob)
+        self._write_block(TYPE_INTEGER, len(keys), b"".join(parts), deadlines is not None)
+        keys.clear()
+        del values[:]
+        if deadlines is not None:
+            del deadlines[:]
+
+    def _write_list(self, key: str, elements: RedisList, deadline: int | None):
+        encoded_key = to_bytes(key)
+        parts = [len(encoded_key).to_bytes(4, 'little')]
+        if deadline is not None:
+            parts.append(deadline.to_bytes(8, 'little'))
+        lengths, blob = pack_strings(list(elements))
+        parts += (lengths, encoded_key, blob)
+        self._write_block(TYPE_LIST, len(elements), b"".join(parts), deadline is not None)
+
+    def _write_hash(self, key: str, value: RedisHash, deadline: int | None):
+        encoded_key = to_bytes(key)
+        parts = [len(encoded_key).to_bytes(4, 'little')]
+        if deadline is not None:
+            parts.append(deadline.to_bytes(8, 'little'))
+        lengths, blob = pack_strings(value.flat())
+        parts += (lengths, encoded_key, blob)
+        self._write_block(TYPE_HASH, len(value), b"".join(parts), deadline is not None)
+
+    def _write_zset(self, key: str, value: SortedSet, deadline: int | None):
+        encoded_key = to_bytes(key)
+        parts = [len(encoded_key).to_bytes(4, 'little')]
+        if deadline is not None:
+            parts.append(deadline.to_bytes(8, 'little'))
+        pairs = list(value.pairs())
+        lengths, blob = pack_strings([member for _, member in pairs])
+        parts += (lengths, _to_bytes(array('d', [score for score, _ in pairs])), encoded_key, blob)
+        self._write_block(TYPE_ZSET, len(pairs), b"".join(parts), deadline is not None)
+
+    def _write_block(self, kind: int, count: int, payload: bytes, has_deadlines: bool):
+        flags = FLAG_DEADLINES if has_deadlines else 0
+        if self.compress and len(payload) >= COMPRESSION_MIN_LENGTH:
+            compressed = zlib.compress(payload, 1)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= FLAG_COMPRESSED
+        self._write(bytes((kind,)) + encode_varint(count) + bytes((flags,)) + encode_varint(len(payload)))
+        self._write(payload)
+
+    def _write(self, chunk: bytes):
+        self._crc = zlib.crc32(chunk, self._crc)
+        self._file.write(chunk)
+
+
+def write_snapshot(file_name: str, items: Iterable[tuple[str, object]], deadlines: dict[str, int],
+                   now: int, compress: bool = True):
+    """
+    writes the entries into a temporary file which replaces `file_name` once it is complete
+    and synced, a crash in between leaves the previous snapshot untouched. Keys whose
+    deadline already passed are skipped.
+    """
+    temp_name = f"{file_name}.tmp-{os.getpid()}"
+    with open(temp_name, 'wb', buffering=1024 * 1024) as file:
+        writer = SnapshotWriter(file, compress)
+        writer.write_entries(items, deadlines, now)
+        writer.finish()
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_name, file_name)
+
+
+def read_block(kind: int, count: int, flags: int, payload, values: dict, deadlines: dict[str, int]):
+    """decodes one block into `values` and `deadlines`"""
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    payload = memoryview(payload)
+    if kind == TYPE_STRING:
+        key_lengths = _to_array('I', payload[:4 * count])
+        value_lengths = _to_array('I', payload[4 * count:8 * count])
+        pos = 8 * count
+        block_deadlines = None
+        if flags & FLAG_DEADLINES:
+            block_deadlines = _to_array('Q', payload[pos:pos + 8 * count])
+            pos += 8 * count
+        keys_end = pos + sum(key_lengths)
+        keys = unpack_strings(key_lengths, payload[pos:keys_end])
+        values.update(zip(keys, unpack_strings(value_lengths, payload[keys_end:])))
+        if block_deadlines is not None:
+            deadlines.update(zip(keys, block_deadlines))
+    elif kind == TYPE_LIST or kind == TYPE_HASH:
+        key_length = int.from_bytes(payload[:4], 'little')
+        pos = 4
+        deadline = None
+        if flags & FLAG_DEADLINES:
+            deadline = int.from_bytes(payload[pos:pos + 8], 'little')
+            pos += 8
+        strings = count if kind == TYPE_LIST else 2 * count
+        lengths = _to_array('I', payload[pos:pos + 4 * strings])
+        pos += 4 * strings
+        key = decode_argument(payload[pos:pos + key_length])
+        elements = unpack_strings(lengths, payload[pos + key_length:])
+        values[key] = RedisList(elements) if kind == TYPE_LIST else RedisHash.from_flat(elements)
+        if deadline is not None:
+            deadlines[key] = deadline
+    elif kind == TYPE_INTEGER:
+        key_lengths = _to_array('I', payload[:4 * count])
+        numbers = _to_array('q', payload[4 * count:12 * count])
+        pos = 12 * count
+        block_deadlines = None
+        if flags & FLAG_DEADLINES:
+            block_deadlines = _to_array('Q', payload[pos:pos + 8 * count])
+            pos += 8 * count
+        keys = unpack_strings(key_lengths, payload[pos:])
+        values.update(zip(keys, map(shared, numbers)))
+        if block_deadlines is not None:
+            deadlines.update(zip(keys, block_deadlines))
+    elif kind == TYPE_ZSET:
+        key_length = int.from_bytes(payload[:4], 'little')
+        pos = 4
+        deadline = None
+        if flags & FLAG_DEADLINES:
+            deadline = int.from_bytes(payload[pos:pos + 8], 'little')
+            pos += 8
+        lengths = _to_array('I', payload[pos:pos + 4 * count])
+        scores = _to_array('d', payload[pos + 4 * count:pos + 12 * count])
+        pos += 12 * count
+        key = decode_argument(payload[pos:pos + key_length])
+        # members are always text, also the long ones
+        members = list(map(to_text, unpack_strings(lengths, payload[pos + key_length:])))
+        values[key] = SortedSet.from_sorted(list(zip(scores, members)))
+        if deadline is not None:
+            deadlines[key] = deadline
+    else:
+        raise SnapshotError(f"Snapshot is corrupt: unknown block type {kind}")
+
+
+def _read_stream_varint(file: BinaryIO) -> tuple[int, bytes]:
+    """:return: the number and its raw bytes, which go into the checksum"""
+    raw = bytearray()
+    while True:
+        byte = file.read(1)
+        if not byte:
+            raise SnapshotError("Snapshot is truncated")
+        raw += byte
+        if byte[0] < 128:
+            return _read_varint(raw, 0)[0], bytes(raw)
+
+
+def iter_snapshot(file_name: str, values: dict, deadlines: dict[str, int]) -> Iterator[int]:
+    """
+    decodes the snapshot a block at a time into `values` and `deadlines`, so a caller can load a
+    huge file in steps. The checksum covers the whole file, it is verified after the last block.
+    :return: generator of the number of bytes read so far, after every block
+    :raises SnapshotError: if the file isn't a snapshot, has an unknown version or a wrong checksum
+    """
+    with open(file_name, 'rb') as file:
+        header = file.read(len(MAGIC) + 1)
+        if len(header) < len(MAGIC) + 1 or not header.startswith(MAGIC):
+            raise SnapshotError(f"{file_name} is not a snapshot")
+        if header[-1] > VERSION:
+            raise SnapshotError(f"{file_name} has the unsupported version {header[-1]}")
+        crc = zlib.crc32(header)
+        position = len(header)
+        while True:
+            kind = file.read(1)
+            if not kind:
+                raise SnapshotError(f"{file_name} is truncated")
+            crc = zlib.crc32(kind, crc)
+            if kind[0] == OPCODE_EOF:
+                break
+            count, raw_count = _read_stream_varint(file)
+            flags = file.read(1)
+            length, raw_length = _read_stream_varint(file)
+            payload = file.read(length)
+            if not flags or len(payload) < length:
+                raise SnapshotError(f"{file_name} is truncated")
+            for chunk in (raw_count, flags, raw_length, payload):
+                crc = zlib.crc32(chunk, crc)
+            # thousands of new objects and not a single cycle among them, collections would only cost time
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                read_block(kind[0], count, flags[0], payload, values, deadlines)
+            except (IndexError, ValueError, zlib.error):
+                raise SnapshotError(f"{file_name} is corrupt")
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+            position += 1 + len(raw_count) + 1 + len(raw_length) + length
+            yield position
+        trailer = file.read(5)
+        if len(trailer) != 4 or int.from_bytes(trailer, 'little') != crc:
+            raise SnapshotError(f"{file_name} has a wrong checksum")
+
+
+def read_snapshot(file_name: str) -> tuple[dict, dict[str, int]]:
+    """
+    :return: the stored key/value pairs and the deadlines of the volatile keys
+    :raises SnapshotError: if the file isn't a snapshot, has an unknown version or a wrong checksum
+    """
+    values: dict = {}
+    deadlines: dict[str, int] = {}
+    for _ in iter_snapshot(file_name, values, deadlines):
+        pass
+    return values, deadlines
@@ -0,0 +1,251 @@
+"""
+Sorted set value type: a dict member -> score for O(1) ZSCORE, and the (score, member) pairs in
+order for ranks and ranges.
+
+The order is kept the way sortedcontainers does it rather than in a skiplist: a list of sorted
+buckets of at most 2 * BUCKET_LOAD pairs and the largest pair of each bucket. Finding a pair is a
+bisect over the maxima and one inside a bucket, inserting moves at most a bucket's worth of
+pointers, all of it in C, where every level of a skiplist would be a Python loop. A Fenwick tree
+over the bucket lengths turns a bucket position into a rank and a rank into a bucket position in
+O(log buckets), so ZRANK and index ranges don't add up the buckets in front of them.
+"""
+import sys
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional
+
+from commandhandler.utils import to_text
+from storage.integers import parse_float
+
+BUCKET_LOAD = 512
+_score = itemgetter(0)
+_STRING_OVERHEAD = sys.getsizeof("")
+ZSET_OVERHEAD = 48 + sys.getsizeof({}) + 2 * sys.getsizeof([])
+# per member: its string, the score float, the (score, member) tuple and its pointer in the
+# bucket, the dict entry with its share of the index
+ZSET_ENTRY_OVERHEAD = _STRING_OVERHEAD + sys.getsizeof(0.0) + sys.getsizeof((0.0, "")) + 8 + 40
+
+
+def parse_score(raw: str) -> Optional[float]:
+    """a score as redis accepts it: a float, 'inf', '+inf' or '-inf', but never NaN"""
+    return parse_float(raw)
+
+
+def parse_score_bound(raw: str) -> Optional[tuple[float, bool]]:
+    """'1.5', '(1.5', '-inf' or '+inf', :return: the score and whether it is excluded from the range"""
+    exclusive = raw[:1] == '('
+    score = parse_score(raw[1:] if exclusive else raw)
+    return None if score is None else (score, exclusive)
+
+
+class SortedSet:
+    __slots__ = ('scores', '_buckets', '_maxes', '_tree', 'nbytes')
+
+    def __init__(self, pairs: Iterable[tuple[float, str]] = ()):
+        self.scores: dict[str, float] = {}
+        self._buckets: list[list[tuple[float, str]]] = []
+        self._maxes: list[tuple[float, str]] = []
+        # Fenwick tree over the bucket lengths, None after the buckets were split or dropped
+        self._tree: Optional[list[int]] = None
+        self.nbytes = ZSET_OVERHEAD
+        for score, member in pairs:
+            self.add(member, score)
+
+    @classmethod
+    def from_sorted(cls, pairs: list[tuple[float, str]]) -> 'SortedSet':
+        """a set from distinct members already in (score, member) order, as a snapshot stores them"""
+        value = cls()
+        value._buckets = [pairs[start:start + BUCKET_LOAD] for start in range(0, len(pairs), BUCKET_LOAD)]
+        value._maxes = [bucket[-1] for bucket in value._buckets]
+        value.scores = {member: score for score, member in pairs}
+        value.nbytes += len(pairs) * ZSET_ENTRY_OVERHEAD + sum(len(member) for member in value.scores)
+        return value
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SortedSet) and self.scores == other.scores
+
+    def __repr__(self) -> str:
+        return f"SortedSet({list(self.pairs())!r})"
+
+    def copy(self) -> 'SortedSet':
+        return SortedSet.from_sorted(list(self.pairs()))
+
+    # changes
+
+    def add(self, member: str, score: float) -> bool:
+        """adds the member or moves it to its new score, :return: whether it is new"""
+        if type(member) is not str:
+            # members are ordered among each other, a huge one the parser kept as bytes becomes text
+            member = to_text(member)
+        old = self.scores.get(member, None)
+        if old is not None:
+            if old == score:
+                return False
+            self._remove_pair((old, member))
+        else:
+            self.nbytes += ZSET_ENTRY_OVERHEAD + len(member)
+        self.scores[member] = score
+        self._insert_pair((score, member))
+        return old is None
+
+    def remove(self, member: str) -> bool:
+        member = to_text(member)
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        self._remove_pair((score, member))
+        self.nbytes -= ZSET_ENTRY_OVERHEAD + len(member)
+        return True
+
+    def pop(self, count: int, from_lowest: bool = True) -> list[tuple[float, str]]:
+        """ZPOPMIN / ZPOPMAX, the removed pairs, lowest or highest score first"""
+        count = min(count, len(self))
+        removed = list(self.range_by_rank(0, count, reverse=not from_lowest))
+        for _, member in removed:
+            self.remove(member)
+        return removed
+
+    def _insert_pair(self, pair: tuple[float, str]):
+        buckets, maxes = self._buckets, self._maxes
+        if not buckets:
+            buckets.append([pair])
+            maxes.append(pair)
+            self._tree = None
+            return
+        index = bisect_right(maxes, pair)
+        if index == len(buckets):
+            index -= 1
+            buckets[index].append(pair)
+            maxes[index] = pair
+        else:
+            insort(buckets[index], pair)
+        bucket = buckets[index]
+        if len(bucket) > 2 * BUCKET_LOAD:
+            buckets.insert(index + 1, bucket[BUCKET_LOAD:])
+            del bucket[BUCKET_LOAD:]
+            maxes.insert(index, bucket[-1])
+            self._tree = None
+        elif self._tree is not None:
+            self._update(index, 1)
+
+    def _remove_pair(self, pair: tuple[float, str]):
+        buckets, maxes = self._buckets, self._maxes
+        index = bisect_left(maxes, pair)
+        bucket = buckets[index]
+        position = bisect_left(bucket, pair)
+        del bucket[position]
+        if not bucket:
+            del buckets[index]
+            del maxes[index]
+            self._tree = None
+            return
+        if position == len(bucket):
+            maxes[index] = bucket[-1]
+        if self._tree is not None:
+            self._update(index, -1)
+
+    # the Fenwick tree, tree[i] holds the length of the buckets (i - (i & -i), i]
+
+    def _build(self) -> list[int]:
+        tree = [0]
+        tree += map(len, self._buckets)
+        size = len(tree)
+        for index in range(1, size):
+            parent = index + (index & -index)
+            if parent < size:
+                tree[parent] += tree[index]
+        self._tree = tree
+        return tree
+
+    def _update(self, bucket: int, delta: int):
+        tree = self._tree
+        index = bucket + 1
+        size = len(tree)
+        while index < size:
+            tree[index] += delta
+            index += index & -index
+
+    def _before(self, bucket: int) -> int:
+        """the number of pairs in the buckets before this one"""
+        tree = self._tree or self._build()
+        total = 0
+        while bucket:
+            total += tree[bucket]
+            bucket -= bucket & -bucket
+        return total
+
+    def _locate(self, rank: int) -> tuple[int, int]:
+        """the bucket and the position in it of the pair with this rank"""
+        tree = self._tree or self._build()
+        bucket = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            following = bucket + step
+            if following < len(tree) and tree[following] <= rank:
+                bucket = following
+                rank -= tree[following]
+            step >>= 1
+        return bucket, rank
+
+    # queries
+
+    def score(self, member: str) -> Optional[float]:
+        return self.scores.get(member if type(member) is str else to_text(member), None)
+
+    def rank(self, member: str, reverse: bool = False) -> Optional[int]:
+        member = to_text(member)
+        score = self.scores.get(member, None)
+        if score is None:
+            return None
+        pair = (score, member)
+        index = bisect_left(self._maxes, pair)
+        rank = self._before(index) + bisect_left(self._buckets[index], pair)
+        return len(self.scores) - 1 - rank if reverse else rank
+
+    def rank_of_score(self, score: float, after: bool) -> int:
+        """the number of members with a lower score, or lower or equal one with `after`"""
+        search = bisect_right if after else bisect_left
+        index = search(self._maxes, score, key=_score)
+        if index == len(self._buckets):
+            return len(self.scores)
+        return self._before(index) + search(self._buckets[index], score, key=_score)
+
+    def range_by_rank(self, start: int, stop: int, reverse: bool = False) -> Iterator[tuple[float, str]]:
+        """
+        the pairs from rank `start` up to, not including, `stop`, both clamped already. Counted from
+        the highest score with `reverse`. The pairs are produced lazily, a reply streams them.
+        """
+        count = stop - start
+        if count <= 0:
+            return iter(())
+        if reverse:
+            return self._backwards(len(self.scores) - 1 - start, count)
+        return self._forwards(start, count)
+
+    def _forwards(self, rank: int, count: int) -> Iterator[tuple[float, str]]:
+        bucket, position = self._locate(rank)
+        buckets = self._buckets
+        while count > 0:
+            chunk = buckets[bucket][position:position + count]
+            yield from chunk
+            count -= len(chunk)
+            bucket += 1
+            position = 0
+
+    def _backwards(self, rank: int, count: int) -> Iterator[tuple[float, str]]:
+        bucket, position = self._locate(rank)
+        buckets = self._buckets
+        while count > 0:
+            chunk = buckets[bucket][max(position + 1 - count, 0):position + 1]
+            chunk.reverse()
+            yield from chunk
+            count -= len(chunk)
+            bucket -= 1
+            position = len(buckets[bucket]) - 1 if bucket >= 0 else 0
+
+    def pairs(self) -> Iterator[tuple[float, str]]:
+        for bucket in self._buckets:
+            yield from bucket
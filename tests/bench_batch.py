@@ -0,0 +1,56 @@
+"""
+Batch commands against one command per key, both through the parser, handler and reply encoder as
+a pipelined client would send them. Reports keys per second for GET vs MGET and SET vs MSET at
+batch sizes 1/10/100/1000 (network round trips not included, they only widen the gap).
+
+    python -m tests.bench_batch [--keys 100000] [--batch-sizes 1 10 100 1000]
+"""
+import argparse
+import time
+
+from commandhandler.handler import CommandHandler
+from commandhandler.parser import CommandParser
+from storage.cache import RedisCache
+from tests.bench_parser import encode_command
+
+
+def run(handler: CommandHandler, frames: bytes) -> float:
+    parser = CommandParser()
+    output = bytearray()
+    started = time.perf_counter()
+    parser.feed(frames)
+    for command in parser.parse():
+        handler.handle_command(command, output)
+    return time.perf_counter() - started
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--keys", type=int, default=100_000)
+    arguments.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    options = arguments.parse_args()
+
+    handler = CommandHandler(RedisCache("bench_batch"))
+    keys = [b"key:%08d" % index for index in range(options.keys)]
+    value = b"x" * 16
+    single = {
+        "SET": b"".join(encode_command(b"SET", key, value) for key in keys),
+        "GET": b"".join(encode_command(b"GET", key) for key in keys),
+    }
+    print(f"{options.keys:,} keys")
+    for batch_size in options.batch_sizes:
+        batches = [keys[index:index + batch_size] for index in range(0, len(keys), batch_size)]
+        batched = {
+            "SET": b"".join(encode_command(b"MSET", *(part for key in batch for part in (key, value)))
+                            for batch in batches),
+            "GET": b"".join(encode_command(b"MGET", *batch) for batch in batches),
+        }
+        for name in ("SET", "GET"):
+            one_by_one = options.keys / run(handler, single[name])
+            together = options.keys / run(handler, batched[name])
+            print(f"  batch {batch_size:>5}  {name} {one_by_one:>12,.0f} keys/sec   "
+                  f"M{name} {together:>12,.0f} keys/sec   {together / one_by_one:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
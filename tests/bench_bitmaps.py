@@ -0,0 +1,79 @@
+"""
+BITCOUNT, BITPOS and BITOP on bitmaps of `--bits` bits with about `--density` of them set, and
+SETBIT of random offsets into them. BITPOS looks for the only set bit, the last one.
+
+In process, every command goes through the parser and CommandHandler like on a connection. The
+'loop' column is the same work done byte by byte in Python, what the commands would cost without
+the big int and regular expression paths (on the first 1M bits only, then scaled).
+
+    python -m tests.bench_bitmaps [--bits 1000000,100000000] [--density 0.01]
+"""
+import argparse
+import random
+import time
+
+from commandhandler.handler import CommandHandler
+from commandhandler.parser import CommandParser
+from storage.cache import RedisCache
+from tests.bench_hyperloglog import execute, rate
+
+LOOP_BYTES = 125000
+
+
+def bitmap(bits: int, density: float) -> bytes:
+    generator = random.Random(1)
+    data = bytearray(bits // 8)
+    for offset in generator.sample(range(bits), int(bits * density)):
+        data[offset >> 3] |= 0x80 >> (offset & 7)
+    return bytes(data)
+
+
+def loop_rates(data: bytes, scale: float) -> dict[str, float]:
+    data = data[:LOOP_BYTES]
+    started = time.perf_counter()
+    sum(bin(byte).count("1") for byte in data)
+    count = scale / (time.perf_counter() - started)
+    started = time.perf_counter()
+    next((position for position, byte in enumerate(bytes(len(data))) if byte), None)
+    position = scale / (time.perf_counter() - started)
+    started = time.perf_counter()
+    bytes(first & second for first, second in zip(data, data))
+    operation = scale / (time.perf_counter() - started)
+    return {"BITCOUNT": count, "BITPOS": position, "BITOP": operation}
+
+
+def run(bits: int, density: float) -> dict[str, float]:
+    handler, parser = CommandHandler(RedisCache("bench_bitmaps")), CommandParser()
+    first, second = bitmap(bits, density), bitmap(bits, density)[::-1]
+    execute(handler, parser, b"SET", b"first", first)
+    execute(handler, parser, b"SET", b"second", second)
+    # the only set bit is the last one, BITPOS searches the whole value
+    execute(handler, parser, b"SET", b"last", bytes(bits // 8 - 1) + b"\x01")
+    generator = random.Random(2)
+    offsets = [b"%d" % generator.randrange(bits) for _ in range(100000)]
+    started = time.perf_counter()
+    for offset in offsets:
+        execute(handler, parser, b"SETBIT", b"first", offset, b"1")
+    return {
+        "SETBIT": len(offsets) / (time.perf_counter() - started),
+        "BITCOUNT": rate(lambda: execute(handler, parser, b"BITCOUNT", b"first")),
+        "BITPOS": rate(lambda: execute(handler, parser, b"BITPOS", b"last", b"1")),
+        "BITOP": rate(lambda: execute(handler, parser, b"BITOP", b"AND", b"result", b"first", b"second")),
+    }
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--bits", default="1000000,100000000")
+    arguments.add_argument("--density", type=float, default=0.01)
+    options = arguments.parse_args()
+    for bits in map(int, options.bits.split(",")):
+        result = run(bits, options.density)
+        loop = loop_rates(bitmap(min(bits, LOOP_BYTES * 8), options.density), LOOP_BYTES * 8 / bits)
+        print(f"{bits:>12,} bits: SETBIT {result['SETBIT']:>9,.0f}/s, "
+              + ", ".join(f"{name} {result[name]:>8,.1f}/s (loop {loop[name]:>6,.2f}/s)"
+                          for name in ("BITCOUNT", "BITPOS", "BITOP")))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Job queue wakeup latency: 1k consumers blocked in BLPOP on one queue, a producer pushing one job
+at a time with the time it was pushed. A consumer reports the time from the push until its BLPOP
+returned and blocks again. For comparison, the same consumers polling with LPOP and a sleep
+between empty replies, the way the job workers did it before, and the CPU time the server spent.
+
+The server runs in a subprocess, the consumers in another process reading with asyncio.
+
+    python -m tests.bench_blocking [--consumers 1000] [--jobs 5000] [--rate 2000] [--poll-interval 0.01]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+
+from tests.bench_workers import encode, serve
+
+QUEUE = b"jobs"
+
+
+def consume(port: int, consumers: int, jobs: int, mode: str, poll_interval: float, ready, results):
+    """all consumers in one process, puts the latencies in ms once every job was taken"""
+
+    async def consumer(latencies: list, started: asyncio.Event, done: asyncio.Event, count: list):
+        reader, writer = await asyncio.open_connection("localhost", port)
+        count[0] += 1
+        if count[0] == consumers:
+            started.set()
+        while not done.is_set():
+            if mode == "blocking":
+                writer.write(encode(b"BLPOP", QUEUE, b"1"))
+            else:
+                writer.write(encode(b"LPOP", QUEUE))
+            header = await reader.readline()
+            if header in (b"*-1\r\n", b"$-1\r\n"):
+                if mode == "polling":
+                    await asyncio.sleep(poll_interval)
+                continue
+            if mode == "blocking":
+                await reader.readline()
+                await reader.readline()
+                header = await reader.readline()
+            value = await reader.readexactly(int(header[1:]) + 2)
+            latencies.append((time.time() - float(value)) * 1000)
+            if len(latencies) == jobs:
+                done.set()
+        writer.close()
+
+    async def run():
+        latencies, started, done, count = [], asyncio.Event(), asyncio.Event(), [0]
+        tasks = [asyncio.create_task(consumer(latencies, started, done, count)) for _ in range(consumers)]
+        await started.wait()
+        ready.set()
+        await done.wait()
+        await asyncio.gather(*tasks)
+        results.put(latencies)
+
+    asyncio.run(run())
+
+
+def server_cpu_seconds(pid: int) -> float:
+    """user and system time of the server, from /proc where there is one"""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return float("nan")
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values: list[float], share: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * share))]
+
+
+def run(port: int, mode: str, consumers: int, jobs: int, rate: float, poll_interval: float):
+    with tempfile.TemporaryDirectory() as directory:
+        server = serve(1, port, directory)
+        try:
+            ready, results = multiprocessing.Event(), multiprocessing.Queue()
+            process = multiprocessing.Process(target=consume, args=(port, consumers, jobs, mode, poll_interval,
+                                                                    ready, results))
+            process.start()
+            ready.wait()
+            # the consumers settle into their first BLPOP or poll
+            time.sleep(0.5)
+            cpu = server_cpu_seconds(server.pid)
+            started = time.time()
+            with socket.create_connection(("localhost", port)) as producer:
+                for number in range(jobs):
+                    producer.sendall(encode(b"RPUSH", QUEUE, b"%.6f" % time.time()))
+                    producer.recv(64)
+                    # paced, every job finds the consumers waiting
+                    time.sleep(max(0.0, started + (number + 1) / rate - time.time()))
+            latencies = results.get()
+            elapsed = time.time() - started
+            cpu = server_cpu_seconds(server.pid) - cpu
+            process.join()
+        finally:
+            server.terminate()
+            server.wait()
+    print(f"{mode:>8}, {consumers} consumers, {jobs} jobs at {rate:,.0f}/s: wakeup p50 "
+          f"{percentile(latencies, 0.5):.2f} ms, p99 {percentile(latencies, 0.99):.2f} ms, "
+          f"max {max(latencies):.2f} ms, server cpu {cpu / elapsed * 100:.0f}%")
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--consumers", type=int, default=1000)
+    arguments.add_argument("--jobs", type=int, default=5000)
+    arguments.add_argument("--rate", type=float, default=2000, help="jobs pushed per second")
+    arguments.add_argument("--poll-interval", type=float, default=0.01, help="seconds between polls, 0 skips them")
+    arguments.add_argument("--port", type=int, default=7410)
+    options = arguments.parse_args()
+    run(options.port, "blocking", options.consumers, options.jobs, options.rate, options.poll_interval)
+    if options.poll_interval:
+        run(options.port, "polling", options.consumers, options.jobs, options.rate, options.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+A counter heavy workload: INCR over a set of keys through the parser, handler and reply encoder, with
+integer encoded values against the previous string values (parsed and formatted on every INCR).
+Reports INCRs per second, the memory the values take and the GET of a counter.
+
+    python -m tests.bench_counters [--incrs 1000000] [--keys 10000] [--rounds 3]
+"""
+import argparse
+import random
+import sys
+import time
+
+from commandhandler.handler import CommandHandler
+from commandhandler.parser import CommandParser
+from storage.cache import RedisCache
+from tests.bench_parser import encode_command
+
+
+class StringCounters(RedisCache):
+    """INCR as it was before the integer encoding: the values stay strings"""
+
+    def increment_by(self, key, delta: int):
+        target = self._lookup(key)
+        try:
+            incremented_value = int(target or 0) + delta
+        except ValueError:
+            return "-ERR value is not an integer or out of range"
+        self._store(key, str(incremented_value))
+        return incremented_value
+
+
+def run(handler: CommandHandler, frames: bytes) -> float:
+    parser = CommandParser()
+    output = bytearray()
+    started = time.perf_counter()
+    parser.feed(frames)
+    for command in parser.parse():
+        handler.handle_command(command, output)
+    return time.perf_counter() - started
+
+
+def values_size(cache: RedisCache) -> int:
+    # shared objects are counted once, like the process would hold them
+    return sum(sys.getsizeof(value) for value in {id(value): value for value in cache.data.values()}.values())
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--incrs", type=int, default=1_000_000)
+    arguments.add_argument("--keys", type=int, default=10_000)
+    arguments.add_argument("--rounds", type=int, default=3)
+    options = arguments.parse_args()
+
+    generator = random.Random(1)
+    keys = [b"counter:%d" % index for index in range(options.keys)]
+    incrs = b"".join(encode_command(b"INCR", keys[generator.randrange(options.keys)])
+                     for _ in range(options.incrs))
+    gets = b"".join(encode_command(b"GET", key) for key in keys)
+
+    modes = {"string values": StringCounters, "integer encoded": RedisCache}
+    best = {name: [float('inf'), float('inf'), 0] for name in modes}
+    for _ in range(options.rounds):
+        for name, cache_type in modes.items():
+            handler = CommandHandler(cache_type(f"bench_counters_{name}"))
+            result = best[name]
+            result[0] = min(result[0], run(handler, incrs))
+            result[1] = min(result[1], run(handler, gets))
+            result[2] = values_size(handler.redis_cache)
+
+    print(f"{options.incrs:,} INCRs over {options.keys:,} keys, best of {options.rounds}")
+    for name, (incr_time, get_time, size) in best.items():
+        print(f"  {name:<16} INCR {options.incrs / incr_time:>10,.0f}/sec   GET {options.keys / get_time:>10,.0f}/sec"
+              f"   values {size:>10,} bytes")
+    speedup = best["string values"][0] / best["integer encoded"][0]
+    print(f"  INCR speedup {speedup:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
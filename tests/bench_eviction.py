@@ -0,0 +1,71 @@
+"""
+Cache aside workload with Zipf distributed keys at a fixed maxmemory: GET the key and SET it on a
+miss. Reports hit rate and throughput per eviction policy, and without a limit for comparison.
+
+    python -m tests.bench_eviction [--keys 100000] [--operations 500000] [--cache-share 0.1] [--skew 1.0]
+"""
+import argparse
+import random
+import time
+from itertools import accumulate
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache
+from storage.eviction import usage, KEY_OVERHEAD, value_size
+
+VALUE = "v" * 32
+
+
+def zipf_keys(keys: int, operations: int, skew: float) -> list[str]:
+    cumulative = list(accumulate(1 / rank ** skew for rank in range(1, keys + 1)))
+    ranks = random.choices(range(keys), cum_weights=cumulative, k=operations)
+    # the popular keys are spread over the keyspace instead of being the first ones written
+    names = [f"key:{index:08d}" for index in range(keys)]
+    random.shuffle(names)
+    return [names[rank] for rank in ranks]
+
+
+def run(policy: str, workload: list[str], limit: int) -> tuple[float, float]:
+    usage.used = 0
+    ServerConfig.set('maxmemory-policy', policy)
+    ServerConfig.set('maxmemory', str(limit))
+    handler = CommandHandler(RedisCache("bench_eviction"))
+    get = [["get", key] for key in workload]
+    ttl = [str(random.randrange(100, 10_000)) for _ in range(1024)]
+    hits = 0
+    output = bytearray()
+    started = time.perf_counter()
+    for index, command in enumerate(get):
+        if handler.execute(command) is not None:
+            hits += 1
+        else:
+            handler.handle_command(["set", command[1], VALUE, "ex", ttl[index & 1023]], output)
+            output.clear()
+    elapsed = time.perf_counter() - started
+    ServerConfig.set('maxmemory', '0')
+    return hits / len(workload), len(workload) / elapsed
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--keys", type=int, default=100_000)
+    arguments.add_argument("--operations", type=int, default=500_000)
+    arguments.add_argument("--cache-share", type=float, default=0.1, help="share of the keys fitting into maxmemory")
+    arguments.add_argument("--skew", type=float, default=1.0)
+    options = arguments.parse_args()
+    random.seed(1)
+    workload = zipf_keys(options.keys, options.operations, options.skew)
+    limit = int(options.keys * options.cache_share * (KEY_OVERHEAD + 12 + value_size(VALUE)))
+
+    print(f"{options.operations:,} GETs over {options.keys:,} keys (zipf {options.skew}), "
+          f"maxmemory {limit / 2 ** 20:.1f} MiB for {options.cache_share:.0%} of them")
+    for policy in ('no limit', 'allkeys-lru', 'allkeys-lfu', 'allkeys-random', 'volatile-lru', 'volatile-ttl'):
+        hit_rate, throughput = run(policy if policy != 'no limit' else 'noeviction', workload,
+                                   limit if policy != 'no limit' else 0)
+        print(f"  {policy:<16} hit rate {hit_rate:6.1%}   {throughput:>10,.0f} ops/sec")
+    ServerConfig.set('maxmemory-policy', 'noeviction')
+
+
+if __name__ == '__main__':
+    main()
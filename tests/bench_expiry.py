@@ -0,0 +1,94 @@
+"""
+Expiry benchmark: sets N keys with a ttl, then lets the server cron expire them while a probe
+measures how late the event loop wakes up. Reports memory per volatile key and loop lag.
+
+    python -m tests.bench_expiry [--keys 1000000] [--tasks-baseline]
+"""
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+
+from storage.cache import CacheHolder
+
+PROBE_INTERVAL = 0.01
+
+
+async def probe_loop_lag(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def cron(cache_holder: CacheHolder, hz: int, stop: asyncio.Event):
+    while not stop.is_set():
+        await asyncio.sleep(1 / hz)
+        cache_holder.cron()
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def bench_engine(keys: int, max_ttl_ms: int, hz: int):
+    holder = CacheHolder()
+    cache = holder.acquire_cache("bench_expiry")
+    tracemalloc.start()
+    started = time.perf_counter()
+    for index in range(keys):
+        cache.set_key_value(f"key:{index}", ["value", "px", str(random.randint(1, max_ttl_ms))])
+    set_elapsed = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lags: list[float] = []
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(probe_loop_lag(lags, stop)), asyncio.create_task(cron(holder, hz, stop))]
+    started = time.perf_counter()
+    while cache.data:
+        await asyncio.sleep(0.05)
+    drain_elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    print(f"expiry engine: {keys:,} keys set in {set_elapsed:.2f}s ({keys / set_elapsed:,.0f} keys/sec)")
+    print(f"  memory: {memory / 2 ** 20:.1f} MiB, {memory / keys:.0f} bytes per volatile key")
+    print(f"  all keys expired {drain_elapsed:.2f}s after the last SET (max ttl {max_ttl_ms} ms)")
+    print(f"  loop lag: p50 {percentile(lags, 0.5) * 1000:.2f} ms, p99 {percentile(lags, 0.99) * 1000:.2f} ms, "
+          f"max {max(lags) * 1000:.2f} ms")
+
+
+async def bench_tasks_baseline(keys: int, max_ttl_ms: int):
+    """what the former one-task-per-key approach costs for the same number of keys"""
+    tracemalloc.start()
+    tasks = [asyncio.create_task(asyncio.sleep(random.randint(1, max_ttl_ms) / 1000)) for _ in range(keys)]
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    lags: list[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_loop_lag(lags, stop))
+    await asyncio.gather(*tasks)
+    stop.set()
+    await probe
+    print(f"task per key: {memory / 2 ** 20:.1f} MiB, {memory / keys:.0f} bytes per volatile key")
+    print(f"  loop lag: p50 {percentile(lags, 0.5) * 1000:.2f} ms, p99 {percentile(lags, 0.99) * 1000:.2f} ms, "
+          f"max {max(lags) * 1000:.2f} ms")
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--keys", type=int, default=1_000_000)
+    arguments.add_argument("--max-ttl-ms", type=int, default=5_000)
+    arguments.add_argument("--hz", type=int, default=10)
+    arguments.add_argument("--tasks-baseline", action="store_true")
+    options = arguments.parse_args()
+    asyncio.run(bench_engine(options.keys, options.max_ttl_ms, options.hz))
+    if options.tasks_baseline:
+        asyncio.run(bench_tasks_baseline(options.keys, options.max_ttl_ms))
+
+
+if __name__ == '__main__':
+    main()
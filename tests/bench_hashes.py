@@ -0,0 +1,56 @@
+"""
+Memory of small objects stored as hashes against one flat key per field: the bytes Python allocated
+for the keyspace (tracemalloc) and the estimate the maxmemory accounting works with, per object.
+
+    python -m tests.bench_hashes [--objects 1000000] [--fields 4]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from storage.cache import RedisCache
+
+FIELDS = ("name", "email", "visits", "created", "country", "plan", "score", "status")
+
+
+def build(objects: int, fields: tuple[str, ...], as_hashes: bool) -> tuple[int, int, float]:
+    """allocated bytes, accounted bytes and seconds to build the keyspace"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    cache = RedisCache("bench_hashes")
+    for number in range(objects):
+        values = [f"{field}-{number}" for field in fields]
+        if as_hashes:
+            # fields parsed from a request are new strings every time, not the shared names
+            cache.hash_set(f"user:{number}", zip([field.encode().decode() for field in fields], values))
+        else:
+            cache.set_many((f"user:{number}:{field}", value) for field, value in zip(fields, values))
+    elapsed = time.perf_counter() - started
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    accounted = cache.table.used
+    del cache
+    return allocated, accounted, elapsed
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--objects", type=int, default=1_000_000)
+    arguments.add_argument("--fields", type=int, default=4, choices=range(1, len(FIELDS) + 1))
+    options = arguments.parse_args()
+    fields = FIELDS[:options.fields]
+
+    print(f"{options.objects:,} objects of {options.fields} fields")
+    results = {}
+    for name, as_hashes in (("flat keys", False), ("hashes", True)):
+        allocated, accounted, elapsed = results[name] = build(options.objects, fields, as_hashes)
+        print(f"  {name:<10} allocated {allocated / options.objects:7.0f} B/object   "
+              f"accounted {accounted / options.objects:7.0f} B/object   built in {elapsed:6.2f} s")
+    saved = 1 - results["hashes"][0] / results["flat keys"][0]
+    print(f"  hashes save {saved:.0%} of the allocated memory")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+HyperLogLog accuracy and throughput: PFADD of `--cardinalities` distinct elements (in batches of
+`--batch` per command) into one key, the error of PFCOUNT against the true cardinality, and the rate
+of PFCOUNT with the cached and with a stale estimate and of PFMERGE of two dense values.
+
+In process, every command goes through the parser and CommandHandler like on a connection. The
+'exact' column is the memory a set of the same elements takes, for comparison with the 12KB.
+
+    python -m tests.bench_hyperloglog [--cardinalities 1000000,100000000] [--batch 1000]
+"""
+import argparse
+import sys
+import time
+
+from commandhandler.handler import CommandHandler
+from commandhandler.parser import CommandParser
+from storage import hyperloglog
+from storage.cache import RedisCache
+from tests.bench_workers import encode
+
+
+def execute(handler: CommandHandler, parser: CommandParser, *arguments: bytes) -> bytes:
+    parser.feed(encode(*arguments))
+    (command,) = parser.parse()
+    return handler.handle_command(command)
+
+
+def rate(call, seconds: float = 1.0) -> float:
+    calls, started = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - started) < seconds:
+        call()
+        calls += 1
+    return calls / elapsed
+
+
+def run(cardinality: int, batch: int) -> dict:
+    handler, parser = CommandHandler(RedisCache("bench_hyperloglog")), CommandParser()
+    started = time.perf_counter()
+    for start in range(0, cardinality, batch):
+        elements = [b"element:%d" % number for number in range(start, min(start + batch, cardinality))]
+        execute(handler, parser, b"PFADD", b"hll", *elements)
+    add_rate = cardinality / (time.perf_counter() - started)
+    estimate = int(execute(handler, parser, b"PFCOUNT", b"hll")[1:])
+    value = handler.redis_cache.data["hll"]
+
+    def stale_count():
+        value[15] |= hyperloglog.STALE
+        execute(handler, parser, b"PFCOUNT", b"hll")
+
+    execute(handler, parser, b"PFADD", b"other", *(b"other:%d" % number for number in range(20000)))
+    return {
+        "add": add_rate,
+        "error": (estimate - cardinality) / cardinality,
+        "estimate": estimate,
+        "size": len(value),
+        "cached": rate(lambda: execute(handler, parser, b"PFCOUNT", b"hll")),
+        "stale": rate(stale_count),
+        "merge": rate(lambda: execute(handler, parser, b"PFMERGE", b"union", b"hll", b"other")),
+        "union": rate(lambda: execute(handler, parser, b"PFCOUNT", b"hll", b"other")),
+    }
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--cardinalities", default="1000000,100000000")
+    arguments.add_argument("--batch", type=int, default=1000, help="elements per PFADD")
+    options = arguments.parse_args()
+    for cardinality in map(int, options.cardinalities.split(",")):
+        result = run(cardinality, options.batch)
+        # a set of the elements, at the size of the shortest of them
+        exact = sys.getsizeof(set(range(1000))) / 1000 * cardinality + cardinality * sys.getsizeof(b"element:0")
+        print(f"{cardinality:>12,} elements: PFADD {result['add']:>9,.0f} elements/s, estimate {result['estimate']:,} "
+              f"({result['error'] * 100:+.2f}%), {result['size']:,} bytes (exact {exact / 1e6:,.0f} MB)")
+        print(f"{'':>23} PFCOUNT {result['cached']:>9,.0f}/s cached, {result['stale']:>7,.0f}/s stale, "
+              f"of two {result['union']:>6,.0f}/s, PFMERGE {result['merge']:>6,.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Queue style list workloads through the command handler, compared with a plain python list
+(what the list type was before) for the same push/pop pattern.
+
+    python -m tests.bench_lists [--operations 200000] [--backlog 100000]
+"""
+import argparse
+import time
+
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache
+
+
+def run(handler: CommandHandler, commands: list[list[str]]) -> float:
+    output = bytearray()
+    started = time.perf_counter()
+    for command in commands:
+        handler.handle_command(command, output)
+        output.clear()
+    return len(commands) / (time.perf_counter() - started)
+
+
+def plain_list_queue(backlog: int, operations: int) -> float:
+    """LPUSH/RPOP on a python list with a standing backlog, head inserts shift every element"""
+    values = [str(index) for index in range(backlog)]
+    started = time.perf_counter()
+    for index in range(operations // 2):
+        values.insert(0, str(index))
+        values.pop()
+    return operations / (time.perf_counter() - started)
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--operations", type=int, default=200_000)
+    arguments.add_argument("--backlog", type=int, default=100_000)
+    options = arguments.parse_args()
+    operations, backlog = options.operations, options.backlog
+
+    def fresh_handler() -> CommandHandler:
+        handler = CommandHandler(RedisCache("bench_lists"))
+        handler.handle_command(["rpush", "queue", *(str(index) for index in range(backlog))])
+        return handler
+
+    workloads = {
+        "RPUSH + LPOP (fifo)": [["rpush", "queue", "job"], ["lpop", "queue"]],
+        "LPUSH + RPOP (fifo)": [["lpush", "queue", "job"], ["rpop", "queue"]],
+        "LPUSH + LPOP (stack)": [["lpush", "queue", "job"], ["lpop", "queue"]],
+        "LRANGE -10 -1 (tail peek)": [["lrange", "queue", "-10", "-1"]],
+        "LINDEX -1": [["lindex", "queue", "-1"]],
+    }
+    print(f"standing backlog of {backlog:,} elements")
+    for name, pattern in workloads.items():
+        commands = pattern * (operations // len(pattern))
+        print(f"  {name:<28} {run(fresh_handler(), commands):>12,.0f} ops/sec")
+    print(f"  {'python list insert(0)/pop()':<28} {plain_list_queue(backlog, operations // 10):>12,.0f} ops/sec")
+
+
+if __name__ == '__main__':
+    main()
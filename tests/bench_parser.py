@@ -0,0 +1,64 @@
+"""
+Parser micro benchmark, reports parsed commands per second.
+
+    python -m tests.bench_parser [--commands 100000] [--large-size 1048576]
+"""
+import argparse
+import time
+
+from commandhandler.parser import CommandParser
+
+
+def encode_command(*arguments: bytes) -> bytes:
+    frame = b"*%d\r\n" % len(arguments)
+    for argument in arguments:
+        frame += b"$%d\r\n%s\r\n" % (len(argument), argument)
+    return frame
+
+
+def bench_streaming(frames: bytes, count: int, chunk_size: int) -> float:
+    parser = CommandParser()
+    parsed = 0
+    started = time.perf_counter()
+    for index in range(0, len(frames), chunk_size):
+        parser.feed(frames[index:index + chunk_size])
+        for _ in parser.parse():
+            parsed += 1
+    elapsed = time.perf_counter() - started
+    assert parsed == count, parsed
+    return count / elapsed
+
+
+def bench_legacy(frame: bytes, count: int) -> float:
+    parser = CommandParser()
+    decoded = frame.decode()
+    started = time.perf_counter()
+    for _ in range(count):
+        parser.parse_command(decoded)
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--commands", type=int, default=100_000)
+    arguments.add_argument("--large-count", type=int, default=200)
+    arguments.add_argument("--large-size", type=int, default=1024 * 1024)
+    arguments.add_argument("--chunk-size", type=int, default=64 * 1024)
+    options = arguments.parse_args()
+
+    small = encode_command(b"SET", b"key:000123", b"x" * 16)
+    large = encode_command(b"SET", b"key:large", b"x" * options.large_size)
+
+    results = {
+        "small frames, legacy str parser": bench_legacy(small, options.commands),
+        "small frames, streaming parser": bench_streaming(small * options.commands, options.commands,
+                                                           options.chunk_size),
+        f"{options.large_size} byte frames, streaming parser": bench_streaming(
+            large * options.large_count, options.large_count, options.chunk_size),
+    }
+    for name, rate in results.items():
+        print(f"{name:<45} {rate:>14,.0f} commands/sec")
+
+
+if __name__ == '__main__':
+    main()
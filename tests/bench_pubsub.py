@@ -0,0 +1,148 @@
+"""
+Pub/sub fan-out: one publisher and 1k subscribers.
+
+In process, PUBLISH through CommandHandler.execute to subscribers with a null transport, for a
+channel, and for a pattern among many patterns (the prefix index only matches a few of them).
+Over sockets, a server in a subprocess, the subscribers in another process reading with asyncio,
+and the publisher sending pipelined PUBLISH commands: the deliveries per second until every
+subscriber received every message.
+
+    python -m tests.bench_pubsub [--subscribers 1000] [--messages 2000] [--size 64] [--patterns 1000]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import tempfile
+import time
+
+from commandhandler.handler import CommandHandler
+from commandhandler.pubsub import pubsub
+from storage.cache import RedisCache
+from tests.bench_workers import encode, serve
+
+CHANNEL = b"invalidate"
+
+
+class NullTransport:
+    def write(self, data: bytes):
+        pass
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+
+def in_process(subscribers: int, messages: int, size: int, patterns: int):
+    handlers = []
+    for _ in range(subscribers):
+        handler = CommandHandler(RedisCache("bench_pubsub"))
+        handler.transport = NullTransport()
+        handlers.append(handler)
+    publisher = CommandHandler(RedisCache("bench_pubsub"))
+    payload = "x" * size
+
+    def timed(channel: str) -> float:
+        started = time.perf_counter()
+        for _ in range(messages):
+            publisher.execute(["publish", channel, payload])
+        return (time.perf_counter() - started) / messages * 1e6
+
+    for handler in handlers:
+        handler.execute(["subscribe", CHANNEL.decode()])
+    channel = timed(CHANNEL.decode())
+    for handler in handlers:
+        handler.execute(["unsubscribe"])
+    # unrelated patterns with distinct prefixes, all the subscribers on one matching pattern
+    handlers[0].execute(["psubscribe", *(f"tenant:{index}:*" for index in range(patterns))])
+    for handler in handlers[1:]:
+        handler.execute(["psubscribe", "cache:*"])
+    pattern = timed("cache:user:1")
+    for handler in handlers:
+        handler.close()
+    per_delivery = channel / subscribers * 1000
+    print(f"in process, {subscribers} subscribers: PUBLISH to a channel {channel:.1f} µs ({per_delivery:.0f} ns "
+          f"per subscriber), to a pattern among {patterns + 1} patterns {pattern:.1f} µs")
+
+
+def subscribe_all(port: int, subscribers: int, expected: int, ready, results):
+    """one process holding all subscriber connections, reports when every one got `expected` bytes"""
+
+    async def subscriber(done: asyncio.Event, started: asyncio.Event, count: list):
+        reader, writer = await asyncio.open_connection("localhost", port)
+        writer.write(encode(b"SUBSCRIBE", CHANNEL))
+        await reader.readuntil(b":1\r\n")
+        count[0] += 1
+        if count[0] == subscribers:
+            started.set()
+        received = 0
+        while received < expected:
+            chunk = await reader.read(1 << 16)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            received += len(chunk)
+        count[1] += 1
+        if count[1] == subscribers:
+            done.set()
+        writer.close()
+
+    async def run():
+        done, started, count = asyncio.Event(), asyncio.Event(), [0, 0]
+        tasks = [asyncio.create_task(subscriber(done, started, count)) for _ in range(subscribers)]
+        await started.wait()
+        ready.set()
+        await done.wait()
+        results.put(time.time())
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+
+
+def over_sockets(port: int, subscribers: int, messages: int, size: int):
+    payload = b"x" * size
+    frame = b"*3\r\n$7\r\nmessage\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n" % (len(CHANNEL), CHANNEL, size, payload)
+    with tempfile.TemporaryDirectory() as directory:
+        server = serve(1, port, directory)
+        try:
+            ready, results = multiprocessing.Event(), multiprocessing.Queue()
+            process = multiprocessing.Process(target=subscribe_all,
+                                              args=(port, subscribers, len(frame) * messages, ready, results))
+            process.start()
+            ready.wait()
+            connection = socket.create_connection(("localhost", port))
+            reply = b":%d\r\n" % subscribers
+            started = time.time()
+            batch = 100
+            for sent in range(0, messages, batch):
+                count = min(batch, messages - sent)
+                connection.sendall(encode(b"PUBLISH", CHANNEL, payload) * count)
+                received = b""
+                while len(received) < len(reply) * count:
+                    received += connection.recv(1 << 16)
+                if received != reply * count:
+                    raise AssertionError(f"unexpected replies {received[:40]!r}")
+            published = time.time() - started
+            delivered = results.get() - started
+            process.join()
+            connection.close()
+        finally:
+            server.terminate()
+            server.wait()
+    print(f"over sockets, {subscribers} subscribers, {messages} messages of {size} bytes: "
+          f"{messages / published:,.0f} PUBLISH/s, {messages * subscribers / delivered:,.0f} deliveries/s")
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--subscribers", type=int, default=1000)
+    arguments.add_argument("--messages", type=int, default=2000)
+    arguments.add_argument("--size", type=int, default=64)
+    arguments.add_argument("--patterns", type=int, default=1000)
+    arguments.add_argument("--port", type=int, default=7380)
+    options = arguments.parse_args()
+    in_process(options.subscribers, options.messages, options.size, options.patterns)
+    assert not pubsub.channels and not pubsub.patterns
+    over_sockets(options.port, options.subscribers, options.messages, options.size)
+
+
+if __name__ == '__main__':
+    main()
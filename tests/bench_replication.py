@@ -0,0 +1,114 @@
+"""
+Replication lag under write load: a primary and a replica in subprocesses, writer processes sending
+pipelined SET commands to the primary. A probe writes a fresh value to the primary every few
+milliseconds and polls the replica until it reads it back, the time in between is the lag.
+
+    python -m tests.bench_replication [--writers 2] [--seconds 5] [--pipeline 100] [--size 64]
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from tests.bench_workers import ROOT, encode
+
+
+def start(port: int, directory: str, *options: str) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py"), "--port", str(port), *options],
+                              cwd=directory, env={**os.environ, "PYTHONPATH": ROOT})
+    while True:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return server
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+
+
+def write_load(port: int, seconds: float, pipeline: int, size: int, index: int, results):
+    connection = socket.create_connection(("localhost", port))
+    value = b"x" * size
+    reply = b"+OK\r\n" * pipeline
+    deadline, written = time.time() + seconds, 0
+    while time.time() < deadline:
+        connection.sendall(b"".join(encode(b"SET", b"load:%d:%d" % (index, (written + number) % 100_000), value)
+                                    for number in range(pipeline)))
+        received = b""
+        while len(received) < len(reply):
+            received += connection.recv(1 << 16)
+        written += pipeline
+    connection.close()
+    results.put(written)
+
+
+def request(connection: socket.socket, *arguments: bytes) -> bytes:
+    connection.sendall(encode(*arguments))
+    return connection.recv(1 << 16)
+
+
+def probe(primary: int, replica: int, seconds: float) -> list[float]:
+    """milliseconds until a write to the primary can be read on the replica"""
+    to_primary = socket.create_connection(("localhost", primary))
+    to_replica = socket.create_connection(("localhost", replica))
+    lags = []
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        value = b"%d" % time.time_ns()
+        expected = b"$%d\r\n%s\r\n" % (len(value), value)
+        started = time.perf_counter()
+        request(to_primary, b"SET", b"probe", value)
+        while request(to_replica, b"GET", b"probe") != expected:
+            pass
+        lags.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.005)
+    to_primary.close()
+    to_replica.close()
+    return lags
+
+
+def percentile(values: list[float], share: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * share))]
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--writers", type=int, default=2)
+    arguments.add_argument("--seconds", type=float, default=5)
+    arguments.add_argument("--pipeline", type=int, default=100)
+    arguments.add_argument("--size", type=int, default=64)
+    arguments.add_argument("--port", type=int, default=7390)
+    options = arguments.parse_args()
+    primary_port, replica_port = options.port, options.port + 1
+
+    with tempfile.TemporaryDirectory() as primary_directory, tempfile.TemporaryDirectory() as replica_directory:
+        primary = start(primary_port, primary_directory)
+        replica = start(replica_port, replica_directory, "--replicaof", "localhost", str(primary_port))
+        try:
+            idle = probe(primary_port, replica_port, 1)
+            results = multiprocessing.Queue()
+            writers = [multiprocessing.Process(target=write_load, args=(
+                primary_port, options.seconds, options.pipeline, options.size, index, results))
+                for index in range(options.writers)]
+            for writer in writers:
+                writer.start()
+            loaded = probe(primary_port, replica_port, options.seconds)
+            written = sum(results.get() for _ in writers)
+            for writer in writers:
+                writer.join()
+        finally:
+            replica.terminate()
+            primary.terminate()
+            replica.wait()
+            primary.wait()
+    print(f"{os.cpu_count()} cores, {options.writers} writers, pipelines of {options.pipeline} SET of "
+          f"{options.size} bytes: {written / options.seconds:,.0f} writes/s on the primary")
+    for name, lags in (("idle", idle), ("under load", loaded)):
+        print(f"lag {name:>10}: p50 {percentile(lags, 0.5):.2f} ms, p99 {percentile(lags, 0.99):.2f} ms, "
+              f"max {max(lags):.2f} ms ({len(lags)} probes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Walks a keyspace of growing size with SCAN at a few COUNT hints, through CommandHandler.execute,
+and compares the longest single call, which is how long the event loop stalls, with one KEYS *.
+The longest SCAN call should stay flat as the keyspace grows, KEYS grows with it.
+
+    python -m tests.bench_scan [--sizes 100000 1000000] [--counts 10 100 1000]
+"""
+import argparse
+import time
+
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache
+
+
+def walk(handler: CommandHandler, count: int) -> tuple[float, float, int]:
+    """seconds for the whole walk, microseconds of the longest call and the number of keys returned"""
+    cursor, keys, longest = "0", 0, 0.0
+    started = time.perf_counter()
+    while True:
+        call = time.perf_counter()
+        cursor, found = handler.execute(["scan", cursor, "count", str(count)])
+        longest = max(longest, time.perf_counter() - call)
+        keys += len(found)
+        if cursor == "0":
+            return time.perf_counter() - started, longest * 1e6, keys
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    arguments.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000])
+    options = arguments.parse_args()
+
+    print(f"{'keys':>12} {'COUNT':>6} {'walk s':>8} {'max call µs':>12} {'returned':>10}")
+    for size in options.sizes:
+        handler = CommandHandler(RedisCache(f"bench_scan_{size}"))
+        batch = 1000
+        for start in range(0, size, batch):
+            handler.execute(["mset", *(part for number in range(start, min(start + batch, size))
+                                       for part in (f"key:{number}", "value"))])
+        for count in options.counts:
+            seconds, longest, returned = walk(handler, count)
+            print(f"{size:>12,} {count:>6} {seconds:>8.2f} {longest:>12.1f} {returned:>10,}")
+        started = time.perf_counter()
+        handler.execute(["keys", "*"])
+        print(f"{size:>12,} {'KEYS':>6} {'':>8} {(time.perf_counter() - started) * 1e6:>12.1f}")
+        del handler
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Reply encoding benchmark: LRANGE of a 10k element list through the former str based
+strategies (new strategy object per value, f-strings, then .encode()) against the bytes encoder.
+
+    python -m tests.bench_serializer [--elements 10000] [--rounds 200]
+"""
+import argparse
+import time
+
+from commandhandler.handler import CommandHandler
+from commandhandler.serializer import write_reply
+from commandhandler.utils import OK_RESP
+from storage.cache import RedisCache
+
+
+def legacy_serialize(value) -> str:
+    """the encoding path before the bytes encoder, minus its print calls"""
+    if value is None:
+        return "$-1\r\n"
+    if isinstance(value, int):
+        return f":{value}\r\n"
+    if isinstance(value, list):
+        serialized_values = [legacy_serialize(val) for val in value]
+        return f"*{len(serialized_values)}\r\n" + ''.join(serialized_values)
+    if value.startswith('+') or (not value.isdigit() and value.startswith('-')):
+        return f"{value}\r\n"
+    return f"${len(value)}\r\n{value}\r\n"
+
+
+def timed(function, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return (time.perf_counter() - started) / rounds
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--elements", type=int, default=10_000)
+    arguments.add_argument("--rounds", type=int, default=200)
+    options = arguments.parse_args()
+
+    cache = RedisCache("bench_serializer")
+    cache.append_to_tail(["list", *(f"element:{index}" for index in range(options.elements))])
+    handler = CommandHandler(cache)
+    values = cache.lrange(["list", "0", str(options.elements - 1)])
+    assert legacy_serialize(values).encode() == handler.handle_command(["lrange", "list", "0", str(options.elements - 1)])
+
+    before = timed(lambda: legacy_serialize(values).encode(), options.rounds)
+
+    def encode():
+        write_reply(values, bytearray())
+
+    after = timed(encode, options.rounds)
+    print(f"LRANGE {options.elements:,} elements, encoding only")
+    print(f"  before (str strategies + encode): {before * 1000:8.3f} ms")
+    print(f"  after  (bytes encoder):           {after * 1000:8.3f} ms  ({before / after:.1f}x)")
+
+    small = [1, 42, 9999, OK_RESP, None] * 1000
+    legacy_small = [1, 42, 9999, "+OK", None] * 1000
+    before = timed(lambda: [legacy_serialize(value).encode() for value in legacy_small], options.rounds)
+    output = bytearray()
+
+    def encode_small():
+        output.clear()
+        for value in small:
+            write_reply(value, output)
+
+    after = timed(encode_small, options.rounds)
+    print(f"{len(small):,} small replies (integers, status, null)")
+    print(f"  before: {before * 1000:8.3f} ms, after: {after * 1000:8.3f} ms  ({before / after:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
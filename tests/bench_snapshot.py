@@ -0,0 +1,57 @@
+"""
+Save and load time and file size of the binary snapshot compared with the JSON store it replaced.
+
+    python -m tests.bench_snapshot [--keys 1000000] [--volatile 0.1]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from storage.expiry import now_ms
+from storage.snapshot import write_snapshot, read_snapshot
+
+
+def timed(function, *args) -> float:
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def json_save(file_name: str, data: dict):
+    with open(file_name, 'w') as file:
+        json.dump(data, file, default=list)
+
+
+def json_load(file_name: str):
+    with open(file_name, 'r') as file:
+        return json.load(file)
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--keys", type=int, default=1_000_000)
+    arguments.add_argument("--volatile", type=float, default=0.1, help="share of keys with a ttl")
+    options = arguments.parse_args()
+    data = {f"key:{index:08d}": f"value:{index}" * 2 for index in range(options.keys)}
+    deadline = now_ms() + 3_600_000
+    deadlines = {key: deadline for key in list(data)[:int(options.keys * options.volatile)]}
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = {name: os.path.join(directory, name) for name in ("dump.json", "dump.rdb", "plain.rdb")}
+        rows = [
+            ("json", timed(json_save, files["dump.json"], data), timed(json_load, files["dump.json"]),
+             files["dump.json"]),
+            ("binary, compressed", timed(write_snapshot, files["dump.rdb"], data.items(), deadlines, now_ms(), True),
+             timed(read_snapshot, files["dump.rdb"]), files["dump.rdb"]),
+            ("binary", timed(write_snapshot, files["plain.rdb"], data.items(), deadlines, now_ms(), False),
+             timed(read_snapshot, files["plain.rdb"]), files["plain.rdb"]),
+        ]
+        print(f"{options.keys:,} keys, {len(deadlines):,} with a ttl (json drops the ttls)")
+        for name, save, load, file_name in rows:
+            print(f"  {name:<20} save {save:6.2f}s   load {load:6.2f}s   {os.path.getsize(file_name) / 2 ** 20:8.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Startup load of a stored keyspace: the JSON store (one blocking json.load), the snapshot loaded in one
+go, and the snapshot loaded in the background while another task keeps pinging the event loop.
+Reported are the time until the keyspace is available and the longest time the loop was blocked.
+
+    python -m tests.bench_startup [--keys 100000 1000000 10000000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from storage.cache import RedisCache, CacheHolder
+from storage.expiry import now_ms
+from storage.snapshot import write_snapshot
+
+
+def load_blocking(name: str) -> tuple[float, float]:
+    CacheHolder._instance = None
+    started = time.perf_counter()
+    CacheHolder().acquire_cache(name)
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed
+
+
+async def load_in_background(name: str) -> tuple[float, float]:
+    CacheHolder._instance = None
+    longest_stall = 0.0
+
+    async def ping():
+        nonlocal longest_stall
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(0)
+            longest_stall = max(longest_stall, time.perf_counter() - before)
+
+    pinger = asyncio.create_task(ping())
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    cache = CacheHolder().acquire_cache(name, background=True)
+    await cache.loading.task
+    elapsed = time.perf_counter() - started
+    pinger.cancel()
+    return elapsed, longest_stall
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--keys", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    options = arguments.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        RedisCache.FILE_STORE = os.path.join(directory, "file_store_")
+        for keys in options.keys:
+            data = {f"key:{index:08d}": f"value:{index}" for index in range(keys)}
+            with open(f"{RedisCache.FILE_STORE}json.json", 'w') as file:
+                json.dump(data, file)
+            write_snapshot(f"{RedisCache.FILE_STORE}rdb.rdb", data.items(), {}, now_ms())
+            del data
+            rows = {
+                "json store": load_blocking("json"),
+                "snapshot, blocking": load_blocking("rdb"),
+                "snapshot, background": asyncio.run(load_in_background("rdb")),
+            }
+            CacheHolder._instance = None
+            print(f"{keys:,} keys")
+            for name, (elapsed, stall) in rows.items():
+                print(f"  {name:<22} available after {elapsed:7.2f}s   longest loop stall {stall * 1000:9.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Overhead of the command statistics: GET/SET through CommandHandler.handle_command with the
+instrumentation stubbed out, with counters only (latency-tracking no) and with the latency
+histograms (latency-tracking yes, the default).
+
+    python -m tests.bench_stats [--commands 200000] [--rounds 5]
+"""
+import argparse
+import time
+
+from commandhandler import handler as handler_module
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache
+
+
+class NoStats:
+    def record(self, *_):
+        pass
+
+    def reject(self, *_):
+        pass
+
+
+def run(commands: list[list[str]]) -> float:
+    """nanoseconds per command"""
+    handler = CommandHandler(RedisCache("bench_stats"))
+    output = bytearray()
+    started = time.perf_counter_ns()
+    for command in commands:
+        handler.handle_command(command, output)
+    return (time.perf_counter_ns() - started) / len(commands)
+
+
+def run_without_stats(commands: list[list[str]]) -> float:
+    stats, clock = handler_module.stats, handler_module.perf_counter_ns
+    handler_module.stats, handler_module.perf_counter_ns = NoStats(), int
+    try:
+        return run(commands)
+    finally:
+        handler_module.stats, handler_module.perf_counter_ns = stats, clock
+
+
+def run_with_tracking(tracking: str):
+    def run_tracking(commands: list[list[str]]) -> float:
+        ServerConfig.set('latency-tracking', tracking)
+        return run(commands)
+    return run_tracking
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--commands", type=int, default=200_000)
+    arguments.add_argument("--rounds", type=int, default=5)
+    options = arguments.parse_args()
+    commands = [["set", f"key:{index % 1000}", "value"] if index % 4 == 0 else ["get", f"key:{index % 1000}"]
+                for index in range(options.commands)]
+
+    modes = {
+        "no instrumentation": run_without_stats,
+        "counters": run_with_tracking('no'),
+        "counters + histograms": run_with_tracking('yes'),
+    }
+    # the modes take turns, so drift of the machine hits all of them alike, the best round counts
+    best = dict.fromkeys(modes, float('inf'))
+    for _ in range(options.rounds):
+        for name, mode in modes.items():
+            best[name] = min(best[name], mode(commands))
+    ServerConfig.set('latency-tracking', 'yes')
+    baseline = best["no instrumentation"]
+
+    print(f"{options.commands:,} commands (1 SET : 3 GET), best of {options.rounds}")
+    for name, cost in best.items():
+        print(f"  {name:<24} {cost:8.0f} ns/command   overhead {cost - baseline:5.0f} ns "
+              f"({(cost - baseline) / baseline:5.1%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+GET and SET of values of 1KB, 64KB and 1MB.
+
+In process, every command goes through the parser, CommandHandler and the serializer like on a
+connection. The 'decoded' column is what the old path added per command on top of that: decoding
+the value into a str on the way in and encoding it again on the way out. Over sockets, a server in
+a subprocess and one client sending pipelined commands.
+
+    python -m tests.bench_strings [--sizes 1024,65536,1048576] [--megabytes 256] [--pipeline 16]
+"""
+import argparse
+import socket
+import tempfile
+import time
+
+from commandhandler.handler import CommandHandler
+from commandhandler.parser import CommandParser
+from storage.cache import RedisCache
+from tests.bench_workers import encode, serve
+
+
+def in_process(size: int, count: int) -> dict[str, float]:
+    handler = CommandHandler(RedisCache("bench_strings"))
+    parser = CommandParser()
+    value = bytes(range(256)) * (size // 256) + b"x" * (size % 256)
+    rates = {}
+    for name, frame in (("SET", encode(b"SET", b"key", value)), ("GET", encode(b"GET", b"key"))):
+        output = bytearray()
+        started = time.perf_counter()
+        for _ in range(count):
+            parser.feed(frame)
+            for command in parser.parse():
+                handler.handle_command(command, output)
+            output.clear()
+        rates[name] = count / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for _ in range(count):
+        value.decode("utf-8", "surrogateescape").encode("utf-8", "surrogateescape")
+    rates["decoded"] = count / (time.perf_counter() - started)
+    handler.redis_cache.delete_by_key("key")
+    return rates
+
+
+def over_sockets(port: int, size: int, count: int, pipeline: int) -> dict[str, float]:
+    value = b"v" * size
+    rates = {}
+    with socket.create_connection(("localhost", port)) as connection:
+        for name, frame, reply in (("SET", encode(b"SET", b"key", value), b"+OK\r\n"),
+                                   ("GET", encode(b"GET", b"key"), b"$%d\r\n%s\r\n" % (size, value))):
+            batch = frame * pipeline
+            expected = len(reply) * pipeline
+            started = time.perf_counter()
+            for _ in range(max(1, count // pipeline)):
+                connection.sendall(batch)
+                received = 0
+                while received < expected:
+                    received += len(connection.recv(1 << 20))
+            rates[name] = max(1, count // pipeline) * pipeline / (time.perf_counter() - started)
+    return rates
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--sizes", default="1024,65536,1048576")
+    arguments.add_argument("--megabytes", type=int, default=256, help="the data moved per size and command")
+    arguments.add_argument("--pipeline", type=int, default=16)
+    arguments.add_argument("--port", type=int, default=7400)
+    options = arguments.parse_args()
+    sizes = [int(size) for size in options.sizes.split(",")]
+
+    def count(size: int) -> int:
+        return max(options.pipeline, options.megabytes * 1024 * 1024 // size)
+
+    for size in sizes:
+        rates = in_process(size, count(size))
+        print(f"in process   {size:>8} bytes: SET {rates['SET']:>10,.0f}/s ({rates['SET'] * size / 1e6:>7,.0f} MB/s), "
+              f"GET {rates['GET']:>10,.0f}/s ({rates['GET'] * size / 1e6:>7,.0f} MB/s), "
+              f"decoded {rates['decoded']:>10,.0f}/s")
+    with tempfile.TemporaryDirectory() as directory:
+        server = serve(1, options.port, directory)
+        try:
+            for size in sizes:
+                rates = over_sockets(options.port, size, count(size) // 4, options.pipeline)
+                print(f"over sockets {size:>8} bytes: SET {rates['SET']:>10,.0f}/s "
+                      f"({rates['SET'] * size / 1e6:>7,.0f} MB/s), "
+                      f"GET {rates['GET']:>10,.0f}/s ({rates['GET'] * size / 1e6:>7,.0f} MB/s)")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
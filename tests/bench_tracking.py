@@ -0,0 +1,96 @@
+"""
+Client side caching: GET latency and hit rate of a client with a local cache kept valid by CLIENT
+TRACKING (client/caching.py), against the same reads going to the server every time. Reads are
+Zipf distributed over the keys, a second connection overwrites random keys meanwhile, one write
+per `--write-every` reads, so the cached client also gets invalidations.
+
+The server runs in a subprocess. With `--bcast` the cached client uses BCAST instead of the
+default mode, the server then tracks nothing per key.
+
+    python -m tests.bench_tracking [--keys 10000] [--reads 200000] [--write-every 100] [--bcast]
+"""
+import argparse
+import random
+import socket
+import tempfile
+import time
+from itertools import accumulate
+
+from client.caching import CachingClient
+from tests.bench_blocking import percentile
+from tests.bench_workers import encode, serve
+
+VALUE = b"v" * 64
+
+
+def key_sequence(keys: int, reads: int) -> list[bytes]:
+    weights = list(accumulate(1 / rank for rank in range(1, keys + 1)))
+    numbers = random.Random(1).choices(range(keys), cum_weights=weights, k=reads)
+    return [b"key:%d" % number for number in numbers]
+
+
+def run(port: int, mode: str, keys: int, reads: int, write_every: int) -> dict:
+    sequence = key_sequence(keys, reads)
+    writes = random.Random(2)
+    writer = socket.create_connection(("localhost", port))
+    if mode == "server":
+        connection = socket.create_connection(("localhost", port))
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        expected = len(b"$%d\r\n%s\r\n" % (len(VALUE), VALUE))
+
+        def get(key: bytes):
+            connection.sendall(encode(b"GET", key))
+            received = 0
+            while received < expected:
+                received += len(connection.recv(1 << 16))
+    else:
+        client = CachingClient("localhost", port, max_entries=keys, prefixes=["key:"] if mode == "bcast" else None)
+        get = client.get
+    latencies = []
+    started = time.perf_counter()
+    for number, key in enumerate(sequence):
+        if write_every and number % write_every == 0:
+            writer.sendall(encode(b"SET", b"key:%d" % writes.randrange(keys), VALUE))
+            writer.recv(64)
+        before = time.perf_counter()
+        get(key)
+        latencies.append((time.perf_counter() - before) * 1e6)
+    elapsed = time.perf_counter() - started
+    writer.close()
+    result = {"rate": reads / elapsed, "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99)}
+    if mode == "server":
+        connection.close()
+        result.update(hit_rate=0.0, invalidations=0)
+    else:
+        result.update(hit_rate=client.hits / reads, invalidations=client.invalidations)
+        client.close()
+    return result
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--keys", type=int, default=10000)
+    arguments.add_argument("--reads", type=int, default=200000)
+    arguments.add_argument("--write-every", type=int, default=100, help="reads per write, 0 for no writes")
+    arguments.add_argument("--bcast", action="store_true")
+    arguments.add_argument("--port", type=int, default=7420)
+    options = arguments.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        server = serve(1, options.port, directory)
+        try:
+            with socket.create_connection(("localhost", options.port)) as connection:
+                for number in range(options.keys):
+                    connection.sendall(encode(b"SET", b"key:%d" % number, VALUE))
+                    connection.recv(64)
+            for mode in ("server", "bcast" if options.bcast else "tracking"):
+                result = run(options.port, mode, options.keys, options.reads, options.write_every)
+                print(f"{mode:>8}: {result['rate']:>9,.0f} GET/s, p50 {result['p50']:7.1f} us, "
+                      f"p99 {result['p99']:7.1f} us, hit rate {result['hit_rate'] * 100:5.1f}%, "
+                      f"{result['invalidations']:,} invalidations")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
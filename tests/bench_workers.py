@@ -0,0 +1,94 @@
+"""
+Multi client throughput of the server with one process and with `--workers N`. Every client is a
+process sending pipelined batches of SET/GET pairs on random keys; the total operations per
+second of all clients are reported. Scaling needs as many free cores as workers plus clients.
+
+    python -m tests.bench_workers [--workers 1 2 4] [--clients 8] [--seconds 5] [--pipeline 50]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VALUE = b"v" * 16
+
+
+def encode(*arguments: bytes) -> bytes:
+    return b"*%d\r\n" % len(arguments) + b"".join(b"$%d\r\n%s\r\n" % (len(argument), argument)
+                                                   for argument in arguments)
+
+
+def client(port: int, seconds: float, pipeline: int, keys: int, results):
+    random.seed(os.getpid())
+    connection = socket.create_connection(("localhost", port))
+    reply = b"+OK\r\n$%d\r\n%s\r\n" % (len(VALUE), VALUE)
+    expected = len(reply) * pipeline
+    operations = 0
+    stop_at = time.perf_counter() + seconds
+    while time.perf_counter() < stop_at:
+        batch = bytearray()
+        for key in random.sample(range(keys), pipeline):
+            name = b"key:%d" % key
+            batch += encode(b"SET", name, VALUE) + encode(b"GET", name)
+        connection.sendall(batch)
+        received = 0
+        while received < expected:
+            chunk = connection.recv(1 << 20)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            received += len(chunk)
+        operations += 2 * pipeline
+    connection.close()
+    results.put(operations)
+
+
+def serve(workers: int, port: int, directory: str) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py"), "--workers", str(workers),
+                               "--port", str(port)], cwd=directory, env={**os.environ, "PYTHONPATH": ROOT})
+    while True:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return server
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    arguments.add_argument("--clients", type=int, default=8)
+    arguments.add_argument("--seconds", type=float, default=5)
+    arguments.add_argument("--pipeline", type=int, default=50)
+    arguments.add_argument("--keys", type=int, default=100_000)
+    arguments.add_argument("--port", type=int, default=7379)
+    options = arguments.parse_args()
+
+    print(f"{options.clients} clients, pipelines of {options.pipeline} SET/GET pairs, {os.cpu_count()} cores")
+    baseline = None
+    for workers in options.workers:
+        with tempfile.TemporaryDirectory() as directory:
+            server = serve(workers, options.port, directory)
+            results = multiprocessing.Queue()
+            clients = [multiprocessing.Process(target=client, args=(options.port, options.seconds, options.pipeline,
+                                                                    options.keys, results))
+                       for _ in range(options.clients)]
+            for process in clients:
+                process.start()
+            total = sum(results.get() for _ in clients)
+            for process in clients:
+                process.join()
+            server.terminate()
+            server.wait()
+        throughput = total / options.seconds
+        baseline = baseline or throughput
+        print(f"  {workers:>2} workers {throughput:>12,.0f} ops/sec   {throughput / baseline:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Sorted set operations at growing sizes, through CommandHandler.handle_command: ZADD of new members,
+ZADD moving existing ones, ZSCORE, ZRANK, ZRANGE of 10 members at a random rank and ZRANGEBYSCORE
+with LIMIT 10. The per operation cost should grow with log(n), not n.
+
+    python -m tests.bench_zsets [--sizes 10000 1000000 10000000] [--operations 20000]
+"""
+import argparse
+import random
+import time
+
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache
+
+
+def timed(handler: CommandHandler, commands: list[list[str]]) -> float:
+    """microseconds per command"""
+    output = bytearray()
+    started = time.perf_counter()
+    for command in commands:
+        handler.handle_command(command, output)
+        if len(output) > 1 << 20:
+            output.clear()
+    return (time.perf_counter() - started) / len(commands) * 1e6
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    arguments.add_argument("--operations", type=int, default=20_000)
+    options = arguments.parse_args()
+    generator = random.Random(1)
+    operations = options.operations
+
+    print(f"{'members':>12} {'build/s':>10} " + " ".join(f"{name:>14}" for name in (
+        "ZADD new", "ZADD update", "ZSCORE", "ZRANK", "ZRANGE 10", "ZRANGEBYSCORE")) + "   (µs per command)")
+    for size in options.sizes:
+        handler = CommandHandler(RedisCache(f"bench_zsets_{size}"))
+        started = time.perf_counter()
+        batch = 1000
+        for start in range(0, size, batch):
+            pairs = [part for number in range(start, min(start + batch, size))
+                     for part in (str(generator.random() * size), f"member:{number}")]
+            handler.handle_command(["zadd", "board", *pairs])
+        build = size / (time.perf_counter() - started)
+
+        members = [f"member:{generator.randrange(size)}" for _ in range(operations)]
+        results = [
+            timed(handler, [["zadd", "board", str(generator.random() * size), f"new:{index}"]
+                            for index in range(operations)]),
+            timed(handler, [["zadd", "board", str(generator.random() * size), member] for member in members]),
+            timed(handler, [["zscore", "board", member] for member in members]),
+            timed(handler, [["zrank", "board", member] for member in members]),
+            timed(handler, [["zrange", "board", str(rank), str(rank + 9)]
+                            for rank in (generator.randrange(size) for _ in range(operations))]),
+            timed(handler, [["zrangebyscore", "board", str(score), "+inf", "limit", "0", "10"]
+                            for score in (generator.random() * size for _ in range(operations))]),
+        ]
+        print(f"{size:>12,} {build:>10,.0f} " + " ".join(f"{result:>14.2f}" for result in results))
+        del handler
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import pytest
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache, CacheHolder
+from storage.eviction import usage
+
+
+@pytest.fixture
+def handler(request, monkeypatch):
+    """a handler on a keyspace of its own, named after the test, with the memory usage counted from zero"""
+    monkeypatch.setattr(usage, "used", 0)
+    return CommandHandler(RedisCache(request.node.name))
+
+
+@pytest.fixture
+def append_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(RedisCache, "FILE_STORE", str(tmp_path / "file_store_"))
+    monkeypatch.setattr(CacheHolder, "_instance", None)
+    ServerConfig.set('appendonly', 'yes')
+    yield tmp_path
+    CacheHolder.shutdown()
+    ServerConfig.set('appendonly', 'no')
+    ServerConfig.set('appendfsync', 'everysec')
@@ -0,0 +1,137 @@
+import os
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache, CacheHolder
+from storage.eviction import usage
+
+
+def restart() -> CommandHandler:
+    CacheHolder.shutdown()
+    CacheHolder._instance = None
+    return CommandHandler(CacheHolder().acquire_cache("client"))
+
+
+def finish_rewrite(cache: RedisCache):
+    assert cache.aof.rewrite.wait()
+    assert cache.aof.poll_rewrite()
+
+
+def test_writes_are_replayed(append_only):
+    handler = CommandHandler(CacheHolder().acquire_cache("client"))
+    finish_rewrite(handler.redis_cache)
+    handler.handle_command(["set", "key", "value", "ex", "100"])
+    handler.handle_command(["rpush", "list", "a", "b", "c"])
+    handler.handle_command(["lpop", "list"])
+    handler.handle_command(["set", "counter", "1"])
+    handler.handle_command(["expire", "counter", "-1"])
+    # reads, misses and errors are not logged
+    handler.handle_command(["get", "key"])
+    handler.handle_command(["lpop", "missing"])
+    handler.handle_command(["lpush", "key", "x"])
+    handler.redis_cache.aof.flush()
+    log = (append_only / "file_store_client.aof").read_bytes()
+    assert b"lpop" in log and b"missing" not in log and b"get" not in log
+    # relative ttls are logged as deadlines
+    assert b"pxat" in log and b"\r\nex\r\n" not in log
+
+    restored = restart()
+    assert restored.handle_command(["get", "key"]) == b'$5\r\nvalue\r\n'
+    assert restored.handle_command(["ttl", "key"]) == b':100\r\n'
+    assert restored.handle_command(["lrange", "list", "0", "-1"]) == b'*2\r\n$1\r\nb\r\n$1\r\nc\r\n'
+    assert restored.handle_command(["exists", "counter"]) == b':0\r\n'
+    assert restored.redis_cache.dirty == 0
+
+
+def test_replay_ignores_maxmemory(append_only, monkeypatch):
+    monkeypatch.setattr(usage, "used", 0)
+    handler = CommandHandler(CacheHolder().acquire_cache("client"))
+    finish_rewrite(handler.redis_cache)
+    for index in range(2000):
+        handler.handle_command(["set", f"key:{index}", "x" * 20])
+    handler.redis_cache.aof.flush()
+    ServerConfig.set('maxmemory', str(usage.used // 4))
+    try:
+        restored = restart()
+        # nothing is evicted or refused while the keyspace is rebuilt
+        assert restored.handle_command(["dbsize"]) == b':2000\r\n'
+        assert restored.handle_command(["get", "key:1999"]) == b'$20\r\n' + b'x' * 20 + b'\r\n'
+        # clients are held to the limit again
+        assert restored.handle_command(["set", "another", "x"]).startswith(b'-OOM')
+    finally:
+        ServerConfig.set('maxmemory', '0')
+
+
+def test_incomplete_tail_is_truncated(append_only):
+    handler = CommandHandler(CacheHolder().acquire_cache("client"))
+    finish_rewrite(handler.redis_cache)
+    handler.handle_command(["set", "key", "value"])
+    handler.redis_cache.aof.flush()
+    path = append_only / "file_store_client.aof"
+    complete = path.read_bytes()
+    with open(path, 'ab') as file:
+        file.write(b"*3\r\n$3\r\nset\r\n$3\r\nkey\r\n$5\r\nval")
+
+    restored = restart()
+    assert restored.handle_command(["get", "key"]) == b'$5\r\nvalue\r\n'
+    assert path.read_bytes() == complete
+
+
+def test_group_commit_syncs_once_per_batch(append_only, monkeypatch):
+    ServerConfig.set('appendfsync', 'always')
+    handler = CommandHandler(CacheHolder().acquire_cache("client"))
+    finish_rewrite(handler.redis_cache)
+    synced = []
+    monkeypatch.setattr("storage.aof.os.fsync", synced.append)
+    for index in range(10):
+        handler.handle_command(["set", f"key{index}", "value"])
+    handler.redis_cache.aof.flush()
+    assert len(synced) == 1
+    handler.redis_cache.aof.flush()
+    assert len(synced) == 1
+
+
+def test_rewrite_compacts_while_writes_continue(append_only):
+    handler = CommandHandler(CacheHolder().acquire_cache("client"))
+    cache = handler.redis_cache
+    finish_rewrite(cache)
+    for index in range(100):
+        handler.handle_command(["set", "key", str(index)])
+        handler.handle_command(["rpush", "list", str(index)])
+    handler.handle_command(["pexpire", "key", "100000"])
+    cache.aof.flush()
+    path = append_only / "file_store_client.aof"
+    before = os.path.getsize(path)
+
+    assert handler.handle_command(["bgrewriteaof"]) == b'+Background append only file rewriting started\r\n'
+    assert handler.handle_command(["bgrewriteaof"]) == \
+           b'-ERR Background append only file rewriting already in progress\r\n'
+    handler.handle_command(["set", "during", "rewrite"])
+    handler.handle_command(["rpush", "list", "last"])
+    finish_rewrite(cache)
+    assert os.path.getsize(path) < before / 4
+
+    restored = restart()
+    assert restored.handle_command(["get", "key"]) == b'$2\r\n99\r\n'
+    assert 0 < int(restored.handle_command(["pttl", "key"])[1:-2]) <= 100_000
+    assert restored.handle_command(["get", "during"]) == b'$7\r\nrewrite\r\n'
+    assert restored.handle_command(["llen", "list"]) == b':101\r\n'
+    assert restored.handle_command(["lindex", "list", "-1"]) == b'$4\r\nlast\r\n'
+
+
+def test_enabling_at_runtime_starts_with_a_rewrite(append_only):
+    ServerConfig.set('appendonly', 'no')
+    handler = CommandHandler(CacheHolder().acquire_cache("client"))
+    handler.handle_command(["set", "existing", "value"])
+    assert handler.handle_command(["bgrewriteaof"]).startswith(b'-ERR Append only file is disabled')
+
+    ServerConfig.set('appendonly', 'yes')
+    cache = handler.redis_cache
+    assert cache.aof.waiting_rewrite
+    handler.handle_command(["set", "new", "value"])
+    finish_rewrite(cache)
+    handler.handle_command(["set", "after", "value"])
+
+    restored = restart()
+    for key in ("existing", "new", "after"):
+        assert restored.handle_command(["get", key]) == b'$5\r\nvalue\r\n'
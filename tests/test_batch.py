@@ -0,0 +1,37 @@
+from storage.eviction import KEY_OVERHEAD, value_size
+
+
+def test_mset_and_mget(handler):
+    assert handler.handle_command(["mset", "a", "1", "b", "", "c", "3"]) == b'+OK\r\n'
+    handler.handle_command(["rpush", "list", "x"])
+    assert handler.handle_command(["mget", "a", "b", "missing", "list", "c"]) == \
+        b'*5\r\n$1\r\n1\r\n$0\r\n\r\n$-1\r\n$-1\r\n$1\r\n3\r\n'
+    assert handler.handle_command(["mset", "a"]) == b"-ERR wrong number of arguments for 'mset' command\r\n"
+    assert handler.handle_command(["mset", "a", "1", "b"]) == b"-ERR wrong number of arguments for 'mset' command\r\n"
+    assert handler.handle_command(["mget"]) == b"-ERR wrong number of arguments for 'mget' command\r\n"
+
+
+def test_mset_replaces_values_and_ttls(handler):
+    handler.handle_command(["set", "a", "old", "ex", "100"])
+    handler.handle_command(["rpush", "list", "x", "y"])
+    handler.handle_command(["mset", "a", "new", "list", "string"])
+    cache = handler.redis_cache
+    assert cache.data == {"a": "new", "list": "string"}
+    assert handler.handle_command(["ttl", "a"]) == b':-1\r\n'
+    assert cache.table.used == sum(KEY_OVERHEAD + len(key) + value_size(value) for key, value in cache.data.items())
+
+
+def test_msetnx_sets_all_or_nothing(handler):
+    assert handler.handle_command(["msetnx", "a", "1", "b", "2"]) == b':1\r\n'
+    assert handler.handle_command(["msetnx", "c", "3", "b", "4"]) == b':0\r\n'
+    assert handler.handle_command(["mget", "a", "b", "c"]) == b'*3\r\n$1\r\n1\r\n$1\r\n2\r\n$-1\r\n'
+
+
+def test_exists_counts_empty_strings_and_duplicates(handler):
+    handler.handle_command(["mset", "empty", "", "zero", "0"])
+    assert handler.handle_command(["exists", "empty", "zero", "missing", "empty"]) == b':3\r\n'
+    # the same through the lookup path, with a deadline in the keyspace
+    handler.handle_command(["set", "volatile", "v", "px", "100000"])
+    assert handler.handle_command(["exists", "empty", "volatile", "missing"]) == b':2\r\n'
+    assert handler.handle_command(["del", "empty", "missing", "volatile", "empty"]) == b':2\r\n'
+    assert handler.redis_cache.data == {"zero": 0}
@@ -0,0 +1,35 @@
+import pytest
+
+from benchmarks.loadgen import reply_end, main
+from benchmarks.workload import Workload, parse_mix
+
+
+def test_reply_end():
+    buffer = b"+OK\r\n$3\r\nabc\r\n$-1\r\n*2\r\n$1\r\na\r\n:5\r\n*3\r\n$1\r\n"
+    ends = []
+    position = 0
+    while (end := reply_end(buffer, position)) != -1:
+        ends.append(end)
+        position = end
+    assert ends == [5, 14, 19, 34]
+    assert reply_end(b"$5\r\nab", 0) == -1
+
+
+def test_workload_is_reproducible():
+    mix = parse_mix("set=1,get=3,lrange")
+    assert mix == {'set': 1, 'get': 3, 'lrange': 1}
+    first = Workload(mix, 100, 8, 'zipf', seed=3).draw(50)
+    assert first == Workload(mix, 100, 8, 'zipf', seed=3).draw(50)
+    assert {name for name, _ in first} <= {'set', 'get', 'lrange'}
+    with pytest.raises(ValueError):
+        parse_mix("set=1,flushall=1")
+
+
+def test_in_process_report(tmp_path, capsys):
+    report = main(["--in-process", "--requests", "2000", "--pipeline", "8", "--keyspace", "50",
+                   "--mix", "set=1,get=1,incr=1,lpush=1,lrange=1", "--distribution", "zipf",
+                   "--output", str(tmp_path / "report.json")])
+    assert report["requests"] == 2000 and report["errors"] == 0
+    assert set(report["commands"]) == {"set", "get", "incr", "lpush", "lrange"}
+    assert set(report["latency_ms"]) == {"p50", "p99", "p999", "mean", "max"}
+    assert (tmp_path / "report.json").exists()
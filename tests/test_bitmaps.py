@@ -0,0 +1,129 @@
+import random
+
+from storage import bitmap
+from storage.eviction import KEY_OVERHEAD, value_size
+from tests.test_strings import run, bulk
+
+
+def naive_bits(data: bytes) -> list[int]:
+    return [(byte >> (7 - bit)) & 1 for byte in data for bit in range(8)]
+
+
+def test_setbit_and_getbit(handler):
+    assert run(handler, b"SETBIT", b"key", b"7", b"1") == b":0\r\n"
+    assert run(handler, b"SETBIT", b"key", b"7", b"1") == b":1\r\n"
+    assert run(handler, b"GET", b"key") == bulk(b"\x01")
+    # the value grows with zero bytes up to the offset
+    assert run(handler, b"SETBIT", b"key", b"100", b"1") == b":0\r\n"
+    assert run(handler, b"STRLEN", b"key") == b":13\r\n"
+    assert run(handler, b"GETBIT", b"key", b"100") == b":1\r\n"
+    assert run(handler, b"GETBIT", b"key", b"99") == b":0\r\n"
+    assert run(handler, b"GETBIT", b"key", b"10000") == b":0\r\n"
+    assert run(handler, b"GETBIT", b"missing", b"0") == b":0\r\n"
+    assert run(handler, b"SETBIT", b"key", b"7", b"0") == b":1\r\n"
+    assert run(handler, b"GETBIT", b"key", b"7") == b":0\r\n"
+
+    # bits of a value set as text, changed in place from then on
+    run(handler, b"SET", b"text", b"a")
+    assert run(handler, b"SETBIT", b"text", b"6", b"1") == b":0\r\n"
+    assert run(handler, b"GET", b"text") == bulk(b"c")
+    assert type(handler.redis_cache.data["text"]) is bytearray
+
+    assert run(handler, b"SETBIT", b"key", b"-1", b"1") == b"-ERR bit offset is not an integer or out of range\r\n"
+    assert run(handler, b"SETBIT", b"key", b"4294967296", b"1").startswith(b"-ERR bit offset")
+    assert run(handler, b"SETBIT", b"key", b"1", b"2") == b"-ERR bit is not an integer or out of range\r\n"
+    run(handler, b"RPUSH", b"list", b"a")
+    assert run(handler, b"SETBIT", b"list", b"1", b"1").startswith(b"-WRONGTYPE")
+    assert run(handler, b"GETBIT", b"list", b"1").startswith(b"-WRONGTYPE")
+    cache = handler.redis_cache
+    assert cache.table.used == sum(KEY_OVERHEAD + len(key) + value_size(value) for key, value in cache.data.items())
+
+
+def test_bitcount(handler):
+    run(handler, b"SET", b"key", b"foobar")
+    for arguments, expected in (((), 26), ((b"0", b"0"), 4), ((b"1", b"1"), 6), ((b"-2", b"-1"), 7),
+                                ((b"5", b"30", b"BIT"), 17), ((b"0", b"0", b"byte"), 4), ((b"3", b"1"), 0),
+                                ((b"-100", b"100"), 26), ((b"100", b"200"), 0)):
+        assert run(handler, b"BITCOUNT", b"key", *arguments) == b":%d\r\n" % expected
+    assert run(handler, b"BITCOUNT", b"missing") == b":0\r\n"
+    assert run(handler, b"BITCOUNT", b"key", b"0") == b"-ERR syntax error\r\n"
+    assert run(handler, b"BITCOUNT", b"key", b"0", b"1", b"bits") == b"-ERR syntax error\r\n"
+    assert run(handler, b"BITCOUNT", b"key", b"a", b"1").startswith(b"-ERR value is not an integer")
+
+    # against bit by bit counting, at ranges starting and ending within bytes
+    data = random.Random(1).randbytes(300)
+    run(handler, b"SET", b"random", data)
+    bits = naive_bits(data)
+    for start, end in ((0, 2399), (3, 5), (7, 8), (13, 2000), (9, 9), (-20, -3)):
+        expected = sum(bits[start:end + 1] if start >= 0 else bits[start:end + 1 or None])
+        assert run(handler, b"BITCOUNT", b"random", b"%d" % start, b"%d" % end, b"BIT") == b":%d\r\n" % expected
+
+
+def test_bitpos(handler):
+    run(handler, b"SET", b"key", b"\xff\xf0\x00")
+    for arguments, expected in (((b"0",), 12), ((b"1",), 0), ((b"1", b"2"), -1), ((b"0", b"0", b"-1"), 12),
+                                ((b"1", b"7", b"15", b"BIT"), 7), ((b"0", b"7", b"15", b"BIT"), 12),
+                                ((b"1", b"1"), 8), ((b"0", b"2", b"1"), -1)):
+        assert run(handler, b"BITPOS", b"key", *arguments) == b":%d\r\n" % expected
+    # a missing key is all zeros
+    assert run(handler, b"BITPOS", b"missing", b"0") == b":0\r\n"
+    assert run(handler, b"BITPOS", b"missing", b"1") == b":-1\r\n"
+    # without an end the value continues with zeros, with one the range is all there is
+    run(handler, b"SET", b"ones", b"\xff\xff")
+    assert run(handler, b"BITPOS", b"ones", b"0") == b":16\r\n"
+    assert run(handler, b"BITPOS", b"ones", b"0", b"0", b"-1") == b":-1\r\n"
+    assert run(handler, b"BITPOS", b"key", b"2") == b"-ERR The bit argument must be 1 or 0.\r\n"
+
+    # the first set bit far into a long run of zero bytes
+    data = bytearray(100000)
+    data[77777] = 0x04
+    run(handler, b"SET", b"sparse", bytes(data))
+    assert run(handler, b"BITPOS", b"sparse", b"1") == b":%d\r\n" % (77777 * 8 + 5)
+    assert run(handler, b"BITPOS", b"sparse", b"1", b"%d" % (77777 * 8 + 6), b"-1", b"BIT") == b":-1\r\n"
+    assert run(handler, b"BITPOS", b"sparse", b"0", b"77777", b"77777") == b":%d\r\n" % (77777 * 8)
+
+
+def test_bitop(handler):
+    run(handler, b"SET", b"a", b"foobar")
+    run(handler, b"SET", b"b", b"abcdef")
+    run(handler, b"SET", b"short", b"\xff")
+    assert run(handler, b"BITOP", b"AND", b"dest", b"a", b"b") == b":6\r\n"
+    assert run(handler, b"GET", b"dest") == bulk(b"`bc`ab")
+    assert run(handler, b"BITOP", b"or", b"dest", b"a", b"b") == b":6\r\n"
+    assert run(handler, b"GET", b"dest") == bulk(b"goofev")
+    assert run(handler, b"BITOP", b"XOR", b"dest", b"a", b"b", b"short") == b":6\r\n"
+    assert run(handler, b"GET", b"dest") == bulk(b"\xf8\r\x0c\x06\x04\x14")
+    assert run(handler, b"BITOP", b"NOT", b"dest", b"short") == b":1\r\n"
+    assert run(handler, b"GET", b"dest") == bulk(b"\x00")
+    # shorter and missing sources are zeros up to the longest
+    assert run(handler, b"BITOP", b"AND", b"dest", b"a", b"missing") == b":6\r\n"
+    assert run(handler, b"GET", b"dest") == bulk(b"\x00" * 6)
+
+    # an empty result deletes the destination, which loses its ttl in any case
+    run(handler, b"EXPIRE", b"dest", b"100")
+    assert run(handler, b"BITOP", b"OR", b"dest", b"a") == b":6\r\n"
+    assert run(handler, b"TTL", b"dest") == b":-1\r\n"
+    assert run(handler, b"BITOP", b"OR", b"dest", b"missing") == b":0\r\n"
+    assert run(handler, b"EXISTS", b"dest") == b":0\r\n"
+
+    assert run(handler, b"BITOP", b"NOT", b"dest", b"a", b"b") == \
+        b"-ERR BITOP NOT must be called with a single source key.\r\n"
+    assert run(handler, b"BITOP", b"NAND", b"dest", b"a") == b"-ERR syntax error\r\n"
+    run(handler, b"RPUSH", b"list", b"a")
+    assert run(handler, b"BITOP", b"AND", b"dest", b"a", b"list").startswith(b"-WRONGTYPE")
+
+
+def test_bit_helpers_against_naive():
+    generator = random.Random(2)
+    for _ in range(200):
+        data = bytes(generator.choice((0, 0xff, generator.randrange(256))) for _ in range(generator.randrange(1, 40)))
+        bits = naive_bits(data)
+        first = generator.randrange(len(bits))
+        last = generator.randrange(first, len(bits))
+        assert bitmap.count_bits(data, first, last) == sum(bits[first:last + 1])
+        for bit in (0, 1):
+            try:
+                expected = bits.index(bit, first, last + 1)
+            except ValueError:
+                expected = -1
+            assert bitmap.bit_position(data, bit, first, last) == expected
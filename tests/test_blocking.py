@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+
+import main
+from commandhandler.blocking import BLOCKED, blocking
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache, CacheHolder
+
+
+@pytest.fixture
+def keyspace(monkeypatch):
+    cache = RedisCache("blocking")
+    propagated = []
+    # what the append only file and the replicas would get
+    monkeypatch.setattr(RedisCache, "replication_feed", lambda name, command: propagated.append(list(command)))
+
+    def connect() -> CommandHandler:
+        handler = CommandHandler(cache)
+        handler.can_block = True
+        return handler
+
+    yield connect, propagated
+    assert not cache.blocked and blocking.blocked_clients == 0
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_served_in_order(keyspace):
+    connect, propagated = keyspace
+    producer = connect()
+    first, second, third = connect(), connect(), connect()
+    assert first.execute(["blpop", "jobs", "0"]) is BLOCKED
+    assert second.execute(["brpop", "other", "jobs", "0"]) is BLOCKED
+    assert third.execute(["blpop", "jobs", "0"]) is BLOCKED
+    assert blocking.blocked_clients == 3 and propagated == []
+
+    # served right after the push, before the next command of the producer
+    assert producer.execute(["rpush", "jobs", "a", "b"]) == 2
+    assert first.waiter.future.result() == ["jobs", "a"]
+    assert second.waiter.future.result() == ["jobs", "b"]
+    assert not third.waiter.future.done()
+    assert producer.execute(["llen", "jobs"]) == 0
+    # the pops follow the push in the stream, as the commands which don't block
+    assert propagated == [["rpush", "jobs", "a", "b"], ["lpop", "jobs"], ["rpop", "jobs"]]
+
+    assert producer.execute(["lpush", "other", "x"]) == 1
+    assert producer.execute(["lpush", "jobs", "c"]) == 1
+    assert third.waiter.future.result() == ["jobs", "c"]
+    assert producer.execute(["lrange", "other", "0", "-1"]) == ["x"]
+    for handler in (first, second, third):
+        handler.waiter = None
+
+    # with elements, nothing blocks, and what was popped is propagated
+    assert first.execute(["brpop", "missing", "other", "1"]) == ["other", "x"]
+    assert propagated[-1] == ["rpop", "other"]
+
+
+@pytest.mark.asyncio
+async def test_timeouts_and_errors(keyspace):
+    connect, propagated = keyspace
+    handler = connect()
+    # nothing is written for a command which blocked, the connection writes the reply later
+    assert handler.handle_command(["brpop", "jobs", "0.01"]) == b""
+    assert await handler.waiter.future == b"*-1\r\n"
+    handler.waiter = None
+    assert handler.handle_command(["blmove", "jobs", "done", "left", "right", "0.01"]) == b""
+    assert await handler.waiter.future is None
+    handler.waiter = None
+
+    assert handler.execute(["blpop", "jobs", "-1"]) == "-ERR timeout is negative"
+    assert handler.execute(["blpop", "jobs", "soon"]) == "-ERR timeout is not a float or out of range"
+    assert handler.execute(["blpop", "jobs", "inf"]) == "-ERR timeout is not a float or out of range"
+    assert handler.execute(["blmove", "a", "b", "up", "left", "0"]) == "-ERR syntax error"
+    assert handler.handle_command(["blpop", "0"]).startswith(b"-ERR wrong number of arguments")
+    handler.execute(["set", "text", "x"])
+    assert handler.execute(["blpop", "text", "0"]).startswith("-WRONGTYPE")
+    assert propagated == [["set", "text", "x"]]
+
+    # a connection which can't wait gets the timeout reply right away
+    handler.can_block = False
+    assert handler.handle_command(["blpop", "jobs", "0"]) == b"*-1\r\n"
+    assert handler.handle_command(["blmove", "jobs", "done", "left", "left", "0"]) == b"$-1\r\n"
+    assert handler.waiter is None and len(propagated) == 1
+
+
+@pytest.mark.asyncio
+async def test_lmove_and_blmove(keyspace):
+    connect, propagated = keyspace
+    producer, mover, consumer = connect(), connect(), connect()
+    producer.execute(["rpush", "list", "a", "b", "c"])
+    assert producer.execute(["lmove", "list", "list", "left", "right"]) == "a"
+    assert producer.execute(["lrange", "list", "0", "-1"]) == ["b", "c", "a"]
+    assert producer.execute(["lmove", "list", "other", "right", "left"]) == "a"
+    assert producer.execute(["lmove", "missing", "other", "left", "left"]) is None
+    producer.execute(["set", "text", "x"])
+    assert producer.execute(["lmove", "list", "text", "left", "left"]).startswith("-WRONGTYPE")
+    assert producer.execute(["llen", "list"]) == 2
+
+    # a moved element wakes the waiters of the destination
+    assert mover.execute(["blmove", "queue", "processing", "right", "left", "0"]) is BLOCKED
+    assert consumer.execute(["blpop", "processing", "0"]) is BLOCKED
+    del propagated[:]
+    producer.execute(["lpush", "queue", "job"])
+    assert mover.waiter.future.result() == "job"
+    assert consumer.waiter.future.result() == ["processing", "job"]
+    assert propagated == [["lpush", "queue", "job"], ["lmove", "queue", "processing", "right", "left"],
+                          ["lpop", "processing"]]
+    assert producer.execute(["exists", "queue", "processing"]) == 0
+
+
+@pytest.mark.asyncio
+async def test_closed_connections_leave_the_queues(keyspace):
+    connect, _ = keyspace
+    gone, waiting = connect(), connect()
+    gone.execute(["blpop", "a", "b", "0"])
+    waiting.execute(["blpop", "b", "5"])
+    gone.close()
+    assert blocking.blocked_clients == 1
+    connect().execute(["rpush", "b", "x"])
+    assert waiting.waiter.future.result() == ["b", "x"]
+
+
+@pytest.mark.asyncio
+async def test_blocked_connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(RedisCache, "FILE_STORE", str(tmp_path / "file_store_"))
+    monkeypatch.setattr(CacheHolder, "_instance", None)
+    server = await asyncio.start_server(main.handle_client, host="localhost", port=0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("localhost", port)
+        # the commands behind the blocking one wait for its reply
+        writer.write(b"*3\r\n$5\r\nBLPOP\r\n$4\r\njobs\r\n$1\r\n0\r\n*1\r\n$4\r\nPING\r\n")
+        await asyncio.sleep(0.05)
+        writer.write(b"*1\r\n$4\r\nPING\r\n")
+        producer_reader, producer = await asyncio.open_connection("localhost", port)
+        producer.write(b"*3\r\n$5\r\nRPUSH\r\n$4\r\njobs\r\n$3\r\njob\r\n")
+        assert await producer_reader.readuntil(b"\r\n") == b":1\r\n"
+        expected = b"*2\r\n$4\r\njobs\r\n$3\r\njob\r\n+PONG\r\n+PONG\r\n"
+        assert await reader.readexactly(len(expected)) == expected
+
+        # a client which disconnects while blocked is dropped from the queue
+        writer.write(b"*3\r\n$5\r\nBLPOP\r\n$4\r\njobs\r\n$1\r\n0\r\n")
+        await asyncio.sleep(0.05)
+        assert blocking.blocked_clients == 1
+        writer.close()
+        for _ in range(100):
+            if blocking.blocked_clients == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert blocking.blocked_clients == 0
+        producer.write(b"*3\r\n$5\r\nRPUSH\r\n$4\r\njobs\r\n$3\r\njob\r\n")
+        assert await producer_reader.readuntil(b"\r\n") == b":1\r\n"
+        producer.close()
+        await producer.wait_closed()
+        # the server side sees the end of the connection before the server closes
+        await asyncio.sleep(0.05)
+    finally:
+        server.close()
+        await server.wait_closed()
+        CacheHolder.shutdown()
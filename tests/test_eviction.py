@@ -0,0 +1,136 @@
+import random
+
+import pytest
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache
+from storage.eviction import usage, KeyTable, KEY_OVERHEAD, value_size
+
+
+@pytest.fixture
+def limited(monkeypatch):
+    monkeypatch.setattr(usage, "used", 0)
+    monkeypatch.setattr(usage, "evicted_keys", 0)
+    handler = CommandHandler(RedisCache("eviction"))
+
+    def configure(policy: str, keys: int):
+        """a limit fitting about `keys` keys as written by `fill`"""
+        ServerConfig.set('maxmemory-policy', policy)
+        ServerConfig.set('maxmemory', str(keys * (KEY_OVERHEAD + 8 + value_size("x" * 10))))
+
+    yield handler, configure
+    ServerConfig.set('maxmemory', '0')
+    ServerConfig.set('maxmemory-policy', 'noeviction')
+    ServerConfig.set('maxmemory-samples', '5')
+
+
+def fill(handler: CommandHandler, first: int, last: int, *options):
+    for index in range(first, last):
+        handler.handle_command(["set", f"key:{index:04d}", "x" * 10, *options])
+
+
+def assert_sizes_match(cache: RedisCache):
+    table = cache.table
+    assert sorted(table.keys) == sorted(cache.data)
+    for key, value in cache.data.items():
+        assert table.sizes[table.slot_of[key]] == KEY_OVERHEAD + len(key) + value_size(value)
+    assert table.used == sum(table.sizes)
+
+
+def test_accounting_follows_every_write(monkeypatch):
+    monkeypatch.setattr(usage, "used", 0)
+    handler = CommandHandler(RedisCache("accounting"))
+    random.seed(7)
+    for _ in range(2000):
+        key = f"list{random.randrange(5)}"
+        command = random.choice([
+            ["rpush", key, *("v" * random.randrange(1, 9) for _ in range(random.randrange(1, 4)))],
+            ["lpush", key, "element"],
+            ["lpop", key],
+            ["rpop", key, "2"],
+            ["lset", key, "0", "x" * random.randrange(20)],
+            ["ltrim", key, "1", "-2"],
+            ["lrem", key, "0", "v"],
+            ["set", f"string{random.randrange(5)}", "s" * random.randrange(30)],
+            ["del", f"string{random.randrange(5)}"],
+            ["incr", "counter"],
+        ])
+        handler.handle_command(command)
+    assert_sizes_match(handler.redis_cache)
+    assert usage.used == handler.redis_cache.table.used
+
+
+def test_key_table_swap_remove():
+    table = KeyTable()
+    for index in range(10):
+        table.store(f"key{index}", index)
+    table.remove("key3")
+    table.remove("key9")
+    table.remove("missing")
+    assert sorted(table.keys) == sorted(f"key{index}" for index in (0, 1, 2, 4, 5, 6, 7, 8))
+    assert all(table.keys[slot] == key for key, slot in table.slot_of.items())
+    assert table.used == 33
+
+
+def test_noeviction_rejects_writes(limited):
+    handler, configure = limited
+    configure('noeviction', 10)
+    fill(handler, 0, 20)
+    assert handler.handle_command(["set", "one", "more"]).startswith(b"-OOM command not allowed")
+    # reads and deletes still work
+    assert handler.handle_command(["get", "key:0000"]) == b'$10\r\nxxxxxxxxxx\r\n'
+    assert handler.handle_command(["del", "key:0000"]) == b':1\r\n'
+
+
+def test_allkeys_lru_keeps_recently_used_keys(limited):
+    handler, configure = limited
+    configure('allkeys-lru', 100)
+    fill(handler, 0, 100)
+    for index in range(300, 1000):
+        for hot in range(10):
+            handler.handle_command(["get", f"key:{hot:04d}"])
+        fill(handler, index, index + 1)
+    cache = handler.redis_cache
+    assert usage.used <= int(ServerConfig.get('maxmemory')) + KEY_OVERHEAD + 100
+    assert usage.evicted_keys > 600
+    assert all(f"key:{hot:04d}" in cache.data for hot in range(10))
+    assert_sizes_match(cache)
+
+
+def test_allkeys_lfu_keeps_frequently_used_keys(limited):
+    handler, configure = limited
+    configure('allkeys-lfu', 100)
+    fill(handler, 0, 10)
+    for _ in range(100):
+        for hot in range(10):
+            handler.handle_command(["get", f"key:{hot:04d}"])
+    fill(handler, 100, 1000)
+    assert all(f"key:{hot:04d}" in handler.redis_cache.data for hot in range(10))
+
+
+def test_volatile_ttl_evicts_the_soonest_expiring_keys(limited):
+    handler, configure = limited
+    configure('volatile-ttl', 100)
+    fill(handler, 0, 50)
+    for index in range(50, 100):
+        handler.handle_command(["set", f"key:{index:04d}", "x" * 10, "ex", str(1000 + index)])
+    fill(handler, 100, 110)
+    cache = handler.redis_cache
+    # persistent keys are never chosen, the ones with the shortest ttl go first
+    assert all(f"key:{index:04d}" in cache.data for index in range(50))
+    assert "key:0099" in cache.data and "key:0050" not in cache.data
+
+    fill(handler, 110, 200)
+    assert handler.handle_command(["set", "no", "volatile keys left"]).startswith(b"-OOM")
+
+
+def test_info_memory(limited):
+    handler, configure = limited
+    configure('allkeys-random', 10)
+    fill(handler, 0, 20)
+    text = handler.execute(["info", "memory"])
+    assert "maxmemory_policy:allkeys-random\r\n" in text
+    assert f"evicted_keys:{usage.evicted_keys}\r\n" in text and usage.evicted_keys >= 9
+    assert handler.handle_command(["config", "set", "maxmemory", "1mb"]) == b'+OK\r\n'
+    assert handler.handle_command(["config", "get", "maxmemory"]) == b'*2\r\n$9\r\nmaxmemory\r\n$7\r\n1048576\r\n'
@@ -0,0 +1,91 @@
+import time
+
+from commandhandler.handler import CommandHandler
+from storage.cache import RedisCache
+from storage.expiry import ExpiryEngine, now_ms
+
+
+def test_set_with_ttl_and_ttl_commands():
+    handler = CommandHandler(RedisCache("expiry"))
+
+    assert handler.handle_command(["set", "key", "value", "EX", "100"]) == b'+OK\r\n'
+    assert handler.handle_command(["ttl", "key"]) == b':100\r\n'
+    assert 99_000 < int(handler.handle_command(["pttl", "key"])[1:-2]) <= 100_000
+    assert handler.handle_command(["persist", "key"]) == b':1\r\n'
+    assert handler.handle_command(["ttl", "key"]) == b':-1\r\n'
+    assert handler.handle_command(["ttl", "missing"]) == b':-2\r\n'
+
+
+def test_set_options():
+    handler = CommandHandler(RedisCache("expiry"))
+
+    assert handler.handle_command(["set", "key", "1", "xx"]) == b'$-1\r\n'
+    assert handler.handle_command(["set", "key", "1", "nx", "px", "50000"]) == b'+OK\r\n'
+    assert handler.handle_command(["set", "key", "2", "nx"]) == b'$-1\r\n'
+    assert handler.handle_command(["set", "key", "3", "keepttl"]) == b'+OK\r\n'
+    assert handler.handle_command(["ttl", "key"]) == b':50\r\n'
+    # a plain SET drops the ttl
+    assert handler.handle_command(["set", "key", "4"]) == b'+OK\r\n'
+    assert handler.handle_command(["ttl", "key"]) == b':-1\r\n'
+    assert handler.handle_command(["set", "key", "4", "ex", "0"]) == b"-ERR invalid expire time in 'set' command\r\n"
+    assert handler.handle_command(["set", "key", "4", "ex", "1", "px", "1"]) == b"-ERR syntax error\r\n"
+
+
+def test_absolute_deadline_in_the_past_deletes():
+    handler = CommandHandler(RedisCache("expiry"))
+
+    handler.handle_command(["set", "key", "value"])
+    assert handler.handle_command(["pexpireat", "key", str(now_ms() - 10)]) == b':1\r\n'
+    assert handler.handle_command(["get", "key"]) == b'$-1\r\n'
+    assert handler.handle_command(["set", "key", "value", "exat", "1"]) == b'+OK\r\n'
+    assert handler.handle_command(["exists", "key"]) == b':0\r\n'
+
+
+def test_expire_flags():
+    handler = CommandHandler(RedisCache("expiry"))
+
+    handler.handle_command(["set", "key", "value"])
+    assert handler.handle_command(["expire", "key", "100", "xx"]) == b':0\r\n'
+    assert handler.handle_command(["expire", "key", "100", "nx"]) == b':1\r\n'
+    assert handler.handle_command(["expire", "key", "50", "gt"]) == b':0\r\n'
+    assert handler.handle_command(["expire", "key", "50", "lt"]) == b':1\r\n'
+    assert handler.handle_command(["ttl", "key"]) == b':50\r\n'
+    assert handler.handle_command(["expire", "missing", "50"]) == b':0\r\n'
+
+
+def test_lazy_expiry_on_read_paths():
+    cache = RedisCache("expiry")
+    cache.set_key_value("key", ["value", "px", "1"])
+    cache.append_to_tail(["list", "a", "b"])
+    cache.expire("list", "px", "1")
+    time.sleep(0.005)
+
+    assert cache.is_key_existing(["key", "list"]) == 0
+    assert cache.get_by_key("key") is None
+    assert cache.lrange(["list", "0", "-1"]) == []
+    assert cache.data == {}
+    assert len(cache.expires) == 0
+
+
+def test_active_expire_cycle_respects_deadlines():
+    cache = RedisCache("expiry")
+    for index in range(100):
+        cache.set_key_value(f"short{index}", ["value", "px", "1"])
+        cache.set_key_value(f"long{index}", ["value", "ex", "100"])
+    time.sleep(0.025)
+
+    assert cache.active_expire_cycle(time.perf_counter() + 1) <= 100
+    assert sorted(cache.data) == sorted(f"long{index}" for index in range(100))
+    assert len(cache.expires) == 100
+
+
+def test_expiry_engine_skips_stale_heap_entries():
+    engine = ExpiryEngine()
+    engine.set("a", 10)
+    engine.set("a", 1_000)
+    engine.set("b", 20)
+    engine.remove("b")
+
+    assert list(engine.pop_expired(500, time.perf_counter() + 1)) == []
+    assert list(engine.pop_expired(1_010, time.perf_counter() + 1)) == ["a"]
+    assert len(engine) == 0
@@ -0,0 +1,119 @@
+import pytest
+
+from commandhandler.config import ServerConfig
+from storage.aof import write_rewrite
+from storage.cache import RedisCache
+from storage.eviction import KEY_OVERHEAD, value_size
+from storage.expiry import now_ms
+from storage.glob import compile_glob
+from storage.hashtype import RedisHash
+from storage.snapshot import write_snapshot, read_snapshot
+
+
+@pytest.fixture
+def small_listpacks():
+    ServerConfig.set('hash-max-listpack-entries', '4')
+    ServerConfig.set('hash-max-listpack-value', '8')
+    yield
+    ServerConfig.set('hash-max-listpack-entries', '128')
+    ServerConfig.set('hash-max-listpack-value', '64')
+
+
+def accounted(cache: RedisCache) -> int:
+    return sum(KEY_OVERHEAD + len(key) + value_size(value) for key, value in cache.data.items())
+
+
+def test_hash_commands(handler):
+    assert handler.handle_command(["hset", "user", "name", "ann", "age", "30"]) == b':2\r\n'
+    assert handler.handle_command(["hset", "user", "name", "bob", "city", "age"]) == b':1\r\n'
+    assert handler.handle_command(["hget", "user", "name"]) == b'$3\r\nbob\r\n'
+    # a value equal to a field name is not a field
+    assert handler.handle_command(["hget", "user", "age"]) == b'$2\r\n30\r\n'
+    assert handler.handle_command(["hmget", "user", "city", "missing"]) == b'*2\r\n$3\r\nage\r\n$-1\r\n'
+    assert handler.handle_command(["hmget", "missing", "a"]) == b'*1\r\n$-1\r\n'
+    assert handler.handle_command(["hgetall", "user"]) == \
+        b'*6\r\n$4\r\nname\r\n$3\r\nbob\r\n$3\r\nage\r\n$2\r\n30\r\n$4\r\ncity\r\n$3\r\nage\r\n'
+    assert handler.handle_command(["hlen", "user"]) == b':3\r\n'
+    assert handler.handle_command(["hexists", "user", "city"]) == b':1\r\n'
+    assert handler.handle_command(["hincrby", "user", "age", "-5"]) == b':25\r\n'
+    assert handler.handle_command(["hincrby", "user", "visits", "1"]) == b':1\r\n'
+    assert handler.handle_command(["hincrby", "user", "name", "1"]) == b'-ERR hash value is not an integer\r\n'
+    assert handler.handle_command(["hdel", "user", "name", "missing", "city"]) == b':2\r\n'
+    assert handler.redis_cache.table.used == accounted(handler.redis_cache)
+    assert handler.handle_command(["hdel", "user", "age", "visits"]) == b':2\r\n'
+    # the last field took the key with it
+    assert handler.handle_command(["exists", "user"]) == b':0\r\n'
+    assert handler.handle_command(["hgetall", "user"]) == b'*0\r\n'
+
+    handler.handle_command(["set", "text", "x"])
+    assert handler.handle_command(["hset", "text", "a", "b"]).startswith(b'-WRONGTYPE')
+    assert handler.handle_command(["hget", "text", "a"]).startswith(b'-WRONGTYPE')
+    assert handler.handle_command(["hset", "user", "a"]) == b"-ERR wrong number of arguments for 'hset' command\r\n"
+    handler.handle_command(["hset", "user", "a", "b"])
+    assert handler.handle_command(["get", "user"]).startswith(b'-WRONGTYPE')
+
+
+def test_compact_hashes_convert_past_the_thresholds(handler, small_listpacks):
+    handler.handle_command(["hset", "small", "a", "1", "b", "2", "c", "3", "d", "4"])
+    handler.handle_command(["hset", "long value", "a", "123456789"])
+    handler.handle_command(["hset", "many", "a", "1", "b", "2", "c", "3", "d", "4", "e", "5"])
+    data = handler.redis_cache.data
+    assert data["small"].is_compact
+    assert not data["long value"].is_compact and not data["many"].is_compact
+    assert handler.handle_command(["hget", "many", "e"]) == b'$1\r\n5\r\n'
+    assert data["many"] == RedisHash([("a", "1"), ("b", "2"), ("c", "3"), ("d", "4"), ("e", "5")])
+    assert handler.redis_cache.table.used == accounted(handler.redis_cache)
+    handler.handle_command(["hdel", "many", "a", "b", "c"])
+    assert handler.redis_cache.table.used == accounted(handler.redis_cache)
+
+
+def test_hscan(handler, small_listpacks):
+    fields = [f"field:{index}" for index in range(20)]
+    handler.handle_command(["hset", "big", *(part for field in fields for part in (field, "v"))])
+    seen, cursor = [], "0"
+    while True:
+        cursor, entries = handler.reply(["hscan", "big", cursor, "count", "6"])
+        seen += entries[::2]
+        if cursor == "0":
+            break
+    assert seen == fields
+    cursor, entries = handler.reply(["hscan", "big", "0", "match", "field:1?", "count", "100"])
+    assert cursor == "0" and entries[::2] == [f"field:{index}" for index in range(10, 20)]
+    handler.handle_command(["hset", "small", "a", "1"])
+    assert handler.reply(["hscan", "small", "0"]) == ["0", ["a", "1"]]
+    assert handler.reply(["hscan", "missing", "0"]) == ["0", []]
+    assert handler.reply(["hscan", "big", "x"]) == "-ERR invalid cursor"
+    assert handler.reply(["hscan", "big", "0", "count"]) == "-ERR syntax error"
+
+
+def test_glob_patterns():
+    cases = {
+        "*": ["", "anything"],
+        "h?llo": ["hello", "hxllo", "!hllo"],
+        "h*llo": ["hllo", "heeeello", "!hellO"],
+        "h[ae]llo": ["hello", "hallo", "!hillo"],
+        "h[^e]llo": ["hallo", "!hello"],
+        "h[a-b]llo": ["hallo", "hbllo", "!hcllo"],
+        "h\\*llo": ["h*llo", "!hello"],
+        "a.b": ["a.b", "!axb"],
+    }
+    for pattern, subjects in cases.items():
+        match = compile_glob(pattern)
+        for subject in subjects:
+            expected = not subject.startswith("!")
+            assert bool(match(subject.lstrip("!"))) is expected, (pattern, subject)
+
+
+def test_hashes_are_persisted(tmp_path, small_listpacks):
+    big = RedisHash((f"f{index}", str(index)) for index in range(10))
+    values = {"small": RedisHash([("a", "1"), ("ü", "")]), "big": big, "volatile": RedisHash([("x", "y")])}
+    deadline = now_ms() + 60_000
+    write_snapshot(str(tmp_path / "dump.rdb"), list(values.items()), {"volatile": deadline}, now_ms())
+    loaded, deadlines = read_snapshot(str(tmp_path / "dump.rdb"))
+    assert loaded == values and deadlines == {"volatile": deadline}
+    assert loaded["small"].is_compact and not loaded["big"].is_compact
+    assert loaded["big"].nbytes == big.nbytes
+
+    write_rewrite(str(tmp_path / "rewrite.aof"), list(values.items()), {}, now_ms())
+    log = (tmp_path / "rewrite.aof").read_bytes()
+    assert log.startswith(b"*6\r\n$4\r\nHSET\r\n$5\r\nsmall\r\n$1\r\na\r\n$1\r\n1\r\n")
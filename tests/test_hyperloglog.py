@@ -0,0 +1,120 @@
+import pytest
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from storage import hyperloglog
+from storage.cache import RedisCache
+from storage.eviction import KEY_OVERHEAD, value_size
+from storage.snapshot import write_snapshot, read_snapshot
+from storage.expiry import now_ms
+from tests.test_strings import run
+
+
+@pytest.fixture(autouse=True)
+def default_sparse_max_bytes():
+    yield
+    ServerConfig.set('hll-sparse-max-bytes', '3000')
+
+
+def add(handler: CommandHandler, key: bytes, elements) -> bytes:
+    elements = [b"%d" % element if type(element) is int else element for element in elements]
+    return run(handler, b"PFADD", key, *elements)
+
+
+def count(handler: CommandHandler, *keys: bytes) -> int:
+    reply = run(handler, b"PFCOUNT", *keys)
+    assert reply.startswith(b":"), reply
+    return int(reply[1:])
+
+
+def test_pfadd_and_pfcount(handler):
+    assert add(handler, b"hll", (b"a", b"b", b"c")) == b":1\r\n"
+    assert add(handler, b"hll", (b"a", b"b")) == b":0\r\n"
+    assert count(handler, b"hll") == 3
+    # a key without elements is created empty, once
+    assert add(handler, b"empty", ()) == b":1\r\n"
+    assert add(handler, b"empty", ()) == b":0\r\n"
+    assert count(handler, b"empty") == 0 and count(handler, b"missing") == 0
+    # the value is a string in the layout of redis
+    value = bytes(handler.redis_cache.data["hll"])
+    assert value[:4] == b"HYLL" and value[4] == hyperloglog.SPARSE
+    assert run(handler, b"TYPE", b"hll") == b"+string\r\n"
+
+    run(handler, b"SET", b"text", b"not a hyperloglog")
+    assert add(handler, b"text", (b"a",)) == b"-WRONGTYPE Key is not a valid HyperLogLog string value.\r\n"
+    assert run(handler, b"PFCOUNT", b"hll", b"text").startswith(b"-WRONGTYPE Key is not a valid HyperLogLog")
+    run(handler, b"RPUSH", b"list", b"a")
+    assert run(handler, b"PFCOUNT", b"list").startswith(b"-WRONGTYPE Operation against a key")
+    # the header is right but the registers are not, found once the cached count is stale
+    run(handler, b"SET", b"broken", value[:15] + bytes((hyperloglog.STALE,)) + b"\x7f")
+    assert run(handler, b"PFCOUNT", b"broken") == b"-INVALIDOBJ Corrupted HLL object detected\r\n"
+
+
+@pytest.mark.parametrize("cardinality", [100, 5000, 100000])
+def test_estimates_are_close(handler, cardinality):
+    for start in range(0, cardinality, 10000):
+        add(handler, b"hll", range(start, min(start + 10000, cardinality)))
+    estimate = count(handler, b"hll")
+    # 0.81% standard error, five of them still pass
+    assert abs(estimate - cardinality) <= max(2, cardinality * 0.05)
+    encoding = handler.redis_cache.data["hll"][4]
+    assert encoding == (hyperloglog.SPARSE if cardinality <= 100 else hyperloglog.DENSE)
+    cache = handler.redis_cache
+    assert cache.table.used == sum(KEY_OVERHEAD + len(key) + value_size(value) for key, value in cache.data.items())
+
+
+def test_sparse_becomes_dense(handler):
+    ServerConfig.set('hll-sparse-max-bytes', '200')
+    add(handler, b"hll", range(20))
+    assert handler.redis_cache.data["hll"][4] == hyperloglog.SPARSE
+    add(handler, b"hll", range(20, 400))
+    value = handler.redis_cache.data["hll"]
+    assert value[4] == hyperloglog.DENSE and len(value) == hyperloglog.DENSE_SIZE
+    # dense values are changed in place
+    add(handler, b"hll", range(400, 800))
+    assert handler.redis_cache.data["hll"] is value
+    assert abs(count(handler, b"hll") - 800) <= 40
+
+
+def test_count_is_cached(handler, monkeypatch):
+    add(handler, b"hll", range(3000))
+    first = count(handler, b"hll")
+    assert not handler.redis_cache.data["hll"][15] & hyperloglog.STALE
+    monkeypatch.setattr(hyperloglog, "estimate", lambda histogram: pytest.fail("estimated again"))
+    assert count(handler, b"hll") == first
+    # an element which changes no register keeps the cached count
+    assert add(handler, b"hll", (b"1",)) == b":0\r\n"
+    assert count(handler, b"hll") == first
+
+
+def test_pfmerge(handler):
+    add(handler, b"a", range(0, 6000))
+    add(handler, b"b", range(3000, 9000))
+    add(handler, b"small", range(20))
+    assert abs(count(handler, b"a", b"b") - 9000) <= 450
+    # the union of a sparse and a dense one, and of missing keys
+    assert abs(count(handler, b"a", b"small", b"missing") - 6000) <= 300
+    assert run(handler, b"PFMERGE", b"union", b"a", b"b") == b"+OK\r\n"
+    assert count(handler, b"union") == count(handler, b"a", b"b")
+    # the destination is one of the sources too
+    assert run(handler, b"PFMERGE", b"small", b"missing") == b"+OK\r\n"
+    assert count(handler, b"small") == 20
+    assert run(handler, b"PFMERGE", b"nothing") == b"+OK\r\n"
+    assert count(handler, b"nothing") == 0 and run(handler, b"EXISTS", b"nothing") == b":1\r\n"
+    run(handler, b"SET", b"text", b"x")
+    assert run(handler, b"PFMERGE", b"union", b"text").startswith(b"-WRONGTYPE")
+
+
+def test_hyperloglogs_are_persisted(handler, tmp_path):
+    add(handler, b"sparse", range(50))
+    add(handler, b"dense", range(50000))
+    expected = count(handler, b"sparse"), count(handler, b"dense")
+    file_name = str(tmp_path / "dump.rdb")
+    write_snapshot(file_name, list(handler.redis_cache.data.items()), {}, now_ms(), True)
+    loaded, _ = read_snapshot(file_name)
+    restored = CommandHandler(RedisCache("restored"))
+    restored.redis_cache._store_loaded(loaded)
+    assert (count(restored, b"sparse"), count(restored, b"dense")) == expected
+    # and keep counting from where they were
+    assert add(restored, b"sparse", range(50)) == b":0\r\n"
+    assert add(restored, b"sparse", (b"new",)) == b":1\r\n"
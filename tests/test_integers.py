@@ -0,0 +1,98 @@
+from storage.eviction import KEY_OVERHEAD, value_size
+from storage.expiry import now_ms
+from storage.integers import parse_integer, encode_string, format_float, LLONG_MAX, LLONG_MIN
+from storage.snapshot import write_snapshot, read_snapshot
+
+
+def test_only_canonical_integers_are_encoded():
+    for value in ("0", "7", "-7", "10000", str(LLONG_MAX), str(LLONG_MIN)):
+        assert encode_string(value) == int(value)
+    for value in ("", "-", "-0", "007", "+1", " 1", "1 ", "1.0", "1e3", "٣", str(LLONG_MAX + 1), "abc"):
+        assert encode_string(value) == value
+        assert parse_integer(value) is None
+    # the small ones come from the shared pool
+    assert encode_string("9999") is encode_string("".join("9999"))
+    assert format_float(3.0) == "3" and format_float(0.1 + 0.2) == "0.30000000000000004"
+
+
+def test_values_are_stored_as_ints_and_read_as_strings(handler):
+    handler.handle_command(["set", "n", "42"])
+    handler.handle_command(["mset", "big", str(LLONG_MAX), "text", "0x1", "negative", "-5"])
+    assert handler.redis_cache.data == {"n": 42, "big": LLONG_MAX, "text": "0x1", "negative": -5}
+    assert handler.handle_command(["get", "n"]) == b'$2\r\n42\r\n'
+    assert handler.handle_command(["get", "negative"]) == b'$2\r\n-5\r\n'
+    assert handler.handle_command(["mget", "n", "big", "text", "missing"]) == \
+        b'*4\r\n$2\r\n42\r\n$19\r\n9223372036854775807\r\n$3\r\n0x1\r\n$-1\r\n'
+    cache = handler.redis_cache
+    assert cache.table.used == sum(KEY_OVERHEAD + len(key) + value_size(value) for key, value in cache.data.items())
+
+
+def test_incr_and_decr(handler):
+    assert handler.handle_command(["incr", "missing"]) == b':1\r\n'
+    assert handler.handle_command(["decrby", "other", "5"]) == b':-5\r\n'
+    handler.handle_command(["set", "counter", "10", "ex", "100"])
+    assert handler.handle_command(["incrby", "counter", "-3"]) == b':7\r\n'
+    assert handler.handle_command(["decr", "counter"]) == b':6\r\n'
+    # the ttl stays, the value stays a string to clients
+    assert handler.handle_command(["ttl", "counter"]) == b':100\r\n'
+    assert handler.handle_command(["get", "counter"]) == b'$1\r\n6\r\n'
+
+    handler.handle_command(["set", "text", "abc"])
+    handler.handle_command(["rpush", "list", "x"])
+    assert handler.handle_command(["incr", "text"]) == b'-ERR value is not an integer or out of range\r\n'
+    assert handler.handle_command(["incrby", "counter", "1.5"]) == b'-ERR value is not an integer or out of range\r\n'
+    assert handler.handle_command(["incr", "list"]).startswith(b'-WRONGTYPE')
+    handler.handle_command(["set", "max", str(LLONG_MAX)])
+    assert handler.handle_command(["incr", "max"]) == b'-ERR increment or decrement would overflow\r\n'
+    assert handler.handle_command(["decrby", "missing", str(LLONG_MIN)]) == \
+        b'-ERR increment or decrement would overflow\r\n'
+
+
+def test_incrbyfloat(handler):
+    assert handler.handle_command(["incrbyfloat", "f", "1.5"]) == b'$3\r\n1.5\r\n'
+    assert handler.handle_command(["incrbyfloat", "f", "1.5"]) == b'$1\r\n3\r\n'
+    # an integral result is integer encoded again
+    assert handler.redis_cache.data["f"] == 3
+    assert handler.handle_command(["incrbyfloat", "f", "x"]) == b'-ERR value is not a valid float\r\n'
+    assert handler.handle_command(["incrbyfloat", "f", "inf"]) == \
+        b'-ERR increment would produce NaN or Infinity\r\n'
+    # python's float() takes these, redis doesn't
+    for delta in ("1_0", " 2 ", "2\n", "nan", "-nan"):
+        assert handler.handle_command(["incrbyfloat", "f", delta]) == b'-ERR value is not a valid float\r\n'
+    assert handler.handle_command(["get", "f"]) == b'$1\r\n3\r\n'
+    for stored in ("1_0", " 2", "nan"):
+        handler.handle_command(["set", "text", stored])
+        assert handler.handle_command(["incrbyfloat", "text", "1"]) == b'-ERR value is not a valid float\r\n'
+    handler.handle_command(["set", "text", "-inf"])
+    assert handler.handle_command(["incrbyfloat", "text", "1"]) == \
+        b'-ERR increment would produce NaN or Infinity\r\n'
+    assert handler._propagated(["incrbyfloat", "f", "0.5"]) == ["set", "f", "3", "keepttl"]
+
+
+def test_getset_and_getdel(handler):
+    assert handler.handle_command(["getset", "key", "1"]) == b'$-1\r\n'
+    handler.handle_command(["expire", "key", "100"])
+    assert handler.handle_command(["getset", "key", "two"]) == b'$1\r\n1\r\n'
+    assert handler.handle_command(["ttl", "key"]) == b':-1\r\n'
+    assert handler.handle_command(["getdel", "key"]) == b'$3\r\ntwo\r\n'
+    assert handler.handle_command(["getdel", "key"]) == b'$-1\r\n'
+    handler.handle_command(["rpush", "list", "x"])
+    assert handler.handle_command(["getset", "list", "1"]).startswith(b'-WRONGTYPE')
+    assert handler.handle_command(["getdel", "list"]).startswith(b'-WRONGTYPE')
+    assert handler.handle_command(["exists", "list"]) == b':1\r\n'
+    # a GETSET of a missing key is a write all the same
+    dirty = handler.redis_cache.dirty
+    handler.handle_command(["getset", "new", "v"])
+    assert handler.redis_cache.dirty == dirty + 1
+
+
+def test_snapshot_keeps_integers(tmp_path):
+    file_name = str(tmp_path / "dump.rdb")
+    deadline = now_ms() + 60_000
+    values = {**{f"counter:{index}": index * 1000 for index in range(5000)},
+              "max": LLONG_MAX, "min": LLONG_MIN, "volatile": 5, "text": "5x"}
+    write_snapshot(file_name, list(values.items()), {"volatile": deadline}, now_ms())
+    loaded, deadlines = read_snapshot(file_name)
+    assert loaded == values
+    assert type(loaded["counter:1"]) is int and loaded["counter:1"] is encode_string("1000")
+    assert deadlines == {"volatile": deadline}
@@ -0,0 +1,80 @@
+import random
+
+from storage.expiry import now_ms
+
+
+def scan_all(handler, *options) -> list[str]:
+    cursor, keys = "0", []
+    while True:
+        cursor, found = handler.execute(["scan", cursor, *options])
+        keys += found
+        if cursor == "0":
+            return keys
+
+
+def test_scan_returns_every_key(handler):
+    for index in range(95):
+        handler.execute(["set", f"key:{index}", "x"])
+    handler.execute(["rpush", "list", "a"])
+    handler.execute(["hset", "hash", "f", "v"])
+    handler.execute(["zadd", "zset", "1", "m"])
+    keys = scan_all(handler, "count", "7")
+    assert sorted(keys) == sorted(handler.redis_cache.data)
+    assert sorted(scan_all(handler, "match", "key:1?")) == [f"key:{index}" for index in range(10, 20)]
+    assert scan_all(handler, "type", "hash") == ["hash"]
+    assert scan_all(handler, "TYPE", "zset", "MATCH", "z*", "COUNT", "1000") == ["zset"]
+    cursor, found = handler.execute(["scan", "0", "count", "10"])
+    assert int(cursor) == 88 and len(found) == 10
+    assert handler.execute(["scan", "x"]) == "-ERR invalid cursor"
+    assert handler.execute(["scan", "0", "count"]) == "-ERR syntax error"
+    assert handler.execute(["scan", "0", "type"]) == "-ERR syntax error"
+    assert handler.execute(["scan", "0", "count", "0"]) == "-ERR syntax error"
+
+
+def test_scan_while_keys_come_and_go(handler):
+    generator = random.Random(3)
+    cache = handler.redis_cache
+    stable = {f"stable:{index}" for index in range(500)}
+    for key in stable:
+        cache.set_key_value(key, "x")
+    churn = [f"churn:{index}" for index in range(1000)]
+    for rounds in range(5):
+        seen, cursor = [], 0
+        while True:
+            cursor, found = cache.scan(cursor, 20)
+            seen += found
+            # deletes move the last keys around, adds grow the table behind the cursor
+            for _ in range(15):
+                key = generator.choice(churn)
+                if generator.random() < 0.5:
+                    cache.set_key_value(key, "y")
+                else:
+                    cache.delete_by_key(key)
+            if cursor == 0:
+                break
+        assert stable <= set(seen)
+        # duplicates are possible but bounded by the keys that moved
+        assert len(seen) < 2 * len(cache.data) + 200
+
+
+def test_scan_skips_expired_keys(handler):
+    handler.execute(["set", "gone", "x"])
+    handler.execute(["set", "kept", "x"])
+    handler.redis_cache.set_deadline("gone", now_ms() - 1)
+    assert scan_all(handler) == ["kept"]
+    assert handler.execute(["keys", "*"]) == ["kept"]
+    assert handler.execute(["randomkey"]) == "kept"
+
+
+def test_keys_type_dbsize_randomkey(handler):
+    assert handler.execute(["dbsize"]) == 0
+    assert handler.execute(["randomkey"]) is None
+    handler.execute(["mset", "user:1", "a", "user:2", "7", "other", "b"])
+    handler.execute(["lpush", "queue", "job"])
+    assert sorted(handler.execute(["keys", "user:*"])) == ["user:1", "user:2"]
+    assert handler.execute(["keys", "user:[^1]"]) == ["user:2"]
+    assert handler.handle_command(["type", "user:2"]) == b'+string\r\n'
+    assert handler.handle_command(["type", "queue"]) == b'+list\r\n'
+    assert handler.handle_command(["type", "missing"]) == b'+none\r\n'
+    assert handler.execute(["dbsize"]) == 4
+    assert handler.execute(["randomkey"]) in handler.redis_cache.data
@@ -0,0 +1,59 @@
+import pytest
+
+from storage.listtype import RedisList
+
+
+def test_push_semantics(handler):
+    assert handler.handle_command(["lpush", "list", "a", "b", "c"]) == b':3\r\n'
+    assert handler.handle_command(["rpush", "list", "d", "e"]) == b':5\r\n'
+    assert handler.redis_cache.get_by_key("list") == RedisList(["c", "b", "a", "d", "e"])
+    assert handler.handle_command(["lrange", "list", "0", "-1"]) == b'*5\r\n$1\r\nc\r\n$1\r\nb\r\n$1\r\na\r\n$1\r\nd\r\n$1\r\ne\r\n'
+    assert handler.handle_command(["lrange", "list", "-2", "100"]) == b'*2\r\n$1\r\nd\r\n$1\r\ne\r\n'
+    assert handler.handle_command(["lrange", "list", "3", "1"]) == b'*0\r\n'
+    assert handler.handle_command(["lpush", "list"]).startswith(b'-ERR wrong number of arguments')
+
+
+def test_pop_and_length(handler):
+    handler.handle_command(["rpush", "list", "a", "b", "c", "d"])
+
+    assert handler.handle_command(["lpop", "list"]) == b'$1\r\na\r\n'
+    assert handler.handle_command(["rpop", "list", "2"]) == b'*2\r\n$1\r\nd\r\n$1\r\nc\r\n'
+    assert handler.handle_command(["llen", "list"]) == b':1\r\n'
+    assert handler.handle_command(["rpop", "list"]) == b'$1\r\nb\r\n'
+    # an emptied list is removed
+    assert handler.handle_command(["exists", "list"]) == b':0\r\n'
+    assert handler.handle_command(["lpop", "list"]) == b'$-1\r\n'
+    assert handler.handle_command(["llen", "list"]) == b':0\r\n'
+
+
+def test_index_set_trim_remove(handler):
+    handler.handle_command(["rpush", "list", "a", "b", "a", "c", "a"])
+
+    assert handler.handle_command(["lindex", "list", "-1"]) == b'$1\r\na\r\n'
+    assert handler.handle_command(["lindex", "list", "10"]) == b'$-1\r\n'
+    assert handler.handle_command(["lset", "list", "1", "x"]) == b'+OK\r\n'
+    assert handler.handle_command(["lset", "list", "9", "x"]) == b'-ERR index out of range\r\n'
+    assert handler.handle_command(["lrem", "list", "-2", "a"]) == b':2\r\n'
+    assert handler.redis_cache.get_by_key("list") == RedisList(["a", "x", "c"])
+    assert handler.handle_command(["ltrim", "list", "1", "-1"]) == b'+OK\r\n'
+    assert handler.redis_cache.get_by_key("list") == RedisList(["x", "c"])
+    assert handler.handle_command(["ltrim", "list", "5", "10"]) == b'+OK\r\n'
+    assert handler.handle_command(["exists", "list"]) == b':0\r\n'
+
+
+def test_wrong_type(handler):
+    handler.handle_command(["set", "string", "value"])
+    handler.handle_command(["rpush", "list", "a"])
+
+    assert handler.handle_command(["lpush", "string", "a"]).startswith(b'-WRONGTYPE')
+    assert handler.handle_command(["lrange", "string", "0", "-1"]).startswith(b'-WRONGTYPE')
+    assert handler.handle_command(["get", "list"]).startswith(b'-WRONGTYPE')
+
+
+@pytest.mark.parametrize("start, end", [(0, -1), (2, 5), (-3, -1), (-100, 3), (7, 9), (5, 2)])
+def test_range_matches_list_slicing(start, end):
+    values = RedisList(range(10))
+    expected = list(range(10))
+    stop = end + 10 + 1 if end < 0 else end + 1
+
+    assert values.range(start, end) == expected[max(start + 10 if start < 0 else start, 0):stop]
@@ -0,0 +1,97 @@
+import pytest
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from storage import snapshot
+from storage.cache import RedisCache, CacheHolder
+from storage.expiry import now_ms
+from storage.snapshot import write_snapshot
+
+
+@pytest.fixture
+def file_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(RedisCache, "FILE_STORE", str(tmp_path / "file_store_"))
+    monkeypatch.setattr(CacheHolder, "_instance", None)
+    # many small blocks, so loading takes many steps
+    monkeypatch.setattr(snapshot, "BLOCK_ENTRIES", 100)
+    monkeypatch.setattr("storage.loading.LOAD_STEP_BUDGET_MS", 0)
+    return tmp_path
+
+
+def store(file_store, keys: int) -> str:
+    file_name = str(file_store / "file_store_client.rdb")
+    write_snapshot(file_name, ((f"key:{index}", str(index)) for index in range(keys)), {}, now_ms())
+    return file_name
+
+
+def info(handler: CommandHandler, section: str) -> dict:
+    lines = handler.execute(["info", section]).split("\r\n")[1:-1]
+    return dict(line.split(":", 1) for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_background_load(file_store):
+    store(file_store, 5000)
+    handler = CommandHandler(CacheHolder().acquire_cache("client", background=True))
+
+    assert handler.handle_command(["get", "key:1"]) == b'-LOADING Redis is loading the dataset in memory\r\n'
+    assert handler.handle_command(["ping"]) == b'+PONG\r\n'
+    assert info(handler, "persistence")["loading"] == "1"
+
+    await handler.redis_cache.loading.task
+    assert handler.redis_cache.loading is None
+    assert handler.handle_command(["get", "key:4999"]) == b'$4\r\n4999\r\n'
+    fields = info(handler, "persistence")
+    assert fields["loading"] == "0"
+    assert fields["last_load_keys_loaded"] == "5000"
+    assert fields["last_load_status"] == "ok"
+    assert info(handler, "keyspace") == {"db0": "keys=5000,expires=0"}
+
+
+@pytest.mark.asyncio
+async def test_damaged_snapshot_keeps_keyspace_unavailable(file_store):
+    file_name = store(file_store, 5000)
+    with open(file_name, 'r+b') as file:
+        file.seek(-10, 2)
+        file.write(b"xx")
+    handler = CommandHandler(CacheHolder().acquire_cache("client", background=True))
+
+    await handler.redis_cache.loading.task
+    assert handler.handle_command(["get", "key:1"]).startswith(b'-ERR Loading ')
+    assert handler.handle_command(["save"]).startswith(b'-ERR Loading ')
+    assert info(handler, "persistence")["last_load_status"] == "err"
+
+
+@pytest.mark.asyncio
+async def test_background_replay_of_the_append_only_file(file_store, monkeypatch):
+    monkeypatch.setattr("storage.cache.LOAD_CHUNK_SIZE", 64)
+    ServerConfig.set('appendonly', 'yes')
+    try:
+        handler = CommandHandler(CacheHolder().acquire_cache("client"))
+        assert handler.redis_cache.aof.rewrite.wait()
+        handler.redis_cache.aof.poll_rewrite()
+        for index in range(100):
+            handler.handle_command(["rpush", "list", str(index)])
+        CacheHolder.shutdown()
+
+        CacheHolder._instance = None
+        restored = CommandHandler(CacheHolder().acquire_cache("client", background=True))
+        assert restored.handle_command(["llen", "list"]).startswith(b'-LOADING')
+        await restored.redis_cache.loading.task
+        assert restored.handle_command(["llen", "list"]) == b':100\r\n'
+        # the log is opened once it is replayed, without a rewrite
+        assert restored.redis_cache.aof is not None and not restored.redis_cache.aof.waiting_rewrite
+    finally:
+        CacheHolder.shutdown()
+        ServerConfig.set('appendonly', 'no')
+
+
+def test_info_sections():
+    handler = CommandHandler(RedisCache("info"))
+    handler.handle_command(["set", "key", "value", "ex", "10"])
+
+    text = handler.execute(["info"])
+    assert text.startswith("# Server\r\n") and "# Persistence\r\n" in text and text.endswith("\r\n")
+    assert info(handler, "keyspace") == {"db0": "keys=1,expires=1"}
+    assert info(handler, "persistence")["rdb_changes_since_last_save"] == "1"
+    assert handler.execute(["info", "unknown"]) == ""
@@ -0,0 +1,94 @@
+import pytest
+
+from commandhandler.parser import CommandParser, ProtocolError
+
+
+def test_parse_pipelined_commands():
+    parser = CommandParser()
+    parser.feed(b'*1\r\n$4\r\nPING\r\n*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$5\r\nvalue\r\n*2\r\n$3\r\nGET\r\n$3\r\nkey\r\n')
+
+    assert list(parser.parse()) == [["PING"], ["SET", "key", "value"], ["GET", "key"]]
+    assert parser.pending() == 0
+
+
+def test_parse_resumes_across_partial_reads():
+    parser = CommandParser()
+    frame = b'*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$11\r\nhello world\r\n'
+
+    commands = []
+    for index in range(len(frame)):
+        parser.feed(frame[index:index + 1])
+        commands.extend(parser.parse())
+
+    assert commands == [["SET", "key", "hello world"]]
+    assert parser.pending() == 0
+
+
+def test_parse_keeps_incomplete_tail():
+    parser = CommandParser()
+    parser.feed(b'*2\r\n$4\r\nECHO\r\n$2\r\nhi\r\n*2\r\n$4\r\nECHO\r\n$5\r\nhel')
+
+    assert list(parser.parse()) == [["ECHO", "hi"]]
+    parser.feed(b'lo\r\n')
+    assert list(parser.parse()) == [["ECHO", "hello"]]
+
+
+def test_parse_large_bulk_and_binary_mode():
+    parser = CommandParser(encoding=None)
+    payload = bytes(range(256)) * 4096
+    frame = b'*3\r\n$3\r\nSET\r\n$3\r\nbig\r\n$%d\r\n%s\r\n' % (len(payload), payload)
+
+    commands = []
+    for index in range(0, len(frame), 1000):
+        parser.feed(frame[index:index + 1000])
+        commands.extend(parser.parse())
+
+    assert commands == [[b"SET", b"big", payload]]
+
+
+def test_parse_inline_command():
+    parser = CommandParser()
+    parser.feed(b'PING\r\n\r\nECHO   hello\r\n')
+
+    assert list(parser.parse()) == [["PING"], ["ECHO", "hello"]]
+
+
+@pytest.mark.parametrize("frame", [
+    b'*1\r\n+PING\r\n',
+    b'*1\r\n$abc\r\n',
+    b'*1\r\n$4\r\nPINGxx',
+    # lengths are ascii digits only, int() would take all of these
+    b'*+1\r\n$4\r\nPING\r\n',
+    b'*1\r\n$ 4\r\nPING\r\n',
+    b'*1\r\n$4 \r\nPING\r\n',
+    b'*1_0\r\n',
+    b'*1\r\n$0_4\r\nPING\r\n',
+    b'*\r\n',
+    b'*-2\r\n',
+    b'*1\r\n$-1\r\n',
+])
+def test_parse_protocol_error(frame):
+    parser = CommandParser()
+    parser.feed(frame)
+
+    with pytest.raises(ProtocolError):
+        list(parser.parse())
+
+
+def test_parse_empty_and_null_arrays():
+    parser = CommandParser()
+    parser.feed(b'*0\r\n*-1\r\n*1\r\n$4\r\nPING\r\n')
+
+    assert list(parser.parse()) == [['PING']]
+
+
+def test_consumed_stops_before_an_incomplete_frame():
+    parser = CommandParser()
+    complete = b'*1\r\n$4\r\nPING\r\n' * 2
+    parser.feed(complete + b'*2\r\n$4\r\nECHO\r\n$5\r\nhel')
+    assert len(list(parser.parse())) == 2
+    assert parser.consumed() == len(complete)
+
+    parser.feed(b'lo\r\n')
+    assert list(parser.parse()) == [["ECHO", "hello"]]
+    assert parser.consumed() == len(complete) + 25
@@ -0,0 +1,153 @@
+import asyncio
+from itertools import chain, repeat
+
+import pytest
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from commandhandler.pubsub import pubsub, literal_prefix
+from storage.cache import RedisCache
+
+
+class FakeTransport:
+    """keeps what was written, `unsent` bytes pretend the client doesn't read"""
+
+    def __init__(self):
+        self.written: list[bytes] = []
+        self.unsent = 0
+        self.reading = True
+        self.aborted = False
+
+    def write(self, data: bytes):
+        self.written.append(data)
+        if not self.reading:
+            self.unsent += len(data)
+
+    def get_write_buffer_size(self) -> int:
+        return self.unsent
+
+    def abort(self):
+        self.aborted = True
+
+
+@pytest.fixture
+def connect():
+    handlers = []
+
+    def connect() -> tuple[CommandHandler, FakeTransport]:
+        handler = CommandHandler(RedisCache("pubsub"))
+        handler.transport = FakeTransport()
+        handlers.append(handler)
+        return handler, handler.transport
+
+    yield connect
+    for handler in handlers:
+        handler.close()
+    assert not pubsub.channels and not pubsub.patterns and not pubsub.prefixes
+
+
+def test_subscribe_publish_unsubscribe(connect):
+    subscriber, transport = connect()
+    publisher, _ = connect()
+    assert subscriber.handle_command(["subscribe", "news", "sport"]) == (
+        b"*3\r\n$9\r\nsubscribe\r\n$4\r\nnews\r\n:1\r\n*3\r\n$9\r\nsubscribe\r\n$5\r\nsport\r\n:2\r\n")
+    assert publisher.handle_command(["publish", "news", "+hello"]) == b":1\r\n"
+    assert publisher.handle_command(["publish", "weather", "x"]) == b":0\r\n"
+    assert transport.written == [b"*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$6\r\n+hello\r\n"]
+
+    assert subscriber.handle_command(["get", "key"]).startswith(b"-ERR Can't execute 'get'")
+    assert subscriber.handle_command(["ping"]) == b"*2\r\n$4\r\npong\r\n$0\r\n\r\n"
+    assert publisher.handle_command(["pubsub", "numsub", "news", "other"]) == \
+        b"*4\r\n$4\r\nnews\r\n:1\r\n$5\r\nother\r\n:0\r\n"
+    assert sorted(publisher.execute(["pubsub", "channels"])) == ["news", "sport"]
+    assert publisher.execute(["pubsub", "channels", "n*"]) == ["news"]
+
+    assert subscriber.handle_command(["unsubscribe", "news"]) == b"*3\r\n$11\r\nunsubscribe\r\n$4\r\nnews\r\n:1\r\n"
+    assert subscriber.handle_command(["unsubscribe"]) == b"*3\r\n$11\r\nunsubscribe\r\n$5\r\nsport\r\n:0\r\n"
+    assert subscriber.handle_command(["unsubscribe"]) == b"*3\r\n$11\r\nunsubscribe\r\n$-1\r\n:0\r\n"
+    # without subscriptions the connection is a normal one again
+    assert subscriber.handle_command(["ping"]) == b"+PONG\r\n"
+
+
+def test_every_subscriber_gets_the_same_frame(connect):
+    transports = []
+    for _ in range(5):
+        handler, transport = connect()
+        handler.execute(["subscribe", "fanout"])
+        transports.append(transport)
+    publisher, _ = connect()
+    assert publisher.execute(["publish", "fanout", "payload"]) == 5
+    frames = [transport.written[0] for transport in transports]
+    assert all(frame is frames[0] for frame in frames)
+
+
+@pytest.mark.asyncio
+async def test_messages_are_written_once_per_loop_iteration(connect):
+    subscriber, transport = connect()
+    publisher, _ = connect()
+    subscriber.execute(["subscribe", "a", "b"])
+    for channel in ("a", "b", "a"):
+        publisher.execute(["publish", channel, "m"])
+    assert transport.written == []
+    await asyncio.sleep(0)
+    assert transport.written == [b"".join(b"*3\r\n$7\r\nmessage\r\n$1\r\n%s\r\n$1\r\nm\r\n" % channel
+                                          for channel in (b"a", b"b", b"a"))]
+    # messages queued before a reply are written before it
+    publisher.execute(["publish", "b", "m"])
+    subscriber.execute(["unsubscribe", "a"])
+    assert len(transport.written) == 2 and not pubsub.unflushed
+    await asyncio.sleep(0)
+    assert len(transport.written) == 2
+
+
+def test_patterns(connect):
+    subscriber, transport = connect()
+    publisher, _ = connect()
+    subscriber.execute(["psubscribe", "cache:user:*", "cache:*", "*:log", "h?llo"])
+    subscriber.execute(["subscribe", "cache:user:1"])
+    assert publisher.execute(["pubsub", "numpat"]) == 4
+    assert publisher.execute(["publish", "cache:user:1", "gone"]) == 3
+    assert transport.written == [
+        b"*3\r\n$7\r\nmessage\r\n$12\r\ncache:user:1\r\n$4\r\ngone\r\n"
+        b"*4\r\n$8\r\npmessage\r\n$7\r\ncache:*\r\n$12\r\ncache:user:1\r\n$4\r\ngone\r\n"
+        b"*4\r\n$8\r\npmessage\r\n$12\r\ncache:user:*\r\n$12\r\ncache:user:1\r\n$4\r\ngone\r\n",
+    ]
+    assert publisher.execute(["publish", "app:log", "x"]) == 1
+    assert publisher.execute(["publish", "hallo", "x"]) == 1
+    assert publisher.execute(["publish", "cach", "x"]) == 0
+    assert subscriber.handle_command(["punsubscribe", "cache:*"]) == \
+        b"*3\r\n$12\r\npunsubscribe\r\n$7\r\ncache:*\r\n:4\r\n"
+    assert publisher.execute(["publish", "cache:item", "x"]) == 0
+    assert literal_prefix("a[bc]*") == "a" and literal_prefix(r"a\*") == "a" and literal_prefix("plain") == "plain"
+
+
+def test_slow_subscribers_are_dropped(connect, monkeypatch):
+    slow, slow_transport = connect()
+    fast, fast_transport = connect()
+    publisher, _ = connect()
+    slow.execute(["subscribe", "feed"])
+    fast.execute(["subscribe", "feed"])
+    slow_transport.reading = False
+    ServerConfig.set("client-output-buffer-limit", "pubsub 1kb 200 60")
+    try:
+        message = "x" * 100
+        assert publisher.execute(["publish", "feed", message]) == 2
+        clock = chain([1000.0, 1000.5], repeat(1061.0))
+        monkeypatch.setattr("commandhandler.pubsub.time.monotonic", lambda: next(clock))
+        # above the soft limit since the second message, for longer than 60s with the third
+        for _ in range(3):
+            publisher.execute(["publish", "feed", message])
+        assert slow_transport.aborted and not fast_transport.aborted
+        assert publisher.execute(["publish", "feed", message]) == 1
+        assert len(fast_transport.written) == 5
+
+        slow, slow_transport = connect()
+        slow.execute(["psubscribe", "f*"])
+        slow_transport.reading = False
+        publisher.execute(["publish", "feed", "y" * 2000])
+        assert slow_transport.aborted
+        assert publisher.execute(["pubsub", "numpat"]) == 0
+        assert publisher.execute(["config", "get", "client-output-buffer-limit"]) == \
+            ["client-output-buffer-limit", "pubsub 1024 200 60"]
+    finally:
+        ServerConfig.set("client-output-buffer-limit", "pubsub 32mb 8mb 60")
@@ -6,8 +6,9 @@ from unittest.mock import Mock, patch, AsyncMock
 from commandhandler.handler import CommandHandler
 
 from commandhandler.parser import CommandParser
-from commandhandler.serializer import StringSerializer, NumberSerializer, SerializerFactory, Serializer
-from main import handle_client, main, _handle_client
+from commandhandler.serializer import SerializerFactory, Serializer
+from commandhandler.utils import ErrorReply, StatusReply
+from main import handle_client, main, _handle_client, BreakExceptionMarker
 from storage.cache import CacheHolder, RedisCache
 
 
@@ -17,6 +18,7 @@ def mock_reader_writer():
     writer = Mock()
     writer.get_extra_info.return_value = ("127.0.0.1", "localhost")
     writer.drain = AsyncMock()
+    writer.transport.get_write_buffer_size.return_value = 0
 
     # Create an AsyncMock object for reader.read that returns a coroutine
     async def read_coroutine(_):
@@ -32,12 +34,58 @@ async def test_handle_client(mock_reader_writer):
     reader, writer = mock_reader_writer
 
     # Call the function to be tested
-    await _handle_client(reader, writer, CacheHolder(), 'ip1')
+    await _handle_client(reader, writer, CommandParser(), CommandHandler(CacheHolder().acquire_cache('ip1')))
 
     # Assert that the expected methods were called on the mocked writer object
     writer.write.assert_called_once()
-    writer.close.assert_called_once()
     writer.drain.assert_called_once()
+    # the connection stays open for the next command
+    writer.close.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_handle_client_pipelined_batch(mock_reader_writer):
+    reader, writer = mock_reader_writer
+
+    async def read_coroutine(_):
+        return b'*1\r\n$4\r\nPING\r\n*2\r\n$4\r\nECHO\r\n$2\r\nhi\r\n*1\r\n$4\r\nPI'
+
+    reader.read.side_effect = read_coroutine
+    parser = CommandParser()
+    await _handle_client(reader, writer, parser, CommandHandler(CacheHolder().acquire_cache('ip1')))
+
+    # both complete replies go out with one write, the partial third command waits for more data
+    writer.write.assert_called_once_with(bytearray(b'+PONG\r\n$2\r\nhi\r\n'))
+    writer.drain.assert_called_once()
+    assert parser.pending() > 0
+
+
+@pytest.mark.asyncio
+async def test_handle_client_quit(mock_reader_writer):
+    reader, writer = mock_reader_writer
+
+    async def read_coroutine(_):
+        return b'*1\r\n$4\r\nQUIT\r\n*1\r\n$4\r\nPING\r\n'
+
+    reader.read.side_effect = read_coroutine
+    with pytest.raises(BreakExceptionMarker):
+        await _handle_client(reader, writer, CommandParser(), CommandHandler(CacheHolder().acquire_cache('ip1')))
+
+    writer.write.assert_called_once_with(bytearray(b'+OK\r\n'))
+
+
+@pytest.mark.asyncio
+async def test_handle_client_closes_on_eof(mock_reader_writer):
+    reader, writer = mock_reader_writer
+
+    async def read_coroutine(_):
+        return b''
+
+    reader.read.side_effect = read_coroutine
+    await handle_client(reader, writer)
+
+    writer.write.assert_not_called()
+    writer.close.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -52,29 +100,80 @@ async def test_main():
         )
 
 
+def test_cache_holder_registry():
+    holder = CacheHolder()
+    cache = holder.acquire_cache('registry')
+
+    assert holder.is_existing('registry') is True
+    assert holder.acquire_cache('registry') is cache
+    assert holder.get_client_cache('unknown') is None
+
+
+def test_dispatch_table_is_shared():
+    first, second = CommandHandler(RedisCache("ip1")), CommandHandler(RedisCache("ip2"))
+
+    assert first.command_mappings is second.command_mappings
+    assert first.handle_command(["PING"]) == b'+PONG\r\n'
+
+
 def test_handle_command():
     redis_cache = RedisCache("ip1")
     command_handler = CommandHandler(redis_cache)
 
     # Test handle_command for various commands
     result_set = command_handler.handle_command(["set", "key", "1"])
-    assert isinstance(command_handler.serializer.strategy, StringSerializer) is True
-
     result_get = command_handler.handle_command(["get", "key"])
-    assert isinstance(command_handler.serializer.strategy, StringSerializer) is True
-
     result_incr = command_handler.handle_command(["incr", "key"])
-    assert isinstance(command_handler.serializer.strategy, NumberSerializer) is True
+
     # Add assertions based on your specific implementation and expected results
-    assert result_set == '+OK\r\n'
-    assert result_get == "$1\r\n1\r\n"
-    assert result_incr == ':2\r\n'
+    assert result_set == b'+OK\r\n'
+    assert result_get == b"$1\r\n1\r\n"
+    assert result_incr == b':2\r\n'
+
+
+def test_arity_is_checked_before_the_command_runs(monkeypatch, caplog):
+    command_handler = CommandHandler(RedisCache("arity"))
+
+    assert command_handler.handle_command(["get"]) == b"-ERR wrong number of arguments for 'get' command\r\n"
+    assert command_handler.handle_command(["get", "a", "b"]) == b"-ERR wrong number of arguments for 'get' command\r\n"
+    assert command_handler.handle_command(["lpop", "list", "1", "2"]).startswith(b"-ERR wrong number of arguments")
+    assert command_handler.handle_command(["rpush", "list"]) == b"-ERR wrong number of arguments for 'rpush' command\r\n"
+    assert CommandHandler.command_arity['set'] == (2, None) and CommandHandler.command_arity['ping'] == (0, 1)
+
+    # an exception raised by the command is a bug, not a wrong call, and the connection gets a reply
+    monkeypatch.setattr(RedisCache, "get_string", lambda self, key: len(None))
+    assert command_handler.handle_command(["get", "key"]) == b"-ERR internal error executing 'get'\r\n"
+    assert "get failed" in caplog.text and "TypeError" in caplog.text
+    monkeypatch.setattr(RedisCache, "get_string", lambda self, key: {}[key])
+    assert command_handler.handle_command(["get", "key"]) == b"-ERR internal error executing 'get'\r\n"
+    assert "KeyError" in caplog.text
+
+
+def test_handle_command_into_output_buffer():
+    command_handler = CommandHandler(RedisCache("ip1"))
+    output = bytearray()
+
+    command_handler.handle_command(["rpush", "list", "a", "bc"], output)
+    command_handler.handle_command(["lrange", "list", "0", "1"], output)
+    command_handler.handle_command(["unknown"], output)
+
+    assert output == b':2\r\n*2\r\n$1\r\na\r\n$2\r\nbc\r\n-ERR Command not found! unknown\r\n'
 
 
 @pytest.mark.parametrize("value_to_test, expected_result", [
-    ("some_value", '$10\r\nsome_value\r\n'),
-    (42, ':42\r\n'),
-    ([1, 2, 3], '*3\r\n:1\r\n:2\r\n:3\r\n'),
+    ("some_value", b'$10\r\nsome_value\r\n'),
+    ("-5", b'$2\r\n-5\r\n'),
+    # a str is a value whatever it starts with, error and status lines have their own types
+    ("-ERR failed", b'$11\r\n-ERR failed\r\n'),
+    ("+OK", b'$3\r\n+OK\r\n'),
+    (ErrorReply("-ERR failed"), b'-ERR failed\r\n'),
+    (StatusReply("+OK"), b'+OK\r\n'),
+    ("\u00e9", b'$2\r\n\xc3\xa9\r\n'),
+    (42, b':42\r\n'),
+    (123456, b':123456\r\n'),
+    (None, b'$-1\r\n'),
+    ([1, 2, 3], b'*3\r\n:1\r\n:2\r\n:3\r\n'),
+    (["a", None], b'*2\r\n$1\r\na\r\n$-1\r\n'),
 ])
 def test_serialize(value_to_test, expected_result):
     serializer = Serializer()
@@ -85,6 +184,12 @@ def test_serialize(value_to_test, expected_result):
     assert result == expected_result
 
 
+def test_serializer_strategies_are_shared():
+    assert SerializerFactory.create_serializor(str) is SerializerFactory.create_serializor(str)
+    with pytest.raises(ValueError):
+        SerializerFactory.create_serializor(float)
+
+
 def test_parse_command():
     command_parser = CommandParser()
 
@@ -0,0 +1,164 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from commandhandler.replication import Backlog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_backlog_keeps_the_latest_bytes():
+    backlog = Backlog(16, 100)
+    assert backlog.read_from(100) == b"" and backlog.read_from(99) is None
+    backlog.feed(b"0123456789")
+    assert backlog.read_from(100) == b"0123456789" and backlog.read_from(105) == b"56789"
+    # wraps around, the oldest bytes are overwritten
+    backlog.feed(b"abcdefghij")
+    assert backlog.offset == 120 and backlog.length == 16
+    assert backlog.read_from(104) == b"456789abcdefghij"
+    assert backlog.read_from(103) is None and backlog.read_from(121) is None
+    # a write larger than the backlog keeps its end
+    backlog.feed(b"x" * 10 + b"ABCDEFGHIJKLMNOP")
+    assert backlog.read_from(130) == b"ABCDEFGHIJKLMNOP"
+    assert backlog.resized(4).read_from(142) == b"MNOP" and backlog.resized(4).read_from(141) is None
+    grown = backlog.resized(64)
+    assert grown.read_from(130) == b"ABCDEFGHIJKLMNOP"
+    grown.feed(b"!")
+    assert grown.read_from(130) == b"ABCDEFGHIJKLMNOP!"
+
+
+def command(*arguments: str) -> bytes:
+    return b"*%d\r\n" % len(arguments) + b"".join(
+        b"$%d\r\n%s\r\n" % (len(argument), argument) for argument in (value.encode() for value in arguments))
+
+
+def read_until(connection: socket.socket, ending: bytes) -> bytes:
+    data = b""
+    while not data.endswith(ending):
+        data += connection.recv(65536)
+    return data
+
+
+def request(port: int, *arguments: str) -> bytes:
+    """a single command on a new connection, the replies in these tests fit into one read"""
+    with socket.create_connection(("localhost", port), timeout=10) as connection:
+        connection.sendall(command(*arguments))
+        return connection.recv(65536)
+
+
+def wait_for(condition, seconds: float = 10):
+    deadline = time.time() + seconds
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    servers = []
+
+    def start(name: str, *options: str) -> int:
+        with socket.socket() as probe:
+            probe.bind(("localhost", 0))
+            port = probe.getsockname()[1]
+        directory = tmp_path / name
+        directory.mkdir()
+        servers.append(subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py"), "--port", str(port), *options],
+                                        cwd=directory, env={**os.environ, "PYTHONPATH": ROOT}))
+
+        def accepting():
+            try:
+                socket.create_connection(("localhost", port)).close()
+                return True
+            except ConnectionRefusedError:
+                return False
+
+        wait_for(accepting)
+        return port
+
+    yield start
+    for server in servers:
+        server.terminate()
+        server.wait(10)
+
+
+def test_replica_follows_the_primary(start_server):
+    primary = start_server("primary")
+    with socket.create_connection(("localhost", primary), timeout=10) as connection:
+        connection.sendall(command("set", "before", "sync", "ex", "100") + command("rpush", "list", "a", "b")
+                           + command("hset", "hash", "field", "value") + command("zadd", "zset", "1", "one"))
+        read_until(connection, b"+OK\r\n:2\r\n:1\r\n:1\r\n")
+    replica = start_server("replica", "--replicaof", "localhost", str(primary))
+    wait_for(lambda: request(replica, "get", "before") == b"$4\r\nsync\r\n")
+    assert request(replica, "lrange", "list", "0", "-1") == b"*2\r\n$1\r\na\r\n$1\r\nb\r\n"
+    assert request(replica, "hget", "hash", "field") == b"$5\r\nvalue\r\n"
+    assert 0 < int(request(replica, "ttl", "before")[1:]) <= 100
+
+    # the writes after the sync arrive through the stream
+    with socket.create_connection(("localhost", primary), timeout=10) as connection:
+        connection.sendall(command("incr", "counter") + command("del", "list") + command("zincrby", "zset", "2", "one")
+                           + command("set", "last", "write"))
+        read_until(connection, b"+OK\r\n")
+    wait_for(lambda: request(replica, "get", "last") == b"$5\r\nwrite\r\n")
+    assert request(replica, "get", "counter") == b"$1\r\n1\r\n"
+    assert request(replica, "exists", "list") == b":0\r\n"
+    assert request(replica, "zscore", "zset", "one") == b"$1\r\n3\r\n"
+
+    assert request(replica, "set", "x", "1") == b"-READONLY You can't write against a read only replica.\r\n"
+    info = request(replica, "info", "replication").decode()
+    assert "role:slave" in info and "master_link_status:up" in info
+    wait_for(lambda: "state=online" in request(primary, "info", "replication").decode())
+    assert "connected_slaves:1" in request(primary, "info", "replication").decode()
+
+    assert request(replica, "replicaof", "no", "one") == b"+OK\r\n"
+    assert request(replica, "set", "x", "1") == b"+OK\r\n"
+    assert "role:master" in request(replica, "info", "replication").decode()
+
+
+def test_replica_applies_writes_past_its_maxmemory(start_server):
+    primary = start_server("primary")
+    replica = start_server("replica", "--replicaof", "localhost", str(primary))
+    wait_for(lambda: "master_link_status:up" in request(replica, "info", "replication").decode())
+    assert request(replica, "config", "set", "maxmemory", "1000") == b"+OK\r\n"
+    with socket.create_connection(("localhost", primary), timeout=10) as connection:
+        connection.sendall(b"".join(command("set", f"key:{index}", "x" * 100) for index in range(100)))
+        read_until(connection, b"+OK\r\n" * 100)
+    # the primary decides what the keyspace holds, the replica doesn't drop its writes
+    wait_for(lambda: request(replica, "dbsize") == b":100\r\n")
+    assert request(replica, "get", "key:99") == b"$100\r\n" + b"x" * 100 + b"\r\n"
+
+
+def test_reconnecting_replica_continues_from_the_backlog(start_server):
+    primary = start_server("primary")
+    assert request(primary, "set", "a", "1") == b"+OK\r\n"
+    with socket.create_connection(("localhost", primary), timeout=10) as connection:
+        stream = connection.makefile('rb')
+        connection.sendall(command("replconf", "listening-port", "6380") + command("psync", "?", "-1"))
+        assert stream.readline() == b"+OK\r\n"
+        _, replid, offset = stream.readline().split()
+        # the snapshot of every keyspace, its name and the file as bulk strings
+        assert stream.readline() == b"*1\r\n"
+        assert stream.readline() == b"$9\r\n" and stream.readline() == b"127.0.0.1\r\n"
+        size = int(stream.readline()[1:])
+        assert stream.read(size + 2).endswith(b"\r\n")
+        assert request(primary, "set", "b", "2") == b"+OK\r\n"
+        written = command("attach", "127.0.0.1") + command("set", "b", "2")
+        assert stream.read(len(written)) == written
+    assert request(primary, "incr", "a") == b":2\r\n"
+
+    with socket.create_connection(("localhost", primary), timeout=10) as connection:
+        stream = connection.makefile('rb')
+        connection.sendall(command("replconf", "listening-port", "6380")
+                           + command("psync", replid.decode(), str(int(offset) + len(written))))
+        assert stream.readline() == b"+OK\r\n"
+        assert stream.readline() == b"+CONTINUE %s\r\n" % replid
+        assert stream.read(len(command("incr", "a"))) == command("incr", "a")
+    # an unknown history needs a full resync
+    with socket.create_connection(("localhost", primary), timeout=10) as connection:
+        connection.sendall(command("psync", "0" * 40, "1"))
+        assert connection.makefile('rb').readline().startswith(b"+FULLRESYNC %s" % replid)
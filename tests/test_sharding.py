@@ -0,0 +1,109 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from commandhandler.sharding import key_slot, read_reply, Router, HASH_SLOTS
+from commandhandler.utils import ErrorReply, StatusReply
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_key_slot_matches_redis_cluster():
+    assert key_slot("foo") == 12182
+    assert key_slot("bar") == 5061
+    # the hash tag decides, an empty one doesn't count
+    assert key_slot("{user1000}.following") == key_slot("{user1000}.followers") == key_slot("user1000")
+    assert key_slot("foo{}{bar}") != key_slot("bar")
+
+
+def test_slot_ranges_cover_all_workers():
+    router = Router(0, ["a", "b", "c"])
+    owners = [slot * router.workers // HASH_SLOTS for slot in range(HASH_SLOTS)]
+    assert owners == sorted(owners) and set(owners) == {0, 1, 2}
+    assert router.peers == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_forwarded_replies_keep_their_kind():
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"-ERR failed\r\n+OK\r\n$4\r\n-foo\r\n*2\r\n$4\r\n+bar\r\n-WRONGTYPE x\r\n")
+    reader.feed_eof()
+    error, status, value, array = [await read_reply(reader) for _ in range(4)]
+    assert type(error) is ErrorReply and error == "-ERR failed"
+    assert type(status) is StatusReply and status == "+OK"
+    # a value stays a value whatever it starts with
+    assert value == b"-foo"
+    assert array == [b"+bar", "-WRONGTYPE x"] and type(array[1]) is ErrorReply
+
+
+def command(*arguments: str) -> bytes:
+    return b"*%d\r\n" % len(arguments) + b"".join(
+        b"$%d\r\n%s\r\n" % (len(argument), argument) for argument in (value.encode() for value in arguments))
+
+
+def read_until(connection: socket.socket, ending: bytes) -> bytes:
+    data = b""
+    while not data.endswith(ending):
+        data += connection.recv(65536)
+    return data
+
+
+@pytest.fixture
+def workers(tmp_path):
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py"), "--workers", "3", "--port", str(port)],
+                              cwd=tmp_path, env={**os.environ, "PYTHONPATH": ROOT})
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            break
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                server.kill()
+                raise
+            time.sleep(0.05)
+    yield port
+    server.terminate()
+    server.wait(10)
+
+
+def test_commands_reach_the_owning_worker(workers):
+    # every connection lands on some worker, all of them see the same keyspace
+    for _ in range(4):
+        with socket.create_connection(("localhost", workers)) as connection:
+            connection.sendall(command("mset", *(part for index in range(10) for part in (f"k{index}", str(index))))
+                               + command("set", "counter", "10")
+                               + command("incr", "counter")
+                               + command("mget", "k0", "k5", "missing", "k9")
+                               + command("msetnx", "k1", "x", "k2", "y")
+                               + command("exists", "k1", "k2", "k3", "missing")
+                               + command("ping"))
+            assert read_until(connection, b"+PONG\r\n") == (
+                b"+OK\r\n+OK\r\n:11\r\n"
+                + b"*4\r\n$1\r\n0\r\n$1\r\n5\r\n$-1\r\n$1\r\n9\r\n"
+                + b"-CROSSSLOT Keys in request don't hash to the same worker\r\n"
+                + b":3\r\n+PONG\r\n")
+    with socket.create_connection(("localhost", workers)) as connection:
+        connection.sendall(command("del", *(f"k{index}" for index in range(12))) + command("mget", "k3", "k4"))
+        assert read_until(connection, b"$-1\r\n$-1\r\n") == b":10\r\n*2\r\n$-1\r\n$-1\r\n"
+
+
+def test_local_replies_are_taken_when_the_command_runs(workers):
+    keys = [f"k{index}" for index in range(10)]
+    with socket.create_connection(("localhost", workers)) as connection:
+        connection.sendall(command("mset", *(part for key in keys for part in (key, "xy")))
+                           + b"".join(command("append", key, "z") for key in keys) + command("ping"))
+        read_until(connection, b"+PONG\r\n")
+        # the keys are spread over the workers, the part of the MGET answered by this one is
+        # held until the others replied, while the APPENDs behind it change the values in place
+        connection.sendall(command("mget", *keys) + b"".join(command("append", key, "Q") for key in keys)
+                           + command("ping"))
+        assert read_until(connection, b"+PONG\r\n").startswith(b"*10\r\n" + b"$3\r\nxyz\r\n" * 10)
@@ -0,0 +1,145 @@
+import logging
+
+import pytest
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from commandhandler.trace import logger
+from storage import snapshot
+from storage.background import BackgroundJob
+from storage.cache import RedisCache, CacheHolder
+from storage.expiry import now_ms
+from storage.listtype import RedisList
+from storage.snapshot import write_snapshot, read_snapshot, SnapshotError
+
+
+@pytest.fixture
+def file_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(RedisCache, "FILE_STORE", str(tmp_path / "file_store_"))
+    monkeypatch.setattr(CacheHolder, "_instance", None)
+    return tmp_path
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_round_trip(tmp_path, monkeypatch, compress):
+    # small blocks, so the entries span several of them
+    monkeypatch.setattr(snapshot, "BLOCK_ENTRIES", 3)
+    file_name = str(tmp_path / "dump.rdb")
+    values = {
+        "plain": "value",
+        "empty": "",
+        "unicode": "grüße " * 100,
+        "ключ": "значение",
+        "list": RedisList(["a", "", "ü" * 500]),
+        "volatile": "soon gone",
+        "volatile list": RedisList(["x"]),
+        **{f"key:{index}": str(index) for index in range(10)},
+    }
+    deadline = now_ms() + 60_000
+    deadlines = {"volatile": deadline, "volatile list": deadline, "expired": now_ms() - 1}
+    write_snapshot(file_name, list(values.items()) + [("expired", "gone")], deadlines, now_ms(), compress)
+
+    loaded, loaded_deadlines = read_snapshot(file_name)
+    assert loaded == values
+    assert isinstance(loaded["list"], RedisList)
+    assert loaded_deadlines == {"volatile": deadline, "volatile list": deadline}
+
+
+def test_damaged_files_are_rejected(tmp_path):
+    file_name = str(tmp_path / "dump.rdb")
+    write_snapshot(file_name, [("key", "value")], {}, now_ms())
+    data = (tmp_path / "dump.rdb").read_bytes()
+
+    (tmp_path / "dump.rdb").write_bytes(data[:-6] + bytes([data[-6] ^ 1]) + data[-5:])
+    with pytest.raises(SnapshotError):
+        read_snapshot(file_name)
+    (tmp_path / "dump.rdb").write_bytes(data[:len(data) // 2])
+    with pytest.raises(SnapshotError):
+        read_snapshot(file_name)
+    (tmp_path / "dump.rdb").write_bytes(b'{"key": "value"}')
+    with pytest.raises(SnapshotError):
+        read_snapshot(file_name)
+
+
+def test_save_and_restore_keyspace(file_store):
+    handler = CommandHandler(CacheHolder().acquire_cache("client"))
+    handler.handle_command(["set", "key", "value", "ex", "100"])
+    handler.handle_command(["rpush", "list", "a", "b"])
+    assert handler.redis_cache.dirty == 2
+    assert handler.handle_command(["save"]) == b'+OK\r\n'
+    assert handler.redis_cache.dirty == 0
+
+    CacheHolder._instance = None
+    restored = CommandHandler(CacheHolder().acquire_cache("client"))
+    assert restored.handle_command(["get", "key"]) == b'$5\r\nvalue\r\n'
+    assert restored.handle_command(["ttl", "key"]) == b':100\r\n'
+    assert restored.handle_command(["lrange", "list", "0", "-1"]) == b'*2\r\n$1\r\na\r\n$1\r\nb\r\n'
+
+
+def test_legacy_json_store_is_still_loaded(file_store):
+    (file_store / "file_store_client.json").write_text('{"key": "value", "list": ["a"]}')
+    handler = CommandHandler(CacheHolder().acquire_cache("client"))
+    assert handler.handle_command(["get", "key"]) == b'$5\r\nvalue\r\n'
+    assert handler.handle_command(["llen", "list"]) == b':1\r\n'
+
+
+def test_bgsave_and_lastsave(file_store):
+    cache = CacheHolder().acquire_cache("client")
+    handler = CommandHandler(cache)
+    handler.handle_command(["set", "key", "value"])
+
+    assert handler.handle_command(["bgsave"]) == b'+Background saving started\r\n'
+    assert handler.handle_command(["bgsave"]) == b'-ERR Background save already in progress\r\n'
+    assert handler.handle_command(["save"]) == b'-ERR Background save already in progress\r\n'
+    # written after the child took its copy, stays unsaved
+    handler.handle_command(["set", "later", "value"])
+    assert cache.bgsave.wait()
+    assert cache.poll_background_save() is True
+    assert cache.bgsave is None
+    assert cache.dirty == 1
+    assert handler.handle_command(["lastsave"]) == b':%d\r\n' % cache.lastsave
+
+    values, _ = read_snapshot(cache.snapshot_file)
+    assert values == {"key": "value"}
+
+
+def test_save_rules(file_store):
+    cache = CacheHolder().acquire_cache("client")
+    handler = CommandHandler(cache)
+    assert handler.handle_command(["config", "set", "save", "3600 1 0 2"]) == b'-ERR Invalid argument ' \
+           b"'3600 1 0 2' for CONFIG SET 'save' - expected pairs of positive <seconds> <changes>\r\n"
+    try:
+        assert handler.handle_command(["config", "set", "save", "1 2"]) == b'+OK\r\n'
+        assert handler.handle_command(["config", "get", "save"]) == b'*2\r\n$4\r\nsave\r\n$3\r\n1 2\r\n'
+        handler.handle_command(["set", "key", "value"])
+        # errors and misses don't count as changes
+        handler.handle_command(["lpop", "key"])
+        handler.handle_command(["lpop", "missing"])
+        cache.lastsave -= 1
+        assert not cache.save_due(ServerConfig.get('save'), cache.lastsave + 1)
+        handler.handle_command(["del", "key"])
+        assert cache.save_due(ServerConfig.get('save'), cache.lastsave + 1)
+
+        CacheHolder.cron()
+        assert cache.bgsave is not None
+        cache.bgsave.wait()
+        CacheHolder.cron()
+        assert cache.bgsave is None and cache.dirty == 0
+    finally:
+        ServerConfig.set('save', '')
+
+
+def test_failed_background_job_logs_the_cause(tmp_path):
+    def work(items, deadlines):
+        raise OSError("No space left on device")
+
+    # the forked child logs through the handlers it inherited, a file outlives it
+    log_file = logging.FileHandler(tmp_path / "log")
+    logger.addHandler(log_file)
+    try:
+        assert BackgroundJob(work, {"key": "value"}, {}).wait() is False
+    finally:
+        logger.removeHandler(log_file)
+        log_file.close()
+    log = (tmp_path / "log").read_text()
+    assert "background save failed" in log and "OSError: No space left on device" in log
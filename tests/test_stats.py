@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from commandhandler.stats import stats, bucket_of, bucket_range, Histogram, BUCKETS
+from storage.cache import RedisCache
+
+
+@pytest.fixture
+def handler():
+    stats.reset()
+    stats.slowlog.clear()
+    yield CommandHandler(RedisCache("stats"))
+    ServerConfig.set('slowlog-log-slower-than', '10000')
+    ServerConfig.set('slowlog-max-len', '128')
+    ServerConfig.set('latency-tracking', 'yes')
+
+
+def test_buckets_are_contiguous_and_precise():
+    assert bucket_of(2 ** 64 - 1) == BUCKETS - 1
+    previous_high = 0
+    for bucket in range(BUCKETS):
+        low, high = bucket_range(bucket)
+        assert low == previous_high and bucket_of(low) == bucket and bucket_of(high - 1) == bucket
+        assert (high - low) / low <= 1 / 16 if low >= 32 else high - low == 1
+        previous_high = high
+    # the copy inlined into Stats.record
+    stats.reset()
+    for value in (0, 31, 32, 1000, 123_456_789):
+        stats.record('bucket', value, ['bucket'], False, 'test')
+        assert stats.commands['bucket'].histogram.counts[bucket_of(value)] == 1
+    stats.reset()
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    values = [random.randrange(1000, 100_000) for _ in range(10_000)]
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    for share in (50, 99, 99.9):
+        exact = values[round(share / 100 * len(values)) - 1]
+        assert abs(histogram.percentile(share) - exact) / exact < 1 / 16
+
+
+def test_commandstats_and_latencystats(handler):
+    handler.handle_command(["set", "key", "value"])
+    handler.handle_command(["get", "key"])
+    handler.handle_command(["get", "key"])
+    handler.handle_command(["incr", "key"])
+    handler.handle_command(["get"])
+    text = handler.execute(["info", "commandstats"])
+    assert "cmdstat_get:calls=3," in text and text.count("cmdstat_") == 3
+    assert "rejected_calls=0,failed_calls=1\r\n" in text
+    assert "latency_percentiles_usec_set:p50=" in handler.execute(["info", "latencystats"])
+    default = handler.execute(["info"])
+    assert "# Stats\r\n" in default and "# Clients\r\n" in default and "cmdstat_" not in default
+    assert "cmdstat_" in handler.execute(["info", "all"])
+    assert handler.handle_command(["config", "resetstat"]) == b'+OK\r\n'
+    assert "cmdstat_get" not in handler.execute(["info", "commandstats"])
+
+
+def test_slowlog(handler):
+    ServerConfig.set('slowlog-log-slower-than', '0')
+    ServerConfig.set('slowlog-max-len', '3')
+    for index in range(5):
+        handler.handle_command(["set", f"key{index}", "x" * 200])
+    assert handler.execute(["slowlog", "len"]) == 3
+    # SLOWLOG LEN is slower than 0 as well
+    assert handler.execute(["slowlog", "get", "1"])[0][3] == ["slowlog", "len"]
+    entries = handler.execute(["slowlog", "get", "-1"])
+    assert len(entries) == 3
+    entry_id, timestamp, microseconds, arguments, client, name = entries[2]
+    assert arguments[:2] == ["set", "key4"] and arguments[2].endswith("... (72 more bytes)")
+    assert client == "stats" and microseconds >= 0 and entries[0][0] == entry_id + 2
+    ServerConfig.set('slowlog-log-slower-than', '-1')
+    assert handler.handle_command(["slowlog", "reset"]) == b'+OK\r\n'
+    handler.handle_command(["get", "key0"])
+    assert handler.execute(["slowlog", "len"]) == 0
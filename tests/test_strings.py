@@ -0,0 +1,171 @@
+from commandhandler.handler import CommandHandler
+from commandhandler.parser import CommandParser
+from commandhandler.stats import stats
+from commandhandler.utils import MAX_DECODED_LENGTH
+from storage.cache import CacheHolder
+from storage.eviction import KEY_OVERHEAD, value_size
+from storage.expiry import now_ms
+from storage.hashtype import RedisHash
+from storage.listtype import RedisList
+from storage.snapshot import write_snapshot, read_snapshot
+from tests.test_aof import restart, finish_rewrite
+
+
+def run(handler: CommandHandler, *arguments: bytes) -> bytes:
+    """the command as a client sends it, through the parser"""
+    parser = CommandParser()
+    parser.feed(b"*%d\r\n" % len(arguments) + b"".join(b"$%d\r\n%s\r\n" % (len(argument), argument)
+                                                      for argument in arguments))
+    (command,) = parser.parse()
+    return handler.handle_command(command)
+
+
+def bulk(value: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def test_binary_values_round_trip(handler):
+    invalid = b"\xff\xfe\x00\x80 caf\xc3\xa9 \xc3"
+    large = bytes(range(256)) * 4096
+    for key, value in ((b"invalid", invalid), (b"large", large), (b"\xff", b"x"), (b"empty", b"")):
+        assert run(handler, b"SET", key, value) == b"+OK\r\n"
+        assert run(handler, b"GET", key) == bulk(value)
+        assert run(handler, b"STRLEN", key) == b":%d\r\n" % len(value)
+    # large values are kept as the bytes read from the socket, never decoded
+    assert type(handler.redis_cache.data["large"]) is bytes
+    assert run(handler, b"MGET", b"invalid", b"large") == b"*2\r\n" + bulk(invalid) + bulk(large)
+    assert run(handler, b"GETSET", b"large", b"small") == bulk(large)
+    assert run(handler, b"RPUSH", b"list", invalid, large) == b":2\r\n"
+    assert run(handler, b"LRANGE", b"list", b"0", b"-1") == b"*2\r\n" + bulk(invalid) + bulk(large)
+    assert run(handler, b"HSET", b"hash", invalid, large) == b":1\r\n"
+    assert run(handler, b"HGET", b"hash", invalid) == bulk(large)
+    assert run(handler, b"ZADD", b"zset", b"1", large, b"2", invalid) == b":2\r\n"
+    assert run(handler, b"ZRANGE", b"zset", b"0", b"-1") == b"*2\r\n" + bulk(large) + bulk(invalid)
+    assert run(handler, b"ZSCORE", b"zset", large) == b"$1\r\n1\r\n"
+    cache = handler.redis_cache
+    assert cache.table.used == sum(KEY_OVERHEAD + len(key) + value_size(value) for key, value in cache.data.items())
+
+
+def test_values_which_look_like_replies(handler):
+    """a value is a bulk string whatever it starts with, never a status or an error line"""
+    stats.reset()
+    for value in (b"-foo", b"+bar", b"-ERR not an error", b"-5", b":1"):
+        assert run(handler, b"SET", b"key", value) == b"+OK\r\n"
+        assert run(handler, b"GET", b"key") == bulk(value)
+        assert run(handler, b"ECHO", value) == bulk(value)
+        assert run(handler, b"GETSET", b"key", value) == bulk(value)
+        assert run(handler, b"GETDEL", b"key") == bulk(value)
+        run(handler, b"HSET", b"hash", b"field", value)
+        assert run(handler, b"HGET", b"hash", b"field") == bulk(value)
+        run(handler, b"RPUSH", b"list", value, value)
+        assert run(handler, b"LPOP", b"list") == bulk(value)
+        assert run(handler, b"RPOP", b"list") == bulk(value)
+    # and the commands which returned them didn't fail
+    assert all(entry.failed_calls == 0 for entry in stats.commands.values())
+    assert run(handler, b"ZADD", b"zset", b"-inf", b"member") == b":1\r\n"
+    assert run(handler, b"ZSCORE", b"zset", b"member") == bulk(b"-inf")
+
+
+def test_append_and_strlen(handler):
+    assert run(handler, b"APPEND", b"key", b"Hello") == b":5\r\n"
+    assert run(handler, b"APPEND", b"key", b" W\xc3\xb6rld") == b":12\r\n"
+    assert run(handler, b"GET", b"key") == bulk(b"Hello W\xc3\xb6rld")
+    # the value is changed in place from the first append on
+    value = handler.redis_cache.data["key"]
+    assert type(value) is bytearray
+    run(handler, b"APPEND", b"key", b"!")
+    assert handler.redis_cache.data["key"] is value
+    assert run(handler, b"STRLEN", b"key") == b":13\r\n" and run(handler, b"STRLEN", b"missing") == b":0\r\n"
+    assert run(handler, b"STRLEN", b"\xc3\xa4") == b":0\r\n"
+    run(handler, b"SET", b"text", "grüße".encode())
+    assert run(handler, b"STRLEN", b"text") == b":7\r\n"
+
+    # counters stay counters
+    run(handler, b"SET", b"counter", b"1")
+    assert run(handler, b"APPEND", b"counter", b"0") == b":2\r\n"
+    assert run(handler, b"INCR", b"counter") == b":11\r\n"
+    assert run(handler, b"APPEND", b"counter", b"x") == b":3\r\n"
+    assert run(handler, b"INCR", b"counter").startswith(b"-ERR value is not an integer")
+
+    run(handler, b"RPUSH", b"list", b"a")
+    assert run(handler, b"APPEND", b"list", b"x").startswith(b"-WRONGTYPE")
+    assert run(handler, b"STRLEN", b"list").startswith(b"-WRONGTYPE")
+    cache = handler.redis_cache
+    assert cache.table.used == sum(KEY_OVERHEAD + len(key) + value_size(value) for key, value in cache.data.items())
+
+
+def test_getrange(handler):
+    run(handler, b"SET", b"key", b"This is a string")
+    for start, end, expected in ((b"0", b"3", b"This"), (b"-3", b"-1", b"ing"), (b"0", b"-1", b"This is a string"),
+                                 (b"10", b"100", b"string"), (b"5", b"3", b""), (b"-100", b"3", b"This"),
+                                 (b"100", b"200", b""), (b"0", b"-100", b"")):
+        assert run(handler, b"GETRANGE", b"key", start, end) == bulk(expected)
+    assert run(handler, b"SUBSTR", b"key", b"0", b"3") == bulk(b"This")
+    assert run(handler, b"GETRANGE", b"missing", b"0", b"-1") == bulk(b"")
+    assert run(handler, b"GETRANGE", b"key", b"a", b"1").startswith(b"-ERR value is not an integer")
+    # byte offsets, also into text with multi byte characters and into binary values
+    run(handler, b"SET", b"text", "ä€".encode())
+    assert run(handler, b"GETRANGE", b"text", b"1", b"2") == bulk("ä€".encode()[1:3])
+    large = bytes(range(256)) * 64
+    run(handler, b"SET", b"large", large)
+    assert run(handler, b"GETRANGE", b"large", b"-300", b"-1") == bulk(large[-300:])
+    run(handler, b"SET", b"counter", b"12345")
+    assert run(handler, b"GETRANGE", b"counter", b"1", b"2") == bulk(b"23")
+    run(handler, b"RPUSH", b"list", b"a")
+    assert run(handler, b"GETRANGE", b"list", b"0", b"1").startswith(b"-WRONGTYPE")
+
+
+def test_setrange(handler):
+    run(handler, b"SET", b"key", b"Hello World")
+    assert run(handler, b"SETRANGE", b"key", b"6", b"Redis") == b":11\r\n"
+    assert run(handler, b"GET", b"key") == bulk(b"Hello Redis")
+    # padded with zero bytes up to the offset
+    assert run(handler, b"SETRANGE", b"new", b"5", b"\xff!") == b":7\r\n"
+    assert run(handler, b"GET", b"new") == bulk(b"\x00" * 5 + b"\xff!")
+    assert run(handler, b"SETRANGE", b"key", b"20", b"") == b":11\r\n"
+    assert run(handler, b"SETRANGE", b"missing", b"20", b"") == b":0\r\n"
+    assert run(handler, b"EXISTS", b"missing") == b":0\r\n"
+    assert run(handler, b"SETRANGE", b"key", b"-1", b"x") == b"-ERR offset is out of range\r\n"
+    assert run(handler, b"SETRANGE", b"key", b"536870911", b"xx").startswith(b"-ERR string exceeds maximum")
+    run(handler, b"SET", b"counter", b"100")
+    assert run(handler, b"SETRANGE", b"counter", b"0", b"2") == b":3\r\n"
+    assert run(handler, b"INCR", b"counter") == b":201\r\n"
+    run(handler, b"RPUSH", b"list", b"a")
+    assert run(handler, b"SETRANGE", b"list", b"0", b"x").startswith(b"-WRONGTYPE")
+    cache = handler.redis_cache
+    assert cache.table.used == sum(KEY_OVERHEAD + len(key) + value_size(value) for key, value in cache.data.items())
+
+
+def test_binary_values_are_persisted(tmp_path):
+    large = bytes(range(256)) * (MAX_DECODED_LENGTH // 64)
+    values = {
+        "text": "grüße",
+        "escaped": b"\xff\xfe".decode("utf-8", "surrogateescape"),
+        "large": large,
+        "appended": bytearray(b"\x00\x01binary"),
+        b"\xff".decode("utf-8", "surrogateescape"): "key with an invalid byte",
+        "list": RedisList(["a", large]),
+        "hash": RedisHash([("field", large)]),
+    }
+    file_name = str(tmp_path / "dump.rdb")
+    write_snapshot(file_name, list(values.items()), {"large": now_ms() + 60_000}, now_ms(), True)
+    loaded, deadlines = read_snapshot(file_name)
+    # read back in the form the parser hands them out, short values as text
+    assert loaded == {**values, "appended": "\x00\x01binary"} and list(deadlines) == ["large"]
+    assert type(loaded["large"]) is bytes and type(loaded["escaped"]) is str
+
+
+def test_binary_writes_are_replayed(append_only):
+    handler = CommandHandler(CacheHolder().acquire_cache("client"))
+    finish_rewrite(handler.redis_cache)
+    large = bytes(range(256)) * 64
+    run(handler, b"SET", b"large", large)
+    run(handler, b"SET", b"invalid", b"\xff\x00")
+    run(handler, b"APPEND", b"invalid", b"\xfe")
+    run(handler, b"SETRANGE", b"padded", b"3", large)
+    handler.redis_cache.aof.flush()
+
+    restored = restart()
+    assert run(restored, b"GET", b"large") == bulk(large)
+    assert run(restored, b"GET", b"invalid") == bulk(b"\xff\x00\xfe")
+    assert run(restored, b"GET", b"padded") == bulk(b"\x00\x00\x00" + large)
@@ -0,0 +1,49 @@
+import logging
+
+import pytest
+
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from commandhandler.trace import tracer, logger
+from storage.cache import RedisCache
+
+
+@pytest.fixture
+def handler():
+    yield CommandHandler(RedisCache("trace"))
+    ServerConfig.set('loglevel', 'notice')
+    ServerConfig.set('log-sample-rate', '1')
+
+
+def test_config_get_and_set(handler):
+    assert handler.handle_command(["config", "get", "loglevel"]) == b'*2\r\n$8\r\nloglevel\r\n$6\r\nnotice\r\n'
+    assert handler.handle_command(["config", "set", "loglevel", "WARNING"]) == b'+OK\r\n'
+    assert handler.handle_command(["config", "get", "log*"]) == (
+        b'*4\r\n$15\r\nlog-sample-rate\r\n$3\r\n1.0\r\n$8\r\nloglevel\r\n$7\r\nwarning\r\n')
+    assert logger.level == logging.WARNING
+
+
+def test_config_set_rejects_invalid_values(handler):
+    assert handler.handle_command(["config", "set", "loglevel", "loud"]).startswith(
+        b"-ERR Invalid argument 'loud' for CONFIG SET 'loglevel'")
+    assert handler.handle_command(["config", "set", "unknown", "1"]).startswith(b"-ERR Unknown option")
+    assert handler.handle_command(["config", "set", "loglevel"]).startswith(b"-ERR wrong number of arguments")
+
+
+def test_tracing_is_off_unless_debug(handler):
+    assert tracer.enabled is False
+    handler.handle_command(["config", "set", "loglevel", "debug"])
+    assert tracer.enabled is True
+    handler.handle_command(["config", "set", "log-sample-rate", "0"])
+    assert tracer.enabled is False
+
+
+def test_trace_is_sampled_and_abbreviated(handler, caplog):
+    handler.handle_command(["config", "set", "loglevel", "debug", "log-sample-rate", "0.5"])
+    with caplog.at_level(logging.DEBUG, logger="own_redis"):
+        for _ in range(10):
+            handler.handle_command(["echo", "x" * 1000])
+
+    traces = [record.getMessage() for record in caplog.records if record.getMessage().startswith("command")]
+    assert len(traces) == 5
+    assert all(len(trace) < 300 for trace in traces)
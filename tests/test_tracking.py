@@ -0,0 +1,217 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+from client.caching import CachingClient, ReplyError
+from commandhandler.config import ServerConfig
+from commandhandler.handler import CommandHandler
+from commandhandler.tracking import tracking, INVALIDATE_ALL
+from storage.cache import RedisCache, CacheHolder
+from tests.test_pubsub import FakeTransport
+
+
+def invalidate(*keys: bytes) -> bytes:
+    return b">2\r\n$10\r\ninvalidate\r\n*%d\r\n" % len(keys) + b"".join(b"$%d\r\n%s\r\n" % (len(key), key)
+                                                                         for key in keys)
+
+
+@pytest.fixture
+def connect():
+    cache = RedisCache("tracking")
+    handlers = []
+
+    def connect(*tracking_options: str) -> tuple[CommandHandler, FakeTransport]:
+        handler = CommandHandler(cache)
+        handler.transport = FakeTransport()
+        handlers.append(handler)
+        if tracking_options:
+            handler.execute(["hello", "3"])
+            assert handler.execute(["client", "tracking", *tracking_options]) == b"+OK\r\n"
+        return handler, handler.transport
+
+    yield connect
+    for handler in handlers:
+        handler.close()
+    ServerConfig.set('tracking-table-max-keys', '1000000')
+    assert not tracking.clients and not tracking.tables and not tracking.prefixes
+    assert RedisCache.invalidation_feed is None
+
+
+def test_hello(connect):
+    handler, _ = connect()
+    # RESP2 gets the fields as a flat array
+    assert handler.handle_command(["hello"]).startswith(b"*14\r\n$6\r\nserver\r\n$5\r\nredis\r\n")
+    assert handler.execute(["client", "tracking", "on"]).startswith("-ERR CLIENT TRACKING needs RESP3")
+    reply = handler.handle_command(["hello", "3", "setname", "worker"])
+    assert reply.startswith(b"%7\r\n") and b"$5\r\nproto\r\n:3\r\n" in reply
+    assert b"$2\r\nid\r\n:%d\r\n" % handler.id in reply
+    assert handler.execute(["client", "id"]) == handler.id
+    assert handler.handle_command(["client", "getname"]) == b"$6\r\nworker\r\n"
+    assert handler.handle_command(["hello", "4"]) == b"-NOPROTO unsupported protocol version\r\n"
+    assert handler.execute(["hello", "3", "auth", "user", "secret"]).startswith("-ERR Syntax error in HELLO")
+    assert handler.execute(["client", "tracking", "on"]) == b"+OK\r\n"
+    assert handler.execute(["hello", "2"]).startswith("-ERR")
+    assert handler.execute(["client", "tracking", "maybe"]) == "-ERR syntax error"
+    assert handler.execute(["client", "tracking", "on", "prefix", "a"]) == \
+        "-ERR PREFIX option requires BCAST mode to be enabled"
+    assert handler.execute(["client", "tracking", "on", "bcast"]).startswith("-ERR You can't switch BCAST mode")
+    # without a transport nothing could be pushed
+    other, _ = connect()
+    other.transport = None
+    other.execute(["hello", "3"])
+    assert other.execute(["client", "tracking", "on"]) == "-ERR this connection can't track keys"
+
+
+def test_read_keys_are_pushed_once(connect):
+    reader, pushes = connect("on")
+    writer, _ = connect()
+    writer.execute(["mset", "a", "1", "b", "2"])
+    assert reader.execute(["get", "a"]) is not None
+    reader.execute(["mget", "b", "missing"])
+    reader.execute(["exists", "c"])
+    assert tracking.tracked_keys == 4 and pushes.written == []
+
+    writer.execute(["set", "a", "3"])
+    assert pushes.written == [invalidate(b"a")]
+    # forgotten until it is read again
+    writer.execute(["set", "a", "4"])
+    assert len(pushes.written) == 1
+    writer.execute(["del", "b", "missing"])
+    writer.execute(["rpush", "c", "x"])
+    assert pushes.written[1:] == [invalidate(b"b"), invalidate(b"missing"), invalidate(b"c")]
+    assert tracking.tracked_keys == 0
+
+    # a write which changed nothing, and a failed one, push nothing
+    reader.execute(["get", "a"])
+    writer.execute(["set", "a", "5", "nx"])
+    assert writer.execute(["lpush", "a", "x"]).startswith("-WRONGTYPE")
+    assert len(pushes.written) == 4
+    # the own writes are pushed too, unless NOLOOP
+    reader.execute(["set", "a", "6"])
+    assert pushes.written[-1] == invalidate(b"a")
+    reader.execute(["client", "tracking", "on", "noloop"])
+    reader.execute(["get", "a"])
+    reader.execute(["incr", "a"])
+    assert len(pushes.written) == 5
+    reader.execute(["get", "a"])
+    writer.execute(["incr", "a"])
+    assert len(pushes.written) == 6
+
+    # a client which turned tracking off hears nothing of the keys it read before
+    reader.execute(["get", "a"])
+    reader.execute(["client", "tracking", "off"])
+    writer.execute(["set", "a", "7"])
+    assert len(pushes.written) == 6
+
+
+def test_bcast_prefixes(connect):
+    users, pushes = connect("on", "bcast", "prefix", "user:", "prefix", "session:")
+    everything, all_pushes = connect("on", "bcast")
+    writer, _ = connect()
+    writer.execute(["set", "user:1", "x"])
+    writer.execute(["set", "other", "x"])
+    writer.execute(["hset", "session:9", "field", "x"])
+    assert pushes.written == [invalidate(b"user:1"), invalidate(b"session:9")]
+    assert all_pushes.written == [invalidate(b"user:1"), invalidate(b"other"), invalidate(b"session:9")]
+    # nothing is remembered for BCAST clients
+    users.execute(["get", "other"])
+    assert tracking.tracked_keys == 0 and tracking.prefix_count() == 3
+
+    overlapping, _ = connect()
+    overlapping.execute(["hello", "3"])
+    assert overlapping.execute(["client", "tracking", "on", "bcast", "prefix", "a", "prefix", "ab"]).startswith(
+        "-ERR Prefix 'a' overlaps with an existing prefix 'ab'")
+    users.close()
+    assert tracking.prefix_count() == 1
+
+
+@pytest.mark.asyncio
+async def test_pushes_are_batched_per_loop_iteration(connect):
+    reader, pushes = connect("on")
+    writer, _ = connect()
+    for key in ("a", "b", "c"):
+        reader.execute(["get", key])
+    writer.execute(["set", "a", "1"])
+    writer.execute(["mset", "b", "1", "c", "1"])
+    assert pushes.written == []
+    await asyncio.sleep(0)
+    assert pushes.written == [invalidate(b"a", b"b", b"c")]
+
+
+def test_keys_removed_by_the_storage(connect):
+    reader, pushes = connect("on")
+    writer, _ = connect()
+    cache = reader.redis_cache
+    writer.execute(["set", "lazy", "x", "px", "50"])
+    writer.execute(["set", "active", "x", "px", "50"])
+    writer.execute(["set", "evicted", "x"])
+    for key in ("lazy", "active", "evicted"):
+        reader.execute(["get", key])
+    time.sleep(0.06)
+    assert writer.execute(["get", "lazy"]) is None
+    assert cache.active_expire_cycle(time.perf_counter() + 1) == 1
+    cache.evict_key("evicted")
+    assert pushes.written == [invalidate(b"lazy"), invalidate(b"active"), invalidate(b"evicted")]
+
+    # an emptied keyspace invalidates everything, also what the client didn't read
+    reader.execute(["get", "x"])
+    cache.reset()
+    assert pushes.written[-1] == INVALIDATE_ALL and tracking.tracked_keys == 0
+
+
+def test_the_table_is_bounded(connect):
+    reader, pushes = connect("on")
+    other, other_pushes = connect("on")
+    ServerConfig.set('tracking-table-max-keys', '3')
+    for key in ("a", "b", "c"):
+        reader.execute(["get", key])
+    other.execute(["get", "a"])
+    assert tracking.tracked_keys == 3 and pushes.written == []
+    # the oldest keys make room, their readers drop them
+    reader.execute(["mget", "d", "e"])
+    assert pushes.written == [invalidate(b"a"), invalidate(b"b")]
+    assert other_pushes.written == [invalidate(b"a")]
+    assert tracking.tracked_keys == 3
+    assert "tracking_total_keys:3" in reader.execute(["info", "stats"])
+    assert "tracking_clients:2" in reader.execute(["info", "clients"])
+
+    # keys which were invalidated meanwhile don't count
+    other.execute(["set", "c", "1"])
+    reader.execute(["get", "f"])
+    assert len(pushes.written) == 3 and tracking.tracked_keys == 3
+
+
+@pytest.mark.asyncio
+async def test_caching_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(RedisCache, "FILE_STORE", str(tmp_path / "file_store_"))
+    monkeypatch.setattr(CacheHolder, "_instance", None)
+    server = await asyncio.start_server(main.handle_client, host="localhost", port=0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        client = await asyncio.to_thread(CachingClient, "localhost", port)
+        writer = await asyncio.to_thread(CachingClient, "localhost", port)
+        await asyncio.to_thread(writer.execute, "SET", "key", "one")
+        assert await asyncio.to_thread(client.get, "key") == b"one"
+        assert await asyncio.to_thread(client.get, "key") == b"one"
+        assert (client.hits, client.misses) == (1, 1)
+
+        await asyncio.to_thread(writer.execute, "SET", "key", "two")
+        # the push arrives shortly after the write, the next lookup reads it first
+        await asyncio.sleep(0.05)
+        assert await asyncio.to_thread(client.get, "key") == b"two"
+        assert (client.hits, client.misses, client.invalidations) == (1, 2, 1)
+        with pytest.raises(ReplyError):
+            await asyncio.to_thread(client.execute, "LPUSH", "key", "x")
+        await asyncio.to_thread(client.close)
+        await asyncio.to_thread(writer.close)
+        for _ in range(100):
+            if not tracking.clients:
+                break
+            await asyncio.sleep(0.01)
+        assert not tracking.clients
+    finally:
+        server.close()
+        await server.wait_closed()
+        CacheHolder.shutdown()
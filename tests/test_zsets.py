@@ -0,0 +1,132 @@
+import random
+
+import pytest
+
+from storage import zsettype
+from storage.aof import write_rewrite
+from storage.eviction import KEY_OVERHEAD, value_size
+from storage.expiry import now_ms
+from storage.snapshot import write_snapshot, read_snapshot
+from storage.zsettype import SortedSet
+
+
+@pytest.fixture
+def small_buckets(monkeypatch):
+    # many buckets with few members, so splits, merges and the rank tree get exercised
+    monkeypatch.setattr(zsettype, "BUCKET_LOAD", 4)
+
+
+def test_sorted_set_against_a_sorted_list(small_buckets):
+    generator = random.Random(7)
+    values, reference = SortedSet(), {}
+    for step in range(5000):
+        member = f"m{generator.randrange(200)}"
+        if generator.random() < 0.6:
+            score = float(generator.randrange(40))
+            values.add(member, score)
+            reference[member] = score
+        else:
+            assert values.remove(member) == (reference.pop(member, None) is not None)
+        if step % 250:
+            continue
+        pairs = sorted((score, member) for member, score in reference.items())
+        assert list(values.pairs()) == pairs and len(values) == len(pairs)
+        for rank, (_, member) in enumerate(pairs):
+            assert values.rank(member) == rank
+            assert values.rank(member, reverse=True) == len(pairs) - 1 - rank
+        for start in range(0, len(pairs), 5):
+            for stop in (start, min(start + 3, len(pairs)), len(pairs)):
+                assert list(values.range_by_rank(start, stop)) == pairs[start:stop]
+                assert list(values.range_by_rank(start, stop, reverse=True)) == pairs[::-1][start:stop]
+        for score in range(-1, 42, 3):
+            assert values.rank_of_score(score, after=False) == sum(pair[0] < score for pair in pairs)
+            assert values.rank_of_score(score, after=True) == sum(pair[0] <= score for pair in pairs)
+    assert values.copy() == values
+
+
+def test_zadd_and_lookups(handler):
+    assert handler.handle_command(["zadd", "board", "3", "c", "1", "a", "2", "b"]) == b':3\r\n'
+    assert handler.handle_command(["zadd", "board", "5", "a", "4", "d"]) == b':1\r\n'
+    assert handler.handle_command(["zadd", "board", "ch", "6", "a", "4", "d"]) == b':1\r\n'
+    assert handler.handle_command(["zadd", "board", "nx", "0", "a", "7", "e"]) == b':1\r\n'
+    assert handler.handle_command(["zadd", "board", "xx", "0", "new", "1", "e"]) == b':0\r\n'
+    assert handler.handle_command(["zadd", "board", "gt", "ch", "3", "a", "9", "e"]) == b':1\r\n'
+    assert handler.handle_command(["zadd", "board", "incr", "1.5", "b"]) == b'$3\r\n3.5\r\n'
+    assert handler.handle_command(["zadd", "board", "nx", "incr", "1", "b"]) == b'$-1\r\n'
+    assert handler.handle_command(["zscore", "board", "a"]) == b'$1\r\n6\r\n'
+    assert handler.handle_command(["zscore", "board", "new"]) == b'$-1\r\n'
+    assert handler.handle_command(["zincrby", "board", "-inf", "c"]) == b'$4\r\n-inf\r\n'
+    assert handler.handle_command(["zcard", "board"]) == b':5\r\n'
+    # c -inf, b 3.5, d 4, a 6, e 9
+    assert handler.handle_command(["zrank", "board", "d"]) == b':2\r\n'
+    assert handler.handle_command(["zrevrank", "board", "d"]) == b':2\r\n'
+    assert handler.handle_command(["zrank", "board", "new"]) == b'$-1\r\n'
+    assert handler.handle_command(["zcount", "board", "(3.5", "+inf"]) == b':3\r\n'
+    assert handler.handle_command(["zcount", "board", "-inf", "4"]) == b':3\r\n'
+    assert handler.handle_command(["zcount", "board", "5", "4"]) == b':0\r\n'
+
+    assert handler.handle_command(["zadd", "board", "x", "a"]) == b'-ERR value is not a valid float\r\n'
+    assert handler.handle_command(["zadd", "board", "nan", "a"]) == b'-ERR value is not a valid float\r\n'
+    assert handler.handle_command(["zadd", "board", "1", "a", "2"]) == b'-ERR syntax error\r\n'
+    assert handler.handle_command(["zadd", "board", "nx", "xx", "1", "a"]).startswith(b'-ERR XX and NX')
+    assert handler.handle_command(["zadd", "board", "incr", "1", "a", "2", "b"]).startswith(b'-ERR INCR option')
+    assert handler.handle_command(["zincrby", "board", "+inf", "c"]) == \
+        b'-ERR resulting score is not a number (NaN)\r\n'
+    assert handler.handle_command(["zcount", "board", "a", "1"]) == b'-ERR min or max is not a float\r\n'
+    handler.handle_command(["set", "text", "x"])
+    assert handler.handle_command(["zadd", "text", "1", "a"]).startswith(b'-WRONGTYPE')
+    assert handler.handle_command(["zrange", "text", "0", "-1"]).startswith(b'-WRONGTYPE')
+    cache = handler.redis_cache
+    assert cache.table.used == sum(KEY_OVERHEAD + len(key) + value_size(value) for key, value in cache.data.items())
+
+
+def test_ranges(handler, small_buckets):
+    members = [f"m{index:02d}" for index in range(30)]
+    handler.handle_command(["zadd", "z", *(part for index, member in enumerate(members) for part in (str(index), member))])
+
+    def reply(*command):
+        encoded = handler.handle_command(list(command))
+        assert encoded.startswith(b'*'), encoded
+        return [line.decode() for line in encoded.split(b"\r\n")[2:-1:2]]
+
+    assert reply("zrange", "z", "0", "-1") == members
+    assert reply("zrange", "z", "-3", "100") == members[-3:]
+    assert reply("zrange", "z", "5", "2") == []
+    assert reply("zrange", "z", "0", "1", "withscores") == ["m00", "0", "m01", "1"]
+    assert reply("zrevrange", "z", "0", "2") == ["m29", "m28", "m27"]
+    assert reply("zrange", "z", "0", "2", "rev") == ["m29", "m28", "m27"]
+    assert reply("zrangebyscore", "z", "(10", "13") == members[11:14]
+    assert reply("zrangebyscore", "z", "-inf", "+inf", "limit", "5", "3") == members[5:8]
+    assert reply("zrangebyscore", "z", "10", "20", "limit", "8", "-1") == members[18:21]
+    assert reply("zrange", "z", "20", "(10", "byscore", "rev", "limit", "1", "2") == ["m19", "m18"]
+    assert reply("zrange", "z", "(1", "2.5", "byscore", "withscores") == ["m02", "2"]
+    assert reply("zrangebyscore", "z", "50", "60") == []
+    assert reply("zrange", "missing", "0", "-1") == []
+    assert handler.handle_command(["zrange", "z", "0", "1", "limit", "0", "1"]).startswith(b'-ERR syntax error, LIMIT')
+    assert handler.handle_command(["zrange", "z", "0", "1", "bylex"]) == b'-ERR syntax error\r\n'
+    assert handler.handle_command(["zrevrange", "z", "a", "1"]) == b'-ERR value is not an integer or out of range\r\n'
+
+
+def test_pop_and_remove(handler):
+    handler.handle_command(["zadd", "z", "1", "a", "2", "b", "3", "c", "4", "d"])
+    assert handler.handle_command(["zpopmin", "z"]) == b'*2\r\n$1\r\na\r\n$1\r\n1\r\n'
+    assert handler.handle_command(["zpopmax", "z", "2"]) == b'*4\r\n$1\r\nd\r\n$1\r\n4\r\n$1\r\nc\r\n$1\r\n3\r\n'
+    assert handler.handle_command(["zpopmin", "z", "-1"]) == b'-ERR value is out of range, must be positive\r\n'
+    assert handler.handle_command(["zrem", "z", "b", "missing"]) == b':1\r\n'
+    assert handler.handle_command(["exists", "z"]) == b':0\r\n'
+    assert handler.handle_command(["zpopmin", "z"]) == b'*0\r\n'
+
+
+def test_sorted_sets_are_persisted(tmp_path, small_buckets):
+    big = SortedSet((float(index % 7), f"member {index}") for index in range(50))
+    values = {"big": big, "special": SortedSet([(float("-inf"), "low"), (0.1, "ü"), (float("inf"), "high")])}
+    deadline = now_ms() + 60_000
+    write_snapshot(str(tmp_path / "dump.rdb"), list(values.items()), {"special": deadline}, now_ms())
+    loaded, deadlines = read_snapshot(str(tmp_path / "dump.rdb"))
+    assert loaded == values and deadlines == {"special": deadline}
+    assert list(loaded["big"].pairs()) == list(big.pairs()) and loaded["big"].nbytes == big.nbytes
+
+    write_rewrite(str(tmp_path / "rewrite.aof"), [("special", values["special"])], {}, now_ms())
+    assert (tmp_path / "rewrite.aof").read_bytes() == (
+        b"*8\r\n$4\r\nZADD\r\n$7\r\nspecial\r\n$4\r\n-inf\r\n$3\r\nlow\r\n"
+        b"$3\r\n0.1\r\n$2\r\n\xc3\xbc\r\n$3\r\ninf\r\n$4\r\nhigh\r\n")